@@ -107,26 +107,39 @@ def apply_transformations(value, transformations):
             raise
     return current_value
 
-def generate_amica_vdf(base_template_path, new_csv_path, static_json_path, mapping_json_path, output_vdf_path, filename_mask="{OriginalFileName}"):
-    """Main function to generate VDF by substituting static and dynamic data."""
+def build_data_file(values, header="C1"):
+    """
+    Builds the CSV/data file in memory in a single pass.
+    Returns (bytes, MD5, record count) with the same semantics as
+    calculate_md5 and count_csv_rows applied to the written file.
+    """
+    hash_md5 = hashlib.md5()
+    chunks = []
+    record_count = 0
+    if header is not None:
+        chunk = f"{header}\n".encode('utf-8')
+        hash_md5.update(chunk)
+        chunks.append(chunk)
+    for value in values:
+        value = str(value)
+        chunk = f"{value}\n".encode('utf-8')
+        hash_md5.update(chunk)
+        chunks.append(chunk)
+        if value.strip():
+            record_count += 1
 
-    # 1. Calculate MD5 and row count of the new CSV file
-    new_md5 = calculate_md5(new_csv_path)
-    record_count = count_csv_rows(new_csv_path)
+    if record_count <= 0:
+        raise ValueError("Data file contains no records (only header or empty).")
 
-    # 2. Load data
-    with open(static_json_path, 'r', encoding='utf-8') as f:
-        static_data = json.load(f)
-
-    with open(mapping_json_path, 'r', encoding='utf-8') as f:
-        mapping_list = json.load(f)
+    return b"".join(chunks), hash_md5.hexdigest().upper(), record_count
 
+def resolve_placeholders(static_data, mapping_list):
+    """Resolves mapping items against static JSON data into {placeholder: value}."""
     if not isinstance(mapping_list, list):
         error_msg = "Mapping file must contain a list of dictionaries"
         logger.error(error_msg)
         raise ValueError(error_msg)
 
-    # 2.1 Pre-calculate transformed values and validate placeholders
     placeholder_to_value = {}
     placeholders_seen = set()
 
@@ -196,118 +209,283 @@ def generate_amica_vdf(base_template_path, new_csv_path, static_json_path, mappi
 
         placeholder_to_value[placeholder] = str(val)
 
-    # 2.2 Resolve output filename
-    original_filename = os.path.basename(output_vdf_path)
-    resolved_filename = filename_mask.replace("{OriginalFileName}", original_filename)
+    return placeholder_to_value
 
+def _sorted_placeholders(placeholder_to_value):
     # Sort placeholders by length descending to prevent shadowing during replacement
-    sorted_placeholders = sorted(placeholder_to_value.items(), key=lambda x: len(x[0]), reverse=True)
+    return sorted(placeholder_to_value.items(), key=lambda x: len(x[0]), reverse=True)
 
-    for placeholder, val in sorted_placeholders:
+def resolve_output_filename(original_filename, placeholder_to_value, filename_mask="{OriginalFileName}"):
+    """Applies the filename mask and braced placeholders to the output file name."""
+    resolved_filename = filename_mask.replace("{OriginalFileName}", original_filename)
+    for placeholder, val in _sorted_placeholders(placeholder_to_value):
         resolved_filename = resolved_filename.replace(f"{{{placeholder}}}", val)
-
-    output_dir = os.path.dirname(output_vdf_path)
-    final_output_path = os.path.join(output_dir, resolved_filename)
-
-    # 3. Parse VDF template (XML)
-    tree = ET.parse(base_template_path)
-    root = tree.getroot()
-
-    # 4. Update dynamic part (CSV path and MD5)
+    return resolved_filename
+
+def _find_vdf_nodes(root):
+    """
+    Locates dynamic nodes of the VDF tree: SourcePath and DataMd5 of every
+    DataSource, RipParam EndNo/OutputRecords and text blocks as
+    (content_node, source_node, text_template_node) triples.
+    """
+    source_paths, md5s = [], []
     for data_source in root.findall(".//DataSource"):
         source_path_node = data_source.find(".//SourcePath")
         if source_path_node is not None:
-            # We keep the path provided in arguments, but Amica might expect Windows paths.
-            # However, for testing purpose and general use, we use the provided path.
-            source_path_node.text = new_csv_path
-
+            source_paths.append(source_path_node)
         md5_node = data_source.find(".//DataMd5")
         if md5_node is not None:
-            md5_node.text = new_md5
+            md5s.append(md5_node)
 
-    # 4.1 Update RipParam (Print parameters)
+    end_no = out_records = None
     rip_param = root.find(".//RipParam")
     if rip_param is not None:
-        # Set total record count
         end_no = rip_param.find("EndNo")
-        if end_no is not None:
-            end_no.text = str(record_count)
-
-        # Set range (e.g., "0-99" for 100 records)
         out_records = rip_param.find("OutputRecords")
-        if out_records is not None:
-            out_records.text = f"0-{max(0, record_count - 1)}"
 
-    # 5. Update static part (Text blocks)
+    text_blocks = []
     parent_map = {c: p for p in root.iter() for c in p}
     for content_node in root.findall(".//Content"):
-        if content_node.text:
-            # Logic: for VariableText, we take source from TextTemplate, not Content itself.
-            source_node = content_node
-            is_variable_text = False
-            text_template_node = None
-
-            # Content -> Text -> VariableText
-            text_node = parent_map.get(content_node)
-            if text_node is not None and text_node.tag == "Text":
-                var_text_node = parent_map.get(text_node)
-                if var_text_node is not None and var_text_node.tag == "VariableText" and \
-                   var_text_node.get("FullName") == "Amica.Vdp.Common.Element.VdpVariableText":
-                    is_variable_text = True
-                    text_template_node = var_text_node.find("TextTemplate")
-                    if text_template_node is not None and text_template_node.text:
-                        source_node = text_template_node
-
+        if not content_node.text:
+            continue
+        # Logic: for VariableText, we take source from TextTemplate, not Content itself.
+        source_node = content_node
+        text_template_node = None
+
+        # Content -> Text -> VariableText
+        text_node = parent_map.get(content_node)
+        if text_node is not None and text_node.tag == "Text":
+            var_text_node = parent_map.get(text_node)
+            if var_text_node is not None and var_text_node.tag == "VariableText" and \
+               var_text_node.get("FullName") == "Amica.Vdp.Common.Element.VdpVariableText":
+                text_template_node = var_text_node.find("TextTemplate")
+                if text_template_node is not None and text_template_node.text:
+                    source_node = text_template_node
+        text_blocks.append((content_node, source_node, text_template_node))
+
+    return source_paths, md5s, end_no, out_records, text_blocks
+
+def _substitute_text(decoded_text, placeholder_to_value, sorted_placeholders):
+    """Returns decoded text with placeholders substituted, or None if nothing matched."""
+    # First, check for exact match of the entire decoded text with a placeholder
+    if decoded_text in placeholder_to_value:
+        return placeholder_to_value[decoded_text]
+
+    # If no exact match, replace braced {placeholder} patterns
+    # using sorted placeholders to prevent shadowing (e.g., {P_long} vs {P})
+    modified = False
+    for placeholder, val in sorted_placeholders:
+        braced_placeholder = f"{{{placeholder}}}"
+        if braced_placeholder in decoded_text:
+            decoded_text = decoded_text.replace(braced_placeholder, val)
+            modified = True
+    return decoded_text if modified else None
+
+def apply_vdf_data(root, source_path, data_md5, record_count, placeholder_to_value):
+    """Updates the parsed VDF tree in place: data source, print range and text blocks."""
+    sorted_placeholders = _sorted_placeholders(placeholder_to_value)
+    source_paths, md5s, end_no, out_records, text_blocks = _find_vdf_nodes(root)
+
+    # Update dynamic part (CSV path and MD5)
+    for node in source_paths:
+        node.text = source_path
+    for node in md5s:
+        node.text = data_md5
+
+    # Update RipParam (Print parameters): total record count and range (e.g., "0-99" for 100 records)
+    if end_no is not None:
+        end_no.text = str(record_count)
+    if out_records is not None:
+        out_records.text = f"0-{max(0, record_count - 1)}"
+
+    # Update static part (Text blocks)
+    for content_node, source_node, text_template_node in text_blocks:
+        decoded_text = hex_to_string(source_node.text)
+        if not decoded_text:
+            continue
+        new_text = _substitute_text(decoded_text, placeholder_to_value, sorted_placeholders)
+        if new_text is not None:
+            new_hex = string_to_hex(new_text)
+            content_node.text = new_hex
+            if text_template_node is not None:
+                text_template_node.text = new_hex
+
+# Private-use character: never appears in templates and is not escaped by ElementTree
+_CDATA_MARK = "\ue000"
+_CDATA_MARK_RE = re.compile(f"{_CDATA_MARK}(\\d+){_CDATA_MARK}")
+# Amica templates are written as <Content><![CDATA[...]]></Content>: attributes of
+# Content are dropped, as the original regex-based CDATA wrapping did
+_CONTENT_START_RE = re.compile(f"<Content\\b[^>]*>(?={_CDATA_MARK}\\d+{_CDATA_MARK}</Content>)")
+_XML_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
+
+def _serialize_with_marks(root, nodes):
+    """
+    Serializes the tree once with the text of the given nodes replaced by
+    numbered marks. Returns the serialized text with original node texts restored.
+    """
+    texts = [node.text for node in nodes]
+    for index, node in enumerate(nodes):
+        node.text = f"{_CDATA_MARK}{index}{_CDATA_MARK}"
+    try:
+        # short_empty_elements=False keeps <Tag></Tag> as in the original templates
+        return ET.tostring(root, encoding="unicode", short_empty_elements=False)
+    finally:
+        for node, text in zip(nodes, texts):
+            node.text = text
+
+def _escape_text(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def _cdata(text):
+    # The serialized (escaped) text goes into CDATA, as in the original output
+    return f"<![CDATA[{_escape_text(text or '')}]]>"
+
+def serialize_vdf(root):
+    """
+    Serializes the VDF tree in one pass with Content text wrapped in CDATA
+    (Amica expects <Content><![CDATA[...]]></Content>, including empty ones).
+    """
+    contents = list(root.iter("Content"))
+    texts = [node.text for node in contents]
+    body = _CONTENT_START_RE.sub("<Content>", _serialize_with_marks(root, contents))
+    body = _CDATA_MARK_RE.sub(lambda m: _cdata(texts[int(m.group(1))]), body)
+    return _XML_DECLARATION + body
+
+class CompiledVdfTemplate:
+    """
+    VDF template parsed once. The serialized template is split into static
+    segments around dynamic slots (SourcePath, DataMd5, EndNo, OutputRecords,
+    Content and linked TextTemplate), so rendering a job is string
+    substitution without parsing or walking the tree.
+    """
+
+    def __init__(self, template_xml):
+        root = ET.fromstring(template_xml)
+        source_paths, md5s, end_no, out_records, text_blocks = _find_vdf_nodes(root)
+
+        slots = {}
+
+        def slot(node, kind):
+            if id(node) not in slots:
+                slots[id(node)] = (len(slots), node, kind)
+            return slots[id(node)][0]
+
+        self._source_path_slots = [slot(node, "text") for node in source_paths]
+        self._md5_slots = [slot(node, "text") for node in md5s]
+        self._end_no_slot = slot(end_no, "text") if end_no is not None else None
+        self._out_records_slot = slot(out_records, "text") if out_records is not None else None
+        # Every Content is emitted as CDATA, even the ones without text
+        for node in root.iter("Content"):
+            slot(node, "cdata")
+
+        # Text blocks: decoded source text and the slots to update on substitution
+        self._text_blocks = []
+        for content_node, source_node, text_template_node in text_blocks:
             decoded_text = hex_to_string(source_node.text)
-            if not decoded_text:
-                continue
-
-            modified = False
-
-            # First, check for exact match of the entire decoded text with a placeholder
-            exact_match_found = False
-            for placeholder, val in placeholder_to_value.items():
-                if decoded_text == placeholder:
-                    decoded_text = val
-                    modified = True
-                    exact_match_found = True
-                    break
-
-            if not exact_match_found:
-                # If no exact match, replace braced {placeholder} patterns
-                # using sorted placeholders to prevent shadowing (e.g., {P_long} vs {P})
-                for placeholder, val in sorted_placeholders:
-                    braced_placeholder = f"{{{placeholder}}}"
-                    if braced_placeholder in decoded_text:
-                        decoded_text = decoded_text.replace(braced_placeholder, val)
-                        modified = True
-
-            if modified:
-                new_hex = string_to_hex(decoded_text)
-                content_node.text = new_hex
-                if is_variable_text and text_template_node is not None:
-                    text_template_node.text = new_hex
-
-    # 6. Save the result
-    # short_empty_elements=False ensures <Content></Content> instead of <Content />
-    # This is important for the subsequent regex replacement of Content tags.
-    with open(final_output_path, 'wb') as f:
-        tree.write(f, encoding="utf-8", xml_declaration=True, short_empty_elements=False)
-
-    # 7. Final touch: wrap Hex text (or empty) in CDATA
-    with open(final_output_path, "r", encoding="utf-8") as f:
-        xml_str = f.read()
-
-    # Replace content of <Content>...</Content> with CDATA
-    xml_str = re.sub(r'<Content[^>]*>(.*?)</Content>', r'<Content><![CDATA[\1]]></Content>', xml_str)
+            if decoded_text:
+                template_slot = slot(text_template_node, "text") if text_template_node is not None else None
+                self._text_blocks.append((decoded_text, slot(content_node, "cdata"), template_slot))
+
+        ordered = sorted(slots.values(), key=lambda item: item[0])
+        nodes = [node for _, node, _ in ordered]
+        self._defaults = []
+        for _, node, kind in ordered:
+            text = node.text or ""
+            self._defaults.append(_cdata(text) if kind == "cdata" else _escape_text(text))
+
+        # Static parts around the marks: segments[i] + slot i + segments[i + 1] ...
+        body = _XML_DECLARATION + _CONTENT_START_RE.sub("<Content>", _serialize_with_marks(root, nodes))
+        parts = _CDATA_MARK_RE.split(body)
+        self._segments = parts[0::2]
+        self._slot_order = [int(index) for index in parts[1::2]]
+
+    def render(self, source_path, data_md5, record_count, placeholder_to_value):
+        """Renders VDF text for one data file."""
+        values = list(self._defaults)
+        for index in self._source_path_slots:
+            values[index] = _escape_text(source_path)
+        for index in self._md5_slots:
+            values[index] = _escape_text(data_md5)
+        if self._end_no_slot is not None:
+            values[self._end_no_slot] = str(record_count)
+        if self._out_records_slot is not None:
+            values[self._out_records_slot] = f"0-{max(0, record_count - 1)}"
+
+        sorted_placeholders = _sorted_placeholders(placeholder_to_value)
+        for decoded_text, content_slot, template_slot in self._text_blocks:
+            new_text = _substitute_text(decoded_text, placeholder_to_value, sorted_placeholders)
+            if new_text is not None:
+                new_hex = string_to_hex(new_text)
+                values[content_slot] = _cdata(new_hex)
+                if template_slot is not None:
+                    values[template_slot] = new_hex
+
+        out = [self._segments[0]]
+        for index, segment in zip(self._slot_order, self._segments[1:]):
+            out.append(values[index])
+            out.append(segment)
+        return "".join(out)
+
+# Compiled templates keyed by MD5 of the template source
+_COMPILED_TEMPLATES = {}
+_COMPILED_TEMPLATES_LIMIT = 32
+
+def compile_vdf_template(template_xml):
+    """Returns the compiled template from cache, compiling it on first use."""
+    source = template_xml if isinstance(template_xml, bytes) else template_xml.encode("utf-8")
+    key = hashlib.md5(source).hexdigest()
+    compiled = _COMPILED_TEMPLATES.get(key)
+    if compiled is None:
+        compiled = CompiledVdfTemplate(template_xml)
+        if len(_COMPILED_TEMPLATES) >= _COMPILED_TEMPLATES_LIMIT:
+            # Drop the oldest template (dicts keep insertion order)
+            _COMPILED_TEMPLATES.pop(next(iter(_COMPILED_TEMPLATES)))
+        _COMPILED_TEMPLATES[key] = compiled
+        logger.info(f"[*] VDF template compiled: {key}")
+    return compiled
+
+def render_amica_vdf(template_xml, source_path, data_md5, record_count, static_data, mapping_list):
+    """
+    Renders VDF text from the template XML and already known data file
+    parameters. Nothing is read from or written to disk.
+    """
+    placeholder_to_value = resolve_placeholders(static_data, mapping_list)
+    return compile_vdf_template(template_xml).render(source_path, data_md5, record_count, placeholder_to_value)
+
+def generate_amica_vdf(base_template_path, new_csv_path, static_json_path, mapping_json_path, output_vdf_path, filename_mask="{OriginalFileName}"):
+    """Main function to generate VDF by substituting static and dynamic data."""
+
+    # 1. Calculate MD5 and row count of the new CSV file
+    new_md5 = calculate_md5(new_csv_path)
+    record_count = count_csv_rows(new_csv_path)
+
+    # 2. Load data
+    with open(static_json_path, 'r', encoding='utf-8') as f:
+        static_data = json.load(f)
+
+    with open(mapping_json_path, 'r', encoding='utf-8') as f:
+        mapping_list = json.load(f)
+
+    placeholder_to_value = resolve_placeholders(static_data, mapping_list)
+
+    # 3. Resolve output filename
+    resolved_filename = resolve_output_filename(os.path.basename(output_vdf_path), placeholder_to_value, filename_mask)
+    final_output_path = os.path.join(os.path.dirname(output_vdf_path), resolved_filename)
+
+    # 4. Render VDF from the compiled template (Content text is emitted as CDATA)
+    with open(base_template_path, 'rb') as f:
+        template = compile_vdf_template(f.read())
+    vdf_text = template.render(new_csv_path, new_md5, record_count, placeholder_to_value)
 
+    # 5. Save the result
     with open(final_output_path, "w", encoding="utf-8") as f:
-        f.write(xml_str)
+        f.write(vdf_text)
 
     logger.info(f"---")
     logger.info(f"[*] File successfully created: {os.path.basename(final_output_path)}")
     logger.info(f"[*] Used CSV: {os.path.basename(new_csv_path)}")
     logger.info(f"[*] MD5: {new_md5}")
+    return final_output_path
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Amica VDF Generator")
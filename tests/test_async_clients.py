@@ -0,0 +1,149 @@
+import asyncio
+import json
+
+import pytest
+
+from xtrek.async_clients import AsyncHonestSignAPI, AsyncSUZ, gather_limited
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, payload=None, text=None):
+        self.status_code = status_code
+        self._payload = payload
+        self.text = text if text is not None else json.dumps(payload)
+
+    def json(self):
+        if self._payload is None:
+            raise ValueError("not json")
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeClient:
+    """Замена httpx.AsyncClient: отвечает handler(method, url, kwargs) и считает параллельность."""
+
+    def __init__(self, handler, delay=0):
+        self.handler = handler
+        self.delay = delay
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+
+    async def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            return self.handler(method, url, kwargs)
+        finally:
+            self.active -= 1
+
+    async def aclose(self):
+        pass
+
+
+def test_suz_requests_are_bounded_by_max_concurrency():
+    client = FakeClient(lambda method, url, kwargs: FakeResponse(payload={"url": url}), delay=0.01)
+    api = AsyncSUZ(token="T", omsId="OMS", clientToken="C", client=client, max_concurrency=3)
+
+    async def run():
+        return await asyncio.gather(*(api.report_info(f"R{i}") for i in range(10)))
+
+    results = asyncio.run(run())
+
+    assert len(results) == 10
+    assert results[0]["url"].endswith("reportId=R0")
+    assert client.max_active == 3
+    assert client.calls[0][2]["headers"]["clientToken"] == "T"
+
+
+def test_token_is_refreshed_once_for_concurrent_401():
+    refreshes = []
+
+    def refresher():
+        refreshes.append(1)
+        return "NEW"
+
+    def handler(method, url, kwargs):
+        if kwargs["headers"]["Authorization"] == "Bearer OLD":
+            return FakeResponse(401, text="unauthorized")
+        return FakeResponse(payload={"status": "CHECKED_OK"})
+
+    client = FakeClient(handler, delay=0.01)
+    api = AsyncHonestSignAPI(token="OLD", token_refresher=refresher, client=client)
+
+    async def run():
+        return await asyncio.gather(*(api.doc(f"DOC-{i}", pg="chemistry") for i in range(5)))
+
+    results = asyncio.run(run())
+
+    assert results == [{"status": "CHECKED_OK"}] * 5
+    assert refreshes == [1]
+    assert api.token == "NEW"
+
+
+def test_true_api_error_conventions_match_sync_client():
+    def handler(method, url, kwargs):
+        if url.endswith("/documents/create"):
+            return FakeResponse(200, payload=None, text='"DOC-1"')
+        if url.endswith("/cises/info"):
+            return FakeResponse(404, text="not found")
+        return FakeResponse(500, text="boom")
+
+    api = AsyncHonestSignAPI(token="T", client=FakeClient(handler))
+
+    async def run():
+        return (
+            await api.documents_create('{"a":1}', pg="chemistry"),
+            await api.get_list_cis_info(["c1"]),
+            await api.doc("DOC-1"),
+        )
+
+    created, cises, doc = asyncio.run(run())
+
+    assert created == {"document_id": "DOC-1"}
+    assert cises == []
+    assert doc == {"error": "boom", "status_code": 500}
+
+
+def test_utilisation_send_returns_report_id(tmp_path):
+    body = tmp_path / "body.json"
+    body.write_text('{"sntins":[]}')
+    signature = tmp_path / "body.json.sig"
+    signature.write_text("SIG\n")
+    client = FakeClient(lambda method, url, kwargs: FakeResponse(payload={"reportId": "R-1"}))
+    api = AsyncSUZ(token="T", omsId="OMS", clientToken="C", client=client)
+
+    report_id = asyncio.run(api.utilisation_send(str(body), str(signature), orderId="O 1"))
+
+    assert report_id == "R-1"
+    method, url, kwargs = client.calls[0]
+    assert method == "POST" and url.endswith("orderId=O%201")
+    assert kwargs["headers"]["X-Signature"] == "SIG"
+    assert kwargs["content"] == b'{"sntins":[]}'
+
+
+def test_gather_limited_keeps_order_and_limit():
+    active = {"now": 0, "max": 0}
+
+    async def work(item):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.001 * (5 - item))
+        active["now"] -= 1
+        return item * 2
+
+    assert asyncio.run(gather_limited(work, range(5), limit=2)) == [0, 2, 4, 6, 8]
+    assert active["max"] == 2
+
+
+def test_missing_httpx_is_reported_without_injected_client(monkeypatch):
+    from xtrek import async_clients
+
+    monkeypatch.setattr(async_clients, "HAS_HTTPX", False)
+    with pytest.raises(ImportError):
+        AsyncHonestSignAPI(token="T")
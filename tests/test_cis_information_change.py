@@ -196,7 +196,7 @@ def test_sign_and_send_uses_manual_cis_information_change_wrapper(tmp_path, monk
     )
 
     fixed_uuid = uuid.UUID("12345678-1234-5678-1234-567812345678")
-    monkeypatch.setattr(workflow.uuid, "uuid4", lambda: fixed_uuid)
+    monkeypatch.setattr(workflow, "_signing_unique_id", lambda operation, task_id: fixed_uuid)
     sign_dir = tmp_path / "sign"
     sign_dir.mkdir()
     signature_name = (
@@ -231,6 +231,47 @@ def test_sign_and_send_uses_manual_cis_information_change_wrapper(tmp_path, monk
     assert (tmp_path / "receipts" / "TASK-1.json").exists()
 
 
+def test_two_phase_signing_keeps_body_until_signature_appears(tmp_path, monkeypatch):
+    config = _config(tmp_path)
+    monkeypatch.setattr(workflow, "load_config", lambda name: config)
+    task_id = workflow.create_cis_information_change_task(
+        "TASK-2PHASE",
+        "7701234567",
+        [_code("AAA")],
+        "productionDate",
+        "2026-08-01",
+    )
+    sign_dir = tmp_path / "sign"
+    sign_dir.mkdir()
+    token_processor = MagicMock()
+    token_processor.get_token_value_by_inn.return_value = "JWT"
+    monkeypatch.setattr(workflow, "OrganizationManager", MagicMock())
+    monkeypatch.setattr(workflow, "TokenProcessor", MagicMock(return_value=token_processor))
+    api = MagicMock()
+    api.documents_create.return_value = {"document_id": "DOC-2"}
+    monkeypatch.setattr(workflow, "HonestSignAPI", MagicMock(return_value=api))
+
+    with pytest.raises(workflow.SignaturePending) as pending:
+        workflow.sign_and_send_cis_information_change(
+            task_id, "chemistry", str(sign_dir), 1, wait_signature=False,
+        )
+
+    body_path = Path(pending.value.body_path)
+    assert body_path.exists()
+    api.documents_create.assert_not_called()
+
+    # Подписант положил .sig - вторая фаза находит то же тело и отправляет
+    Path(pending.value.signature_path).write_text("BASE64-SIGNATURE")
+    result = workflow.sign_and_send_cis_information_change(
+        task_id, "chemistry", str(sign_dir), 1, wait_signature=False,
+    )
+
+    assert result["document_id"] == "DOC-2"
+    api.documents_create.assert_called_once()
+    assert not body_path.exists()
+    assert (tmp_path / "receipts" / "TASK-2PHASE.json").exists()
+
+
 def test_update_status_uses_receipt_group_and_persists_result(tmp_path, monkeypatch):
     config = _config(tmp_path)
     monkeypatch.setattr(workflow, "load_config", lambda name: config)
@@ -295,3 +336,135 @@ def test_create_rejects_duplicates_after_crypto_tail_normalization(tmp_path, mon
             "expirationDate",
             "2029-06-01",
         )
+
+
+def test_oversized_task_is_sent_in_parts_and_status_is_combined(tmp_path, monkeypatch):
+    config = _config(tmp_path)
+    config["document_chunking"] = {"cis-information-change": {"max_codes": 2}}
+    monkeypatch.setattr(workflow, "load_config", lambda name: config)
+    task_id = workflow.create_cis_information_change_task(
+        "TASK-PARTS",
+        "7701234567",
+        [_code(serial) for serial in ("AAA", "BBB", "CCC", "DDD", "EEE")],
+        "productionDate",
+        "2026-08-01",
+    )
+    sign_dir = tmp_path / "sign"
+    sign_dir.mkdir()
+    token_processor = MagicMock()
+    token_processor.get_token_value_by_inn.return_value = "JWT"
+    monkeypatch.setattr(workflow, "OrganizationManager", MagicMock())
+    monkeypatch.setattr(workflow, "TokenProcessor", MagicMock(return_value=token_processor))
+
+    def documents_create(wrapped_json, pg):
+        document = json.loads(base64.b64decode(json.loads(wrapped_json)["product_document"]))
+        return {"document_id": "DOC-" + document["codes"][0]["code"][0][-3:]}
+
+    api = MagicMock()
+    api.documents_create.side_effect = documents_create
+    monkeypatch.setattr(workflow, "HonestSignAPI", MagicMock(return_value=api))
+
+    # Первая фаза выкладывает на подпись все три части
+    with pytest.raises(workflow.SignaturePending):
+        workflow.sign_and_send_cis_information_change(
+            task_id, "chemistry", str(sign_dir), 1, wait_signature=False,
+        )
+    bodies = sorted(sign_dir.glob("*.json"))
+    assert len(bodies) == 3
+    api.documents_create.assert_not_called()
+
+    for body in bodies:
+        Path(f"{body}.sig").write_text("BASE64-SIGNATURE")
+    result = workflow.sign_and_send_cis_information_change(
+        task_id, "chemistry", str(sign_dir), 1, wait_signature=False,
+    )
+
+    assert api.documents_create.call_count == 3
+    assert [part["document_id"] for part in result["parts"]] == ["DOC-AAA", "DOC-CCC", "DOC-EEE"]
+    assert [part["partId"] for part in result["parts"]] == [
+        "TASK-PARTS__part001", "TASK-PARTS__part002", "TASK-PARTS__part003",
+    ]
+    assert result["document_id"] == "DOC-AAA"
+    assert result["taskId"] == "TASK-PARTS"
+    receipt = json.loads((tmp_path / "receipts" / "TASK-PARTS.json").read_text())
+    assert receipt == result
+
+    # Повторный вызов не отправляет части заново
+    assert workflow.sign_and_send_cis_information_change(
+        task_id, "chemistry", str(sign_dir), 1, wait_signature=False,
+    ) == receipt
+    assert api.documents_create.call_count == 3
+
+    statuses = {"DOC-AAA": "CHECKED_OK", "DOC-CCC": "IN_PROGRESS", "DOC-EEE": "CHECKED_OK"}
+    api.doc.side_effect = lambda document_id, pg: [{"status": statuses[document_id]}]
+    status = workflow.update_cis_information_change_status(task_id)
+    assert status["status"] == "IN_PROGRESS"
+    assert [part["status"] for part in status["parts"]] == ["CHECKED_OK", "IN_PROGRESS", "CHECKED_OK"]
+
+    statuses["DOC-CCC"] = "CHECKED_OK"
+    assert workflow.update_cis_information_change_status(task_id)["status"] == "CHECKED_OK"
+
+
+def test_bulk_source_over_document_limit_is_validated_and_split(tmp_path, monkeypatch):
+    config = _config(tmp_path)
+    monkeypatch.setattr(workflow, "load_config", lambda name: config)
+    serials = [f"{i:07d}" for i in range(workflow.CIS_INFORMATION_CHANGE_MAX_CODES + 1)]
+    source = tmp_path / "bulk.txt"
+    source.write_text("\n".join(_code(serial) for serial in serials), encoding="utf-8")
+
+    task_id = workflow.create_cis_information_change_from_source(
+        str(source), "7701234567", "expirationDate", "2029-06-01",
+    )
+
+    task = json.loads((tmp_path / "tasks" / f"{task_id}.json").read_text())
+    parts = workflow.split_document(
+        "cis-information-change", task, workflow.document_limits(config, "cis-information-change")
+    )
+    assert [len(part["codes"][0]["code"]) for part in parts] == [workflow.CIS_INFORMATION_CHANGE_MAX_CODES, 1]
+    assert parts[1]["codes"][0]["code"] == [_short_code(serials[-1])]
+
+
+@pytest.mark.parametrize("codes, message", [
+    ([_code("AAA"), " ", _code("BBB")], "позиции 2"),
+    ([_code("AAA"), _short_code("B B"), _short_code("AAA")], "позиции 2 содержит пробельные"),
+    ([_code("AAA"), _code("BBB"), _short_code("AAA")], f"уникальны: {_short_code('AAA')}"),
+])
+def test_batch_validation_reports_first_bad_code(codes, message):
+    with pytest.raises(ValueError, match=message):
+        workflow._validate_cis_information_change_codes(codes)
+
+
+def test_all_parts_are_staged_for_signing_before_sending(tmp_path, monkeypatch):
+    config = _config(tmp_path)
+    config["document_chunking"] = {"cis-information-change": {"max_codes": 2}, "max_workers": 1}
+    monkeypatch.setattr(workflow, "load_config", lambda name: config)
+    task_id = workflow.create_cis_information_change_task(
+        "TASK-STAGE", "7701234567", [_code(serial) for serial in ("AAA", "BBB", "CCC", "DDD", "EEE")],
+        "productionDate", "2026-08-01",
+    )
+    sign_dir = tmp_path / "sign"
+    sign_dir.mkdir()
+    token_processor = MagicMock()
+    token_processor.get_token_value_by_inn.return_value = "JWT"
+    monkeypatch.setattr(workflow, "OrganizationManager", MagicMock())
+    monkeypatch.setattr(workflow, "TokenProcessor", MagicMock(return_value=token_processor))
+    api = MagicMock()
+    api.documents_create.side_effect = lambda wrapped_json, pg: {"document_id": f"DOC-{api.documents_create.call_count}"}
+    monkeypatch.setattr(workflow, "HonestSignAPI", MagicMock(return_value=api))
+
+    staged = []
+    original_await = workflow._await_signature
+
+    def signer(storage_sign, remote_body_path, remote_signature_path, *args, **kwargs):
+        # Один поток отправки, но подписант уже видит тела всех частей
+        staged.append(len(list(sign_dir.glob("*.json"))))
+        Path(remote_signature_path).write_text("BASE64-SIGNATURE")
+        return original_await(storage_sign, remote_body_path, remote_signature_path, *args, **kwargs)
+
+    monkeypatch.setattr(workflow, "_await_signature", signer)
+
+    result = workflow.sign_and_send_cis_information_change(task_id, "chemistry", str(sign_dir), 1)
+
+    assert staged == [3, 2, 1]
+    assert [part["document_id"] for part in result["parts"]] == ["DOC-1", "DOC-2", "DOC-3"]
+    assert not list(sign_dir.iterdir())
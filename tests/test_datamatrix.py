@@ -0,0 +1,66 @@
+import pytest
+
+from xtrek.datamatrix import (GS, cut_crypto_tail, gtin_of, ki_of, parse_code, parse_codes,
+                              short_code)
+from xtrek.kinGenerator import KinReportGenerator
+
+CODE = f"0104601234567890215abcdef{GS}93QWER"
+# GTIN содержит "21": поиск первого вхождения "21" попадал внутрь GTIN
+GTIN_WITH_21 = f"0104602121212121215AbCdE1{GS}91EE10{GS}92aGVsbG8="
+
+
+def test_parse_code_fields_and_offsets():
+    parsed = parse_code(CODE)
+
+    assert (parsed.gtin, parsed.serial, parsed.sscc) == ("04601234567890", "5abcdef", None)
+    assert CODE[parsed.start:parsed.ki_end] == "0104601234567890215abcdef"
+    assert CODE[parsed.tail_start:] == "93QWER"
+
+
+@pytest.mark.parametrize("code, gtin, serial, ki", [
+    (GTIN_WITH_21, "04602121212121", "5AbCdE1", "0104602121212121215AbCdE1"),
+    (f"]d2{GS}{CODE}", "04601234567890", "5abcdef", "0104601234567890215abcdef"),
+    ("0104601234567890215abcdef", "04601234567890", "5abcdef", "0104601234567890215abcdef"),
+    ("01046012345678", None, None, "01046012345678"),
+    ("010460123456789X215abc", None, None, "010460123456789X215abc"),
+    ("", None, None, ""),
+])
+def test_edge_cases(code, gtin, serial, ki):
+    parsed = parse_code(code)
+
+    assert (parsed.gtin, parsed.serial) == (gtin, serial)
+    assert gtin_of(code) == gtin
+    assert cut_crypto_tail(code) == ki
+
+
+def test_sscc_and_non_strings():
+    assert parse_code("00046070517000000015").sscc == "046070517000000015"
+    assert parse_code(None) is None
+    assert gtin_of(123) is None
+
+
+def test_parse_codes_returns_columns():
+    parsed = parse_codes([CODE, None, GTIN_WITH_21])
+
+    assert len(parsed) == 3
+    assert parsed.gtins == ["04601234567890", None, "04602121212121"]
+    assert parsed.serials == ["5abcdef", None, "5AbCdE1"]
+    assert list(parsed.ki_ends) == [25, -1, 25]
+    assert list(parsed.tail_starts) == [26, -1, 26]
+
+
+def test_call_sites_share_the_parser():
+    generator = KinReportGenerator()
+
+    assert short_code(GTIN_WITH_21) == generator.extract_short_code(GTIN_WITH_21) == "5AbCdE"
+    assert generator.extract_short_codes([GTIN_WITH_21, CODE, "0104601234567890215ab"]) == \
+        ["5AbCdE", "5abcde", None]
+    assert ki_of("not a code") is None
+
+
+def test_jsontoxlsx_parse_dm_code():
+    pytest.importorskip("xlsxwriter")
+    from xtrek.jsontoxlsx import parse_dm_code
+
+    assert parse_dm_code(f" {GTIN_WITH_21}\n") == "0104602121212121215AbCdE1"
+    assert parse_dm_code(f"abc{GS}def") == "abcdef"
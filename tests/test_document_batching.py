@@ -0,0 +1,206 @@
+import json
+
+import pytest
+
+from xtrek import document_batching as batching
+from xtrek.create_emission_task_sample import SignaturePending
+
+
+def _config(tmp_path, **utilisation):
+    return {
+        "utilisation_tasks_path": str(tmp_path / "utilisation-tasks"),
+        "utilisation_receipts": str(tmp_path / "utilisation-receipts"),
+        "introduce-tasks": str(tmp_path / "introduce-tasks"),
+        "introduce-receipts": str(tmp_path / "introduce-receipts"),
+        "sign": str(tmp_path / "sign"),
+        "s3_config": {},
+        "document_batching": {
+            "path": str(tmp_path / "batches"),
+            "utilisation": {"window_seconds": 300, "max_orders": 50, "max_codes": 100, **utilisation},
+            "introduce": True,
+        },
+    }
+
+
+def _write_utilisation_task(tmp_path, order_id, codes, inn="7701234567", usage_type="VERIFIED"):
+    path = tmp_path / "utilisation-tasks" / f"{order_id}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({
+        "sntins": [f"0104600000000000{order_id}{i}" for i in range(codes)],
+        "usageType": usage_type,
+        "attributes": {"participantId": inn},
+        "productionOrderId": f"T-{order_id}",
+    }))
+
+
+@pytest.fixture
+def sent(tmp_path, monkeypatch):
+    """Подмена отправки: пишет чек как sign_and_send_utilisation и запоминает вызовы."""
+    calls = []
+
+    def fake_send(order_id, signing_dir, timeout, wait_signature=True, receipts_path=None,
+                  send_order_id=True):
+        calls.append({
+            "order_id": order_id,
+            "task": json.loads((tmp_path / "utilisation-tasks" / f"{order_id}.json").read_text()),
+            "receipts_path": receipts_path,
+            "send_order_id": send_order_id,
+        })
+        receipts = receipts_path or str(tmp_path / "utilisation-receipts")
+        receipt = tmp_path / receipts / f"{order_id}.json"
+        receipt.parent.mkdir(parents=True, exist_ok=True)
+        receipt.write_text(json.dumps({"reportId": f"R-{order_id}", "orderId": order_id, "omsId": "OMS"}))
+        return f"R-{order_id}"
+
+    monkeypatch.setattr(batching, "sign_and_send_utilisation", fake_send)
+    return calls
+
+
+def test_utilisation_orders_are_sent_as_one_report_and_receipts_fanned_out(tmp_path, monkeypatch, sent):
+    config = _config(tmp_path)
+    monkeypatch.setattr(batching, "load_config", lambda name: config)
+    _write_utilisation_task(tmp_path, "111", 2)
+    _write_utilisation_task(tmp_path, "222", 3)
+
+    key_1 = batching.enqueue_document("utilisation", "111", "chemistry")
+    key_2 = batching.enqueue_document("utilisation", "222", "chemistry")
+    assert key_1 == key_2
+
+    # Окно пакета еще не истекло
+    assert batching.flush_document_batches("utilisation") == {"opened": 0, "sent": 0, "single": 0, "failed": 0}
+    assert sent == []
+
+    assert batching.flush_document_batches("utilisation", force=True) == {"opened": 1, "sent": 1, "single": 0, "failed": 0}
+    assert len(sent) == 1
+    call = sent[0]
+    assert call["order_id"].startswith(batching.BATCH_ID_PREFIX)
+    assert call["send_order_id"] is False
+    assert len(call["task"]["sntins"]) == 5
+    assert call["task"]["productionOrderId"] == "T-111"
+
+    for order_id in ("111", "222"):
+        receipt = json.loads((tmp_path / "utilisation-receipts" / f"{order_id}.json").read_text())
+        assert receipt["reportId"] == f"R-{call['order_id']}"
+        assert receipt["orderId"] == order_id
+        assert receipt["productionOrderId"] == f"T-{order_id}"
+        assert receipt["batchId"] == call["order_id"]
+
+    assert list((tmp_path / "batches" / "utilisation" / "pending").glob("*.json")) == []
+    batch = json.loads(next((tmp_path / "batches" / "utilisation" / "batches").glob("*.json")).read_text())
+    assert batch["status"] == "sent"
+
+
+def test_incompatible_and_oversized_orders_are_not_combined(tmp_path, monkeypatch, sent):
+    config = _config(tmp_path, max_codes=5)
+    monkeypatch.setattr(batching, "load_config", lambda name: config)
+    _write_utilisation_task(tmp_path, "111", 3)
+    _write_utilisation_task(tmp_path, "222", 3)
+    _write_utilisation_task(tmp_path, "333", 1, inn="7709999999")
+    for order_id in ("111", "222", "333"):
+        batching.enqueue_document("utilisation", order_id, "chemistry")
+
+    stats = batching.flush_document_batches("utilisation", force=True)
+
+    # 111 и 222 вместе превышают max_codes, 333 другого участника
+    assert stats == {"opened": 0, "sent": 0, "single": 3, "failed": 0}
+    assert sorted(call["order_id"] for call in sent) == ["111", "222", "333"]
+    assert all(call["receipts_path"] is None for call in sent)
+
+
+def test_batch_waiting_for_signature_is_resumed_on_next_flush(tmp_path, monkeypatch, sent):
+    config = _config(tmp_path)
+    monkeypatch.setattr(batching, "load_config", lambda name: config)
+    _write_utilisation_task(tmp_path, "111", 1)
+    _write_utilisation_task(tmp_path, "222", 1)
+    batching.enqueue_document("utilisation", "111", "chemistry")
+    batching.enqueue_document("utilisation", "222", "chemistry")
+
+    send = batching.sign_and_send_utilisation
+
+    def pending(order_id, *args, **kwargs):
+        raise SignaturePending("utilisation", order_id, "body", "body.sig")
+
+    monkeypatch.setattr(batching, "sign_and_send_utilisation", pending)
+    assert batching.flush_document_batches("utilisation", force=True) == {"opened": 1, "sent": 0, "single": 0, "failed": 0}
+    assert not (tmp_path / "utilisation-receipts" / "111.json").exists()
+
+    monkeypatch.setattr(batching, "sign_and_send_utilisation", send)
+    assert batching.flush_document_batches("utilisation") == {"opened": 0, "sent": 1, "single": 0, "failed": 0}
+    assert (tmp_path / "utilisation-receipts" / "111.json").exists()
+    assert (tmp_path / "utilisation-receipts" / "222.json").exists()
+
+
+def test_batching_disabled_without_settings(tmp_path, monkeypatch):
+    config = _config(tmp_path)
+    del config["document_batching"]["introduce"]
+    assert batching.batching_settings(config, "introduce") is None
+    assert batching.batching_settings(config, "utilisation")["max_codes"] == 100
+    monkeypatch.setattr(batching, "load_config", lambda name: config)
+    with pytest.raises(RuntimeError):
+        batching.enqueue_document("introduce", "111", "chemistry")
+
+
+def test_redelivered_flush_does_not_send_batch_twice(tmp_path, monkeypatch, sent):
+    config = _config(tmp_path)
+    monkeypatch.setattr(batching, "load_config", lambda name: config)
+    _write_utilisation_task(tmp_path, "111", 1)
+    _write_utilisation_task(tmp_path, "222", 1)
+    pending_dir = tmp_path / "batches" / "utilisation" / "pending"
+    for order_id in ("111", "222"):
+        batching.enqueue_document("utilisation", order_id, "chemistry")
+    entries = {path.name: path.read_text() for path in pending_dir.glob("*.json")}
+
+    send = batching.sign_and_send_utilisation
+
+    def pending(order_id, *args, **kwargs):
+        raise SignaturePending("utilisation", order_id, "body", "body.sig")
+
+    monkeypatch.setattr(batching, "sign_and_send_utilisation", pending)
+    assert batching.flush_document_batches("utilisation", force=True)["opened"] == 1
+
+    # Сбой между записью пакета и снятием заказов с очереди
+    for name, text in entries.items():
+        (pending_dir / name).write_text(text)
+    monkeypatch.setattr(batching, "sign_and_send_utilisation", send)
+    assert batching.flush_document_batches("utilisation", force=True) == {"opened": 0, "sent": 1, "single": 0, "failed": 0}
+    assert list(pending_dir.glob("*.json")) == []
+
+    # Чек сохранен, но пакет не помечен отправленным - повторная доставка сброса
+    batch_path = next((tmp_path / "batches" / "utilisation" / "batches").glob("*.json"))
+    batch = json.loads(batch_path.read_text())
+    batch_path.write_text(json.dumps({**batch, "status": "open"}))
+    (tmp_path / "utilisation-receipts" / "111.json").unlink()
+
+    assert batching.flush_document_batches("utilisation") == {"opened": 0, "sent": 1, "single": 0, "failed": 0}
+    assert len(sent) == 1
+    receipt = json.loads((tmp_path / "utilisation-receipts" / "111.json").read_text())
+    assert receipt["reportId"] == f"R-{batch['batchId']}"
+
+
+def test_failed_single_order_is_moved_to_errors_and_flush_continues(tmp_path, monkeypatch, sent):
+    config = _config(tmp_path, max_codes=5)
+    monkeypatch.setattr(batching, "load_config", lambda name: config)
+    _write_utilisation_task(tmp_path, "111", 3)
+    _write_utilisation_task(tmp_path, "222", 3)
+    _write_utilisation_task(tmp_path, "333", 1, inn="7709999999")
+    _write_utilisation_task(tmp_path, "444", 1, inn="7709999999")
+    for order_id in ("111", "222", "333", "444"):
+        batching.enqueue_document("utilisation", order_id, "chemistry")
+    send = batching.sign_and_send_utilisation
+
+    def failing(order_id, *args, **kwargs):
+        if order_id == "111":
+            raise RuntimeError("task not found")
+        return send(order_id, *args, **kwargs)
+
+    monkeypatch.setattr(batching, "sign_and_send_utilisation", failing)
+
+    stats = batching.flush_document_batches("utilisation", force=True)
+
+    # 111 и 222 отправляются отдельно, 333 и 444 - пакетом другого участника
+    assert stats == {"opened": 1, "sent": 1, "single": 1, "failed": 1}
+    assert (tmp_path / "utilisation-receipts" / "222.json").exists()
+    assert (tmp_path / "utilisation-receipts" / "333.json").exists()
+    error = json.loads((tmp_path / "batches" / "utilisation" / "errors" / "111.json").read_text())
+    assert error["error"] == "task not found"
+    assert list((tmp_path / "batches" / "utilisation" / "pending").glob("*.json")) == []
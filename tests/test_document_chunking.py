@@ -0,0 +1,56 @@
+from xtrek import document_chunking as chunking
+
+
+def _box(sscc, codes):
+    return {"unitSerialNumber": sscc, "aggregationType": "AGGREGATION", "sntins": codes}
+
+
+def test_small_document_is_not_split():
+    task = {"sntins": ["a", "b"], "usageType": "VERIFIED"}
+    assert chunking.split_document("utilisation", task, {"max_codes": 2}) == [task]
+
+
+def test_utilisation_split_keeps_document_fields():
+    task = {"sntins": ["a", "b", "c"], "usageType": "VERIFIED", "productionOrderId": "T-1"}
+
+    parts = chunking.split_document("utilisation", task, {"max_codes": 2})
+
+    assert [part["sntins"] for part in parts] == [["a", "b"], ["c"]]
+    assert all(part["usageType"] == "VERIFIED" and part["productionOrderId"] == "T-1" for part in parts)
+
+
+def test_aggregation_split_keeps_pallet_with_its_boxes():
+    units = [
+        _box("BOX-1", ["c1", "c2"]),
+        _box("BOX-2", ["c3", "c4"]),
+        _box("BOX-3", ["c5", "c6"]),
+        _box("PALLET-1", ["BOX-1", "BOX-2"]),
+    ]
+    task = {"participantId": "7701234567", "aggregationUnits": units}
+
+    parts = chunking.split_document("aggregation", task, {"max_codes": 4})
+
+    serials = [[unit["unitSerialNumber"] for unit in part["aggregationUnits"]] for part in parts]
+    # Паллета с коробами превышает лимит, но не делится; порядок коробов до паллеты сохраняется
+    assert serials == [["BOX-1", "BOX-2", "PALLET-1"], ["BOX-3"]]
+    assert all(part["participantId"] == "7701234567" for part in parts)
+
+
+def test_byte_limit_splits_document():
+    task = {"products": [{"uit_code": "x" * 100} for _ in range(4)]}
+
+    parts = chunking.split_document("introduce", task, {"max_codes": None, "max_bytes": 250})
+
+    assert [len(part["products"]) for part in parts] == [2, 2]
+
+
+def test_limits_are_overridden_by_config():
+    config = {"document_chunking": {"aggregation": {"max_codes": 10}}}
+
+    assert chunking.document_limits(config, "aggregation")["max_codes"] == 10
+    assert chunking.document_limits({}, "utilisation")["max_codes"] == 30000
+
+
+def test_combined_state_requires_success_in_every_part():
+    assert chunking.combine_part_states(["SUCCESS", "SUCCESS"], "SUCCESS") == "SUCCESS"
+    assert chunking.combine_part_states(["SUCCESS", "PENDING"], "SUCCESS") == "PENDING"
@@ -174,3 +174,59 @@ def test_send_functions_skip_before_signing_when_receipt_exists(
     assert result == receipt
     assert storage_requests == [receipts_path]
     assert storage.acquired == []
+
+
+@pytest.mark.parametrize(
+    ("function_name", "identifier", "config", "receipts_path", "receipt", "expected"),
+    [
+        (
+            "sign_and_send_emission",
+            "P-1",
+            {
+                "emission_orders_path": "s3://internal/emissionOrders",
+                "emission_receipts": "s3://internal/emissionReceipts",
+                "s3_config": {},
+            },
+            "s3://internal/emissionReceipts",
+            {"orderId": "SUZ-ORDER-1", "omsId": "OMS", "productionOrderId": "P-1"},
+            {"orderId": "SUZ-ORDER-1", "omsId": "OMS", "productionOrderId": "P-1"},
+        ),
+        (
+            "sign_and_send_utilisation",
+            "P-1",
+            {
+                "utilisation_tasks_path": "s3://internal/utilisationTasks",
+                "utilisation_receipts": "s3://internal/utilisationReceipts",
+                "s3_config": {},
+            },
+            "s3://internal/utilisationReceipts",
+            {"reportId": "REPORT-1", "orderId": "P-1", "omsId": "OMS"},
+            "REPORT-1",
+        ),
+    ],
+)
+def test_suz_send_functions_skip_before_signing_when_receipt_exists(
+    monkeypatch,
+    function_name,
+    identifier,
+    config,
+    receipts_path,
+    receipt,
+    expected,
+):
+    storage = FakeReceiptStorage({f"{receipts_path}/{identifier}.json": json.dumps(receipt)})
+    storage_requests = []
+
+    monkeypatch.setattr(workflow, "load_config", lambda name: config)
+
+    def get_storage(path, s3_config):
+        storage_requests.append(path)
+        return storage
+
+    monkeypatch.setattr(workflow, "get_storage", get_storage)
+
+    result = getattr(workflow, function_name)(identifier, "s3://internal/sign", 120)
+
+    assert result == expected
+    assert storage_requests == [receipts_path]
+    assert storage.acquired == []
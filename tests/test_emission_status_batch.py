@@ -0,0 +1,105 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from xtrek import create_emission_task_sample as cets
+
+
+@pytest.fixture
+def emission_env(tmp_path, monkeypatch):
+    config = {
+        "emission_receipts": str(tmp_path / "emissionReceipts"),
+        "production_orders_path": str(tmp_path / "productionOrders"),
+        "emissions_path": str(tmp_path / "emissions"),
+        "s3_config": {},
+    }
+    monkeypatch.setattr(cets, "load_config", lambda name: config)
+    monkeypatch.chdir(tmp_path)
+    for production_order_id, order_id, oms_id, gtin in (
+        ("P-1", "O-1", "OMS-A", "04600000000011"),
+        ("P-2", "O-2", "OMS-A", "04600000000028"),
+        ("P-3", "O-3", "OMS-B", "04600000000035"),
+    ):
+        for folder, payload in (
+            ("emissionReceipts", {"orderId": order_id, "omsId": oms_id}),
+            ("productionOrders", {"Gtin": gtin}),
+        ):
+            path = tmp_path / folder / f"{production_order_id}.json"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(payload))
+
+    apis = {}
+
+    def suz_for_oms(oms_id, status_context=None):
+        api = MagicMock()
+        api.order_list.return_value = {"orderInfos": [
+            {"orderId": f"O-{n}", "buffers": [_buffer(f"O-{n}", gtin, state)]}
+            for n, gtin, state in buffers_by_oms[oms_id]
+        ]}
+        apis.setdefault(oms_id, []).append(api)
+        return api
+
+    buffers_by_oms = {
+        "OMS-A": [(1, "04600000000011", "ACTIVE"), (2, "04600000000028", "PENDING")],
+        "OMS-B": [(3, "04600000000035", "EXHAUSTED")],
+    }
+    monkeypatch.setattr(cets, "_suz_api_for_oms", suz_for_oms)
+    return tmp_path, apis
+
+
+def _buffer(order_id, gtin, state):
+    return {
+        "orderId": order_id, "gtin": gtin, "bufferStatus": state, "leftInBuffer": 10,
+        "totalCodes": 10, "unavailableCodes": 0, "availableCodes": 10, "totalPassed": 0,
+        "poolsExhausted": False, "poolInfos": [],
+    }
+
+
+def test_one_order_list_per_oms_and_only_published_transitions_are_written(emission_env):
+    tmp_path, apis = emission_env
+
+    results = cets.update_emission_order_statuses(["P-1", "P-2", "P-3"], known_states={"P-3": "EXHAUSTED"})
+
+    assert {oms_id: len(calls) for oms_id, calls in apis.items()} == {"OMS-A": 1, "OMS-B": 1}
+    assert {pid: result.bufferStatus for pid, result in results.items()} == {
+        "P-1": "ACTIVE", "P-2": "PENDING", "P-3": "EXHAUSTED",
+    }
+    # PENDING не публикуется, EXHAUSTED уже был известен
+    # Локальное хранилище отражает тег bufferStatus в расширении файла
+    assert sorted(p.name for p in (tmp_path / "emissions").iterdir()) == ["O-1.ACTIVE", "O-1.ACTIVE.tags"]
+    status = json.loads((tmp_path / "emissions" / "O-1.ACTIVE").read_text())
+    assert status["omsId"] == "OMS-A" and status["productionOrderId"] == "P-1"
+    assert status["checkedAtUnix"] > 0
+    assert results["P-2"].productionOrderId == "P-2"
+
+
+def test_order_list_error_is_reported_per_order(emission_env, monkeypatch):
+    monkeypatch.setattr(cets, "_suz_api_for_oms", MagicMock(side_effect=RuntimeError("timeout")))
+
+    results = cets.update_emission_order_statuses(["P-1", "P-404"])
+
+    assert results["P-1"] == "timeout"
+    assert "P-404" in results["P-404"]
+
+
+def test_status_context_loads_config_and_tokens_once_per_cycle(monkeypatch):
+    load_config = MagicMock(return_value={"s3_config": {}})
+    org = MagicMock(inn="7701234567", oms_id="OMS-A", connection_id="CONN")
+    token_processor = MagicMock()
+    token_processor.get_token_value_by_inn.return_value = "UUID-1"
+    token_processor.refresh_token_value.return_value = "UUID-2"
+    monkeypatch.setattr(cets, "load_config", load_config)
+    monkeypatch.setattr(cets, "OrganizationManager", MagicMock(return_value=MagicMock(list=lambda: [org])))
+    monkeypatch.setattr(cets, "TokenProcessor", MagicMock(return_value=token_processor))
+    monkeypatch.setattr(cets, "SUZ", MagicMock())
+
+    context = cets.StatusCheckContext()
+    assert context.config is context.config
+    assert context.suz_api_for_oms("OMS-A") is context.suz_api_for_oms("OMS-A")
+    load_config.assert_called_once()
+    token_processor.get_token_value_by_inn.assert_called_once_with("7701234567", token_type="UUID", conid="CONN")
+
+    # Обновленный после 401 токен получают следующие документы цикла
+    cets.SUZ.call_args.kwargs["token_refresher"]()
+    assert context.token("7701234567", "UUID", "CONN") == "UUID-2"
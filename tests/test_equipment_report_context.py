@@ -0,0 +1,97 @@
+import json
+from unittest.mock import MagicMock
+
+from xtrek import create_emission_task_sample as workflow
+from xtrek.storage import LocalStorage
+from xtrek import utils
+from xtrek.utils import AggregationAnalyzer
+
+REPORT = {
+    "readyBox": [{
+        "boxNumber": "046070517911326848",
+        "productNumbersFull": ["0104680038240782215pQsAW\u001d930may", "0104680038240782215QNTeB\u001d931IFR"],
+    }]
+}
+
+
+def _config(tmp_path):
+    for name in ("equipment-tasks", "equipment-reports", "production-orders", "utilisation-tasks"):
+        (tmp_path / name).mkdir()
+    (tmp_path / "equipment-tasks" / "T-1.json").write_text(json.dumps({
+        "task-export-signed-link": "https://storage.test/equipment-reports/T-1.json?X-Amz-Signature=abc",
+    }), encoding="utf-8")
+    (tmp_path / "equipment-reports" / "T-1.json").write_text(json.dumps(REPORT), encoding="utf-8")
+    return {
+        "equipment-tasks": str(tmp_path / "equipment-tasks"),
+        "equipment-reports": str(tmp_path / "equipment-reports"),
+        "production_orders_path": str(tmp_path / "production-orders"),
+        "utilisation_tasks_path": str(tmp_path / "utilisation-tasks"),
+        "s3_config": {},
+    }
+
+
+def test_event_stages_read_and_parse_report_once(tmp_path, monkeypatch):
+    config = _config(tmp_path)
+    monkeypatch.setattr(workflow, "load_config", lambda name: config)
+    monkeypatch.chdir(tmp_path)
+    reads = []
+    original_read_text = LocalStorage.read_text
+    monkeypatch.setattr(LocalStorage, "read_text", lambda self, path: reads.append(path) or original_read_text(self, path))
+    create_virtual = MagicMock(return_value="created")
+    monkeypatch.setattr(workflow, "create_virtual_production_tasks", create_virtual)
+    report_path = f"{config['equipment-reports']}/T-1.json"
+
+    context = workflow.EquipmentReportContext("T-1")
+    analyzer = AggregationAnalyzer(MagicMock(), MagicMock())
+    analyzer.check_statuses = MagicMock(return_value=[])
+    analyzer.is_set = MagicMock(return_value=False)
+    assert "wrongunitstatus" in analyzer.check_report(report_path, report_context=context)
+    assert workflow.create_utilisation_task_from_report("T-1", report_context=context) == "T-1"
+    assert workflow.create_virtual_tasks_from_equipment_report("T-1", report_context=context) == "created"
+
+    assert reads.count(report_path) == 1
+    assert reads.count(context.task_path) == 1
+    create_virtual.assert_called_once_with("T-1", qty=2)
+    task = json.loads((tmp_path / "utilisation-tasks" / "T-1.json").read_text(encoding="utf-8"))
+    assert task["sntins"] == REPORT["readyBox"][0]["productNumbersFull"]
+    assert context.canonical_report() is context.canonical_report()
+
+
+def test_missing_link_is_reported_without_reading_report(tmp_path, monkeypatch):
+    config = _config(tmp_path)
+    (tmp_path / "equipment-tasks" / "T-1.json").write_text("{}", encoding="utf-8")
+    config.update(kodes=str(tmp_path / "kodes"), equipment_set_reports=str(tmp_path / "set-reports"))
+    monkeypatch.setattr(workflow, "load_config", lambda name: config)
+
+    context = workflow.EquipmentReportContext("T-1.json")
+
+    assert context.production_order_id == "T-1"
+    assert workflow.create_utilisation_task_from_report("T-1", report_context=context) is None
+    assert workflow.create_equipment_set_report_from_report("T-1", report_context=context) is None
+
+
+def test_check_reads_report_by_context_path_when_resolved_path_differs(tmp_path, monkeypatch):
+    config = _config(tmp_path)
+    # equipment-reports не s3:// - resolve_file_path дал бы s3://bucket/<путь>/T-1.json
+    config["s3_config"] = {"bucket": "reports-bucket"}
+    (tmp_path / "equipment-tasks" / "T-1.json").write_text(json.dumps({
+        "task-export-signed-link": "https://storage.test/equipment-reports/export-T-1.json?X-Amz-Signature=abc",
+    }), encoding="utf-8")
+    (tmp_path / "equipment-reports" / "export-T-1.json").write_text(json.dumps(REPORT), encoding="utf-8")
+    monkeypatch.setattr(workflow, "load_config", lambda name: config)
+    reads = []
+    original_read_text = LocalStorage.read_text
+    monkeypatch.setattr(LocalStorage, "read_text", lambda self, path: reads.append(path) or original_read_text(self, path))
+    monkeypatch.setattr(AggregationAnalyzer, "check_statuses", MagicMock(return_value=[]))
+    monkeypatch.setattr(AggregationAnalyzer, "is_set", MagicMock(return_value=False))
+
+    context = workflow.EquipmentReportContext("T-1", config)
+    assert utils.resolve_file_path("T-1", config) != context.report_path
+
+    results = utils.check_aggregation_reports(["T-1"], api=MagicMock(), nk=MagicMock(), config=config,
+                                              report_context=context)
+
+    assert list(results) == [context.report_path]
+    assert "wrongunitstatus" in results[context.report_path]
+    assert context.report() is context.read_json(context.report_path)
+    assert reads.count(context.report_path) == 1
@@ -253,10 +253,10 @@ def test_create_introduce_task_with_fallback(mock_token_proc, mock_org_man, mock
         "tnVedCode10": "3305900009"
     }
 
-    # get_active_permit_documents_by_gtin should use the passed product info
-    mock_nk_inst.get_active_permit_documents_by_gtin.return_value = [
+    # get_active_permit_documents_by_gtins should use the passed product info
+    mock_nk_inst.get_active_permit_documents_by_gtins.return_value = {"04680328040887": [
         {"number": "CERT123", "date": "2024-09-27", "type": "CONFORMITY_DECLARATION"}
-    ]
+    ]}
 
     mock_token_proc.return_value.get_token_value_by_inn.return_value = "fake_token"
 
@@ -265,6 +265,6 @@ def test_create_introduce_task_with_fallback(mock_token_proc, mock_org_man, mock
     assert res == "uuid"
     assert mock_nk_inst.product_info.called
     # Check that product info was passed to avoid redundant call
-    args, kwargs = mock_nk_inst.get_active_permit_documents_by_gtin.call_args
-    assert kwargs.get('product') is not None
-    assert kwargs['product']['name'] == "Fallback Product"
+    args, kwargs = mock_nk_inst.get_active_permit_documents_by_gtins.call_args
+    assert args[0] == ["04680328040887"]
+    assert kwargs['products']["04680328040887"]['name'] == "Fallback Product"
@@ -0,0 +1,81 @@
+import csv
+import json
+
+import pytest
+
+from xtrek import SSCC_Utils
+from xtrek.SSCC_Utils import (Gs1LabelTemplate, generate_gs1_csv, invalid_ssccs, sscc_check_digit,
+                              write_gs1_label_shards, write_gs1_labels)
+
+TEMPLATE = "00{sscc}{GS}01{gtin}10{batch}{GS}11{d_prod}17{d_exp}"
+FIELDS = dict(gtin="04607051790012", batch="BN-1", GS="\x1d", d_prod="240101", d_pack="240102", d_exp="260101")
+
+
+def make_sscc(serial):
+    body = f"46070517{serial:09d}"
+    return body + str(sscc_check_digit(body))
+
+
+def reference_csv(path, template, ssccs, fields, column_name="C1"):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([column_name])
+        for sscc in ssccs:
+            writer.writerow([template.format(sscc=sscc, **fields)])
+
+
+@pytest.mark.parametrize("template, fields", [
+    (TEMPLATE, FIELDS),
+    ("00{sscc}|{batch}|{sscc}", dict(FIELDS, batch='N,"7"')),
+    ("{{00}}{sscc:>20}", FIELDS),
+])
+def test_labels_match_format_based_output(tmp_path, template, fields):
+    ssccs = [make_sscc(i) for i in range(25)]
+    reference_csv(tmp_path / "expected.csv", template, ssccs, fields)
+
+    write_gs1_labels(str(tmp_path / "actual.csv"), Gs1LabelTemplate(template, **fields), ssccs, batch_size=7)
+
+    assert (tmp_path / "actual.csv").read_bytes() == (tmp_path / "expected.csv").read_bytes()
+
+
+def test_invalid_ssccs_matches_check_digit():
+    valid = [make_sscc(i) for i in range(200)]
+    broken = valid[5][:17] + str((int(valid[5][17]) + 1) % 10)
+
+    assert invalid_ssccs(valid + ["00" + valid[0]]) == []
+    assert invalid_ssccs([broken, "4607051700000000１２", valid[1]]) == [broken, "4607051700000000１２"]
+
+
+def test_shards_split_contiguously_and_concatenate_to_single_file(tmp_path):
+    ssccs = [make_sscc(i) for i in range(11)]
+    template = Gs1LabelTemplate(TEMPLATE, **FIELDS)
+    write_gs1_labels(str(tmp_path / "all.csv"), template, ssccs)
+
+    paths = write_gs1_label_shards(str(tmp_path / "out.csv"), template, ssccs, shards=3, workers=2)
+
+    assert paths == [str(tmp_path / f"out_{i}.csv") for i in (1, 2, 3)]
+    rows = [open(p, encoding="utf-8", newline="").read().split("\r\n")[1:-1] for p in paths]
+    assert [len(r) for r in rows] == [4, 4, 3]
+    assert sum(rows, []) == open(tmp_path / "all.csv", encoding="utf-8", newline="").read().split("\r\n")[1:-1]
+
+
+def test_generate_gs1_csv_rejects_bad_check_digit(tmp_path, monkeypatch):
+    source = tmp_path / "order.json"
+    source.write_text(json.dumps({"Quantity": 2, "PasportData": {
+        "Product_PackBarcode": "4607051790012", "Batch_BN_1С_full": "BN-1",
+        "Batch_date_production": "2024-01-01", "Batch_date_packing": "2024-01-02",
+        "Batch_date_expired": "2026-01-01",
+    }}), encoding="utf-8")
+    good = [make_sscc(1), make_sscc(2)]
+    monkeypatch.setattr(SSCC_Utils, "get_sscc_from_service", lambda *args: good)
+
+    paths = generate_gs1_csv(str(source), str(tmp_path / "out.csv"), sscc_url="http://sscc",
+                             sscc_prefix="46070517", gs1_template=TEMPLATE, shards=2, workers=1)
+
+    assert paths == [str(tmp_path / "out_1.csv"), str(tmp_path / "out_2.csv")]
+    assert open(paths[1], encoding="utf-8", newline="").read().split("\r\n")[1].startswith("00" + good[1] + "\x1d01")
+
+    monkeypatch.setattr(SSCC_Utils, "get_sscc_from_service", lambda *args: [good[0], good[1][:17] + "X"])
+    assert generate_gs1_csv(str(source), str(tmp_path / "bad.csv"), sscc_url="http://sscc",
+                            sscc_prefix="46070517") is None
+    assert not (tmp_path / "bad.csv").exists()
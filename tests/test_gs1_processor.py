@@ -63,5 +63,25 @@ class TestGS1Processor(unittest.TestCase):
         self.assertEqual(prefix_map.get("4610117"), "12345")
         self.assertEqual(prefix_map.get("467001792"), "12345")
 
+    def test_parallel_build_merges_conflicts_deterministically(self):
+        """Конфликт префикса решается в пользу ИНН с большим числом GTIN"""
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "owned_gtins_1111111111.csv"), "w", encoding="utf-8") as f:
+                f.write("gtin;name\n4610117633945;A\n4610117633952;B\n4751042000001;C\n")
+            with open(os.path.join(tmp, "linked_gtins_2222222222.csv"), "w", encoding="utf-8") as f:
+                f.write("name,gtin\nX,04610117000000\n")
+
+            masks = [os.path.join(tmp, "*.csv")]
+            db, conflicts = gs1_processor.build_prefix_inn_db(masks, workers=2)
+
+            self.assertEqual(db, {"4610117": "1111111111", "4751042": "1111111111"})
+            self.assertEqual(conflicts, {"4610117": {"1111111111": 2, "2222222222": 1}})
+
+            output = os.path.join(tmp, "db.json")
+            gs1_processor.write_json_mapping(db, output)
+            with open(output, encoding="utf-8") as f:
+                self.assertEqual(json.load(f), db)
+
 if __name__ == "__main__":
     unittest.main()
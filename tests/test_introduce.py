@@ -69,9 +69,9 @@ def test_create_introduce_task_basic(mock_token_proc, mock_org_man, mock_nk, moc
             ]
         }]
     }
-    mock_nk_inst.get_active_permit_documents_by_gtin.return_value = [
+    mock_nk_inst.get_active_permit_documents_by_gtins.return_value = {"04610117624776": [
         {"number": "CERT123", "date": "2024-09-27", "type": "CONFORMITY_DECLARATION"}
-    ]
+    ]}
 
     mock_token_proc.return_value.get_token_value_by_inn.return_value = "fake_token"
 
@@ -51,13 +51,13 @@ def test_create_introduce_task_with_new_permits_logic(mock_token_proc, mock_org_
         }]
     }
 
-    mock_nk_inst.get_active_permit_documents_by_gtin.return_value = [
+    mock_nk_inst.get_active_permit_documents_by_gtins.return_value = {"04610117624776": [
         {
             "number": "ЕАЭС N RU Д-RU.РА09.В.37749/24",
             "date": "2024-10-11",
             "type": "CONFORMITY_DECLARATION"
         }
-    ]
+    ]}
 
     mock_token_proc.return_value.get_token_value_by_inn.return_value = "fake_token"
 
@@ -121,13 +121,13 @@ def test_create_introduce_task_with_new_permits_logic_verified(mock_token_proc,
         }]
     }
 
-    mock_nk_inst.get_active_permit_documents_by_gtin.return_value = [
+    mock_nk_inst.get_active_permit_documents_by_gtins.return_value = {"04610117624776": [
         {
             "number": "ЕАЭС N RU Д-RU.РА09.В.37749/24",
             "date": "2024-10-11",
             "type": "CONFORMITY_DECLARATION"
         }
-    ]
+    ]}
 
     mock_token_proc.return_value.get_token_value_by_inn.return_value = "fake_token"
 
@@ -173,7 +173,7 @@ def test_create_introduce_task_error_no_permits(mock_token_proc, mock_org_man, m
         }]
     }
 
-    mock_nk_inst.get_active_permit_documents_by_gtin.return_value = []
+    mock_nk_inst.get_active_permit_documents_by_gtins.return_value = {"04610117624776": []}
 
     mock_token_proc.return_value.get_token_value_by_inn.return_value = "fake_token"
 
@@ -181,3 +181,52 @@ def test_create_introduce_task_error_no_permits(mock_token_proc, mock_org_man, m
 
     assert res is None
     mock_storage_kodes.set_tags.assert_called_with("s3://bucket/kodes/uuid.json", {"статусСообщенияВводаВОборот": "Error"})
+
+@patch("xtrek.create_emission_task_sample.load_config")
+@patch("xtrek.create_emission_task_sample.get_storage")
+@patch("xtrek.create_emission_task_sample.get_inn_by_gtin")
+@patch("xtrek.create_emission_task_sample.NK")
+@patch("xtrek.create_emission_task_sample.OrganizationManager")
+@patch("xtrek.create_emission_task_sample.TokenProcessor")
+def test_create_introduce_task_resolves_permits_for_all_gtins_in_one_call(mock_token_proc, mock_org_man, mock_nk, mock_get_inn, mock_get_storage, mock_load_config):
+    from xtrek.create_emission_task_sample import create_introduce_task
+
+    mock_load_config.return_value = {
+        "kodes": "s3://bucket/kodes",
+        "introduce-tasks": "s3://bucket/intro",
+    }
+
+    mock_storage_kodes = MagicMock()
+    mock_storage_intro = MagicMock()
+    captured_data = {}
+
+    def upload_side_effect(local_path, remote_path):
+        with open(local_path, 'r', encoding='utf-8') as f:
+            captured_data['json'] = json.load(f)
+    mock_storage_intro.upload.side_effect = upload_side_effect
+    mock_get_storage.side_effect = lambda path, config: mock_storage_kodes if "kodes" in path else mock_storage_intro
+
+    mock_storage_kodes.exists.return_value = True
+    mock_storage_kodes.read_text.return_value = json.dumps({"codes": [
+        "0104610117624776215\u001d!3krb",
+        "0104610117624783215\u001d!4krb",
+        "0104610117624776216\u001d!5krb",
+    ]})
+    mock_get_inn.return_value = "7733154124"
+
+    mock_nk_inst = mock_nk.return_value
+    mock_nk_inst.feedProduct.return_value = {"result": [{"tnved_code": "3307300000"}]}
+    mock_nk_inst.get_active_permit_documents_by_gtins.return_value = {
+        "04610117624776": [{"number": "DOC-1", "date": "2024-10-11", "type": "CONFORMITY_DECLARATION"}],
+        "04610117624783": [{"number": "DOC-2", "date": "2024-10-12", "type": "CONFORMITY_DECLARATION"}],
+    }
+    mock_token_proc.return_value.get_token_value_by_inn.return_value = "fake_token"
+
+    res = create_introduce_task("uuid", production_date="2026-04-01")
+
+    assert res == "uuid"
+    mock_nk_inst.get_active_permit_documents_by_gtins.assert_called_once()
+    assert mock_nk_inst.get_active_permit_documents_by_gtins.call_args.args[0] == ["04610117624776", "04610117624783"]
+    mock_nk_inst.get_active_permit_documents_by_gtin.assert_not_called()
+    numbers = [p['certificate_document_data'][0]['certificate_number'] for p in captured_data['json']['products']]
+    assert numbers == ["DOC-1", "DOC-2", "DOC-1"]
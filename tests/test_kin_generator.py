@@ -102,3 +102,95 @@ def test_generate_kin_report_logic_and_format(tmp_path, monkeypatch, test_dir_na
     assert 'id' in generated_data
     assert 'startTime' in generated_data
     assert 'endTime' in generated_data
+
+
+def _write_codes(path, gtin, count, prefix):
+    path.write_text(json.dumps({"codes": [f"01{gtin}21{prefix}{i:05d}\u001d93ABCD" for i in range(count)]}))
+
+
+def test_codes_are_indexed_by_ai01_and_large_reports_are_fast(tmp_path, monkeypatch):
+    import time
+
+    monkeypatch.chdir(tmp_path)
+    num_kits = 50000
+    hierarchy = {
+        "id": "REPORT-1",
+        "Hierarchy": [
+            {"LevelType": "Kigu", "Packs": [{"GTIN": "04600000000011"}]},
+            {"LevelType": "Kit", "Packs": [{"GTIN": "04600000000028"}, {"GTIN": "04600000000028"},
+                                           {"GTIN": "04600000000035"}]},
+        ],
+    }
+    (tmp_path / "main.json").write_text(json.dumps(hierarchy))
+    _write_codes(tmp_path / "kigu.json", "04600000000011", num_kits, "S")
+    _write_codes(tmp_path / "kit_a.json", "04600000000028", 2 * num_kits, "A")
+    _write_codes(tmp_path / "kit_b.json", "04600000000035", num_kits, "B")
+    # GTIN набора встречается только внутри серийного номера - файл не должен попасть в пул
+    (tmp_path / "noise.json").write_text(json.dumps({"codes": ["010460000000004221x04600000000011"]}))
+
+    files = [str(tmp_path / name) for name in ("main.json", "kigu.json", "kit_a.json", "kit_b.json", "noise.json")]
+    started = time.perf_counter()
+    output_file = generate_kin_report_from_files(files)
+    elapsed = time.perf_counter() - started
+
+    with open(output_file, encoding="utf-8") as f:
+        report = json.load(f)
+    assert len(report["readyBox"]) == num_kits
+    box = report["readyBox"][1]
+    assert box["boxNumber"] == "010460000000001121S00001\u001d93ABCD"
+    assert box["productNumbers"] == ["A00002", "A00003", "B00001"]
+    assert elapsed < 20
+
+
+def test_streaming_report_matches_in_memory_report(tmp_path, monkeypatch):
+    import io
+
+    monkeypatch.chdir(tmp_path)
+    data_dir = os.path.join(os.path.dirname(__file__), "data/kinGenerator/test1")
+    input_paths = [
+        os.path.join(data_dir, f) for f in sorted(os.listdir(data_dir))
+        if f.endswith(".json") and "kin_report" not in f
+    ]
+
+    with open(KinReportGenerator().generate_kin_report(input_paths), encoding="utf-8") as f:
+        expected = json.load(f)
+
+    generator = KinReportGenerator()
+    stream = io.StringIO()
+    assert generator.generate_kin_report_stream(input_paths, output=stream) is stream
+    streamed = json.loads(stream.getvalue())
+
+    assert generator.generated_kits == len(expected["readyBox"])
+    assert set(streamed) == set(expected)
+    assert streamed["id"] == expected["id"]
+    strip_time = lambda boxes: [{k: v for k, v in box.items() if k != "boxTime"} for box in boxes]
+    assert strip_time(streamed["readyBox"]) == strip_time(expected["readyBox"])
+    # Компактный JSON без отступов
+    assert "\n" not in stream.getvalue()
+
+
+def test_streaming_report_reads_codes_lazily(tmp_path, monkeypatch):
+    from xtrek import kinGenerator
+
+    monkeypatch.chdir(tmp_path)
+    hierarchy = {"Hierarchy": [
+        {"LevelType": "Kigu", "Packs": [{"GTIN": "04600000000011"}]},
+        {"LevelType": "Kit", "Packs": [{"GTIN": "04600000000028"}]},
+    ]}
+    (tmp_path / "main.json").write_text(json.dumps(hierarchy))
+    _write_codes(tmp_path / "kigu.json", "04600000000011", 3, "S")
+    _write_codes(tmp_path / "kit.json", "04600000000028", 5, "A")
+    opened = []
+    original = kinGenerator.iter_file_codes
+    monkeypatch.setattr(kinGenerator, "iter_file_codes", lambda path: opened.append(path) or original(path))
+
+    generator = KinReportGenerator()
+    output = generator.generate_kin_report_stream(
+        [str(tmp_path / name) for name in ("main.json", "kigu.json", "kit.json")], num_kits=2
+    )
+
+    report = json.loads((tmp_path / output).read_text(encoding="utf-8"))
+    assert [box["productNumbers"] for box in report["readyBox"]] == [["A00000"], ["A00001"]]
+    # Файлы кодов не держатся в памяти генератора
+    assert list(generator.uploaded_files) == [str(tmp_path / "main.json")]
+    assert opened.count(str(tmp_path / "kit.json")) == 2
@@ -0,0 +1,98 @@
+import json
+import threading
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from xtrek.nkapi import NK
+
+
+def _catalogue(count):
+    # Карточки равномерно обновлялись в течение 2024 года
+    start = datetime(2024, 1, 1).timestamp()
+    step = (datetime(2024, 12, 31).timestamp() - start) / count
+    return [
+        {"gtin": f"0460000000{i:04d}", "updated_date": datetime.fromtimestamp(start + i * step)}
+        for i in range(count)
+    ]
+
+
+def _fake_product_list(catalogue, max_results):
+    calls = []
+    lock = threading.Lock()
+
+    def fake_get(url, params=None, **kwargs):
+        with lock:
+            calls.append(dict(params))
+        date_from = datetime.strptime(params["from_date"], NK.PRODUCT_LIST_DATE_FORMAT)
+        date_to = datetime.strptime(params["to_date"], NK.PRODUCT_LIST_DATE_FORMAT)
+        matched = [
+            {"gtin": item["gtin"], "updated_date": str(item["updated_date"])}
+            for item in catalogue
+            if date_from <= item["updated_date"] <= date_to
+        ]
+        response = MagicMock()
+        if len(matched) > max_results:
+            response.status_code = 413
+            return response
+        offset = params.get("offset", 0)
+        response.status_code = 200
+        response.json.return_value = {
+            "result": {"goods": matched[offset:offset + params["limit"]]}
+        }
+        return response
+
+    return fake_get, calls
+
+
+def test_get_gtins_windowed_bisects_on_413_and_dedupes():
+    nk = NK(token="fake_token")
+    nk.PRODUCT_LIST_MAX_RESULTS = 50
+    catalogue = _catalogue(180)
+    fake_get, calls = _fake_product_list(catalogue, max_results=50)
+
+    with patch("requests.get", side_effect=fake_get):
+        goods = nk.get_gtins_windowed(
+            from_date=datetime(2024, 1, 1),
+            to_date=datetime(2025, 1, 1),
+            page_size=20,
+            workers=3,
+            rate_limit=None,
+        )
+
+    assert [item["gtin"] for item in goods] == sorted(item["gtin"] for item in catalogue)
+    assert all(call["limit"] + call.get("offset", 0) <= 50 for call in calls)
+
+
+def test_sync_gtins_stores_high_water_mark(tmp_path):
+    nk = NK(token="fake_token")
+    state_path = tmp_path / "sync.json"
+    catalogue = _catalogue(10)
+    fake_get, calls = _fake_product_list(catalogue, max_results=10000)
+
+    with patch("requests.get", side_effect=fake_get):
+        assert len(nk.sync_gtins(str(state_path), workers=1, rate_limit=None)) == 10
+        first_mark = json.loads(state_path.read_text())["high_water_mark"]
+
+        calls.clear()
+        assert nk.sync_gtins(str(state_path), workers=1, rate_limit=None, overlap_seconds=0) == []
+
+    assert calls[0]["from_date"] == first_mark
+
+
+def test_get_all_linked_gtins_fetches_pages_in_parallel_waves():
+    nk = NK(token="fake_token")
+    linked = [{"gtin": f"0460000000{i:04d}", "producer_inn": "7700000000"} for i in range(25)]
+
+    def fake_get(url, params=None, **kwargs):
+        offset = params.get("offset", 0)
+        response = MagicMock(status_code=200)
+        response.json.return_value = {
+            "result": {"linked_gtins": linked[offset:offset + params["limit"]]}
+        }
+        return response
+
+    with patch("requests.get", side_effect=fake_get) as get:
+        result = nk.get_all_linked_gtins(page_size=10, workers=2, rate_limit=None)
+
+    assert sorted(item["gtin"] for item in result) == [item["gtin"] for item in linked]
+    assert get.call_count == 4
@@ -0,0 +1,65 @@
+from unittest.mock import MagicMock, patch
+
+from xtrek.cache_store import SqliteCache
+from xtrek.nkapi import NK
+
+
+def _product_info_response(cards):
+    response = MagicMock()
+    response.status_code = 200
+    response.json.return_value = {"results": cards}
+    return response
+
+
+def test_product_info_many_batches_and_caches_cards(tmp_path):
+    cache = SqliteCache(tmp_path / "cards.sqlite", namespace="product_info")
+    nk = NK(token="fake_token", product_cache=cache)
+    nk.PRODUCT_INFO_MAX_GTINS = 2
+    gtins = ["04630446581021", "04630446581038", "04630446581045"]
+
+    def side_effect(url, json=None, **kwargs):
+        return _product_info_response([
+            {"gtin": gtin, "isSet": False}
+            for gtin in json["gtins"]
+            if gtin != "04630446581045"
+        ])
+
+    with patch("requests.post", side_effect=side_effect) as post:
+        cards = nk.product_info_many(gtins + [gtins[0]])
+
+    assert post.call_count == 2
+    assert post.call_args_list[0].kwargs["json"]["gtins"] == gtins[:2]
+    assert cards[gtins[0]]["gtin"] == gtins[0]
+    assert cards[gtins[2]] is None
+
+    # Повторный запрос другим клиентом обслуживается общим кешем,
+    # включая отрицательный результат.
+    other = NK(token="other_token", product_cache=cache)
+    with patch("requests.post") as post:
+        assert other.product_info(gtins[1])["gtin"] == gtins[1]
+        assert other.product_info(gtins[2]) is None
+    post.assert_not_called()
+
+
+def test_product_info_errors_are_not_cached(tmp_path):
+    cache = SqliteCache(tmp_path / "cards.sqlite", namespace="product_info")
+    nk = NK(token="fake_token", product_cache=cache)
+
+    with patch("requests.post", return_value=MagicMock(status_code=503, text="busy")):
+        assert nk.product_info("04630446581021") is None
+
+    with patch("requests.post", return_value=_product_info_response([
+        {"gtin": "04630446581021", "isSet": True},
+    ])) as post:
+        assert nk.product_info("04630446581021")["isSet"] is True
+    post.assert_called_once()
+
+
+def test_sqlite_cache_enforces_size_cap(tmp_path):
+    cache = SqliteCache(tmp_path / "cache.sqlite", max_entries=2)
+    cache.set("a", {"v": 1}, 60)
+    cache.set("b", {"v": 2}, 60)
+    cache.set("c", {"v": 3}, 60)
+    cache.set("expired", {"v": 4}, -1)
+
+    assert cache.get_many(["a", "b", "c", "expired"]) == {"b": {"v": 2}, "c": {"v": 3}}
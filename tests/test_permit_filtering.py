@@ -142,22 +142,69 @@ def test_create_introduce_task_uses_new_permit_method(mock_token_proc, mock_org_
     }
 
     # Mock the new method
-    mock_nk_inst.get_active_permit_documents_by_gtin.return_value = [
+    mock_nk_inst.get_active_permit_documents_by_gtins.return_value = {"04610117624776": [
         {
             "number": "ACTIVE_DOC",
             "date": "2026-07-01",
             "type": "CONFORMITY_DECLARATION"
         }
-    ]
+    ]}
 
     mock_token_proc.return_value.get_token_value_by_inn.return_value = "fake_token"
 
     res = create_introduce_task("uuid", production_date="2026-04-01")
 
     assert res == "uuid"
-    assert mock_nk_inst.get_active_permit_documents_by_gtin.called
+    assert mock_nk_inst.get_active_permit_documents_by_gtins.called
 
     uploaded_data = captured_data['json']
     certs = uploaded_data['products'][0]['certificate_document_data']
     assert len(certs) == 1
     assert certs[0]['certificate_number'] == "ACTIVE_DOC"
+
+
+def test_batch_permit_resolution_dedupes_documents_and_caches_statuses(tmp_path):
+    from xtrek.cache_store import SqliteCache
+
+    cache = SqliteCache(tmp_path / "nk.sqlite", namespace="rd_list")
+    nk = NK(token="fake_token", permit_cache=cache)
+
+    shared_doc = {"type": "CONFORMITY_DECLARATION", "number": "SHARED", "date": "2025-01-01"}
+    own_docs = [
+        {"type": "CONFORMITY_CERTIFICATE", "number": f"CERT-{i}", "date": "2025-01-01"}
+        for i in range(30)
+    ]
+    cards = [
+        {"gtin": "04630446581021", "certDocList": [shared_doc] + own_docs[:15]},
+        {"gtin": "04630446581038", "certDocList": [shared_doc] + own_docs[15:]},
+    ]
+    rd_requests = []
+
+    def side_effect(url, json=None, **kwargs):
+        response = MagicMock(status_code=200)
+        if "product/info" in url:
+            response.json.return_value = {"results": cards}
+        else:
+            rd_requests.append(json["documents"])
+            response.json.return_value = {"result": {"documents": [
+                {**doc, "status": "Действует", "dateTo": "2099-01-01"}
+                for doc in json["documents"]
+            ]}}
+        return response
+
+    with patch("requests.post", side_effect=side_effect):
+        docs = nk.get_active_permit_documents_by_gtins(["04630446581021", "04630446581038"])
+
+    assert len(docs["04630446581021"]) == 16
+    assert len(docs["04630446581038"]) == 16
+    sent = [doc["number"] for chunk in rd_requests for doc in chunk]
+    assert len(sent) == 31 and len(set(sent)) == 31
+    assert all(len(chunk) <= 25 for chunk in rd_requests)
+
+    rd_requests.clear()
+    with patch("requests.post", side_effect=side_effect):
+        docs = nk.get_active_permit_documents_by_gtins(
+            ["04630446581021"], products={"04630446581021": cards[0]}
+        )
+    assert len(docs["04630446581021"]) == 16
+    assert rd_requests == []
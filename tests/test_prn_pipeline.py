@@ -0,0 +1,206 @@
+import json
+import xml.etree.ElementTree as ET
+from unittest.mock import patch
+
+import pytest
+
+import amica.amica_generator as amica_generator
+from amica.amica_generator import build_data_file, generate_amica_vdf, render_amica_vdf, string_to_hex
+from xtrek import prn_util
+from xtrek.prn_util import convert_json_to_raw_csv, generate_prn_batch, generate_prn_files
+
+TEMPLATE = (
+    "<?xml version='1.0' encoding='utf-8'?>\n"
+    "<Document>\n"
+    "  <DataSource><SourcePath>old.csv</SourcePath><DataMd5>OLD</DataMd5></DataSource>\n"
+    "  <RipParam><EndNo>1</EndNo><OutputRecords>0-0</OutputRecords></RipParam>\n"
+    "  <Text><Content>" + string_to_hex("Партия {batch}") + "</Content></Text>\n"
+    "  <Text><Content></Content></Text>\n"
+    "  <Empty />\n"
+    "</Document>\n"
+)
+CODES = ["0104601234567890215abc\u001d93QWER", "0104601234567890215abd\u001d93QWES", ""]
+STATIC = {"order": {"batch": "B-7"}}
+MAPPING = [{"batch": "batch"}]
+
+
+def test_build_data_file_matches_file_based_md5_and_count(tmp_path):
+    source = tmp_path / "codes.json"
+    source.write_text(json.dumps({"codes": CODES}), encoding="utf-8")
+    csv_path = convert_json_to_raw_csv(str(source), str(tmp_path / "codes.csv"))
+
+    data, md5, count = build_data_file(CODES)
+
+    assert data == (tmp_path / "codes.csv").read_bytes()
+    assert md5 == amica_generator.calculate_md5(csv_path)
+    assert count == amica_generator.count_csv_rows(csv_path) == 2
+
+
+def test_build_data_file_rejects_empty_codes():
+    with pytest.raises(ValueError):
+        build_data_file(["", " "])
+
+
+def test_render_matches_file_based_generator(tmp_path):
+    for name, content in {
+        "t.VDF": TEMPLATE,
+        "amica.json": json.dumps(STATIC),
+        "mapping.json": json.dumps(MAPPING),
+    }.items():
+        (tmp_path / name).write_text(content, encoding="utf-8")
+    data, md5, count = build_data_file(CODES)
+    csv_path = tmp_path / "job.csv"
+    csv_path.write_bytes(data)
+
+    generate_amica_vdf(str(tmp_path / "t.VDF"), str(csv_path), str(tmp_path / "amica.json"),
+                       str(tmp_path / "mapping.json"), str(tmp_path / "job.vdf"))
+    rendered = render_amica_vdf(TEMPLATE, str(csv_path), md5, count, STATIC, MAPPING)
+
+    assert (tmp_path / "job.vdf").read_text(encoding="utf-8") == rendered
+    assert rendered.startswith("<?xml version='1.0' encoding='utf-8'?>\n<Document>")
+    assert f"<DataMd5>{md5}</DataMd5>" in rendered
+    assert "<EndNo>2</EndNo><OutputRecords>0-1</OutputRecords>" in rendered
+    assert f"<Content><![CDATA[{string_to_hex('Партия B-7')}]]></Content>" in rendered
+    assert "<Content><![CDATA[]]></Content>" in rendered
+    assert "<Empty></Empty>" in rendered
+
+
+def make_print_dirs(tmp_path, print_statuses):
+    kodes, tasks, templates = tmp_path / "kodes", tmp_path / "tasks", tmp_path / "templates"
+    kodes.mkdir()
+    templates.mkdir()
+    for key, status in print_statuses.items():
+        (kodes / f"{key}.json").write_text(json.dumps({"codes": CODES[:2]}), encoding="utf-8")
+        (kodes / f"{key}.json.tags").write_text(json.dumps({"print-status": status}), encoding="utf-8")
+    (templates / "32x32_20x20.VDF").write_text(TEMPLATE, encoding="utf-8")
+    (templates / "amica.json").write_text(json.dumps(STATIC), encoding="utf-8")
+    (templates / "mapping-empty.json").write_text(json.dumps(MAPPING), encoding="utf-8")
+    return kodes, tasks, {
+        "kodes": str(kodes), "prn_tasks": str(tasks), "prn_templates": str(templates),
+        "emissions_path": str(tmp_path / "emissions"),
+    }
+
+
+def test_generate_prn_files_builds_job_in_memory(tmp_path):
+    kodes, tasks, config = make_print_dirs(tmp_path, {"ORDER-1": "not-printed"})
+
+    with patch("xtrek.prn_util.load_config", return_value=config), \
+         patch("xtrek.prn_util._find_production_order_id_by_suz_order_id", return_value=None), \
+         patch("tempfile.TemporaryDirectory", side_effect=AssertionError("temp dir is not needed")):
+        assert generate_prn_files("ORDER-1") == "ORDER-1"
+
+    data, md5, _ = build_data_file(CODES[:2])
+    assert (tasks / "ORDER-1.csv").read_bytes() == data
+    vdf = (tasks / "ORDER-1.vdf").read_text(encoding="utf-8")
+    assert "<SourcePath>ORDER-1.csv</SourcePath>" in vdf
+    assert f"<DataMd5>{md5}</DataMd5>" in vdf
+
+
+VARIABLE_TEMPLATE = (
+    "<Document>"
+    "<DataSource><Inner><SourcePath /></Inner><DataMd5 /></DataSource>"
+    "<DataSource><SourcePath>x</SourcePath></DataSource>"
+    "<RipParam><EndNo>0</EndNo><OutputRecords /></RipParam>"
+    "<VariableText FullName=\"Amica.Vdp.Common.Element.VdpVariableText\">"
+    "<TextTemplate>" + string_to_hex("{batch} / {batch_no}") + "</TextTemplate>"
+    "<Text><Content>" + string_to_hex("ignored") + "</Content></Text>"
+    "</VariableText>"
+    "<Text><Content>" + string_to_hex("batch") + "</Content></Text>"
+    "<Text><Content>" + string_to_hex("без замены") + "</Content></Text>"
+    "</Document>"
+)
+
+
+def test_compiled_template_matches_tree_rendering():
+    placeholders = amica_generator.resolve_placeholders(
+        {"batch": "B&7", "no": 12}, [{"batch": "batch"}, {"no": "batch_no"}]
+    )
+    root = ET.fromstring(VARIABLE_TEMPLATE)
+    amica_generator.apply_vdf_data(root, "C:\\jobs\\a&b.csv", "MD5", 3, placeholders)
+    expected = amica_generator.serialize_vdf(root)
+
+    compiled = amica_generator.compile_vdf_template(VARIABLE_TEMPLATE)
+    rendered = compiled.render("C:\\jobs\\a&b.csv", "MD5", 3, placeholders)
+
+    assert rendered == expected
+    assert "<SourcePath>C:\\jobs\\a&amp;b.csv</SourcePath>" in rendered
+    assert f"<TextTemplate>{string_to_hex('B&7 / 12')}</TextTemplate>" in rendered
+    assert f"<Content><![CDATA[{string_to_hex('B&7')}]]></Content>" in rendered
+    # Другие данные в том же скомпилированном шаблоне
+    assert "<EndNo>5</EndNo><OutputRecords>0-4</OutputRecords>" in compiled.render("b.csv", "M", 5, placeholders)
+
+
+def test_content_attributes_are_dropped_as_in_regex_wrapping(tmp_path):
+    template = (
+        "<?xml version='1.0' encoding='utf-8'?>\n"
+        "<Document>"
+        "<DataSource><SourcePath>old.csv</SourcePath><DataMd5>OLD</DataMd5></DataSource>"
+        "<Text><Content Id=\"1\" Kind=\"hex\">" + string_to_hex("Партия {batch}") + "</Content></Text>"
+        "<Text><Content Id=\"2\"></Content></Text>"
+        "<Text><Content Id=\"3\">A&amp;B</Content></Text>"
+        "</Document>"
+    )
+    placeholders = amica_generator.resolve_placeholders(STATIC, MAPPING)
+    # Прежняя запись: дерево в файл и обертка Content в CDATA регулярным выражением
+    root = ET.fromstring(template)
+    amica_generator.apply_vdf_data(root, "job.csv", "MD5", 2, placeholders)
+    ET.ElementTree(root).write(tmp_path / "old.VDF", encoding="utf-8", xml_declaration=True,
+                               short_empty_elements=False)
+    expected = amica_generator.re.sub(r'<Content[^>]*>(.*?)</Content>', r'<Content><![CDATA[\1]]></Content>',
+                                      (tmp_path / "old.VDF").read_text(encoding="utf-8"))
+
+    rendered = amica_generator.compile_vdf_template(template).render("job.csv", "MD5", 2, placeholders)
+
+    assert rendered == expected == amica_generator.serialize_vdf(root)
+    assert f"<Content><![CDATA[{string_to_hex('Партия B-7')}]]></Content>" in rendered
+    assert "<Content><![CDATA[]]></Content>" in rendered
+    assert "<Content><![CDATA[A&amp;B]]></Content>" in rendered
+
+
+def test_compiled_template_is_cached_by_source(monkeypatch):
+    monkeypatch.setattr(amica_generator, "_COMPILED_TEMPLATES", {})
+    first = amica_generator.compile_vdf_template(TEMPLATE)
+
+    monkeypatch.setattr(amica_generator.ET, "fromstring", lambda *args: pytest.fail("template parsed again"))
+    data, md5, count = build_data_file(CODES)
+    rendered = render_amica_vdf(TEMPLATE.encode("utf-8"), "job.csv", md5, count, STATIC, MAPPING)
+
+    assert amica_generator.compile_vdf_template(TEMPLATE) is first
+    assert f"<Content><![CDATA[{string_to_hex('Партия B-7')}]]></Content>" in rendered
+
+
+def test_batch_shares_templates_and_respects_locks_and_tags(tmp_path, monkeypatch):
+    kodes, tasks, config = make_print_dirs(tmp_path, {
+        "ORDER-1": "not-printed", "ORDER-2": "printed", "ORDER-3": "not-printed", "OTHER-1": "not-printed",
+    })
+    (tasks / ".locks").mkdir(parents=True)
+    (tasks / ".locks" / "ORDER-3.lock").write_text("{}", encoding="utf-8")
+    monkeypatch.setattr(prn_util, "load_config", lambda name: config)
+    monkeypatch.setattr(prn_util, "_find_production_order_id_by_suz_order_id", lambda key: None)
+    loads = []
+    original_load = prn_util.load_print_templates
+    monkeypatch.setattr(prn_util, "load_print_templates", lambda *args: loads.append(args) or original_load(*args))
+
+    batch = generate_prn_batch(prefix="ORDER-", workers=1)
+
+    assert len(loads) == 1
+    assert [(job["key"], job["status"]) for job in batch["jobs"]] == [
+        ("ORDER-1", "printed"), ("ORDER-2", "duplicate"), ("ORDER-3", "locked"),
+    ]
+    assert batch["summary"] == {"printed": 1, "duplicate": 1, "locked": 1}
+    assert batch["jobs"][0]["csv"] == str(tasks / "ORDER-1.csv")
+    assert (tasks / "ORDER-1.vdf").exists() and not (tasks / "ORDER-2.csv").exists()
+    assert json.loads((kodes / "ORDER-1.json.tags").read_text())["print-status"] == "printed"
+    assert (tasks / ".locks" / "ORDER-3.lock").exists()
+    assert json.loads(open(batch["manifest"], encoding="utf-8").read())["jobs"] == batch["jobs"]
+
+
+def test_batch_runs_jobs_in_process_pool(tmp_path, monkeypatch):
+    kodes, tasks, config = make_print_dirs(tmp_path, {"A-1": "not-printed", "A-2": "not-printed"})
+    monkeypatch.setenv("suz_worker_config", json.dumps(config))
+
+    batch = generate_prn_batch(["A-1", "A-2", "A-1"], workers=2, manifest=False)
+
+    assert batch["summary"] == {"printed": 2}
+    assert "manifest" not in batch
+    assert (tasks / "A-1.csv").read_bytes() == (tasks / "A-2.csv").read_bytes() == build_data_file(CODES[:2])[0]
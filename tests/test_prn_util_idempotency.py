@@ -40,9 +40,21 @@ class FakeStorage:
             local.write_text("template", encoding='utf-8')
         return str(local)
 
+    def read_text(self, path):
+        if str(path).endswith('.json') and not str(path).endswith('amica.json'):
+            if 'mapping' in str(path):
+                return "[]"
+            return json.dumps({"codes": ["010123456789012321ABC\u001d93XYZ"]})
+        if str(path).endswith('amica.json'):
+            return "{}"
+        return "template"
+
     def upload(self, local_path, remote_path):
         self.uploads.append((local_path, remote_path))
 
+    def write_text(self, path, text):
+        self.uploads.append((text, path))
+
 
 def fake_config():
     return {
@@ -63,13 +75,10 @@ def run_with_storages(kodes_storage, tasks_storage, templates_storage):
             return templates_storage
         raise AssertionError(f"unexpected storage path: {path}")
 
-    def write_vdf(**kwargs):
-        Path(kwargs["output_vdf_path"]).write_text("vdf", encoding="utf-8")
-
     with patch("xtrek.prn_util.load_config", return_value=fake_config()), \
          patch("xtrek.prn_util.get_storage", side_effect=storage_for), \
          patch("xtrek.prn_util._find_production_order_id_by_suz_order_id", return_value=None), \
-         patch("xtrek.prn_util.generate_amica_vdf", side_effect=write_vdf):
+         patch("xtrek.prn_util.render_amica_vdf", return_value="vdf"):
         return generate_prn_files("ORDER-1")
 
 
@@ -0,0 +1,144 @@
+import json
+import multiprocessing
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from xtrek import rate_limit
+from xtrek.rate_limit import SqliteRateLimiter, StorageRateLimiter
+
+
+@pytest.fixture(autouse=True)
+def _clean_limiters(monkeypatch):
+    monkeypatch.delenv("XTREK_RATE_LIMIT_PATH", raising=False)
+    monkeypatch.delenv("XTREK_RATE_LIMIT_S3", raising=False)
+    monkeypatch.delenv("XTREK_RATE_LIMITS", raising=False)
+    monkeypatch.setattr(rate_limit, "_SHARED_LIMITERS", {})
+
+
+def _acquire_many(path, count, queue):
+    limiter = SqliteRateLimiter(path, "suz_codes", rate=20, burst=1)
+    for _ in range(count):
+        limiter.acquire()
+        queue.put(time.time())
+
+
+def test_sqlite_bucket_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "limits.sqlite")
+    SqliteRateLimiter(path, "suz_codes", rate=20, burst=1)
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_acquire_many, args=(path, 5, queue)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=30)
+
+    stamps = sorted(queue.get(timeout=5) for _ in range(10))
+    # 10 разрешений при 20 в секунду и корзине 1 занимают не меньше ~0.45 с
+    assert stamps[-1] - stamps[0] >= 0.4
+
+
+def test_pause_delays_next_acquire(tmp_path, monkeypatch):
+    limiter = SqliteRateLimiter(tmp_path / "limits.sqlite", "true_api_doc", rate=10, burst=5)
+    sleeps = []
+    monkeypatch.setattr(rate_limit.time, "sleep", sleeps.append)
+
+    assert limiter.acquire() == 0
+    limiter.pause(2)
+
+    assert limiter.acquire() == pytest.approx(2.1, abs=0.05)
+    assert sleeps == [pytest.approx(2.1, abs=0.05)]
+
+
+def test_storage_bucket_and_stale_lock(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(rate_limit.time, "sleep", sleeps.append)
+    limiter = StorageRateLimiter(tmp_path / "limits", "nk_product_list", rate=1, burst=1, lock_ttl=5)
+
+    # Блокировка упавшего процесса
+    (tmp_path / "limits").mkdir()
+    (tmp_path / "limits" / "nk_product_list.lock").write_text(json.dumps({"createdAt": time.time() - 60}))
+
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == pytest.approx(1, abs=0.05)
+    state = json.loads((tmp_path / "limits" / "nk_product_list.json").read_text())
+    assert state["tokens"] == pytest.approx(-1, abs=0.05)
+    assert not (tmp_path / "limits" / "nk_product_list.lock").exists()
+
+
+def test_stale_lock_is_taken_over_by_one_process(tmp_path):
+    from xtrek.storage import take_over_stale_lock
+
+    first = StorageRateLimiter(tmp_path / "limits", "nk_product_list", rate=1, burst=1, lock_ttl=5)
+    second = StorageRateLimiter(tmp_path / "limits", "nk_product_list", rate=1, burst=1, lock_ttl=5)
+    lock_path = tmp_path / "limits" / "nk_product_list.lock"
+    (tmp_path / "limits").mkdir()
+    stale = json.dumps({"createdAt": time.time() - 60, "token": "crashed"})
+    lock_path.write_text(stale)
+
+    owner = first._lock()
+    # Второй процесс прочитал ту же устаревшую блокировку, но опоздал с перехватом
+    assert not take_over_stale_lock(second.storage, str(lock_path), stale, json.dumps({"token": "late"}))
+    assert lock_path.read_text() == owner
+
+    # Владелец перехваченной блокировки не снимает чужую
+    second._unlock(stale)
+    assert lock_path.read_text() == owner
+    first._unlock(owner)
+    assert not lock_path.exists()
+
+
+def test_throttle_is_noop_without_configuration():
+    assert rate_limit.shared_rate_limiter("suz_codes") is None
+    assert rate_limit.throttle("suz_codes") == 0.0
+
+
+def test_family_limits_override(tmp_path, monkeypatch):
+    monkeypatch.setenv("XTREK_RATE_LIMIT_PATH", str(tmp_path / "limits.sqlite"))
+    monkeypatch.setenv("XTREK_RATE_LIMITS", json.dumps({"suz_codes": {"rate": 3}, "true_api_doc": 7}))
+
+    codes = rate_limit.shared_rate_limiter("suz_codes")
+    doc = rate_limit.shared_rate_limiter("true_api_doc")
+
+    assert isinstance(codes, SqliteRateLimiter)
+    assert (codes.rate, codes.burst) == (3, 10)
+    assert doc.rate == 7
+    assert rate_limit.shared_rate_limiter("suz_codes") is codes
+
+
+def test_suz_get_uses_family_by_url(monkeypatch):
+    from xtrek import suz
+
+    families = []
+    monkeypatch.setattr(suz, "throttle", families.append)
+    response = MagicMock(status_code=200)
+    response.json.return_value = {}
+    monkeypatch.setattr(suz.requests, "get", MagicMock(return_value=response))
+
+    api = suz.SUZ(token="T", omsId="OMS", clientToken="C")
+    api.codes("O-1", 10, "046")
+    api.report_info("R-1")
+
+    assert families == ["suz_codes", "suz_status"]
+
+
+@pytest.mark.parametrize("client", ["suz", "nkapi"])
+def test_retry_after_token_refresh_reports_rate_limit(monkeypatch, client):
+    from xtrek import nkapi, suz
+
+    module = suz if client == "suz" else nkapi
+    noted = []
+    monkeypatch.setattr(module, "throttle", lambda family: 0.0)
+    monkeypatch.setattr(module, "note_response", lambda family, response: noted.append(response.status_code))
+    responses = [MagicMock(status_code=401), MagicMock(status_code=429, headers={"Retry-After": "3"})]
+    monkeypatch.setattr(module.requests, "get", MagicMock(side_effect=responses))
+
+    if client == "suz":
+        api = suz.SUZ(token="T", omsId="OMS", clientToken="C", token_refresher=lambda: "T2")
+        api.codes("O-1", 10, "046")
+    else:
+        api = nkapi.NK(token="T", token_refresher=lambda: "T2")
+        api._request("GET", "https://nk/product-list", headers={})
+
+    assert noted == [401, 429]
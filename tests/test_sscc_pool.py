@@ -0,0 +1,132 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from xtrek.SSCC_Utils import invalid_ssccs, sscc_check_digit
+from xtrek.create_emission_task_sample import _create_pallet_assignment
+from xtrek.sscc_pool import SsccPool
+
+
+def _sscc(serial, prefix="460705179", extension="0"):
+    body = f"{extension}{prefix}{serial:07d}"
+    return body + str(sscc_check_digit(body))
+
+
+class FakeService:
+    def __init__(self):
+        self.calls = []
+        self.next_serial = 1
+
+    def __call__(self, prefix, count, extension):
+        self.calls.append(count)
+        codes = [_sscc(self.next_serial + i, prefix, extension) for i in range(count)]
+        self.next_serial += count
+        return codes
+
+
+def test_check_digit_validation_in_bulk():
+    assert sscc_check_digit("00614141123456789") == 0
+    valid = "006141411234567890"
+    assert invalid_ssccs([valid, "00" + valid, "006141411234567891", "123"]) == ["006141411234567891", "123"]
+
+
+def test_concurrent_takes_get_distinct_codes_and_ledger_is_written(tmp_path):
+    service = FakeService()
+    pool = SsccPool(tmp_path / "pool.sqlite", service, block_size=100, low_water=0,
+                    ledger_path=str(tmp_path / "ledger"))
+    pool.refill("460705179", "0")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        batches = list(executor.map(lambda i: pool.take("460705179", 10, "0", reserved_for=f"T-{i}"), range(8)))
+
+    codes = [code for batch in batches for code in batch]
+    assert len(codes) == len(set(codes)) == 80
+    assert service.calls == [100]
+    assert pool.available("460705179", "0") == 20
+    assert len(list((tmp_path / "ledger" / "reservations").glob("*.json"))) == 8
+    block = json.loads(next((tmp_path / "ledger" / "blocks").glob("*.json")).read_text())
+    assert len(block["ssccs"]) == 100
+
+
+def test_retry_with_same_reserved_for_returns_existing_codes(tmp_path):
+    service = FakeService()
+    pool = SsccPool(tmp_path / "pool.sqlite", service, block_size=20, low_water=0,
+                    ledger_path=str(tmp_path / "ledger"))
+    pool.refill("460705179", "0")
+
+    first = pool.take("460705179", 5, "0", reserved_for="T-1", reuse=True)
+    retry = pool.take("460705179", 5, "0", reserved_for="T-1", reuse=True)
+    # Без явного reuse тот же ключ получает новые коды
+    other = pool.take("460705179", 5, "0", reserved_for="T-1")
+
+    assert retry == first
+    assert not set(other) & set(first)
+    assert pool.available("460705179", "0") == 10
+    assert len(list((tmp_path / "ledger" / "reservations").glob("*.json"))) == 2
+
+
+def test_label_runs_for_same_lot_get_distinct_codes(tmp_path):
+    from xtrek.SSCC_Utils import generate_gs1_csv
+
+    source = tmp_path / "order.json"
+    source.write_text(json.dumps({"Quantity": 3, "PasportData": {
+        "Product_PackBarcode": "4607051790012", "Batch_BN_1С_full": "LOT-1",
+        "Batch_date_production": "2024-01-01", "Batch_date_packing": "2024-01-02",
+        "Batch_date_expired": "2026-01-01",
+    }}), encoding="utf-8")
+    pool = SsccPool(tmp_path / "pool.sqlite", FakeService(), block_size=20, low_water=0)
+    pool.refill("460705179", "0")
+
+    def run(name, job_id=None):
+        generate_gs1_csv(str(source), str(tmp_path / name), sscc_prefix="460705179", sscc_extension="0",
+                         sscc_pool=pool, job_id=job_id)
+        return (tmp_path / name).read_text(encoding="utf-8").split()[1:]
+
+    first, second = run("first.csv"), run("first.csv")
+    assert not set(first) & set(second)
+    assert run("job.csv", job_id="J-1") == run("job.csv", job_id="J-1")
+    assert pool.available("460705179", "0") == 11
+
+
+def test_empty_pool_fetches_synchronously_and_low_stock_refills_in_background(tmp_path):
+    service = FakeService()
+    pool = SsccPool(tmp_path / "pool.sqlite", service, block_size=5, low_water=3)
+
+    assert len(pool.take("460705179", 4, "0")) == 4
+    # Синхронный запрос: недостающие 4 кода плюс low_water, не меньше блока
+    assert service.calls[0] == 7
+    assert len(pool.take("460705179", 2, "0")) == 2
+    # Остаток 1 < low_water: пополнение запущено в фоне, take не ждет сервис
+    pool._refill_threads["460705179:0"].join(timeout=5)
+    assert service.calls[1] == 5
+    assert pool.available("460705179", "0") == 6
+
+
+def test_invalid_codes_from_service_are_not_handed_out(tmp_path):
+    good = _sscc(1)
+    bad = good[:-1] + str((int(good[-1]) + 1) % 10)
+    pool = SsccPool(tmp_path / "pool.sqlite", lambda prefix, count, extension: [good, bad], block_size=2, low_water=0)
+
+    assert pool.refill("460705179", "0") == 1
+    assert pool.take("460705179", 1, "0") == [good]
+
+
+def test_pallet_assignment_takes_codes_from_pool(tmp_path, monkeypatch):
+    from xtrek import create_emission_task_sample as cets
+
+    service = FakeService()
+    pool = SsccPool(tmp_path / "pool.sqlite", service, block_size=50, low_water=0)
+    pool.refill("460705179", "0")
+    monkeypatch.setattr(cets, "get_sscc_pool", lambda config: pool)
+    monkeypatch.setattr(cets, "get_sscc_from_service", pytest.fail)
+    config = {"sscc_service_url": "https://sscc.example.test", "sscc_prefix": "460705179",
+              "sscc_extension": "0", "pallet_sscc_reserve": 1}
+
+    assignment = _create_pallet_assignment({"Quantity": "17", "numBoxesInPallet": 8}, config, reserved_for="T-1")
+
+    assert len(assignment["palletNumbers"]) == 4
+    # Повтор создания задания для того же заказа получает те же коды
+    retry = _create_pallet_assignment({"Quantity": "17", "numBoxesInPallet": 8}, config, reserved_for="T-1")
+    assert retry["palletNumbers"] == assignment["palletNumbers"]
+    assert service.calls == [50]
@@ -0,0 +1,90 @@
+from unittest.mock import MagicMock
+
+from xtrek.status_poller import StatusPoller
+
+
+def test_run_once_backs_off_and_continues_only_on_final_state(tmp_path):
+    poller = StatusPoller(tmp_path / "poller.sqlite", base_interval=0, max_interval=0)
+    poller.register("update_agg", "T-1", "bucket/aggReceipts/T-1.json", "IN_PROGRESS")
+    poller.register("update_agg", "T-2", "bucket/aggReceipts/T-2.json", "IN_PROGRESS")
+    states = {
+        "T-1": [("IN_PROGRESS", False), ("IN_PROGRESS", False), ("CHECKED_OK", True)],
+        "T-2": [("IN_PROGRESS", False)] * 3,
+    }
+    probe = MagicMock(side_effect=lambda doc_id: states[doc_id].pop(0))
+    on_final = MagicMock()
+
+    for _ in range(3):
+        poller.run_once({"update_agg": probe}, on_final)
+
+    on_final.assert_called_once_with("update_agg", "bucket/aggReceipts/T-1.json", "CHECKED_OK")
+    assert [row["document_id"] for row in poller.pending()] == ["T-2"]
+    assert poller.pending()[0]["attempts"] == 3
+
+
+def test_state_change_resets_backoff_and_failed_continuation_is_kept(tmp_path):
+    poller = StatusPoller(tmp_path / "poller.sqlite", base_interval=0, max_interval=0)
+    poller.register("update_introduce", "DOC-1", "bucket/introduceReceipts/DOC-1.json", "IN_PROGRESS")
+    poller._reschedule({"stage": "update_introduce", "document_id": "DOC-1"}, "IN_PROGRESS", 5)
+
+    poller.run_once({"update_introduce": lambda doc_id: ("WAIT_ACCEPTANCE", False)}, MagicMock())
+    assert poller.pending()[0]["attempts"] == 0
+    assert poller.pending()[0]["state"] == "WAIT_ACCEPTANCE"
+
+    stats = poller.run_once(
+        {"update_introduce": lambda doc_id: ("CHECKED_OK", True)},
+        MagicMock(side_effect=RuntimeError("broker down")),
+    )
+    assert stats["finished"] == 0
+    assert [row["document_id"] for row in poller.pending()] == ["DOC-1"]
+    # Неудачное продолжение повторяется с растущей задержкой, а не с начала
+    assert poller.pending()[0]["attempts"] == 1
+
+
+def test_failed_final_state_is_dropped_without_continuation(tmp_path):
+    poller = StatusPoller(tmp_path / "poller.sqlite", base_interval=0, max_interval=0)
+    poller.register("update_agg", "T-1", "bucket/aggReceipts/T-1.json", "IN_PROGRESS")
+    on_final, on_failed = MagicMock(), MagicMock()
+
+    stats = poller.run_once({"update_agg": lambda doc_id: ("REJECTED", True)}, on_final,
+                            is_failed=lambda stage, state: state != "CHECKED_OK", on_failed=on_failed)
+
+    assert stats["failed"] == 1 and stats["finished"] == 0
+    on_final.assert_not_called()
+    assert on_failed.call_args.args[0]["document_id"] == "T-1"
+    assert on_failed.call_args.args[1] == "REJECTED"
+    assert poller.pending() == []
+
+
+def test_claim_due_leases_documents_and_expired_are_dropped(tmp_path):
+    poller = StatusPoller(tmp_path / "poller.sqlite", base_interval=0, max_age=-1)
+    poller.register("update_emission", "T-1", "bucket/emissionReceipts/T-1.json")
+
+    assert len(poller.claim_due()) == 1
+    assert poller.claim_due() == []
+
+    poller._reschedule({"stage": "update_emission", "document_id": "T-1"}, "PENDING", 0)
+    on_expired = MagicMock()
+    stats = poller.run_once({"update_emission": lambda doc_id: ("PENDING", False)}, MagicMock(), on_expired)
+    assert stats["expired"] == 1
+    on_expired.assert_called_once()
+    assert poller.pending() == []
+
+
+def test_batch_probe_checks_stage_once_and_missing_results_are_retried(tmp_path):
+    poller = StatusPoller(tmp_path / "poller.sqlite", base_interval=0, max_interval=0)
+    for doc_id in ("T-1", "T-2", "T-3"):
+        poller.register("update_emission", doc_id, f"bucket/emissionReceipts/{doc_id}.json", "PENDING")
+    batch_probe = MagicMock(return_value={"T-1": ("ACTIVE", True), "T-2": ("PENDING", False)})
+    single_probe = MagicMock()
+    on_final = MagicMock()
+
+    stats = poller.run_once({"update_emission": single_probe}, on_final,
+                            batch_probes={"update_emission": batch_probe})
+
+    batch_probe.assert_called_once()
+    assert sorted(row["document_id"] for row in batch_probe.call_args.args[0]) == ["T-1", "T-2", "T-3"]
+    single_probe.assert_not_called()
+    on_final.assert_called_once_with("update_emission", "bucket/emissionReceipts/T-1.json", "ACTIVE")
+    assert stats["checked"] == 3 and stats["finished"] == 1
+    assert sorted(row["document_id"] for row in poller.pending()) == ["T-2", "T-3"]
@@ -1,5 +1,7 @@
 import importlib
+import json
 import sys
+import time
 import types
 from unittest.mock import MagicMock, patch
 
@@ -114,8 +116,10 @@ def test_unit_equipment_report_creates_utilisation_and_skips_virtual_tasks(monke
 
     tasks.logic_start_equipment_reports("internal-bucket/equipment-reports/T-UNIT.json")
 
-    create_util.assert_called_once_with("T-UNIT", "chemistry")
-    sign_util.assert_called_once_with("T-UNIT", "/tmp/sign", 120)
+    report_context = create_util.call_args.kwargs["report_context"]
+    create_util.assert_called_once_with("T-UNIT", "chemistry", report_context=report_context)
+    assert report_context.production_order_id == "T-UNIT"
+    sign_util.assert_called_once_with("T-UNIT", "/tmp/sign", 120, wait_signature=True)
     create_virtual.assert_not_called()
 
 
@@ -247,7 +251,7 @@ def test_unit_utilisation_success_starts_introduce_from_report(monkeypatch):
 
     assert "Introduction task for UNIT T-UNIT started successfully" in result
     create_intro.assert_called_once_with("T-UNIT", "chemistry")
-    sign_intro.assert_called_once_with("T-UNIT", "chemistry", "/tmp/sign", 120)
+    sign_intro.assert_called_once_with("T-UNIT", "chemistry", "/tmp/sign", 120, wait_signature=True)
     tasks.trigger_set_aggregation_if_ready.assert_not_called()
 
 
@@ -290,7 +294,7 @@ def test_unit_checked_ok_introduce_starts_standard_aggregation(monkeypatch):
 
     assert "Standard aggregation for UNIT T-UNIT started successfully" in result
     create_agg.assert_called_once_with("T-UNIT")
-    sign_agg.assert_called_once_with("T-UNIT", "chemistry", "/tmp/sign", 120)
+    sign_agg.assert_called_once_with("T-UNIT", "chemistry", "/tmp/sign", 120, wait_signature=True)
     tasks.trigger_set_aggregation_if_ready.assert_not_called()
 
 
@@ -333,13 +337,15 @@ def test_unit_checked_ok_introduce_uses_status_production_order_id(monkeypatch):
     assert "Standard aggregation for UNIT T-UNIT started successfully" in result
     find_prod.assert_not_called()
     create_agg.assert_called_once_with("T-UNIT")
-    sign_agg.assert_called_once_with("T-UNIT", "chemistry", "/tmp/sign", 120)
+    sign_agg.assert_called_once_with("T-UNIT", "chemistry", "/tmp/sign", 120, wait_signature=True)
 
 
 def test_set_equipment_report_still_creates_virtual_tasks(monkeypatch):
     tasks = import_tasks(monkeypatch)
-    monkeypatch.setattr(tasks, "check_aggregation_reports", MagicMock(return_value={"report": None}))
-    monkeypatch.setattr(tasks, "create_utilisation_task_from_report", MagicMock(return_value="T-SET"))
+    check_reports = MagicMock(return_value={"report": None})
+    create_util = MagicMock(return_value="T-SET")
+    monkeypatch.setattr(tasks, "check_aggregation_reports", check_reports)
+    monkeypatch.setattr(tasks, "create_utilisation_task_from_report", create_util)
     monkeypatch.setattr(tasks, "sign_and_send_utilisation", MagicMock(return_value=True))
     create_virtual = MagicMock(return_value="created")
     monkeypatch.setattr(tasks, "create_virtual_tasks_from_equipment_report", create_virtual)
@@ -347,7 +353,10 @@ def test_set_equipment_report_still_creates_virtual_tasks(monkeypatch):
 
     tasks.logic_start_equipment_reports("internal-bucket/equipment-reports/T-SET.json")
 
-    create_virtual.assert_called_once_with("T-SET")
+    # Все этапы события получают один контекст отчета оборудования
+    report_context = check_reports.call_args.kwargs["report_context"]
+    create_util.assert_called_once_with("T-SET", "chemistry", report_context=report_context)
+    create_virtual.assert_called_once_with("T-SET", report_context=report_context)
 
 
 def test_set_utilisation_success_still_checks_set_readiness(monkeypatch):
@@ -370,3 +379,267 @@ def test_set_utilisation_success_still_checks_set_readiness(monkeypatch):
     trigger_ready.assert_called_once_with("T-SET")
     tasks.create_introduce_task_from_report.assert_not_called()
     tasks.sign_and_send_introduce.assert_not_called()
+
+
+
+def test_routes_cover_every_prefix_in_router_order(monkeypatch):
+    tasks = import_tasks(monkeypatch)
+
+    route = tasks.resolve_route("internal-bucket", "emissionReceipts/T-1.json")
+    assert route.stage == "update_emission"
+    assert route.kind == "polling"
+    assert route.queue == "xtrek_update_emission"
+
+    assert tasks.resolve_route("input-bucket", "Задания/order.json").handler == "logic_create_order"
+    assert tasks.resolve_route("input-bucket", "emissionReceipts/T-1.json") is None
+    assert len({route.queue for route in tasks.S3_ROUTES}) == len(tasks.S3_ROUTES)
+    assert "--concurrency=8" in tasks.stage_worker_command(route)
+
+
+def test_process_s3_event_dispatches_to_stage_queue_when_configured(monkeypatch):
+    tasks = import_tasks(monkeypatch)
+    stage_task = MagicMock()
+    handler = MagicMock()
+    monkeypatch.setattr(tasks, "logic_update_emission", handler)
+    monkeypatch.setitem(tasks.STAGE_TASKS, "update_emission", stage_task)
+    monkeypatch.setattr(tasks, "STAGE_QUEUE_URLS", {"xtrek_update_emission": "https://example.test/stage"})
+
+    result = tasks.process_s3_event.apply(args=[{
+        "bucket": "internal-bucket",
+        "key": "emissionReceipts/T-1.json",
+    }])
+
+    assert result.successful()
+    assert result.result == "Dispatched to xtrek_update_emission"
+    handler.assert_not_called()
+    stage_task.apply_async.assert_called_once_with(
+        args=["internal-bucket/emissionReceipts/T-1.json"],
+        queue="xtrek_update_emission",
+        priority=3,
+    )
+
+
+def test_stage_task_runs_handler(monkeypatch):
+    tasks = import_tasks(monkeypatch)
+    handler = MagicMock(return_value="done")
+    monkeypatch.setattr(tasks, "logic_update_agg", handler)
+
+    assert tasks.STAGE_TASKS["update_agg"]("internal-bucket/aggReceipts/T-1.json") == "done"
+    handler.assert_called_once_with("internal-bucket/aggReceipts/T-1.json")
+
+
+def test_pending_signature_is_registered_and_resumed_by_sig_event(monkeypatch, tmp_path):
+    tasks = import_tasks(monkeypatch)
+    pending_dir = tmp_path / "pending"
+    signature_path = str(tmp_path / "sign" / "7701234567_X_agg.json.sig")
+    monkeypatch.setattr(tasks, "SIGNATURE_PENDING_PATH", str(pending_dir))
+    handler = MagicMock(side_effect=[
+        tasks.SignaturePending("aggregation", "T-1", signature_path[:-4], signature_path),
+        "sent",
+    ])
+    monkeypatch.setattr(tasks, "logic_update_agg", handler)
+
+    result = tasks.process_s3_event.apply(args=[{
+        "bucket": "internal-bucket",
+        "key": "aggReceipts/T-1.json",
+    }])
+
+    assert result.successful()
+    assert result.result == f"Pending signature: {signature_path}"
+    record_path = pending_dir / "7701234567_X_agg.json.sig.json"
+    assert record_path.exists()
+
+    assert tasks.logic_signature_ready(signature_path) == "sent"
+    assert handler.call_count == 2
+    handler.assert_called_with("internal-bucket/aggReceipts/T-1.json")
+    assert not record_path.exists()
+
+
+def test_sweep_resumes_signed_documents_and_moves_expired_to_errors(monkeypatch, tmp_path):
+    tasks = import_tasks(monkeypatch)
+    pending_dir = tmp_path / "pending"
+    pending_dir.mkdir()
+    errors_dir = tmp_path / "errors"
+    sign_dir = tmp_path / "sign"
+    sign_dir.mkdir()
+    (sign_dir / "ready.json.sig").write_text("SIG")
+    monkeypatch.setattr(tasks, "SIGNATURE_PENDING_PATH", str(pending_dir))
+    monkeypatch.setattr(tasks, "SIGNATURE_PENDING_ERRORS_PATH", str(errors_dir))
+    handler = MagicMock(return_value="sent")
+    monkeypatch.setattr(tasks, "logic_update_agg", handler)
+
+    for name, created_at in (("ready", 0), ("lost", 0), ("waiting", 10 ** 10)):
+        (pending_dir / f"{name}.json.sig.json").write_text(json.dumps({
+            "stage": "update_agg",
+            "fullKey": f"internal-bucket/aggReceipts/{name}.json",
+            "signaturePath": str(sign_dir / f"{name}.json.sig"),
+            "createdAtUnix": created_at,
+        }))
+
+    assert tasks.sweep_pending_signatures() == {"resumed": 1, "expired": 1}
+    handler.assert_called_once_with("internal-bucket/aggReceipts/ready.json")
+    assert sorted(path.name for path in pending_dir.iterdir()) == ["waiting.json.sig.json"]
+    expired = json.loads((errors_dir / "lost.json.sig.json").read_text())
+    assert expired["fullKey"] == "internal-bucket/aggReceipts/lost.json"
+    assert "Подпись не получена" in expired["error"]
+
+
+def test_pending_status_goes_to_poller_and_continues_on_final_state(monkeypatch, tmp_path):
+    tasks = import_tasks(monkeypatch)
+    monkeypatch.setattr(tasks, "STATUS_POLLER_ENABLED", True)
+    poller = tasks.StatusPoller(tmp_path / "poller.sqlite", base_interval=0, max_interval=0)
+    monkeypatch.setattr(tasks, "_status_poller", poller)
+    statuses = [[{"status": "IN_PROGRESS"}], [{"status": "IN_PROGRESS"}], [{"status": "CHECKED_OK"}], [{"status": "CHECKED_OK"}]]
+    update_status = MagicMock(side_effect=lambda *args, **kwargs: statuses.pop(0))
+    check_report = MagicMock()
+    monkeypatch.setattr(tasks, "update_aggregation_status", update_status)
+    monkeypatch.setattr(tasks, "check_aggregation_report", check_report)
+
+    result = tasks.process_s3_event.apply(args=[{
+        "bucket": "internal-bucket",
+        "key": "aggReceipts/T-1.json",
+    }])
+
+    assert result.successful()
+    assert result.result == "Pending status: IN_PROGRESS"
+    assert [row["document_id"] for row in poller.pending()] == ["T-1"]
+
+    assert tasks.poll_document_statuses()["finished"] == 0
+    check_report.assert_not_called()
+
+    assert tasks.poll_document_statuses()["finished"] == 1
+    check_report.assert_called_once_with("T-1")
+    assert poller.pending() == []
+
+
+def test_rejected_document_is_moved_to_errors_instead_of_rerunning_stage(monkeypatch, tmp_path):
+    tasks = import_tasks(monkeypatch)
+    poller = tasks.StatusPoller(tmp_path / "poller.sqlite", base_interval=0, max_interval=0)
+    monkeypatch.setattr(tasks, "_status_poller", poller)
+    monkeypatch.setattr(tasks, "STATUS_POLLER_ERRORS_PATH", str(tmp_path / "errors"))
+    poller.register("update_agg", "T-1", "internal-bucket/aggReceipts/T-1.json", "IN_PROGRESS")
+    monkeypatch.setattr(tasks, "update_aggregation_status", MagicMock(return_value=[{"status": "REJECTED"}]))
+    dispatch = MagicMock()
+    monkeypatch.setattr(tasks, "_dispatch_stage", dispatch)
+
+    stats = tasks.poll_document_statuses()
+
+    assert stats["failed"] == 1 and stats["finished"] == 0
+    dispatch.assert_not_called()
+    assert poller.pending() == []
+    error = json.loads((tmp_path / "errors" / "update_agg" / "T-1.json").read_text())
+    assert error["status"] == "REJECTED"
+    assert error["fullKey"] == "internal-bucket/aggReceipts/T-1.json"
+
+
+def test_poll_cycle_shares_one_status_context(monkeypatch, tmp_path):
+    tasks = import_tasks(monkeypatch)
+    poller = tasks.StatusPoller(tmp_path / "poller.sqlite", base_interval=0, max_interval=0)
+    monkeypatch.setattr(tasks, "_status_poller", poller)
+    for document_id in ("T-1", "T-2"):
+        poller.register("update_agg", document_id, f"internal-bucket/aggReceipts/{document_id}.json", "IN_PROGRESS")
+    update_status = MagicMock(return_value=[{"status": "IN_PROGRESS"}])
+    monkeypatch.setattr(tasks, "update_aggregation_status", update_status)
+
+    assert tasks.poll_document_statuses()["checked"] == 2
+    first, second = (call.kwargs["status_context"] for call in update_status.call_args_list)
+    assert first is second
+
+    tasks.poll_document_statuses()
+    assert update_status.call_args.kwargs["status_context"] is not first
+
+
+def test_duplicate_s3_events_are_dropped_by_etag(monkeypatch, tmp_path):
+    tasks = import_tasks(monkeypatch)
+    monkeypatch.setattr(tasks, "_event_store", tasks.SqliteCache(tmp_path / "events.sqlite", namespace="s3_events"))
+    handler = MagicMock(side_effect=[RuntimeError("SUZ unavailable"), "ok", "ok"])
+    monkeypatch.setattr(tasks, "logic_update_emission", handler)
+    event = {"bucket": "internal-bucket", "key": "emissionReceipts/T-1.json", "eTag": '"abc"'}
+
+    assert not tasks.process_s3_event.apply(args=[event]).successful()
+    # После ошибки отпечаток снят - повторная доставка обрабатывается
+    assert tasks.process_s3_event.apply(args=[event]).successful()
+    assert tasks.process_s3_event.apply(args=[event]).result == "Skipped: Duplicate event"
+    assert tasks.process_s3_event.apply(args=[{**event, "eTag": "def"}]).result == "ok"
+    assert handler.call_count == 3
+
+
+def test_burst_of_events_for_one_document_is_coalesced(monkeypatch, tmp_path):
+    tasks = import_tasks(monkeypatch)
+    monkeypatch.setattr(tasks, "_event_store", tasks.SqliteCache(tmp_path / "events.sqlite", namespace="s3_events"))
+    monkeypatch.setattr(tasks, "EVENT_COALESCE_SECONDS", 5)
+    apply_async = MagicMock()
+    monkeypatch.setattr(tasks.process_s3_event, "apply_async", apply_async, raising=False)
+    handler = MagicMock(return_value="ok")
+    monkeypatch.setattr(tasks, "logic_update_agg", handler)
+    event = {"bucket": "internal-bucket", "key": "aggReceipts/T-1.json"}
+
+    results = [tasks.process_s3_event.apply(args=[event]).result for _ in range(3)]
+
+    assert results == ["Coalescing update_agg for 5s", "Skipped: Coalesced", "Skipped: Coalesced"]
+    apply_async.assert_called_once_with(args=[{**event, "coalesced": True}], countdown=5)
+    handler.assert_not_called()
+
+    assert tasks.process_s3_event.apply(args=[{**event, "coalesced": True}]).result == "ok"
+    assert tasks.process_s3_event.apply(args=[event]).result == "Coalescing update_agg for 5s"
+
+
+def test_emission_orders_are_polled_in_one_batch(monkeypatch, tmp_path):
+    tasks = import_tasks(monkeypatch)
+    poller = tasks.StatusPoller(tmp_path / "poller.sqlite", base_interval=0, max_interval=0)
+    monkeypatch.setattr(tasks, "_status_poller", poller)
+    for document_id in ("P-1", "P-2"):
+        poller.register("update_emission", document_id, f"internal-bucket/emissionReceipts/{document_id}.json", "PENDING")
+    bulk = MagicMock(return_value={
+        "P-1": tasks.EmissionOrderStatus("OMS", "O-1", "046", "ACTIVE", 1, 1, 0, 1, 0, False),
+        "P-2": "timeout",
+    })
+    single = MagicMock()
+    dispatch = MagicMock()
+    monkeypatch.setattr(tasks, "update_emission_order_statuses", bulk)
+    monkeypatch.setattr(tasks, "update_emission_order_status", single)
+    monkeypatch.setattr(tasks, "_dispatch_stage", dispatch)
+
+    stats = tasks.poll_document_statuses()
+
+    bulk.assert_called_once()
+    assert bulk.call_args.kwargs["known_states"] == {"P-1": "PENDING", "P-2": "PENDING"}
+    single.assert_not_called()
+    # Переход в ACTIVE уже записан в emissions/, этап повторно не запускается
+    dispatch.assert_not_called()
+    assert stats["finished"] == 1
+    assert [row["document_id"] for row in poller.pending()] == ["P-2"]
+
+
+def test_claimed_pending_signature_is_not_resumed_twice(monkeypatch, tmp_path):
+    tasks = import_tasks(monkeypatch)
+    pending_dir = tmp_path / "pending"
+    pending_dir.mkdir()
+    sign_dir = tmp_path / "sign"
+    sign_dir.mkdir()
+    signature_path = str(sign_dir / "ready.json.sig")
+    (sign_dir / "ready.json.sig").write_text("SIG")
+    monkeypatch.setattr(tasks, "SIGNATURE_PENDING_PATH", str(pending_dir))
+    handler = MagicMock(return_value="sent")
+    monkeypatch.setattr(tasks, "logic_update_agg", handler)
+    record_path = pending_dir / "ready.json.sig.json"
+    record_path.write_text(json.dumps({
+        "stage": "update_agg",
+        "fullKey": "internal-bucket/aggReceipts/ready.json",
+        "signaturePath": signature_path,
+        "createdAtUnix": 0,
+    }))
+    claim_path = pending_dir / "ready.json.sig.resuming"
+    claim_path.write_text(json.dumps({"claimedAtUnix": time.time()}))
+
+    assert tasks.logic_signature_ready(signature_path).startswith("Already resuming")
+    assert tasks.sweep_pending_signatures() == {"resumed": 0, "expired": 0}
+    handler.assert_not_called()
+
+    # Захват упавшего воркера перехватывается после TTL
+    claim_path.write_text(json.dumps({"claimedAtUnix": 0}))
+    assert tasks.logic_signature_ready(signature_path) == "sent"
+    handler.assert_called_once_with("internal-bucket/aggReceipts/ready.json")
+    assert not record_path.exists()
+    assert not claim_path.exists()
+    assert tasks.logic_signature_ready(signature_path).startswith("No pending document")
@@ -346,3 +346,98 @@ def test_finished_state(analyzer, tmp_path):
     errors = analyzer.check_report(str(file1))
 
     assert errors == {"finished": ["All codes are INTRODUCED"]}
+
+
+def _statuses(status_by_code):
+    def mock_check(codes):
+        return [{"cisInfo": {"cis": c, "status": status_by_code[c]}} for c in codes if c in status_by_code]
+    return mock_check
+
+
+def test_retry_rechecks_only_unverified_codes(analyzer, tmp_path):
+    file1 = tmp_path / "report.json"
+    ok_1, ok_2, late = (f"0104630234040808215CHILD{i}" for i in range(3))
+    data = {"readyBox": [{"boxNumber": "123456789012345678", "productNumbersFull": [ok_1, ok_2, late + "\u001d93tail"]}]}
+    file1.write_text(json.dumps(data))
+    analyzer.min_sscc = 0
+    analyzer.gtin_cache["04630234040808"] = False
+    statuses = {ok_1: "EMITTED", ok_2: "EMITTED"}
+    analyzer.check_statuses = MagicMock(side_effect=_statuses(statuses))
+
+    first = analyzer.check_report(str(file1))
+    assert first == {"wrongunitstatus": [f"{late} (Статус: Не найден)"]}
+    assert set(analyzer.check_statuses.call_args.args[0]) == {ok_1, ok_2, late, "00123456789012345678"}
+
+    # Повтор: коды в EMITTED и незарегистрированный SSCC в ГИС МТ не запрашиваются
+    statuses[late] = "EMITTED"
+    assert analyzer.check_report(str(file1)) is None
+    assert analyzer.check_statuses.call_args.args[0] == [late]
+
+    # Новая версия отчета проверяется полностью
+    data["readyBox"][0]["productNumbersFull"].append("0104630234040808215CHILD3")
+    statuses["0104630234040808215CHILD3"] = "EMITTED"
+    file1.write_text(json.dumps(data))
+    assert analyzer.check_report(str(file1)) is None
+    assert len(analyzer.check_statuses.call_args.args[0]) == 5
+
+
+def test_retry_after_passing_check_sees_changed_statuses(analyzer, tmp_path):
+    file1 = tmp_path / "report.json"
+    children = [f"0104630234040808215CHILD{i}" for i in range(2)]
+    sscc = "00123456789012345678"
+    file1.write_text(json.dumps({"readyBox": [{"boxNumber": sscc[2:], "productNumbersFull": children}]}))
+    analyzer.min_sscc = 0
+    analyzer.gtin_cache["04630234040808"] = False
+    statuses = dict.fromkeys(children, "EMITTED")
+    analyzer.check_statuses = MagicMock(side_effect=_statuses(statuses))
+    assert analyzer.check_report(str(file1)) is None
+
+    # Нанесение отправлено, следующий этап упал - повтор задачи в пределах TTL
+    statuses.update(dict.fromkeys(children, "APPLIED"), **{sscc: "APPLIED"})
+    errors = analyzer.check_report(str(file1))
+    assert set(errors) == {"alreadyregistered", "wrongunitstatus"}
+    assert set(analyzer.check_statuses.call_args.args[0]) == {*children, sscc}
+
+    statuses.update(dict.fromkeys(children, "INTRODUCED"))
+    assert analyzer.check_report(str(file1)) == {"finished": ["All codes are INTRODUCED"]}
+
+
+def test_api_error_keeps_codes_checked_before_failure(analyzer, tmp_path):
+    file1 = tmp_path / "report.json"
+    children = [f"0104630234040808215CHILD{i}" for i in range(4)]
+    file1.write_text(json.dumps({"readyBox": [{"boxNumber": "123456789012345678", "productNumbersFull": children}]}))
+    analyzer.min_sscc = 0
+    analyzer.status_batch_size = 2
+    analyzer.gtin_cache["04630234040808"] = False
+    checked = []
+
+    def failing_check(codes):
+        checked.append(codes)
+        if len(checked) == 2:
+            return {"error": "503 Service Unavailable"}
+        return [{"cisInfo": {"cis": c, "status": "EMITTED"}} for c in codes if c in children]
+
+    analyzer.check_statuses = MagicMock(side_effect=failing_check)
+    assert analyzer.check_report(str(file1)) == {"api_error": ["503 Service Unavailable"]}
+
+    analyzer.check_statuses = MagicMock(side_effect=_statuses(dict.fromkeys(children, "EMITTED")))
+    assert analyzer.check_report(str(file1)) is None
+    rechecked = [code for call in analyzer.check_statuses.call_args_list for code in call.args[0]]
+    assert sorted(rechecked) == sorted(set(children + ["00123456789012345678"]) - set(checked[0]))
+
+
+def test_is_set_is_decided_once_per_gtin(analyzer, tmp_path):
+    file1 = tmp_path / "report.json"
+    children = [f"0104630234040808215CHILD{i}" for i in range(3)]
+    file1.write_text(json.dumps({"readyBox": [{"boxNumber": "BOX1", "productNumbersFull": children}]}))
+    analyzer.min_sscc = 0
+    analyzer.check_statuses = MagicMock(return_value=[])
+    analyzer.nk.product_info_many.return_value = {}
+    analyzer.nk.product_info.return_value = None
+    analyzer.nk.feedProduct.return_value = None
+    analyzer.nk.get_set_by_gtin.return_value = None
+
+    errors = analyzer.check_report(str(file1))
+
+    assert errors == {"gtinnotfound": ["04630234040808"]}
+    analyzer.nk.product_info.assert_called_once_with("04630234040808")
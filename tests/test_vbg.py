@@ -28,7 +28,7 @@ class FakeSession:
 
 
 def test_get_gtin_info_fetches_and_caches(tmp_path):
-    cache_path = tmp_path / "vbg-cache.json"
+    cache_path = tmp_path / "vbg-cache.sqlite"
     session = FakeSession({
         "data": [{
             "gtin": "4670167220663",
@@ -54,8 +54,27 @@ def test_get_gtin_info_fetches_and_caches(tmp_path):
     assert session.calls[0]["json"] == ["04670167220663"]
     assert session.calls[0]["headers"]["Token"] == "token"
 
-    cache = json.loads(cache_path.read_text(encoding="utf-8"))
-    assert cache["04670167220663"]["data"]["license"]["licenseeName"] == 'ООО "СМАРТ КОСМЕТИК"'
+    cache = vbg.open_cache(str(cache_path))
+    entry = cache.get("04670167220663")
+    assert entry["data"]["license"]["licenseeName"] == 'ООО "СМАРТ КОСМЕТИК"'
+
+
+def test_get_gtin_info_fetches_batches_concurrently_with_shared_session(tmp_path):
+    session = FakeSession({"data": []})
+    gtins = [str(4670167220000 + i) for i in range(5)]
+
+    vbg.get_gtin_info(
+        gtins,
+        token="token",
+        cache_path=str(tmp_path / "vbg-cache.sqlite"),
+        session=session,
+        batch_size=2,
+        fetch_workers=3,
+    )
+
+    sent = sorted(gtin for call in session.calls for gtin in call["json"])
+    assert len(session.calls) == 3
+    assert sent == [gtin.zfill(14) for gtin in gtins]
 
 
 def test_get_gtin_info_uses_fresh_cache_without_token(tmp_path):
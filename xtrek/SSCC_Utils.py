@@ -2,10 +2,11 @@ import json
 import csv
 import logging
 import os
-import re
 import requests
 import time
+import uuid
 from datetime import datetime
+from string import Formatter
 
 # Настройка логирования
 logging.basicConfig(
@@ -22,6 +23,150 @@ def format_gs1_date(date_str):
         logger.error(f"Ошибка преобразования даты {date_str}: {e}")
         raise
 
+def sscc_check_digit(body):
+    """Контрольная цифра GS1 (mod 10) для 17 цифр SSCC без контрольной."""
+    total = sum(int(digit) * (3 if index % 2 == 0 else 1) for index, digit in enumerate(reversed(body)))
+    return (10 - total % 10) % 10
+
+
+def sscc_body(code):
+    """18 цифр SSCC без AI 00 или None, если код не похож на SSCC."""
+    raw = str(code).strip()
+    if len(raw) == 20 and raw.startswith('00'):
+        raw = raw[2:]
+    if len(raw) != 18 or not raw.isascii() or not raw.isdigit():
+        return None
+    return raw
+
+
+# Сумма кодов '0' с весами 3/1 по 17 позициям тела SSCC: 9 позиций с весом 3 и 8 с весом 1
+_SSCC_ZERO_WEIGHTED = ord('0') * (9 * 3 + 8)
+
+
+def invalid_ssccs(codes):
+    """
+    Коды из списка с неверным форматом или контрольной цифрой (проверка без обращения к сервису).
+    Взвешенная сумма считается срезами байтов, без разбора кода по цифрам.
+    """
+    invalid = []
+    for code in codes:
+        body = sscc_body(code)
+        if body is None:
+            invalid.append(code)
+            continue
+        digits = body.encode('ascii')
+        total = 3 * sum(digits[0:17:2]) + sum(digits[1:17:2]) - _SSCC_ZERO_WEIGHTED
+        if (10 - total % 10) % 10 != digits[17] - 48:
+            invalid.append(code)
+    return invalid
+
+
+# Символы, из-за которых csv.writer заключает поле в кавычки
+_CSV_SPECIAL = (',', '"', '\r', '\n')
+GS1_BATCH_SIZE = 10000
+
+
+def _is_sscc_line(line):
+    """Строка файла SSCC из 18-20 цифр."""
+    return 18 <= len(line) <= 20 and line.isascii() and line.isdigit()
+
+
+class Gs1LabelTemplate:
+    """
+    Шаблон строки DataMatrix (gs1_template), разобранный один раз: все поля,
+    кроме {sscc}, подставляются заранее, и строка собирается как
+    sscc.join(segments) без format на каждую этикетку.
+    """
+
+    def __init__(self, template, **fields):
+        self.template = template
+        self.fields = fields
+        segments = ['']
+        for literal, field_name, format_spec, conversion in Formatter().parse(template):
+            segments[-1] += literal
+            if field_name is None:
+                continue
+            if field_name == 'sscc' and not format_spec and not conversion:
+                segments.append('')
+                continue
+            if field_name.split('.')[0].split('[')[0] == 'sscc':
+                # Форматирование самого SSCC: собираем строку через format
+                segments = None
+                break
+            field = '{' + field_name + ('!' + conversion if conversion else '') + \
+                    (':' + format_spec if format_spec else '') + '}'
+            segments[-1] += field.format(**fields)
+        self.segments = segments
+        self.csv_safe = segments is not None and \
+            not any(ch in segment for segment in segments for ch in _CSV_SPECIAL)
+
+    def render(self, sscc):
+        if self.segments is None:
+            return self.template.format(sscc=sscc, **self.fields)
+        return str(sscc).join(self.segments)
+
+    def render_many(self, ssccs):
+        if self.segments is None:
+            return [self.template.format(sscc=sscc, **self.fields) for sscc in ssccs]
+        segments = self.segments
+        if len(segments) == 2:
+            prefix, suffix = segments
+            return [prefix + sscc + suffix for sscc in ssccs]
+        return [sscc.join(segments) for sscc in ssccs]
+
+
+def write_gs1_labels(output_path, template, sscc_list, column_name='C1', batch_size=GS1_BATCH_SIZE):
+    """
+    Пишет CSV этикеток пачками по batch_size. Если ни шаблон, ни SSCC не
+    требуют экранирования, строки пишутся напрямую, иначе через csv.writer;
+    результат совпадает с построчной записью csv.writer.
+    """
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([column_name])
+        for start in range(0, len(sscc_list), batch_size):
+            chunk = [str(sscc) for sscc in sscc_list[start:start + batch_size]]
+            labels = template.render_many(chunk)
+            if template.csv_safe and all(sscc.isdigit() for sscc in chunk):
+                f.write('\r\n'.join(labels))
+                f.write('\r\n')
+            else:
+                writer.writerows([label] for label in labels)
+    return output_path
+
+
+def _write_gs1_shard(args):
+    return write_gs1_labels(*args)
+
+
+def shard_output_paths(output_path, shards):
+    """Имена файлов частей: result.csv -> result_1.csv, result_2.csv, ..."""
+    base, ext = os.path.splitext(output_path)
+    return [f"{base}_{index}{ext}" for index in range(1, shards + 1)]
+
+
+def write_gs1_label_shards(output_path, template, sscc_list, shards, column_name='C1', workers=None):
+    """
+    Делит SSCC на shards непрерывных диапазонов (по файлу на принтер линии)
+    и пишет части параллельно в пуле процессов. Возвращает пути файлов.
+    """
+    shards = max(1, min(int(shards), len(sscc_list)))
+    paths = shard_output_paths(output_path, shards)
+    size, extra = divmod(len(sscc_list), shards)
+    tasks = []
+    start = 0
+    for index, path in enumerate(paths):
+        end = start + size + (1 if index < extra else 0)
+        tasks.append((path, template, sscc_list[start:end], column_name))
+        start = end
+
+    if workers == 1 or shards == 1:
+        return [_write_gs1_shard(task) for task in tasks]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_write_gs1_shard, tasks))
+
+
 def get_sscc_from_service(function_url, prefix, count, extension=None):
     """Запрашивает SSCC коды у внешнего сервиса с замером времени отклика."""
     count = int(count)
@@ -54,10 +199,18 @@ def get_sscc_from_service(function_url, prefix, count, extension=None):
 def generate_gs1_csv(json_path, output_path, sscc_path=None,
                      column_name='C1', sscc_url=None,
                      sscc_prefix=None, sscc_extension=None,
-                     gs1_template="00{sscc}"):
+                     gs1_template="00{sscc}", sscc_pool=None, shards=1, workers=None,
+                     job_id=None):
     """
     Генерация CSV для DataMatrix.
     Все ключи JSON обязательны. Отсутствие ключа вызывает прерывание с ошибкой.
+    sscc_pool (xtrek.sscc_pool.SsccPool) - выдача SSCC из локального запаса
+    вместо запроса к сервису. Каждый запуск получает новые коды; job_id -
+    идентификатор задания печати, повторный запуск с тем же job_id получает
+    уже выданные ему коды.
+    shards > 1 - вывод в несколько файлов (result_1.csv, ...) для многопринтерной
+    линии, части пишутся в пуле из workers процессов.
+    Возвращает список созданных файлов или None при ошибке.
     """
     logger.info("=== Запуск процедуры генерации ===")
 
@@ -99,8 +252,8 @@ def generate_gs1_csv(json_path, output_path, sscc_path=None,
                 logger.error("Файл SSCC пуст.")
                 return
 
-            if re.match(r'^\d{18,20}$', raw_lines[0]):
-                sscc_list = [l for l in raw_lines if re.match(r'^\d{18,20}$', l)]
+            if _is_sscc_line(raw_lines[0]):
+                sscc_list = [l for l in raw_lines if _is_sscc_line(l)]
             else:
                 start_idx = next((i for i, line in enumerate(raw_lines) if column_name in line), -1)
                 if start_idx == -1:
@@ -115,11 +268,17 @@ def generate_gs1_csv(json_path, output_path, sscc_path=None,
             logger.error(f"Ошибка чтения файла SSCC: {e}")
             return
     else:
-        if not all([sscc_url, sscc_prefix]):
+        if not sscc_prefix or (not sscc_url and sscc_pool is None):
             logger.error("Параметры API не заданы.")
             return
         try:
-            sscc_list = get_sscc_from_service(sscc_url, sscc_prefix, target_quantity, sscc_extension)
+            if sscc_pool is not None:
+                # Партия не идентифицирует запуск: одна партия печатается несколько раз
+                reserved_for = f"labels:{job_id or f'{output_path}:{uuid.uuid4().hex}'}"
+                sscc_list = sscc_pool.take(sscc_prefix, target_quantity, sscc_extension,
+                                           reserved_for=reserved_for, reuse=job_id is not None)
+            else:
+                sscc_list = get_sscc_from_service(sscc_url, sscc_prefix, target_quantity, sscc_extension)
         except ValueError:
             return
 
@@ -127,26 +286,30 @@ def generate_gs1_csv(json_path, output_path, sscc_path=None,
         logger.error("Список SSCC пуст. Процедура остановлена.")
         return
 
-    # 3. Запись выходного CSV
+    invalid = invalid_ssccs(sscc_list)
+    if invalid:
+        logger.error(f"Найдено {len(invalid)} SSCC с неверным форматом или контрольной цифрой, "
+                     f"например {invalid[0]}. Процедура остановлена.")
+        return
+
+    # 3. Запись выходного CSV (или частей по принтерам линии)
     try:
-        GS = '\x1d'
-        with open(output_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([column_name])
-
-            for sscc in sscc_list:
-                gs1_string = gs1_template.format(
-                    sscc=sscc,
-                    gtin=gtin,
-                    batch=batch,
-                    GS=GS,
-                    d_prod=d_prod,
-                    d_pack=d_pack,
-                    d_exp=d_exp
-                )
-                writer.writerow([gs1_string])
-
-        logger.info(f"Файл успешно создан: {output_path}")
+        template = Gs1LabelTemplate(
+            gs1_template,
+            gtin=gtin,
+            batch=batch,
+            GS='\x1d',
+            d_prod=d_prod,
+            d_pack=d_pack,
+            d_exp=d_exp
+        )
+        if shards > 1:
+            paths = write_gs1_label_shards(output_path, template, sscc_list, shards, column_name, workers)
+        else:
+            paths = [write_gs1_labels(output_path, template, sscc_list, column_name)]
+
+        logger.info(f"Файл успешно создан: {', '.join(paths)}")
+        return paths
     except Exception as e:
         logger.error(f"Ошибка записи результата: {e}")
 
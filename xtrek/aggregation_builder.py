@@ -5,6 +5,7 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Any, Mapping, Optional, Sequence
 
+from . import datamatrix
 from .suz_api_models import AggregationReport, AggregationUnit
 
 
@@ -120,9 +121,14 @@ def iter_equipment_report_boxes(
     return tuple(boxes)
 
 
-def extract_full_product_codes(report: Mapping[str, Any]) -> list[str]:
+def extract_full_product_codes(
+    report: Mapping[str, Any] | CanonicalEquipmentReport,
+) -> list[str]:
     """Validate a v1/v2 report and flatten its full marking codes."""
-    canonical = normalize_equipment_report(report)
+    if isinstance(report, CanonicalEquipmentReport):
+        canonical = report
+    else:
+        canonical = normalize_equipment_report(report)
     return [
         code
         for pallet in canonical.pallets
@@ -135,7 +141,7 @@ def cut_crypto_tail(code: str) -> str:
     """Return the KI part before the first GS separator."""
     if not isinstance(code, str) or not code:
         raise AggregationBuildError("Marking code must be a non-empty string")
-    return code.split("\u001d", 1)[0]
+    return datamatrix.cut_crypto_tail(code)
 
 
 def normalize_sscc(value: Any, field_name: str = "SSCC") -> str:
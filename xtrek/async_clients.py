@@ -0,0 +1,318 @@
+#
+#       Асинхронные клиенты СУЗ и True API (asyncio + httpx)
+#
+import os
+import re
+import asyncio
+import inspect
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, TypeVar
+from urllib.parse import quote
+
+try:
+    import httpx
+    HAS_HTTPX = True
+except ImportError:
+    httpx = None
+    HAS_HTTPX = False
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_MAX_CONCURRENCY = 50
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_TIMEOUT = 30.0
+
+if HAS_HTTPX:
+    _NETWORK_ERRORS = (httpx.TimeoutException, httpx.NetworkError)
+else:
+    _NETWORK_ERRORS = (ConnectionError, TimeoutError)
+
+
+async def gather_limited(func: Callable[[Any], Awaitable[T]], items: Iterable[Any],
+                         limit: int = DEFAULT_MAX_CONCURRENCY,
+                         return_exceptions: bool = False) -> List[T]:
+    """
+    Выполняет func(item) для всех items, одновременно не более limit вызовов.
+    Результаты возвращаются в порядке items.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(item):
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=return_exceptions)
+
+
+class _AsyncClient:
+    """
+    Общая часть асинхронных клиентов: пул соединений httpx.AsyncClient,
+    семафор на количество одновременных запросов и обновление токена при
+    ответе 401/403 (один раз на всех ожидающих корутин).
+    """
+
+    def __init__(self, token_refresher=None, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS, timeout: float = DEFAULT_TIMEOUT,
+                 client=None):
+        self.token_refresher = token_refresher
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._refresh_lock = asyncio.Lock()
+        self._owns_client = client is None
+        if client is None:
+            if not HAS_HTTPX:
+                raise ImportError("Для асинхронных клиентов установите httpx: pip install xtrek[async]")
+            client = httpx.AsyncClient(
+                verify=False,
+                timeout=timeout,
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                ),
+            )
+        self._client = client
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._owns_client:
+            await self._client.aclose()
+
+    # Переопределяется в наследниках
+    def _headers(self) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def _set_token(self, token: str) -> None:
+        self.token = token
+
+    async def _refresh_token(self, used_token: str) -> None:
+        async with self._refresh_lock:
+            # Токен уже обновила другая корутина, пока эта ждала блокировку
+            if self.token != used_token:
+                return
+            if inspect.iscoroutinefunction(self.token_refresher):
+                token = await self.token_refresher()
+            else:
+                # Обновление читает S3/файлы - не блокируем цикл событий
+                token = await asyncio.to_thread(self.token_refresher)
+            self._set_token(token)
+
+    async def _request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None, **kwargs):
+        async with self._semaphore:
+            used_token = self.token
+            response = await self._client.request(method, url, headers={**self._headers(), **(headers or {})},
+                                                  **kwargs)
+            if response.status_code in (401, 403) and self.token_refresher:
+                await self._refresh_token(used_token)
+                response = await self._client.request(method, url, headers={**self._headers(), **(headers or {})},
+                                                      **kwargs)
+            return response
+
+
+class AsyncSUZ(_AsyncClient):
+    """Асинхронный вариант xtrek.suz.SUZ с теми же методами и результатами."""
+
+    def __init__(self, token: str = None, omsId: str = None, clientToken: str = None, token_refresher=None,
+                 **client_options):
+        self.token = token or os.getenv('HONEST_SIGN_TOKEN')
+        if not self.token:
+            raise ValueError("Токен не найден")
+        self.omsId = omsId or os.getenv('OMSID')
+        if not self.omsId:
+            raise ValueError("omsId не найден")
+        self.clientToken = clientToken or os.getenv('CLIENT_TOKEN')
+        if not self.clientToken:
+            raise ValueError("clientToken не найден")
+        self.base_url = "https://suzgrid.crpt.ru"
+        super().__init__(token_refresher=token_refresher, **client_options)
+
+    def _headers(self):
+        return {"clientToken": f"{self.token or self.clientToken}", "Accept": "application/json"}
+
+    async def _get(self, url, params=None):
+        response = await self._request("GET", url, params=params)
+        if response.status_code != 200:
+            logger.error(f"GET {url} failed. Status: {response.status_code}, Body: {response.text}")
+        response.raise_for_status()
+        return response.json()
+
+    async def order_list(self):
+        return await self._get(f"{self.base_url}/api/v3/order/list?omsId={self.omsId}")
+
+    async def order_status(self, orderId: str, gtin: str):
+        return await self._get(
+            f"{self.base_url}/api/v3/order/status?omsId={self.omsId}&orderId={orderId}&gtin={gtin}"
+        )
+
+    async def codes(self, orderId: str, quantity: int, gtin: str):
+        return await self._get(
+            f"{self.base_url}/api/v3/codes?omsId={self.omsId}&orderId={orderId}&quantity={quantity}&gtin={gtin}"
+        )
+
+    async def order_codes_retry(self, blockId: str):
+        return await self._get(f"{self.base_url}/api/v3/order/codes/retry?omsId={self.omsId}&blockId={blockId}")
+
+    async def order_codes_blocks(self, orderId: str, gtin: str):
+        return await self._get(
+            f"{self.base_url}/api/v3/order/codes/blocks?omsId={self.omsId}&orderId={orderId}&gtin={gtin}"
+        )
+
+    async def providers(self):
+        return await self._get(f"{self.base_url}/api/v3/providers?omsId={self.omsId}")
+
+    async def report_info(self, reportId: str):
+        return await self._get(f"{self.base_url}/api/v3/report/info?omsId={self.omsId}&reportId={reportId}")
+
+    async def utilisation_reports_list(self, orderId: str, limit: int = None, skip: int = None):
+        params = {}
+        if limit: params["limit"] = limit
+        if skip: params["skip"] = skip
+        return await self._get(f"{self.base_url}/api/v3/quality?omsId={self.omsId}&orderId={orderId}",
+                               params=params)
+
+    async def utilisation_codes(self, reportId: str):
+        return await self._get(f"{self.base_url}/api/v3/utilisation/codes?omsId={self.omsId}&reportId={reportId}")
+
+    async def _send_signed_request(self, url: str, body_file: str, signature_file: str, max_retries: int = 3):
+        """Подписанный POST в СУЗ с повторами при 503 и сетевых ошибках."""
+        if not os.path.exists(body_file):
+            raise FileNotFoundError(f"Файл с телом запроса не найден: {body_file}")
+        if not os.path.exists(signature_file):
+            raise FileNotFoundError(f"Файл с подписью не найден: {signature_file}")
+
+        with open(body_file, 'rb') as f:
+            body_bytes = f.read()
+        with open(signature_file, 'r', encoding='utf-8') as f:
+            signature = re.sub(r'\s+', '', f.read().strip())
+        if not signature:
+            raise ValueError("Подпись не может быть пустой")
+
+        headers = {"Content-Type": "application/json; charset=utf-8", "X-Signature": signature}
+        for attempt in range(max_retries):
+            try:
+                response = await self._request("POST", url, headers=headers, content=body_bytes)
+            except _NETWORK_ERRORS as e:
+                if attempt < max_retries - 1:
+                    logger.warning(f"Ошибка сети: {e}. Повтор через 5 секунд...")
+                    await asyncio.sleep(5)
+                    continue
+                raise
+            if response.status_code == 503 and attempt < max_retries - 1:
+                wait_time = (attempt + 1) * 5
+                logger.warning(f"Сервис недоступен (503). Повтор через {wait_time} секунд...")
+                await asyncio.sleep(wait_time)
+                continue
+            return response
+        return None
+
+    async def utilisation_send(self, body_file: str, signature_file: str, max_retries: int = 3,
+                               orderId: str = None) -> str:
+        """Отправить отчёт о нанесении КМ (Метод 4.4.11)."""
+        url = f"{self.base_url}/api/v3/utilisation?omsId={self.omsId}"
+        if orderId:
+            url += f"&orderId={quote(orderId)}"
+        try:
+            response = await self._send_signed_request(url, body_file, signature_file, max_retries)
+        except Exception as e:
+            logger.error(f"Ошибка при отправке отчета о нанесении: {e}")
+            return str(e)
+        if response is None:
+            return ""
+        if response.status_code != 200:
+            logger.error(f"Ошибка при отправке отчета о нанесении: {response.status_code}")
+            return response.text
+        return response.json().get('reportId', '')
+
+
+class AsyncHonestSignAPI(_AsyncClient):
+    """Асинхронный вариант xtrek.trueapi.HonestSignAPI с теми же методами и результатами."""
+
+    def __init__(self, token: str = None, omsId: str = None, clientToken: str = None, host: str = None,
+                 token_refresher=None, **client_options):
+        self.token = token or os.getenv('HONEST_SIGN_TOKEN')
+        if not self.token:
+            raise ValueError("Токен не найден")
+        self.omsId = omsId or os.getenv('OMSID')
+        self.clientToken = clientToken or os.getenv('CLIENT_TOKEN')
+        self.host = host or os.getenv('TRUE_API_HOST', "https://markirovka.crpt.ru")
+        super().__init__(token_refresher=token_refresher, **client_options)
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.token}",
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        }
+
+    async def get_balance_all(self) -> List[Dict[str, Any]]:
+        url = f"{self.host}/api/v3/true-api/elk/product-groups/balance/all"
+        try:
+            response = await self._request("GET", url)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.error(f"Ошибка при получении баланса: {e}")
+            return []
+
+    async def get_single_cis_info(self, code: str) -> Dict[str, Any]:
+        url = f"{self.host}/api/v3/true-api/cises/info"
+        try:
+            response = await self._request("POST", url, json=[code])
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.warning(f"Ошибка при запросе информации о коде {code}: {e}")
+            return {"code": code, "error": str(e)}
+
+    async def get_list_cis_info(self, code: List) -> Dict[str, Any]:
+        url = f"{self.host}/api/v3/true-api/cises/info"
+        try:
+            response = await self._request("POST", url, json=code)
+            if response.status_code == 404:
+                # Если ни один код не найден, API может вернуть 404
+                return []
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.warning(f"Ошибка при запросе информации о {len(code)} кодах: {e}")
+            return {"code": code, "error": str(e)}
+
+    async def documents_create(self, wrapped_document_json: str, pg: str) -> Dict[str, Any]:
+        """Отправка документа в ЛК ЧЗ (/api/v3/true-api/lk/documents/create)."""
+        url = f"{self.host}/api/v3/true-api/lk/documents/create"
+        try:
+            response = await self._request(
+                "POST", url, params={"pg": pg}, content=wrapped_document_json.encode('utf-8'),
+            )
+            if response.status_code >= 400:
+                logger.error(f"Ошибка API (Status {response.status_code}): {response.text}")
+                return {"error": response.text, "status_code": response.status_code}
+            try:
+                return response.json()
+            except ValueError:
+                # Если сервер вернул ID документа просто строкой (бывает в True API)
+                return {"document_id": response.text.strip('"')}
+        except Exception as e:
+            logger.error(f"Ошибка при отправке документа: {e}")
+            return {"error": str(e)}
+
+    async def doc(self, doc_id: str, body: bool = False, content: bool = False, pg: str = None) -> Dict[str, Any]:
+        """Информация о документе (/api/v4/true-api/doc/{docId}/info)."""
+        url = f"{self.host}/api/v4/true-api/doc/{doc_id}/info"
+        params = {"body": str(body).lower(), "content": str(content).lower()}
+        if pg:
+            params["pg"] = pg
+        try:
+            response = await self._request("GET", url, params=params)
+            if response.status_code >= 400:
+                logger.error(f"Ошибка API (Status {response.status_code}): {response.text}")
+                return {"error": response.text, "status_code": response.status_code}
+            return response.json()
+        except Exception as e:
+            logger.error(f"Ошибка при получении информации о документе: {e}")
+            return {"error": str(e)}
@@ -0,0 +1,195 @@
+import json
+import time
+import sqlite3
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Ограничение SQLite на количество параметров в одном запросе (999 в старых сборках)
+_SQL_CHUNK = 500
+
+
+def _chunks(items: List[Any], size: int) -> Iterable[List[Any]]:
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+class SqliteCache:
+    """
+    Общий для процессов кеш ключ -> JSON-значение на SQLite (WAL).
+
+    Каждая запись хранится отдельной строкой с собственным сроком жизни,
+    поэтому параллельные воркеры не перезаписывают чужие данные. Значение
+    None допустимо и означает отрицательный результат (например, карточка
+    не найдена) - такие записи обычно сохраняются с более коротким TTL.
+    """
+
+    def __init__(self, path, namespace: str = "default", max_entries: Optional[int] = None,
+                 timeout: float = 30.0):
+        self.path = Path(str(path)).expanduser()
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT,"
+                " expires_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_expires ON entries (namespace, expires_at)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_updated ON entries (namespace, updated_at)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Отдельное соединение на операцию: объект безопасно делить между
+        # потоками, а блокировки разрешает сам SQLite (busy timeout).
+        conn = sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None)
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return conn
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Возвращает только свежие записи. Отсутствующий ключ - промах кеша."""
+        keys = list(dict.fromkeys(str(k) for k in keys))
+        if not keys:
+            return {}
+        now = time.time()
+        result = {}
+        conn = self._connect()
+        try:
+            for chunk in _chunks(keys, _SQL_CHUNK):
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, value FROM entries WHERE namespace = ? AND expires_at > ? "
+                    f"AND key IN ({placeholders})",
+                    [self.namespace, now, *chunk],
+                )
+                for key, value in rows:
+                    result[key] = json.loads(value) if value is not None else None
+        finally:
+            conn.close()
+        return result
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.get_many([key]).get(str(key), default)
+
+    def contains(self, key: str) -> bool:
+        return str(key) in self.get_many([key])
+
+    def set_many(self, items: Dict[str, Any], ttl_seconds: float) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (
+                self.namespace,
+                str(key),
+                json.dumps(value, ensure_ascii=False) if value is not None else None,
+                now + ttl_seconds,
+                now,
+            )
+            for key, value in items.items()
+        ]
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            if self.max_entries:
+                self._enforce_cap(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def set(self, key: str, value: Any, ttl_seconds: float) -> None:
+        self.set_many({key: value}, ttl_seconds)
+
+    def add(self, key: str, value: Any, ttl_seconds: float) -> bool:
+        """
+        Атомарно добавляет запись, если свежей записи с таким ключом нет.
+        Возвращает False, если ключ уже занят (например, другим процессом).
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT 1 FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (self.namespace, str(key), now),
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        self.namespace,
+                        str(key),
+                        json.dumps(value, ensure_ascii=False) if value is not None else None,
+                        now + ttl_seconds,
+                        now,
+                    ),
+                )
+                if self.max_entries:
+                    self._enforce_cap(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return row is None
+
+    def delete(self, key: str) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, str(key)))
+        finally:
+            conn.close()
+
+    def purge_expired(self) -> int:
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND expires_at <= ?",
+                (self.namespace, time.time()),
+            )
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def _enforce_cap(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(
+            "DELETE FROM entries WHERE namespace = ? AND expires_at <= ?",
+            (self.namespace, now),
+        )
+        (count,) = conn.execute(
+            "SELECT COUNT(*) FROM entries WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            # Вытесняем самые давно обновленные записи
+            conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key IN ("
+                " SELECT key FROM entries WHERE namespace = ? ORDER BY updated_at ASC LIMIT ?)",
+                (self.namespace, self.namespace, excess),
+            )
+            logger.debug(f"Кеш {self.path} ({self.namespace}): вытеснено записей {excess}")
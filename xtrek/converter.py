@@ -21,6 +21,12 @@ import argparse
 import sys
 import os
 
+try:
+    from .datamatrix import cut_crypto_tail
+except ImportError:
+    # Запуск файла как скрипта
+    from datamatrix import cut_crypto_tail
+
 def transform_aggregation(input_path, output_path, inn_value):
     # 1. Проверка физического наличия файла
     if not os.path.exists(input_path):
@@ -41,7 +47,7 @@ def transform_aggregation(input_path, output_path, inn_value):
             # Очистка кодов маркировки от криптохвостов (все после разделителя GS1)
             # Для агрегации в ЧЗ передается только GTIN + Серийный номер
             clean_codes = [
-                code.split('\u001d')[0] for code in box.get('productNumbersFull', [])
+                cut_crypto_tail(code) for code in box.get('productNumbersFull', [])
             ]
 
             unit = {
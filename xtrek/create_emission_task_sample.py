@@ -6,9 +6,10 @@ import argparse
 import uuid
 import logging
 import inspect
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, datetime, timedelta
 from pathlib import Path
-from urllib.parse import urlparse
+from urllib.parse import unquote, urlparse
 
 import base64
 from .suz_api_models import (
@@ -38,9 +39,20 @@ from .aggregation_builder import (
     extract_full_product_codes,
     get_equipment_report_version,
     iter_equipment_report_pallets,
+    normalize_equipment_report,
     normalize_sscc,
 )
 from .SSCC_Utils import get_sscc_from_service
+from .utils import report_etag
+from . import datamatrix
+from .sscc_pool import get_sscc_pool
+from .document_chunking import (
+    chunking_workers,
+    combine_part_states,
+    document_limits,
+    part_task_id,
+    split_document,
+)
 
 # ---------------------------------------------------------------------------
 # Изменения 2026-07-09: поддержка linked GTIN и работы через субаккаунты.
@@ -72,7 +84,7 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 
-def _load_existing_document_receipt(storage, receipt_path):
+def _load_existing_document_receipt(storage, receipt_path, id_field="document_id"):
     if not storage.exists(receipt_path):
         return None
 
@@ -84,9 +96,9 @@ def _load_existing_document_receipt(storage, receipt_path):
             "Повторная отправка заблокирована."
         ) from exc
 
-    if not isinstance(receipt, dict) or not receipt.get("document_id"):
+    if not isinstance(receipt, dict) or not receipt.get(id_field):
         raise RuntimeError(
-            f"[!] В существующем чеке нет document_id: {receipt_path}. "
+            f"[!] В существующем чеке нет {id_field}: {receipt_path}. "
             "Повторная отправка заблокирована."
         )
     return receipt
@@ -110,17 +122,23 @@ def _document_submission_lock_path(receipts_path, operation, task_id):
     )
 
 
-def _claim_document_submission(receipts_path, s3_config, operation, task_id):
+def _claim_document_submission(receipts_path, s3_config, operation, task_id,
+                               id_field="document_id"):
+    """
+    Захватывает отправку документа: возвращает уже сохраненный чек или
+    берет lock отправки. id_field - поле идентификатора документа в чеке
+    (document_id для ЧЗ, orderId/reportId для СУЗ).
+    """
     storage = get_storage(receipts_path, s3_config)
     receipt_path = f"{str(receipts_path).rstrip('/')}/{task_id}.json"
-    existing_receipt = _load_existing_document_receipt(storage, receipt_path)
+    existing_receipt = _load_existing_document_receipt(storage, receipt_path, id_field)
     if existing_receipt is not None:
         logger.info(
             "[IDEMPOTENCY] %s для %s уже отправлен как %s; повторная "
             "отправка пропущена.",
             operation,
             task_id,
-            existing_receipt["document_id"],
+            existing_receipt[id_field],
         )
         return existing_receipt, storage, receipt_path, None
 
@@ -135,14 +153,14 @@ def _claim_document_submission(receipts_path, s3_config, operation, task_id):
         ensure_ascii=False,
     )
     if not storage.acquire_lock(lock_path, lock_content):
-        existing_receipt = _load_existing_document_receipt(storage, receipt_path)
+        existing_receipt = _load_existing_document_receipt(storage, receipt_path, id_field)
         if existing_receipt is not None:
             logger.info(
                 "[IDEMPOTENCY] %s для %s завершен другим воркером как %s; "
                 "повторная отправка пропущена.",
                 operation,
                 task_id,
-                existing_receipt["document_id"],
+                existing_receipt[id_field],
             )
             return existing_receipt, storage, receipt_path, None
         raise RuntimeError(
@@ -151,7 +169,7 @@ def _claim_document_submission(receipts_path, s3_config, operation, task_id):
         )
 
     try:
-        existing_receipt = _load_existing_document_receipt(storage, receipt_path)
+        existing_receipt = _load_existing_document_receipt(storage, receipt_path, id_field)
     except Exception:
         storage.release_lock(lock_path)
         raise
@@ -162,7 +180,7 @@ def _claim_document_submission(receipts_path, s3_config, operation, task_id):
             "повторная отправка пропущена.",
             operation,
             task_id,
-            existing_receipt["document_id"],
+            existing_receipt[id_field],
         )
         return existing_receipt, storage, receipt_path, None
 
@@ -182,6 +200,199 @@ def _release_document_submission_lock(storage, lock_path):
         )
 
 
+class SignaturePending(RuntimeError):
+    """
+    Документ выложен на подпись, но файла подписи еще нет. Тело документа
+    остается в корзине подписи, отправку нужно повторить после появления .sig.
+    """
+
+    def __init__(self, operation, task_id, body_path, signature_path):
+        super().__init__(
+            f"[SIGN] {operation} для {task_id} ожидает подпись {signature_path}"
+        )
+        self.operation = operation
+        self.task_id = str(task_id)
+        self.body_path = body_path
+        self.signature_path = signature_path
+
+
+def _signing_unique_id(operation, task_id):
+    # Имя файла на подпись стабильно для документа: повторная попытка находит
+    # уже выложенное тело и готовую подпись, а не создает новую пару файлов.
+    return uuid.uuid5(uuid.NAMESPACE_URL, f"xtrek-signing/{operation}/{task_id}")
+
+
+def _stage_signing_body(storage_sign, remote_body_path, remote_signature_path, body_text):
+    """Выкладывает тело документа на подпись, если его там нет или оно изменилось."""
+    if not storage_sign.exists(remote_body_path):
+        storage_sign.write_text(remote_body_path, body_text)
+    elif storage_sign.read_text(remote_body_path) != body_text:
+        # Документ изменился с прошлой попытки - старая подпись к нему не подходит
+        if storage_sign.exists(remote_signature_path):
+            storage_sign.delete(remote_signature_path)
+        storage_sign.write_text(remote_body_path, body_text)
+
+
+def _await_signature(storage_sign, remote_body_path, remote_signature_path, body_text,
+                     timeout, wait, operation, task_id, on_timeout=None):
+    """
+    Выкладывает тело документа на подпись и проверяет готовность подписи.
+
+    wait=False - первая фаза двухфазной подписи: поток не ждет, при отсутствии
+    подписи бросается SignaturePending. wait=True - прежнее ожидание в цикле
+    не дольше timeout секунд.
+
+    Пока подпись не готова, тело остается в корзине подписи: вызывающий код
+    не удаляет его при SignaturePending, и повторная попытка находит ту же
+    пару файлов.
+    """
+    _stage_signing_body(storage_sign, remote_body_path, remote_signature_path, body_text)
+
+    if not wait:
+        if not storage_sign.exists(remote_signature_path):
+            logger.info(f"[*] {operation} {task_id} выложен на подпись: {remote_body_path}")
+            raise SignaturePending(operation, task_id, remote_body_path, remote_signature_path)
+        logger.info("[+] Подпись обнаружена в хранилище!")
+        return
+
+    logger.info(f"[*] Ожидание подписи для {remote_body_path}...")
+    start_time = time.time()
+    while not storage_sign.exists(remote_signature_path):
+        if time.time() - start_time > timeout:
+            if on_timeout:
+                on_timeout()
+            raise RuntimeError(
+                f"[!] Таймаут ({timeout}с): Файл подписи {remote_signature_path} не найден."
+            )
+        time.sleep(2)
+
+    time.sleep(0.5)
+    logger.info("[+] Подпись обнаружена в хранилище!")
+
+
+def _document_parts_receipts_path(receipts_path, operation):
+    """Папка чеков частей документа - рядом с папкой чеков, вне маршрутов S3."""
+    if str(receipts_path).startswith("s3://"):
+        parsed = urlparse(str(receipts_path))
+        return f"s3://{parsed.netloc}/documentParts/{operation}"
+    return str(Path(receipts_path).parent / "documentParts" / operation)
+
+
+def _send_document_parts(operation, task_id, parts, tasks_path, receipts_path, s3_config,
+                         send_part, max_workers, stage_part=None):
+    """
+    Отправляет части документа параллельно: send_part(part_id, parts_receipts_path)
+    подписывает и отправляет одну часть обычной функцией отправки. Части с
+    чеком повторно не отправляются. Если часть ждет подпись, SignaturePending
+    бросается после того, как на подпись выложены все части.
+    stage_part(part_id, part_text) - выкладывает тело части на подпись: все
+    неотправленные части выкладываются одним проходом до начала отправки, и
+    подписант получает их сразу, а не по мере освобождения потоков.
+    Возвращает чеки частей в порядке частей.
+    """
+    tasks_storage = get_storage(tasks_path, s3_config)
+    parts_receipts_path = _document_parts_receipts_path(receipts_path, operation)
+    receipts_storage = get_storage(parts_receipts_path, s3_config)
+
+    part_ids = []
+    part_paths = {}
+    for index, part in enumerate(parts, start=1):
+        part_id = part_task_id(task_id, index)
+        part_ids.append(part_id)
+        part_path = f"{tasks_path.rstrip('/')}/{part_id}.json"
+        part_paths[part_id] = part_path
+        if not tasks_storage.exists(part_path):
+            tasks_storage.write_text(part_path, json.dumps(part, ensure_ascii=False))
+
+    def receipt_path(part_id):
+        return f"{parts_receipts_path}/{part_id}.json"
+
+    todo = [part_id for part_id in part_ids if not receipts_storage.exists(receipt_path(part_id))]
+    logger.info(
+        f"[CHUNK] {operation} {task_id}: частей {len(parts)}, к отправке {len(todo)}"
+    )
+    if stage_part and todo:
+        for part_id in todo:
+            stage_part(part_id, tasks_storage.read_text(part_paths[part_id]))
+        logger.info(f"[SIGN] {operation} {task_id}: на подпись выложено частей {len(todo)}")
+    pending, errors = [], []
+    if todo:
+        # Функции отправки удаляют общую temp_signing, когда она пуста. Пока
+        # части отправляются параллельно, метка не дает удалить папку у
+        # соседнего потока между mkdir и записью тела.
+        local_dir = Path("temp_signing")
+        local_dir.mkdir(exist_ok=True)
+        guard = local_dir / f".parts-{uuid.uuid4()}"
+        guard.touch()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(todo)))) as pool:
+                futures = {pool.submit(send_part, part_id, parts_receipts_path): part_id for part_id in todo}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except SignaturePending as e:
+                        pending.append(e)
+                    except Exception as e:
+                        errors.append((futures[future], e))
+        finally:
+            guard.unlink()
+            try:
+                if not any(local_dir.iterdir()):
+                    local_dir.rmdir()
+            except OSError:
+                pass
+
+    if errors:
+        part_id, error = sorted(errors, key=lambda item: item[0])[0]
+        raise RuntimeError(
+            f"[CHUNK] {operation} {task_id}: не отправлено частей {len(errors)} "
+            f"из {len(parts)}, {part_id}: {error}"
+        )
+    if pending:
+        raise sorted(pending, key=lambda e: e.task_id)[0]
+
+    return [
+        {"partId": part_id, **json.loads(receipts_storage.read_text(receipt_path(part_id)))}
+        for part_id in part_ids
+    ]
+
+
+def _parts_receipt(part_receipts, **fields):
+    """Сводный чек документа из частей: поля первой части и список всех частей."""
+    receipt = {k: v for k, v in part_receipts[0].items() if k != "partId"}
+    receipt.update(fields)
+    receipt["parts"] = part_receipts
+    return receipt
+
+
+def _true_api_document_status(api, receipt_data, group):
+    """
+    Статус документа True API по чеку. Для документа из частей запрашиваются
+    все части, статус CHECKED_OK выставляется, только если он у всех частей.
+    """
+    parts = receipt_data.get("parts")
+    if not parts:
+        return api.doc(receipt_data.get("document_id"), pg=group)
+
+    part_statuses = []
+    for part in parts:
+        status_res = api.doc(part.get("document_id"), pg=group)
+        if not status_res or (isinstance(status_res, dict) and "error" in status_res):
+            return status_res
+        target = status_res[0] if isinstance(status_res, list) else status_res
+        part_statuses.append(target)
+
+    combined = dict(part_statuses[0])
+    combined["status"] = combine_part_states(
+        [status.get("status") for status in part_statuses], "CHECKED_OK"
+    )
+    combined["parts"] = [
+        {"partId": part.get("partId"), "document_id": part.get("document_id"), "status": status.get("status")}
+        for part, status in zip(parts, part_statuses)
+    ]
+    return combined
+
+
 def _vbg_diagnostics_enabled(config):
     value = os.getenv("XTREK_VBG_DIAGNOSTICS")
     if value is not None:
@@ -209,15 +420,106 @@ def _log_vbg_gtin_diagnostics(gtin):
     )
 
 
-def create_virtual_tasks_from_equipment_report(production_order_id: str):
+class EquipmentReportContext:
+    """
+    Отчет оборудования в рамках одного события. Задание оборудования и отчет
+    по ссылке task-export-signed-link находятся один раз, каждый файл читается
+    и разбирается один раз, каноническая форма (normalize_equipment_report)
+    строится по требованию. Этапы цепочки logic_start_equipment_reports
+    получают контекст параметром report_context. Прочитанные документы общие
+    для всех этапов, изменять их нельзя.
+    """
+
+    def __init__(self, production_order_id, config=None):
+        name = str(production_order_id)
+        self.production_order_id = name[:-5] if name.lower().endswith('.json') else name
+        self._config = config
+        self._documents = {}
+        self._etags = {}
+        self._report_path = None
+        self._canonical = None
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = load_config('suz_worker_config')
+        return self._config
+
+    def _config_path(self, key):
+        path = self.config.get(key)
+        if not path:
+            raise ValueError(f"В конфигурации отсутствует {key}")
+        return path.rstrip('/')
+
+    def exists(self, path, root=None):
+        if path in self._documents:
+            return True
+        return get_storage(root or path, self.config.get('s3_config')).exists(path)
+
+    def read_json(self, path, root=None):
+        """
+        Документ по пути: одно чтение и один json.loads на контекст.
+        root - папка, для которой создается хранилище (как в get_storage).
+        """
+        if path not in self._documents:
+            storage = get_storage(root or path, self.config.get('s3_config'))
+            content = storage.read_text(path)
+            self._etags[path] = report_etag(content)
+            self._documents[path] = json.loads(content)
+        return self._documents[path]
+
+    def etag(self, path):
+        """ETag прочитанного документа (MD5 содержимого)."""
+        self.read_json(path)
+        return self._etags[path]
+
+    @property
+    def task_path(self):
+        return f"{self._config_path('equipment-tasks')}/{self.production_order_id}.json"
+
+    def task(self):
+        task_path = self.task_path
+        tasks_root = self.config.get('equipment-tasks')
+        if not self.exists(task_path, tasks_root):
+            raise FileNotFoundError(f"Задание на оборудование не найдено: {task_path}")
+        return self.read_json(task_path, tasks_root)
+
+    @property
+    def report_path(self):
+        if self._report_path is None:
+            task_data = self.task()
+            signed_link = task_data.get('task-export-signed-link') or task_data.get('task_export_signed_link')
+            if not signed_link:
+                raise ValueError(
+                    f"В задании {self.production_order_id} не найден ключ task-export-signed-link"
+                )
+            report_filename = unquote(os.path.basename(urlparse(signed_link).path))
+            if not report_filename:
+                raise ValueError(f"Не удалось извлечь имя файла из ссылки: {signed_link}")
+            self._report_path = f"{self._config_path('equipment-reports')}/{report_filename}"
+        return self._report_path
+
+    def report(self):
+        report_path = self.report_path
+        reports_root = self.config.get('equipment-reports')
+        if not self.exists(report_path, reports_root):
+            raise FileNotFoundError(f"Отчет оборудования не найден: {report_path}")
+        return self.read_json(report_path, reports_root)
+
+    def canonical_report(self):
+        if self._canonical is None:
+            self._canonical = normalize_equipment_report(self.report())
+        return self._canonical
+
+
+def create_virtual_tasks_from_equipment_report(production_order_id: str, report_context=None):
     """
     Обертка для create_virtual_production_tasks, которая берет количество из отчета оборудования.
     Находит отчет в два этапа: через задание на оборудование и ссылку в нем.
+    report_context - EquipmentReportContext события, если отчет уже прочитан.
     """
     try:
-        from urllib.parse import urlparse, unquote
         config = load_config('suz_worker_config')
-        s3_config = config.get('s3_config')
         equipment_tasks_path = config.get('equipment-tasks')
         equipment_reports_path = config.get('equipment-reports')
 
@@ -225,41 +527,8 @@ def create_virtual_tasks_from_equipment_report(production_order_id: str):
             logger.error("[!] В конфигурации отсутствуют пути equipment-tasks или equipment-reports")
             raise ValueError("Missing equipment paths in config")
 
-        # 1. Сначала находим задание на оборудование
-        storage_tasks = get_storage(equipment_tasks_path, s3_config)
-        task_path = f"{equipment_tasks_path.rstrip('/')}/{production_order_id}.json"
-
-        if not storage_tasks.exists(task_path):
-            logger.error(f"[!] Задание на оборудование не найдено: {task_path}")
-            raise FileNotFoundError(f"Equipment task {task_path} not found")
-
-        task_content = storage_tasks.read_text(task_path)
-        task_data = json.loads(task_content)
-
-        # По ключу task-export-signed-link получаем ссылку
-        signed_link = task_data.get('task-export-signed-link') or task_data.get('task_export_signed_link')
-        if not signed_link:
-            logger.error(f"[!] В задании {production_order_id} не найден ключ task-export-signed-link")
-            raise ValueError(f"Missing task-export-signed-link in task {production_order_id}")
-
-        # Распарсить ссылку и получить ключ (имя файла)
-        parsed_url = urlparse(signed_link)
-        report_filename = unquote(os.path.basename(parsed_url.path))
-
-        if not report_filename:
-             logger.error(f"[!] Не удалось извлечь имя файла из ссылки: {signed_link}")
-             raise ValueError(f"Could not parse report filename from link {signed_link}")
-
-        # 2. Получаем отчет оборудования по извлеченному имени файла
-        storage_reports = get_storage(equipment_reports_path, s3_config)
-        report_path = f"{equipment_reports_path.rstrip('/')}/{report_filename}"
-
-        if not storage_reports.exists(report_path):
-            logger.error(f"[!] Отчет оборудования не найден: {report_path}")
-            raise FileNotFoundError(f"Equipment report {report_path} not found")
-
-        content = storage_reports.read_text(report_path)
-        report_data = json.loads(content)
+        report_context = report_context or EquipmentReportContext(production_order_id, config)
+        report_data = report_context.report()
 
         total_qty = 0
         ready_boxes = report_data.get('readyBox', [])
@@ -788,10 +1057,16 @@ def create_emission_task(production_order_id: str, group: str, contact: str):
         return None
 
 def sign_and_send_emission(production_order_id: str, signing_dir: str, timeout: int,
-                  oms_id: str = None, client_token: str = None):
+                  oms_id: str = None, client_token: str = None, wait_signature: bool = True):
     """
-    Загружает заказ из S3, подписывает его через файловый обмен и отправляет в СУЗ
+    Загружает заказ из S3, подписывает его через файловый обмен и отправляет в СУЗ.
+    При wait_signature=False не ждет подпись, а бросает SignaturePending.
+    Заказ с сохраненным чеком повторно не отправляется.
     """
+    submission_storage = None
+    submission_lock_path = None
+    submission_ambiguous = False
+    accepted_not_persisted = False
     try:
         config = load_config('suz_worker_config')
         s3_config = config.get('s3_config')
@@ -808,6 +1083,21 @@ def sign_and_send_emission(production_order_id: str, signing_dir: str, timeout:
         if not all([emission_orders_path, emission_receipts_path]):
             raise RuntimeError("[!] В конфигурации отсутствуют необходимые пути (emission_orders_path, emission_receipts)")
 
+        (
+            existing_receipt,
+            submission_storage,
+            remote_receipt_path,
+            submission_lock_path,
+        ) = _claim_document_submission(
+            emission_receipts_path,
+            s3_config,
+            "emission",
+            production_order_id,
+            id_field="orderId",
+        )
+        if existing_receipt is not None:
+            return existing_receipt
+
         storage_orders = get_storage(emission_orders_path, s3_config)
         order_path = f"{emission_orders_path.rstrip('/')}/{production_order_id}.json"
 
@@ -882,7 +1172,7 @@ def sign_and_send_emission(production_order_id: str, signing_dir: str, timeout:
 
         # 2. Подготовка к подписи
         storage_sign = get_storage(signing_dir, s3_config)
-        unique_id = uuid.uuid4()
+        unique_id = _signing_unique_id("emission", production_order_id)
         body_filename = f"{inn}_{unique_id}_order.json"
         signature_filename = f"{body_filename}.sig"
 
@@ -895,26 +1185,20 @@ def sign_and_send_emission(production_order_id: str, signing_dir: str, timeout:
         local_body_path = local_dir / body_filename
         local_signature_path = local_dir / signature_filename
 
+        keep_signing_body = False
         try:
             # СУЗ требует компактный JSON без пробелов между ключами.
             body_json = json.dumps(order_data, separators=(',', ':'))
-            storage_sign.write_text(remote_body_path, body_json)
 
             # Также сохраняем локально для SUZ API
             with open(local_body_path, "w", encoding="utf-8") as f:
                 f.write(body_json)
 
-            logger.info(f"[*] Заказ отправлен на подпись в: {remote_body_path}. Ожидание...")
-
-            start_time = time.time()
-            while not storage_sign.exists(remote_signature_path):
-                if time.time() - start_time > timeout:
-                    storage_orders.mark_error(order_path)
-                    raise RuntimeError(f"[!] Таймаут ({timeout}с): Файл подписи {signature_filename} не найден.")
-                time.sleep(2)
-
-            time.sleep(0.5)
-            logger.info("[+] Подпись обнаружена в хранилище!")
+            _await_signature(
+                storage_sign, remote_body_path, remote_signature_path, body_json,
+                timeout, wait_signature, "emission", production_order_id,
+                on_timeout=lambda: storage_orders.mark_error(order_path),
+            )
 
             # Скачиваем подпись локально для API
             storage_sign.download(remote_signature_path, str(local_signature_path))
@@ -922,26 +1206,28 @@ def sign_and_send_emission(production_order_id: str, signing_dir: str, timeout:
             # 3. Отправка в СУЗ
             suz_api = SUZ(token=token, omsId=final_oms_id, clientToken=final_client_token)
             logger.info(f"[*] Отправка заказа в СУЗ (omsId: {final_oms_id})...")
+            submission_ambiguous = True
             result = suz_api.order_create(str(local_body_path), str(local_signature_path))
+            submission_ambiguous = False
 
             # 4. Сохранение результата и обновление статуса
             if isinstance(result, EmissionOrderreceipts):
                 logger.info("[+++] Заказ успешно создан!")
+                accepted_not_persisted = True
                 storage_orders.mark_finished(order_path)
 
-                if emission_receipts_path:
-                    storage_receipts = get_storage(emission_receipts_path, s3_config)
-                    remote_receipt_path = f"{emission_receipts_path.rstrip('/')}/{production_order_id}.json"
-
-                    temp_receipt = local_dir / f"receipt_{unique_id}.json"
-                    result.productionOrderId = production_order_id
-                    with open(temp_receipt, 'w', encoding='utf-8') as f:
-                        json.dump(result.to_dict(), f, indent=4)
+                temp_receipt = local_dir / f"receipt_{unique_id}.json"
+                result.productionOrderId = production_order_id
+                with open(temp_receipt, 'w', encoding='utf-8') as f:
+                    json.dump(result.to_dict(), f, indent=4)
 
-                    logger.info(f"[*] Выгрузка чека в S3: {remote_receipt_path}")
-                    storage_receipts.upload(str(temp_receipt), remote_receipt_path)
-                    try: temp_receipt.unlink()
-                    except: pass
+                logger.info(f"[*] Выгрузка чека в S3: {remote_receipt_path}")
+                submission_storage.upload(str(temp_receipt), remote_receipt_path)
+                accepted_not_persisted = False
+                _release_document_submission_lock(submission_storage, submission_lock_path)
+                submission_lock_path = None
+                try: temp_receipt.unlink()
+                except: pass
 
                 return result
             else:
@@ -950,6 +1236,9 @@ def sign_and_send_emission(production_order_id: str, signing_dir: str, timeout:
                 storage_orders.mark_error(order_path)
                 raise RuntimeError(message)
 
+        except SignaturePending:
+            keep_signing_body = True
+            raise
         finally:
             if local_body_path.exists(): local_body_path.unlink()
             if local_signature_path.exists(): local_signature_path.unlink()
@@ -958,11 +1247,23 @@ def sign_and_send_emission(production_order_id: str, signing_dir: str, timeout:
                     local_dir.rmdir()
             except: pass
             try:
-                if storage_sign.exists(remote_body_path): storage_sign.delete(remote_body_path)
-                if storage_sign.exists(remote_signature_path): storage_sign.delete(remote_signature_path)
+                if not keep_signing_body:
+                    if storage_sign.exists(remote_body_path): storage_sign.delete(remote_body_path)
+                    if storage_sign.exists(remote_signature_path): storage_sign.delete(remote_signature_path)
             except: pass
 
     except Exception as e:
+        if (
+            submission_lock_path
+            and not submission_ambiguous
+            and not accepted_not_persisted
+        ):
+            _release_document_submission_lock(
+                submission_storage,
+                submission_lock_path,
+            )
+        if isinstance(e, SignaturePending):
+            raise
         logger.error(f"[!] Ошибка в sign_and_send_emission: {e}")
         raise
 
@@ -1068,19 +1369,27 @@ def get_emission_kodes(order_id: str):
             ),
         )
 
-        # Проверяем статус в СУЗ
-        logger.info(f"[*] Запрос актуального статуса из СУЗ для orderId: {order_id}, gtin: {gtin}")
-        try:
-            api_status_res = suz_api.order_status(order_id, gtin)
-        except Exception as api_err:
-            logger.error(f"[!] Ошибка API при запросе статуса: {api_err}")
-            return None
+        # Статус ACTIVE, только что записанный воркером, повторно в СУЗ не запрашивается
+        checked_at = status_data.get('checkedAtUnix')
+        fresh_seconds = config.get('emission_status_fresh_seconds', 60)
+        if (status_data.get('bufferStatus') == 'ACTIVE' and checked_at
+                and time.time() - checked_at <= fresh_seconds):
+            logger.info(f"[*] Используется статус заказа {order_id}, проверенный {time.time() - checked_at:.0f}с назад")
+            api_status = status_data
+        else:
+            # Проверяем статус в СУЗ
+            logger.info(f"[*] Запрос актуального статуса из СУЗ для orderId: {order_id}, gtin: {gtin}")
+            try:
+                api_status_res = suz_api.order_status(order_id, gtin)
+            except Exception as api_err:
+                logger.error(f"[!] Ошибка API при запросе статуса: {api_err}")
+                return None
 
-        if not api_status_res or not isinstance(api_status_res, list):
-            logger.error(f"[!] Некорректный ответ от API: {api_status_res}")
-            return None
+            if not api_status_res or not isinstance(api_status_res, list):
+                logger.error(f"[!] Некорректный ответ от API: {api_status_res}")
+                return None
 
-        api_status = api_status_res[0]
+            api_status = api_status_res[0]
         if api_status.get('bufferStatus') == 'EXHAUSTED':
             logger.info(f"[*] Заказ {order_id} имеет статус {api_status.get('bufferStatus')}, он уже скачен. Пропуск.")
             return api_status
@@ -1273,6 +1582,24 @@ def get_product_info_robust(nk: NK, gtin: str, rd_info: bool = False):
 
     return None
 
+def _resolve_permits_for_codes(nk: NK, codes, gtin: str, product=None):
+    """
+    Активные разрешительные документы для GTIN всех кодов задания.
+    GTIN собираются заранее и разрешаются одним пакетным запросом
+    (карточки и /rd/list); product - уже полученная карточка gtin.
+    Возвращает {gtin: [GtinDocument]}.
+    """
+    gtins = list(dict.fromkeys([gtin] + [datamatrix.gtin_of(code) or gtin for code in codes]))
+    permit_data = nk.get_active_permit_documents_by_gtins(gtins, products={gtin: product} if product else None)
+    return {
+        g: [GtinDocument(
+            certificate_number=p['number'],
+            certificate_date=p['date'],
+            certificate_type=p['type']
+        ) for p in permit_data.get(g) or []]
+        for g in gtins
+    }
+
 def format_date_suz(date_str: str) -> str:
     """Преобразует дату из dd.mm.yyyy в yyyy-MM-dd"""
     if not date_str:
@@ -1423,13 +1750,13 @@ def create_virtual_introduce_task(order_id: str, group: str, production_date: st
         logger.error(f"[!] Ошибка в create_virtual_introduce_task: {e}")
         return None
 
-def create_utilisation_task_from_report(production_order_id: str, group: str = "chemistry"):
+def create_utilisation_task_from_report(production_order_id: str, group: str = "chemistry", report_context=None):
     """
     Создает задачу на отчет о нанесении на основе отчета оборудования.
     Извлекает коды КМ из отчета оборудования и создает задачу.
+    report_context - EquipmentReportContext события, если отчет уже прочитан.
     """
     try:
-        from urllib.parse import urlparse, unquote
         config = load_config('suz_worker_config')
         s3_config = config.get('s3_config')
         equipment_tasks_path = config.get('equipment-tasks')
@@ -1441,41 +1768,18 @@ def create_utilisation_task_from_report(production_order_id: str, group: str = "
             logger.error("[!] В конфигурации отсутствуют необходимые пути (equipment-tasks, equipment-reports, production_orders_path, utilisation_tasks_path)")
             return None
 
-        # 1. Находим задание на оборудование
-        storage_tasks = get_storage(equipment_tasks_path, s3_config)
+        # 1-2. Задание на оборудование и отчет по ссылке из него
         task_filename = production_order_id if production_order_id.lower().endswith('.json') else f"{production_order_id}.json"
-        task_path = f"{equipment_tasks_path.rstrip('/')}/{task_filename}"
-
-        if not storage_tasks.exists(task_path):
-            logger.error(f"[!] Задание на оборудование не найдено: {task_path}")
-            return None
-
-        task_content = storage_tasks.read_text(task_path)
-        task_data = json.loads(task_content)
-
-        # Получаем ссылку на отчет
-        signed_link = task_data.get('task-export-signed-link') or task_data.get('task_export_signed_link')
-        if not signed_link:
-            logger.error(f"[!] В задании {production_order_id} не найден ключ task-export-signed-link")
-            return None
-
-        # Извлекаем имя файла отчета
-        parsed_url = urlparse(signed_link)
-        report_filename = unquote(os.path.basename(parsed_url.path))
-
-        # 2. Получаем отчет оборудования
-        storage_reports = get_storage(equipment_reports_path, s3_config)
-        report_path = f"{equipment_reports_path.rstrip('/')}/{report_filename}"
-
-        if not storage_reports.exists(report_path):
-            logger.error(f"[!] Отчет оборудования не найден: {report_path}")
+        report_context = report_context or EquipmentReportContext(production_order_id, config)
+        try:
+            canonical_report = report_context.canonical_report()
+        except (FileNotFoundError, ValueError) as e:
+            logger.error(f"[!] {e}")
             return None
-
-        report_content = storage_reports.read_text(report_path)
-        report_data = json.loads(report_content)
+        report_filename = os.path.basename(report_context.report_path)
 
         # Извлекаем коды
-        codes = extract_full_product_codes(report_data)
+        codes = extract_full_product_codes(canonical_report)
         if not codes:
             logger.warning(f"[*] Отчет {report_filename} не содержит кодов.")
             return None
@@ -1589,11 +1893,9 @@ def create_introduce_task_from_report(production_order_id: str, group: str = Non
             return None
 
         # 3. Определяем GTIN и дату производства
-        gtin = None
         first_code = codes[0]
-        if first_code.startswith('01'):
-            gtin = first_code[2:16]
-        else:
+        gtin = datamatrix.gtin_of(first_code)
+        if not gtin:
             logger.error(f"[!] Не удалось определить GTIN из кода: {first_code}")
             return None
 
@@ -1683,25 +1985,20 @@ def create_introduce_task_from_report(production_order_id: str, group: str = Non
             return None
 
         # Получаем разрешительные документы через специальный метод (с фильтрацией Прекращен)
-        permit_data = nk.get_active_permit_documents_by_gtin(gtin, product=f_res.get('_raw'))
-        permits = [GtinDocument(
-            certificate_number=p['number'],
-            certificate_date=p['date'],
-            certificate_type=p['type']
-        ) for p in permit_data]
-
-        if not permits:
-            logger.error(f"[!] Отсутствует разрешительная документация для GTIN {gtin}")
+        permits_by_gtin = _resolve_permits_for_codes(nk, codes, gtin, product=f_res.get('_raw'))
+        missing = [g for g, permits in permits_by_gtin.items() if not permits]
+        if missing:
+            logger.error(f"[!] Отсутствует разрешительная документация для GTIN {', '.join(missing)}")
             return None
 
         # 6. Формируем сообщение
         introduce_products = []
         for code in codes:
-            clean_code = code.split('\u001d')[0]
+            clean_code = datamatrix.cut_crypto_tail(code)
             introduce_products.append(IntroduceProduct(
                 uit_code=clean_code,
                 tnved_code=tnved,
-                certificate_document_data=permits
+                certificate_document_data=permits_by_gtin[datamatrix.gtin_of(code) or gtin]
             ))
 
         message = IntroduceMessage(
@@ -1790,9 +2087,8 @@ def create_utilisation_task(order_id: str, group: str, production_date: str = No
 
         # Определяем GTIN по первому коду (01 + 14 цифр)
         first_code = codes[0]
-        if first_code.startswith('01'):
-            gtin = first_code[2:16]
-        else:
+        gtin = datamatrix.gtin_of(first_code)
+        if not gtin:
             logger.error(f"[!] Не удалось определить GTIN из кода: {first_code}")
             return None
 
@@ -1834,16 +2130,54 @@ def create_utilisation_task(order_id: str, group: str, production_date: str = No
         logger.error(f"[!] Ошибка в create_utilisation_task: {e}")
         return None
 
+def _resolve_utilisation_inn(config, task_data, production_order_id=None):
+    """
+    ИНН участника для подписи отчета о нанесении. В linked GTIN код товара
+    может принадлежать чужой карточке, поэтому приоритетно берем participantId
+    из задачи, затем Manufacturer_inn из исходного производственного задания.
+    """
+    s3_config = config.get('s3_config')
+    inn = task_data.get('attributes', {}).get('participantId')
+    if not inn and production_order_id:
+        production_orders_path = config.get('production_orders_path')
+        if production_orders_path:
+            storage_prod = get_storage(production_orders_path, s3_config)
+            prod_path = f"{production_orders_path.rstrip('/')}/{production_order_id}.json"
+            if storage_prod.exists(prod_path):
+                prod_data = json.loads(storage_prod.read_text(prod_path))
+                inn = prod_data.get('Manufacturer_inn') or prod_data.get('PasportData', {}).get('Manufacturer_inn')
+                if inn:
+                    logger.info(f"[*] Для отчета о нанесении используем Manufacturer_inn из производственного задания: {inn}")
+    if not inn:
+        first_code = task_data['sntins'][0]
+        gtin = datamatrix.gtin_of(first_code)
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        inn = get_inn_by_gtin(gtin, db_path=os.path.join(base_path, 'gs1prefix_inn_db.json'))
+    return inn
+
+
 def sign_and_send_utilisation(order_id: str, signing_dir: str, timeout: int,
-                            oms_id: str = None, client_token: str = None):
+                            oms_id: str = None, client_token: str = None,
+                            wait_signature: bool = True, receipts_path: str = None,
+                            send_order_id: bool = True, suz_order_id: str = None):
     """
-    Загружает задачу отчета о нанесении, подписывает и отправляет в СУЗ
+    Загружает задачу отчета о нанесении, подписывает и отправляет в СУЗ.
+    При wait_signature=False не ждет подпись, а бросает SignaturePending.
+    receipts_path переопределяет папку чека, send_order_id=False не передает
+    orderId в СУЗ (сводный отчет по нескольким заказам), suz_order_id - orderId
+    для СУЗ, если он отличается от id задачи (часть документа).
+    Отчет сверх ограничений СУЗ отправляется частями. Отчет с сохраненным
+    чеком повторно не отправляется.
     """
+    submission_storage = None
+    submission_lock_path = None
+    submission_ambiguous = False
+    accepted_not_persisted = False
     try:
         config = load_config('suz_worker_config')
         s3_config = config.get('s3_config')
         utilisation_tasks_path = config.get('utilisation_tasks_path')
-        utilisation_receipts_path = config.get('utilisation_receipts')
+        utilisation_receipts_path = receipts_path or config.get('utilisation_receipts')
 
         # Переопределяем параметры подписи из конфига если они есть
         sign_path = config.get('sign')
@@ -1855,6 +2189,21 @@ def sign_and_send_utilisation(order_id: str, signing_dir: str, timeout: int,
         if not all([utilisation_tasks_path, utilisation_receipts_path]):
             raise RuntimeError("[!] В конфигурации отсутствуют пути (utilisation_tasks_path, utilisation_receipts)")
 
+        (
+            existing_receipt,
+            submission_storage,
+            remote_receipt_path,
+            submission_lock_path,
+        ) = _claim_document_submission(
+            utilisation_receipts_path,
+            s3_config,
+            "utilisation",
+            order_id,
+            id_field="reportId",
+        )
+        if existing_receipt is not None:
+            return existing_receipt["reportId"]
+
         storage_tasks = get_storage(utilisation_tasks_path, s3_config)
         task_path = f"{utilisation_tasks_path.rstrip('/')}/{order_id}.json"
 
@@ -1866,28 +2215,31 @@ def sign_and_send_utilisation(order_id: str, signing_dir: str, timeout: int,
 
         task_content = storage_tasks.read_text(task_path)
         task_data = json.loads(task_content)
+
+        parts = split_document("utilisation", task_data, document_limits(config, "utilisation"))
+        if len(parts) > 1:
+            part_receipts = _send_document_parts(
+                "utilisation", order_id, parts, utilisation_tasks_path, utilisation_receipts_path, s3_config,
+                lambda part_id, part_receipts_path: sign_and_send_utilisation(
+                    part_id, signing_dir, timeout, oms_id, client_token,
+                    wait_signature=wait_signature, receipts_path=part_receipts_path,
+                    send_order_id=send_order_id, suz_order_id=suz_order_id or order_id,
+                ),
+                chunking_workers(config),
+            )
+            receipt = _parts_receipt(
+                part_receipts, orderId=order_id, productionOrderId=task_data.get('productionOrderId')
+            )
+            submission_storage.write_text(remote_receipt_path, json.dumps(receipt, indent=4, ensure_ascii=False))
+            _release_document_submission_lock(submission_storage, submission_lock_path)
+            submission_lock_path = None
+            storage_tasks.mark_finished(task_path)
+            logger.info(f"[+++] Отчет {order_id} принят частями: {len(part_receipts)}")
+            return receipt["reportId"]
+
         production_order_id = task_data.pop('productionOrderId', None)
 
-        # Получаем ИНН участника для подписи отчета о нанесении. В linked GTIN
-        # код товара может принадлежать чужой карточке, поэтому приоритетно
-        # берем participantId из задачи, затем Manufacturer_inn из исходного
-        # производственного задания.
-        inn = task_data.get('attributes', {}).get('participantId')
-        if not inn and production_order_id:
-            production_orders_path = config.get('production_orders_path')
-            if production_orders_path:
-                storage_prod = get_storage(production_orders_path, s3_config)
-                prod_path = f"{production_orders_path.rstrip('/')}/{production_order_id}.json"
-                if storage_prod.exists(prod_path):
-                    prod_data = json.loads(storage_prod.read_text(prod_path))
-                    inn = prod_data.get('Manufacturer_inn') or prod_data.get('PasportData', {}).get('Manufacturer_inn')
-                    if inn:
-                        logger.info(f"[*] Для отчета о нанесении используем Manufacturer_inn из производственного задания: {inn}")
-        if not inn:
-             first_code = task_data['sntins'][0]
-             gtin = first_code[2:16] if first_code.startswith('01') else None
-             base_path = os.path.dirname(os.path.abspath(__file__))
-             inn = get_inn_by_gtin(gtin, db_path=os.path.join(base_path, 'gs1prefix_inn_db.json'))
+        inn = _resolve_utilisation_inn(config, task_data, production_order_id)
 
         if not inn:
             storage_tasks.mark_error(task_path)
@@ -1926,7 +2278,7 @@ def sign_and_send_utilisation(order_id: str, signing_dir: str, timeout: int,
 
         # Подпись
         storage_sign = get_storage(signing_dir, s3_config)
-        unique_id = uuid.uuid4()
+        unique_id = _signing_unique_id("utilisation", order_id)
         body_filename = f"{inn}_{unique_id}_utilisation.json"
         signature_filename = f"{body_filename}.sig"
 
@@ -1939,49 +2291,50 @@ def sign_and_send_utilisation(order_id: str, signing_dir: str, timeout: int,
         local_body_path = local_dir / body_filename
         local_signature_path = local_dir / signature_filename
 
+        keep_signing_body = False
         try:
             # Важно: separators=(',', ':') для компактного JSON
             body_json = json.dumps(task_data, separators=(',', ':'))
-            storage_sign.write_text(remote_body_path, body_json)
 
             with open(local_body_path, "w", encoding="utf-8") as f:
                 f.write(body_json)
 
-            logger.info(f"[*] Отчет отправлен на подпись в: {remote_body_path}. Ожидание...")
-            start_time = time.time()
-            while not storage_sign.exists(remote_signature_path):
-                if time.time() - start_time > timeout:
-                    storage_tasks.mark_error(task_path)
-                    raise RuntimeError("[!] Таймаут ожидания подписи.")
-                time.sleep(2)
-
-            time.sleep(0.5)
-            logger.info("[+] Подпись обнаружена в хранилище!")
+            _await_signature(
+                storage_sign, remote_body_path, remote_signature_path, body_json,
+                timeout, wait_signature, "utilisation", order_id,
+                on_timeout=lambda: storage_tasks.mark_error(task_path),
+            )
 
             storage_sign.download(remote_signature_path, str(local_signature_path))
 
             # Отправка
             suz_api = SUZ(token=token, omsId=final_oms_id, clientToken=final_client_token)
             logger.info(f"[*] Отправка отчета в СУЗ (orderId: {order_id})...")
-            report_id = suz_api.utilisation_send(str(local_body_path), str(local_signature_path), orderId=order_id)
+            submission_ambiguous = True
+            report_id = suz_api.utilisation_send(
+                str(local_body_path), str(local_signature_path),
+                orderId=(suz_order_id or order_id) if send_order_id else None,
+            )
+            submission_ambiguous = False
 
             if report_id and not report_id.startswith('{') and 'Error' not in report_id:
                 logger.info(f"[+++] Отчет принят! ID: {report_id}")
+                accepted_not_persisted = True
                 storage_tasks.mark_finished(task_path)
 
-                storage_receipts = get_storage(utilisation_receipts_path, s3_config)
-                remote_receipt_path = f"{utilisation_receipts_path.rstrip('/')}/{order_id}.json"
-
                 temp_receipt = local_dir / f"receipt_util_{unique_id}.json"
                 with open(temp_receipt, 'w', encoding='utf-8') as f:
                     json.dump({
                         "reportId": report_id,
-                        "orderId": order_id,
+                        "orderId": suz_order_id or order_id,
                         "omsId": final_oms_id,
                         "productionOrderId": production_order_id
                     }, f, indent=4)
 
-                storage_receipts.upload(str(temp_receipt), remote_receipt_path)
+                submission_storage.upload(str(temp_receipt), remote_receipt_path)
+                accepted_not_persisted = False
+                _release_document_submission_lock(submission_storage, submission_lock_path)
+                submission_lock_path = None
                 try: temp_receipt.unlink()
                 except: pass
 
@@ -1992,28 +2345,202 @@ def sign_and_send_utilisation(order_id: str, signing_dir: str, timeout: int,
                 storage_tasks.mark_error(task_path)
                 raise RuntimeError(message)
 
-        finally:
-            if local_body_path.exists(): local_body_path.unlink()
-            if local_signature_path.exists(): local_signature_path.unlink()
-            try:
-                if local_dir.exists() and not any(local_dir.iterdir()):
-                    local_dir.rmdir()
-            except: pass
-            try:
-                if storage_sign.exists(remote_body_path): storage_sign.delete(remote_body_path)
-                if storage_sign.exists(remote_signature_path): storage_sign.delete(remote_signature_path)
-            except: pass
+        except SignaturePending:
+            keep_signing_body = True
+            raise
+        finally:
+            if local_body_path.exists(): local_body_path.unlink()
+            if local_signature_path.exists(): local_signature_path.unlink()
+            try:
+                if local_dir.exists() and not any(local_dir.iterdir()):
+                    local_dir.rmdir()
+            except: pass
+            try:
+                if not keep_signing_body:
+                    if storage_sign.exists(remote_body_path): storage_sign.delete(remote_body_path)
+                    if storage_sign.exists(remote_signature_path): storage_sign.delete(remote_signature_path)
+            except: pass
+
+    except Exception as e:
+        if (
+            submission_lock_path
+            and not submission_ambiguous
+            and not accepted_not_persisted
+        ):
+            _release_document_submission_lock(
+                submission_storage,
+                submission_lock_path,
+            )
+        if isinstance(e, SignaturePending):
+            raise
+        logger.error(f"[!] Ошибка в sign_and_send_utilisation: {e}")
+        raise
+
+def _emission_order_keys(production_order_id: str, config, s3_config):
+    """(orderId, omsId, gtin) заказа на эмиссию по чеку и производственному заказу или None."""
+    emission_receipts_path = config.get('emission_receipts')
+    production_orders_path = config.get('production_orders_path')
+
+    # 1. Загружаем чек заказа на эмиссию
+    storage_receipts = get_storage(emission_receipts_path, s3_config)
+    receipt_path = f"{emission_receipts_path.rstrip('/')}/{production_order_id}.json"
+
+    if not storage_receipts.exists(receipt_path):
+        logger.error(f"[!] Файл чека не найден: {receipt_path}")
+        return None
+
+    receipt_data = json.loads(storage_receipts.read_text(receipt_path))
+    order_id = receipt_data.get('orderId')
+    oms_id = receipt_data.get('omsId')
+
+    # 2. Загружаем производственный заказ для получения GTIN
+    storage_production = get_storage(production_orders_path, s3_config)
+    prod_order_path = f"{production_orders_path.rstrip('/')}/{production_order_id}.json"
+
+    if not storage_production.exists(prod_order_path):
+        logger.error(f"[!] Файл производственного заказа не найден: {prod_order_path}")
+        return None
+
+    prod_data = json.loads(storage_production.read_text(prod_order_path))
+    gtin = prod_data.get('Gtin')
+
+    if not all([order_id, oms_id, gtin]):
+        logger.error(f"[!] Не удалось получить все данные (orderId, omsId, gtin) для {production_order_id}")
+        return None
+    return order_id, oms_id, gtin
+
+
+class StatusCheckContext:
+    """
+    Общие ресурсы проверок статуса: конфигурация, организации, токены и
+    клиенты API. Поллер создает один контекст на цикл опроса и передает его
+    во все update_*_status цикла, поэтому конфигурация и токены загружаются
+    один раз на цикл, а не для каждого документа.
+    """
+
+    def __init__(self, config=None):
+        self._config = config
+        self._org_manager = None
+        self._token_processor = None
+        self._tokens = {}
+        self._suz_clients = {}
+        self._true_api_clients = {}
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = load_config('suz_worker_config')
+        return self._config
+
+    @property
+    def org_manager(self):
+        if self._org_manager is None:
+            base_path = os.path.dirname(os.path.abspath(__file__))
+            self._org_manager = OrganizationManager(os.path.join(base_path, 'my_orgs'))
+        return self._org_manager
+
+    @property
+    def token_processor(self):
+        if self._token_processor is None:
+            self._token_processor = TokenProcessor(org_manager=self.org_manager)
+        return self._token_processor
+
+    def token(self, inn, token_type, conid=None):
+        key = (inn, token_type, conid)
+        if key not in self._tokens:
+            self._tokens[key] = self.token_processor.get_token_value_by_inn(
+                inn, token_type=token_type, conid=conid
+            )
+        return self._tokens[key]
+
+    def refresh_token(self, inn, token_type, conid=None):
+        """Обновляет токен и запоминает новый для следующих документов цикла."""
+        token = self.token_processor.refresh_token_value(inn, token_type, conid)
+        self._tokens[(inn, token_type, conid)] = token
+        return token
+
+    def suz_api_for_oms(self, oms_id):
+        """Клиент СУЗ организации с omsId или None, если организация или токен не найдены."""
+        if oms_id in self._suz_clients:
+            return self._suz_clients[oms_id]
+
+        found_org = None
+        for o in self.org_manager.list():
+            if o.oms_id == oms_id:
+                found_org = o
+                break
+
+        suz_api = None
+        if not found_org:
+            logger.error(f"[!] Организация с omsId {oms_id} не найдена в базе.")
+        elif not self.token(found_org.inn, 'UUID', found_org.connection_id):
+            logger.error(f"[!] Активный токен для ИНН {found_org.inn} не найден.")
+        else:
+            suz_api = SUZ(
+                token=self.token(found_org.inn, 'UUID', found_org.connection_id),
+                omsId=oms_id, clientToken=found_org.connection_id,
+                token_refresher=lambda: self.refresh_token(
+                    found_org.inn, 'UUID', found_org.connection_id
+                ),
+            )
+        self._suz_clients[oms_id] = suz_api
+        return suz_api
+
+    def true_api(self, inn):
+        """Клиент True API участника или None, если JWT токен не найден."""
+        if inn not in self._true_api_clients:
+            token = self.token(inn, 'JWT')
+            if not token:
+                logger.error(f"[!] JWT токен для ИНН {inn} не найден.")
+            self._true_api_clients[inn] = HonestSignAPI(token=token) if token else None
+        return self._true_api_clients[inn]
+
+
+def _suz_api_for_oms(oms_id: str, status_context=None):
+    """Клиент СУЗ организации с omsId или None, если организация или токен не найдены."""
+    return (status_context or StatusCheckContext()).suz_api_for_oms(oms_id)
+
+
+def _save_emission_status(status_data, production_order_id, emissions_path, s3_config):
+    """Сохраняет статус буфера в emissions/<orderId>.json с тегом bufferStatus."""
+    # Фильтруем поля для инициализации dataclass, на случай появления новых полей в API
+    sig = inspect.signature(EmissionOrderStatus.__init__)
+    valid_fields = {k for k, v in sig.parameters.items() if k != 'self'}
+    filtered_data = {k: v for k, v in status_data.items() if k in valid_fields}
+
+    status_obj = EmissionOrderStatus(**filtered_data)
+    status_obj.productionOrderId = production_order_id
+    status_obj.checkedAtUnix = time.time()
+
+    storage_emissions = get_storage(emissions_path, s3_config)
+    output_filename = f"{status_obj.orderId}.json"
+    output_path = f"{emissions_path.rstrip('/')}/{output_filename}"
+
+    # Временный локальный файл
+    temp_local = Path(f"temp_status_{status_obj.orderId}.json")
+    with open(temp_local, 'w', encoding='utf-8') as f:
+        f.write(status_obj.to_json())
+
+    logger.info(f"[*] Сохранение статуса в {output_path}")
+    storage_emissions.upload(str(temp_local), output_path)
+
+    # Установка тегов/расширения
+    storage_emissions.set_tags(output_path, {"bufferStatus": status_obj.bufferStatus})
+
+    try: temp_local.unlink()
+    except: pass
+
+    return status_obj
 
-    except Exception as e:
-        logger.error(f"[!] Ошибка в sign_and_send_utilisation: {e}")
-        raise
 
-def update_emission_order_status(production_order_id: str):
+def update_emission_order_status(production_order_id: str, status_context=None):
     """
-    Получает статус заказа из СУЗ и сохраняет его в S3
+    Получает статус заказа из СУЗ и сохраняет его в S3.
+    status_context - общий контекст цикла опроса (StatusCheckContext).
     """
     try:
-        config = load_config('suz_worker_config')
+        status_context = status_context or StatusCheckContext()
+        config = status_context.config
         s3_config = config.get('s3_config')
         emission_receipts_path = config.get('emission_receipts')
         production_orders_path = config.get('production_orders_path')
@@ -2023,61 +2550,15 @@ def update_emission_order_status(production_order_id: str):
             logger.error("[!] В конфигурации отсутствуют необходимые пути (emission_receipts, production_orders_path, emissions_path)")
             return None
 
-        # 1. Загружаем чек заказа на эмиссию
-        storage_receipts = get_storage(emission_receipts_path, s3_config)
-        receipt_path = f"{emission_receipts_path.rstrip('/')}/{production_order_id}.json"
-
-        if not storage_receipts.exists(receipt_path):
-            logger.error(f"[!] Файл чека не найден: {receipt_path}")
-            return None
-
-        receipt_data = json.loads(storage_receipts.read_text(receipt_path))
-        order_id = receipt_data.get('orderId')
-        oms_id = receipt_data.get('omsId')
-
-        # 2. Загружаем производственный заказ для получения GTIN
-        storage_production = get_storage(production_orders_path, s3_config)
-        prod_order_path = f"{production_orders_path.rstrip('/')}/{production_order_id}.json"
-
-        if not storage_production.exists(prod_order_path):
-            logger.error(f"[!] Файл производственного заказа не найден: {prod_order_path}")
-            return None
-
-        prod_data = json.loads(storage_production.read_text(prod_order_path))
-        gtin = prod_data.get('Gtin')
-
-        if not all([order_id, oms_id, gtin]):
-            logger.error(f"[!] Не удалось получить все данные (orderId, omsId, gtin) для {production_order_id}")
+        keys = _emission_order_keys(production_order_id, config, s3_config)
+        if keys is None:
             return None
+        order_id, oms_id, gtin = keys
 
         # 3. Инициализация API и получение статуса
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        org_manager = OrganizationManager(os.path.join(base_path, 'my_orgs'))
-
-        # Ищем организацию по oms_id
-        found_org = None
-        for o in org_manager.list():
-            if o.oms_id == oms_id:
-                found_org = o
-                break
-
-        if not found_org:
-            logger.error(f"[!] Организация с omsId {oms_id} не найдена в базе.")
+        suz_api = _suz_api_for_oms(oms_id, status_context)
+        if suz_api is None:
             return None
-
-        token_processor = TokenProcessor(org_manager=org_manager)
-        token = token_processor.get_token_value_by_inn(found_org.inn, token_type='UUID', conid=found_org.connection_id)
-
-        if not token:
-            logger.error(f"[!] Активный токен для ИНН {found_org.inn} не найден.")
-            return None
-
-        suz_api = SUZ(
-            token=token, omsId=oms_id, clientToken=found_org.connection_id,
-            token_refresher=lambda: token_processor.refresh_token_value(
-                found_org.inn, 'UUID', found_org.connection_id
-            ),
-        )
         logger.info(f"[*] Запрос статуса для orderId: {order_id}, gtin: {gtin}")
 
         try:
@@ -2090,41 +2571,97 @@ def update_emission_order_status(production_order_id: str):
             logger.error(f"[!] Получен некорректный ответ от СУЗ: {status_response}")
             return str(status_response)
 
-        # Берем первый элемент статуса
-        status_data = status_response[0]
+        # 4. Сохранение результата (берем первый элемент статуса)
+        return _save_emission_status(status_response[0], production_order_id, emissions_path, s3_config)
 
-        # Фильтруем поля для инициализации dataclass, на случай появления новых полей в API
-        sig = inspect.signature(EmissionOrderStatus.__init__)
-        valid_fields = {k for k, v in sig.parameters.items() if k != 'self'}
-        filtered_data = {k: v for k, v in status_data.items() if k in valid_fields}
+    except Exception as e:
+        logger.error(f"[!] Ошибка в update_emission_order_status: {e}")
+        return str(e)
 
-        status_obj = EmissionOrderStatus(**filtered_data)
-        status_obj.productionOrderId = production_order_id
 
-        # 4. Сохранение результата
-        storage_emissions = get_storage(emissions_path, s3_config)
-        output_filename = f"{order_id}.json"
-        output_path = f"{emissions_path.rstrip('/')}/{output_filename}"
+# Состояния буфера, переход в которые передается дальше по цепочке (emissions/)
+EMISSION_PUBLISHED_STATES = ("ACTIVE", "EXHAUSTED")
 
-        # Временный локальный файл
-        temp_local = Path(f"temp_status_{order_id}.json")
-        with open(temp_local, 'w', encoding='utf-8') as f:
-            f.write(status_obj.to_json())
 
-        logger.info(f"[*] Сохранение статуса в {output_path}")
-        storage_emissions.upload(str(temp_local), output_path)
+def _order_list_buffers(order_list_response):
+    """Буферы из ответа /order/list по (orderId, gtin)."""
+    buffers = {}
+    for order_info in (order_list_response or {}).get('orderInfos') or []:
+        order_id = order_info.get('orderId')
+        for buffer in order_info.get('buffers') or []:
+            buffer_order_id = buffer.get('orderId') or order_id
+            buffers[(buffer_order_id, buffer.get('gtin'))] = {**buffer, 'orderId': buffer_order_id}
+    return buffers
 
-        # Установка тегов/расширения
-        storage_emissions.set_tags(output_path, {"bufferStatus": status_obj.bufferStatus})
 
-        try: temp_local.unlink()
-        except: pass
+def update_emission_order_statuses(production_order_ids, known_states=None, status_context=None):
+    """
+    Пакетный вариант update_emission_order_status: один запрос /order/list
+    на omsId вместо запроса статуса по каждому заказу.
 
-        return status_obj
+    known_states - последние известные bufferStatus по productionOrderId.
+    Файл статуса в emissions/ пишется только при переходе в ACTIVE или
+    EXHAUSTED, остальные изменения возвращаются без записи.
+    Возвращает {productionOrderId: EmissionOrderStatus | текст ошибки}.
+    """
+    known_states = known_states or {}
+    status_context = status_context or StatusCheckContext()
+    config = status_context.config
+    s3_config = config.get('s3_config')
+    emissions_path = config.get('emissions_path')
+    if not all([config.get('emission_receipts'), config.get('production_orders_path'), emissions_path]):
+        logger.error("[!] В конфигурации отсутствуют необходимые пути (emission_receipts, production_orders_path, emissions_path)")
+        return {}
+
+    results = {}
+    orders_by_oms = {}
+    for production_order_id in production_order_ids:
+        try:
+            keys = _emission_order_keys(production_order_id, config, s3_config)
+        except Exception as e:
+            keys = None
+            logger.error(f"[!] Ошибка чтения заказа {production_order_id}: {e}")
+        if keys is None:
+            results[production_order_id] = f"Нет данных заказа {production_order_id}"
+            continue
+        order_id, oms_id, gtin = keys
+        orders_by_oms.setdefault(oms_id, []).append((production_order_id, order_id, gtin))
 
-    except Exception as e:
-        logger.error(f"[!] Ошибка в update_emission_order_status: {e}")
-        return str(e)
+    for oms_id, orders in orders_by_oms.items():
+        try:
+            suz_api = _suz_api_for_oms(oms_id, status_context)
+            if suz_api is None:
+                raise RuntimeError(f"Нет клиента СУЗ для omsId {oms_id}")
+            logger.info(f"[*] Запрос списка заказов omsId {oms_id} для {len(orders)} заказов")
+            buffers = _order_list_buffers(suz_api.order_list())
+        except Exception as e:
+            logger.error(f"[!] Ошибка запроса списка заказов omsId {oms_id}: {e}")
+            for production_order_id, _, _ in orders:
+                results[production_order_id] = str(e)
+            continue
+
+        for production_order_id, order_id, gtin in orders:
+            buffer = buffers.get((order_id, gtin))
+            if buffer is None:
+                logger.warning(f"[!] Заказ {order_id} (gtin {gtin}) отсутствует в списке заказов omsId {oms_id}")
+                results[production_order_id] = f"Заказ {order_id} не найден в /order/list"
+                continue
+            buffer.setdefault('omsId', oms_id)
+            state = buffer.get('bufferStatus')
+            try:
+                if state in EMISSION_PUBLISHED_STATES and state != known_states.get(production_order_id):
+                    results[production_order_id] = _save_emission_status(
+                        buffer, production_order_id, emissions_path, s3_config
+                    )
+                else:
+                    results[production_order_id] = EmissionOrderStatus(**{
+                        **{k: v for k, v in buffer.items() if k in EmissionOrderStatus.__dataclass_fields__},
+                        'productionOrderId': production_order_id,
+                    })
+            except Exception as e:
+                logger.error(f"[!] Ошибка сохранения статуса заказа {order_id}: {e}")
+                results[production_order_id] = str(e)
+    return results
 
 def _validate_pallet_assignments(
     *,
@@ -2215,9 +2752,10 @@ def _validate_pallet_assignments(
     return assigned[0][2:] if assigned else None
 
 
-def create_aggregation_report(task_uuid: str, inn_override: str = None):
+def create_aggregation_report(task_uuid: str, inn_override: str = None, report_context=None):
     """
     Создает отчет об агрегации для ЛК на основе отчета оборудования.
+    report_context - EquipmentReportContext события, если отчет уже прочитан.
     """
     try:
         config = load_config('suz_worker_config')
@@ -2230,15 +2768,14 @@ def create_aggregation_report(task_uuid: str, inn_override: str = None):
             logger.error("[!] В конфигурации отсутствуют пути (equipment-tasks, equipment-reports, agg-tasks)")
             return None
 
-        storage_tasks = get_storage(equipment_tasks_path, s3_config)
-
         # 1. Загружаем задание оборудования
+        report_context = report_context or EquipmentReportContext(task_uuid, config)
         task_path = f"{equipment_tasks_path.rstrip('/')}/{task_uuid}.json"
-        if not storage_tasks.exists(task_path):
+        if not report_context.exists(task_path, equipment_tasks_path):
             logger.error(f"[!] Задание оборудования не найдено: {task_path}")
             return None
 
-        task_data = json.loads(storage_tasks.read_text(task_path))
+        task_data = report_context.read_json(task_path, equipment_tasks_path)
         # Заменяем дефисы на подчеркивания для совместимости с dataclass
         task_data_clean = {k.replace('-', '_'): v for k, v in task_data.items()}
         # Фильтрация полей для dataclass
@@ -2249,14 +2786,13 @@ def create_aggregation_report(task_uuid: str, inn_override: str = None):
 
         # 2. Получаем ID отчета из задания и ищем сам отчет в equipment-reports
         report_uuid = task_obj.id
-        storage_reports = get_storage(equipment_reports_path, s3_config)
         report_path = f"{equipment_reports_path.rstrip('/')}/{report_uuid}.json"
 
-        if not storage_reports.exists(report_path):
+        if not report_context.exists(report_path, equipment_reports_path):
             logger.info(f"[*] Отчет оборудования {report_uuid} не найден в {equipment_reports_path}. Завершение без ошибки.")
             return None
 
-        report_data = json.loads(storage_reports.read_text(report_path))
+        report_data = report_context.read_json(report_path, equipment_reports_path)
         if not report_data.get('readyBox') and not report_data.get('readyPallet'):
             logger.info(
                 f"[*] Отчет {report_uuid} не содержит readyBox/readyPallet. "
@@ -2313,9 +2849,13 @@ def create_aggregation_report(task_uuid: str, inn_override: str = None):
         logger.error(f"[!] Ошибка в create_aggregation_report: {e}")
         return None
 
-def sign_and_send_aggregation(task_uuid: str, group: str, signing_dir: str, timeout: int, refresh_token: bool = False):
+def sign_and_send_aggregation(task_uuid: str, group: str, signing_dir: str, timeout: int, refresh_token: bool = False,
+                              wait_signature: bool = True, receipts_path: str = None):
     """
     Загружает отчет об агрегации, подписывает его и отправляет в ЛК ЧЗ в обертке.
+    При wait_signature=False не ждет подпись, а бросает SignaturePending.
+    Отчет сверх ограничений ГИС МТ отправляется частями, единица агрегации
+    (паллета вместе с коробами) не делится.
     """
     submission_storage = None
     submission_lock_path = None
@@ -2325,7 +2865,7 @@ def sign_and_send_aggregation(task_uuid: str, group: str, signing_dir: str, time
         config = load_config('suz_worker_config')
         s3_config = config.get('s3_config')
         agg_tasks_path = config.get('agg-tasks')
-        agg_receipts_path = config.get('agg-receipts')
+        agg_receipts_path = receipts_path or config.get('agg-receipts')
 
         # Переопределяем параметры подписи из конфига если они есть
         sign_path = config.get('sign')
@@ -2368,6 +2908,22 @@ def sign_and_send_aggregation(task_uuid: str, group: str, signing_dir: str, time
         if not inn:
             raise RuntimeError(f"[!] Не найден participantId в отчете {task_uuid}")
 
+        parts = split_document("aggregation", report_data, document_limits(config, "aggregation"))
+        if len(parts) > 1:
+            part_receipts = _send_document_parts(
+                "aggregation", task_uuid, parts, agg_tasks_path, agg_receipts_path, s3_config,
+                lambda part_id, part_receipts_path: sign_and_send_aggregation(
+                    part_id, group, signing_dir, timeout,
+                    wait_signature=wait_signature, receipts_path=part_receipts_path,
+                ),
+                chunking_workers(config),
+            )
+            result = _parts_receipt(part_receipts, productionOrderId=task_uuid)
+            submission_storage.write_text(remote_receipt_path, json.dumps(result, indent=4, ensure_ascii=False))
+            _release_document_submission_lock(submission_storage, submission_lock_path)
+            submission_lock_path = None
+            return result
+
         # 2. Проверяем токен ДО цикла подписи, чтобы не ждать зря
         base_path = os.path.dirname(os.path.abspath(__file__))
         org_manager = OrganizationManager(os.path.join(base_path, 'my_orgs'))
@@ -2385,7 +2941,7 @@ def sign_and_send_aggregation(task_uuid: str, group: str, signing_dir: str, time
 
         # 3. Подготовка к подписи
         storage_sign = get_storage(signing_dir, s3_config)
-        unique_id = uuid.uuid4()
+        unique_id = _signing_unique_id("aggregation", task_uuid)
         body_filename = f"{inn}_{unique_id}_agg.json"
         signature_filename = f"{body_filename}.sig"
 
@@ -2398,25 +2954,19 @@ def sign_and_send_aggregation(task_uuid: str, group: str, signing_dir: str, time
         local_body_path = local_dir / body_filename
         local_signature_path = local_dir / signature_filename
 
+        keep_signing_body = False
         try:
-            # ЧЗ крайне чувствителен к изменению тела документа после подписи.
-            # Поэтому мы используем исходные байты, загруженные из S3.
-            storage_sign.write_text(remote_body_path, report_content)
-
             # Также сохраняем локально, чтобы потом прочитать как байты
             local_body_bytes = report_content if isinstance(report_content, bytes) else report_content.encode('utf-8')
             with open(local_body_path, "wb") as f:
                 f.write(local_body_bytes)
 
-            logger.info(f"[*] Ожидание подписи для {remote_body_path}...")
-            start_time = time.time()
-            while not storage_sign.exists(remote_signature_path):
-                if time.time() - start_time > timeout:
-                    raise RuntimeError("[!] Таймаут ожидания подписи.")
-                time.sleep(2)
-
-            time.sleep(0.5)
-            logger.info("[+] Подпись обнаружена в хранилище!")
+            # ЧЗ крайне чувствителен к изменению тела документа после подписи.
+            # Поэтому мы используем исходные байты, загруженные из S3.
+            _await_signature(
+                storage_sign, remote_body_path, remote_signature_path, report_content,
+                timeout, wait_signature, "aggregation", task_uuid,
+            )
 
             # Используем байты напрямую
             doc_base64 = base64.b64encode(local_body_bytes).decode('utf-8')
@@ -2477,6 +3027,9 @@ def sign_and_send_aggregation(task_uuid: str, group: str, signing_dir: str, time
                 logger.error(message)
                 raise RuntimeError(message)
 
+        except SignaturePending:
+            keep_signing_body = True
+            raise
         finally:
             if local_body_path.exists(): local_body_path.unlink()
             if local_signature_path.exists(): local_signature_path.unlink()
@@ -2485,8 +3038,9 @@ def sign_and_send_aggregation(task_uuid: str, group: str, signing_dir: str, time
                     local_dir.rmdir()
             except: pass
             try:
-                if storage_sign.exists(remote_body_path): storage_sign.delete(remote_body_path)
-                if storage_sign.exists(remote_signature_path): storage_sign.delete(remote_signature_path)
+                if not keep_signing_body:
+                    if storage_sign.exists(remote_body_path): storage_sign.delete(remote_body_path)
+                    if storage_sign.exists(remote_signature_path): storage_sign.delete(remote_signature_path)
             except: pass
 
     except Exception as e:
@@ -2499,15 +3053,19 @@ def sign_and_send_aggregation(task_uuid: str, group: str, signing_dir: str, time
                 submission_storage,
                 submission_lock_path,
             )
+        if isinstance(e, SignaturePending):
+            raise
         logger.error(f"[!] Ошибка в sign_and_send_aggregation: {e}")
         raise
 
-def update_utilisation_report_status(order_id: str):
+def update_utilisation_report_status(order_id: str, status_context=None):
     """
     Получает актуальный статус отчета о нанесении из СУЗ и сохраняет в S3/Локально.
+    status_context - общий контекст цикла опроса (StatusCheckContext).
     """
     try:
-        config = load_config('suz_worker_config')
+        status_context = status_context or StatusCheckContext()
+        config = status_context.config
         s3_config = config.get('s3_config')
         utilisation_receipts_path = config.get('utilisation_receipts')
         utilisation_reports_path = config.get('utilisation_reports')
@@ -2534,37 +3092,25 @@ def update_utilisation_report_status(order_id: str):
             return None
 
         # 2. Инициализация API
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        org_manager = OrganizationManager(os.path.join(base_path, 'my_orgs'))
-
-        found_org = None
-        for o in org_manager.list():
-            if o.oms_id == oms_id:
-                found_org = o
-                break
-
-        if not found_org:
-            logger.error(f"[!] Организация с omsId {oms_id} не найдена.")
-            return None
-
-        token_processor = TokenProcessor(org_manager=org_manager)
-        token = token_processor.get_token_value_by_inn(found_org.inn, token_type='UUID', conid=found_org.connection_id)
-
-        if not token:
-            logger.error(f"[!] Токен не найден.")
+        suz_api = _suz_api_for_oms(oms_id, status_context)
+        if suz_api is None:
             return None
 
-        suz_api = SUZ(
-            token=token, omsId=oms_id, clientToken=found_org.connection_id,
-            token_refresher=lambda: token_processor.refresh_token_value(
-                found_org.inn, 'UUID', found_org.connection_id
-            ),
-        )
-
         # 3. Запрос статуса
         logger.info(f"[*] Запрос статуса отчета {report_id} для заказа {order_id}...")
         try:
             status_res = suz_api.report_info(report_id)
+            # Отчет из частей: SUCCESS, только если он у всех частей
+            parts = receipt_data.get('parts') or []
+            if parts and status_res:
+                part_states = [status_res.get('reportStatus')]
+                for part in parts[1:]:
+                    part_res = suz_api.report_info(part.get('reportId'))
+                    if not part_res:
+                        logger.error(f"[!] Пустой ответ СУЗ для части {part.get('partId')}")
+                        return None
+                    part_states.append(part_res.get('reportStatus'))
+                status_res = {**status_res, 'reportStatus': combine_part_states(part_states, "SUCCESS")}
         except Exception as e:
             logger.error(f"[!] Ошибка API: {e}")
             return None
@@ -2642,9 +3188,8 @@ def create_introduce_task(order_id: str, group: str = None, production_date: str
 
         # Определяем GTIN по первому коду
         first_code = codes[0]
-        if first_code.startswith('01'):
-            gtin = first_code[2:16]
-        else:
+        gtin = datamatrix.gtin_of(first_code)
+        if not gtin:
             logger.error(f"[!] Не удалось определить GTIN из кода: {first_code}")
             return None
 
@@ -2752,16 +3297,11 @@ def create_introduce_task(order_id: str, group: str = None, production_date: str
             return None
 
         # Получаем разрешительные документы через специальный метод (с фильтрацией Прекращен)
-        permit_data = nk.get_active_permit_documents_by_gtin(gtin, product=f_res.get('_raw'))
-        permits = [GtinDocument(
-            certificate_number=p['number'],
-            certificate_date=p['date'],
-            certificate_type=p['type']
-        ) for p in permit_data]
-
-        if not permits:
+        permits_by_gtin = _resolve_permits_for_codes(nk, codes, gtin, product=f_res.get('_raw'))
+        missing = [g for g, permits in permits_by_gtin.items() if not permits]
+        if missing:
             error_msg = "отсутсвует разрешительная документация"
-            logger.error(f"[!] {error_msg} для GTIN {gtin}")
+            logger.error(f"[!] {error_msg} для GTIN {', '.join(missing)}")
             # Присваиваем тег ошибке
             storage_kodes.set_tags(kodes_file_path, {"статусСообщенияВводаВОборот": "Error"})
             return None
@@ -2770,11 +3310,11 @@ def create_introduce_task(order_id: str, group: str = None, production_date: str
         introduce_products = []
         for code in codes:
             # Очистка кодов от криптохвоста (до первого \u001d) для ввода в оборот
-            clean_code = code.split('\u001d')[0]
+            clean_code = datamatrix.cut_crypto_tail(code)
             introduce_products.append(IntroduceProduct(
                 uit_code=clean_code,
                 tnved_code=tnved,
-                certificate_document_data=permits
+                certificate_document_data=permits_by_gtin[datamatrix.gtin_of(code) or gtin]
             ))
 
         # Важно: owner_inn в LP_INTRODUCE_GOODS должен соответствовать текущему
@@ -2810,9 +3350,13 @@ def create_introduce_task(order_id: str, group: str = None, production_date: str
         logger.error(f"[!] Ошибка в create_introduce_task: {e}")
         return None
 
-def sign_and_send_introduce(order_id: str, group: str, signing_dir: str, timeout: int, refresh_token: bool = False):
+def sign_and_send_introduce(order_id: str, group: str, signing_dir: str, timeout: int, refresh_token: bool = False,
+                            wait_signature: bool = True, receipts_path: str = None):
     """
     Подписывает и отправляет сообщение о вводе в оборот в ЛК ЧЗ.
+    При wait_signature=False не ждет подпись, а бросает SignaturePending.
+    receipts_path переопределяет папку чека отправки. Сообщение сверх
+    ограничений ГИС МТ отправляется частями.
     """
     submission_storage = None
     submission_lock_path = None
@@ -2822,7 +3366,7 @@ def sign_and_send_introduce(order_id: str, group: str, signing_dir: str, timeout
         config = load_config('suz_worker_config')
         s3_config = config.get('s3_config')
         introduce_tasks_path = config.get('introduce-tasks')
-        introduce_receipts_path = config.get('introduce-receipts')
+        introduce_receipts_path = receipts_path or config.get('introduce-receipts')
 
         # Переопределяем параметры подписи из конфига если они есть
         sign_path = config.get('sign')
@@ -2857,6 +3401,23 @@ def sign_and_send_introduce(order_id: str, group: str, signing_dir: str, timeout
         # Читаем задачу
         task_content = storage_intro.read_text(task_path)
         task_data = json.loads(task_content)
+
+        parts = split_document("introduce", task_data, document_limits(config, "introduce"))
+        if len(parts) > 1:
+            part_receipts = _send_document_parts(
+                "introduce", order_id, parts, introduce_tasks_path, introduce_receipts_path, s3_config,
+                lambda part_id, part_receipts_path: sign_and_send_introduce(
+                    part_id, group, signing_dir, timeout,
+                    wait_signature=wait_signature, receipts_path=part_receipts_path,
+                ),
+                chunking_workers(config),
+            )
+            result = _parts_receipt(part_receipts, productionOrderId=task_data.get('productionOrderId'))
+            submission_storage.write_text(remote_receipt_path, json.dumps(result, indent=4, ensure_ascii=False))
+            _release_document_submission_lock(submission_storage, submission_lock_path)
+            submission_lock_path = None
+            return result
+
         production_order_id = task_data.pop('productionOrderId', None)
         inn = task_data.get('participant_inn') or task_data.get('owner_inn')
 
@@ -2875,7 +3436,7 @@ def sign_and_send_introduce(order_id: str, group: str, signing_dir: str, timeout
 
         # Подпись
         storage_sign = get_storage(signing_dir, s3_config)
-        unique_id = uuid.uuid4()
+        unique_id = _signing_unique_id("introduce", order_id)
         body_filename = f"{inn}_{unique_id}_introduce.json"
         signature_filename = f"{body_filename}.sig"
 
@@ -2888,22 +3449,16 @@ def sign_and_send_introduce(order_id: str, group: str, signing_dir: str, timeout
         local_body_path = local_dir / body_filename
         local_signature_path = local_dir / signature_filename
 
+        keep_signing_body = False
         try:
-            storage_sign.write_text(remote_body_path, task_content)
-
             local_body_bytes = task_content if isinstance(task_content, bytes) else task_content.encode('utf-8')
             with open(local_body_path, "wb") as f:
                 f.write(local_body_bytes)
 
-            logger.info(f"[*] Ожидание подписи для {remote_body_path}...")
-            start_time = time.time()
-            while not storage_sign.exists(remote_signature_path):
-                if time.time() - start_time > timeout:
-                    raise RuntimeError("[!] Таймаут ожидания подписи.")
-                time.sleep(2)
-
-            time.sleep(0.5)
-            logger.info("[+] Подпись обнаружена в хранилище!")
+            _await_signature(
+                storage_sign, remote_body_path, remote_signature_path, task_content,
+                timeout, wait_signature, "introduce", order_id,
+            )
 
             doc_base64 = base64.b64encode(local_body_bytes).decode('utf-8')
 
@@ -2952,6 +3507,9 @@ def sign_and_send_introduce(order_id: str, group: str, signing_dir: str, timeout
                 logger.error(message)
                 raise RuntimeError(message)
 
+        except SignaturePending:
+            keep_signing_body = True
+            raise
         finally:
             if local_body_path.exists(): local_body_path.unlink()
             if local_signature_path.exists(): local_signature_path.unlink()
@@ -2960,8 +3518,9 @@ def sign_and_send_introduce(order_id: str, group: str, signing_dir: str, timeout
                     local_dir.rmdir()
             except: pass
             try:
-                if storage_sign.exists(remote_body_path): storage_sign.delete(remote_body_path)
-                if storage_sign.exists(remote_signature_path): storage_sign.delete(remote_signature_path)
+                if not keep_signing_body:
+                    if storage_sign.exists(remote_body_path): storage_sign.delete(remote_body_path)
+                    if storage_sign.exists(remote_signature_path): storage_sign.delete(remote_signature_path)
             except: pass
 
     except Exception as e:
@@ -2974,15 +3533,19 @@ def sign_and_send_introduce(order_id: str, group: str, signing_dir: str, timeout
                 submission_storage,
                 submission_lock_path,
             )
+        if isinstance(e, SignaturePending):
+            raise
         logger.error(f"[!] Ошибка в sign_and_send_introduce: {e}")
         raise
 
-def update_aggregation_status(task_uuid: str, group: str):
+def update_aggregation_status(task_uuid: str, group: str, status_context=None):
     """
     Получает актуальный статус документа агрегации из ЛК ЧЗ и сохраняет чек.
+    status_context - общий контекст цикла опроса (StatusCheckContext).
     """
     try:
-        config = load_config('suz_worker_config')
+        status_context = status_context or StatusCheckContext()
+        config = status_context.config
         s3_config = config.get('s3_config')
         agg_receipts_path = config.get('agg-receipts')
         agg_tasks_path = config.get('agg-tasks')
@@ -3027,20 +3590,13 @@ def update_aggregation_status(task_uuid: str, group: str):
             return None
 
         # 3. Инициализация API
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        org_manager = OrganizationManager(os.path.join(base_path, 'my_orgs'))
-        token_processor = TokenProcessor(org_manager=org_manager)
-        token = token_processor.get_token_value_by_inn(inn, token_type='JWT')
-
-        if not token:
-            logger.error(f"[!] JWT токен для ИНН {inn} не найден.")
+        api = status_context.true_api(inn)
+        if api is None:
             return None
 
-        api = HonestSignAPI(token=token)
-
         # 4. Запрос статуса
         logger.info(f"[*] Запрос статуса документа {doc_id} для задачи {task_uuid}...")
-        status_res = api.doc(doc_id, pg=group)
+        status_res = _true_api_document_status(api, receipt_data, group)
 
         if not status_res:
             logger.error("[!] Пустой ответ от API.")
@@ -3136,13 +3692,9 @@ def create_aggregation_set_report(task_uuid: str, group: str, inn_override: str
         inn = inn_override
         if not inn:
             first_box = report_obj.readyBox[0]
-            box_number = first_box.boxNumber
-            # Очищаем код набора от криптохвоста
-            clean_box_number = box_number.split('')[0]
-            # Извлекаем GTIN (позиции 3-16 для формата 01...)
-            if clean_box_number.startswith('01'):
-                gtin = clean_box_number[2:16]
-
+            # GTIN из AI (01) кода набора, криптохвост не мешает разбору
+            gtin = datamatrix.gtin_of(first_box.boxNumber)
+            if gtin:
                 # Ищем ИНН через NK.feedProduct
                 # Нам нужен токен для NK. Попробуем найти любой доступный JWT токен.
                 base_path = os.path.dirname(os.path.abspath(__file__))
@@ -3223,9 +3775,12 @@ def create_aggregation_set_report(task_uuid: str, group: str, inn_override: str
         logger.error(f"[!] Ошибка в create_aggregation_set_report: {e}")
         return None
 
-def sign_and_send_aggregation_set(task_uuid: str, group: str, signing_dir: str, timeout: int, refresh_token: bool = False):
+def sign_and_send_aggregation_set(task_uuid: str, group: str, signing_dir: str, timeout: int, refresh_token: bool = False,
+                                  wait_signature: bool = True, receipts_path: str = None):
     """
     Загружает отчет об агрегации наборов, подписывает его и отправляет в ЛК ЧЗ.
+    При wait_signature=False не ждет подпись, а бросает SignaturePending.
+    Отчет сверх ограничений ГИС МТ отправляется частями без деления наборов.
     """
     submission_storage = None
     submission_lock_path = None
@@ -3235,7 +3790,7 @@ def sign_and_send_aggregation_set(task_uuid: str, group: str, signing_dir: str,
         config = load_config('suz_worker_config')
         s3_config = config.get('s3_config')
         agg_set_tasks_path = config.get('agg_set_tasks')
-        agg_set_receipts_path = config.get('agg_set_receipts')
+        agg_set_receipts_path = receipts_path or config.get('agg_set_receipts')
 
         # Переопределяем параметры подписи из конфига если они есть
         sign_path = config.get('sign')
@@ -3275,6 +3830,22 @@ def sign_and_send_aggregation_set(task_uuid: str, group: str, signing_dir: str,
         if not inn:
             raise RuntimeError(f"[!] Не найден participantId в отчете {task_uuid}")
 
+        parts = split_document("aggregation-set", report_data, document_limits(config, "aggregation-set"))
+        if len(parts) > 1:
+            part_receipts = _send_document_parts(
+                "aggregation-set", task_uuid, parts, agg_set_tasks_path, agg_set_receipts_path, s3_config,
+                lambda part_id, part_receipts_path: sign_and_send_aggregation_set(
+                    part_id, group, signing_dir, timeout,
+                    wait_signature=wait_signature, receipts_path=part_receipts_path,
+                ),
+                chunking_workers(config),
+            )
+            result = _parts_receipt(part_receipts, productionOrderId=task_uuid)
+            submission_storage.write_text(remote_receipt_path, json.dumps(result, indent=4, ensure_ascii=False))
+            _release_document_submission_lock(submission_storage, submission_lock_path)
+            submission_lock_path = None
+            return result
+
         # 2. Токен
         base_path = os.path.dirname(os.path.abspath(__file__))
         org_manager = OrganizationManager(os.path.join(base_path, 'my_orgs'))
@@ -3287,7 +3858,7 @@ def sign_and_send_aggregation_set(task_uuid: str, group: str, signing_dir: str,
 
         # 3. Подготовка к подписи
         storage_sign = get_storage(signing_dir, s3_config)
-        unique_id = uuid.uuid4()
+        unique_id = _signing_unique_id("aggregation-set", task_uuid)
         body_filename = f"{inn}_{unique_id}_agg_set.json"
         signature_filename = f"{body_filename}.sig"
 
@@ -3300,22 +3871,16 @@ def sign_and_send_aggregation_set(task_uuid: str, group: str, signing_dir: str,
         local_body_path = local_dir / body_filename
         local_signature_path = local_dir / signature_filename
 
+        keep_signing_body = False
         try:
-            storage_sign.write_text(remote_body_path, report_content)
-
             local_body_bytes = report_content if isinstance(report_content, bytes) else report_content.encode('utf-8')
             with open(local_body_path, 'wb') as f:
                 f.write(local_body_bytes)
 
-            logger.info(f"[*] Ожидание подписи для {remote_body_path}...")
-            start_time = time.time()
-            while not storage_sign.exists(remote_signature_path):
-                if time.time() - start_time > timeout:
-                    raise RuntimeError("[!] Таймаут ожидания подписи.")
-                time.sleep(2)
-
-            time.sleep(0.5)
-            logger.info("[+] Подпись обнаружена в хранилище!")
+            _await_signature(
+                storage_sign, remote_body_path, remote_signature_path, report_content,
+                timeout, wait_signature, "aggregation-set", task_uuid,
+            )
 
             doc_base64 = base64.b64encode(local_body_bytes).decode('utf-8')
 
@@ -3366,6 +3931,9 @@ def sign_and_send_aggregation_set(task_uuid: str, group: str, signing_dir: str,
                 logger.error(message)
                 raise RuntimeError(message)
 
+        except SignaturePending:
+            keep_signing_body = True
+            raise
         finally:
             if local_body_path.exists(): local_body_path.unlink()
             if local_signature_path.exists(): local_signature_path.unlink()
@@ -3374,8 +3942,9 @@ def sign_and_send_aggregation_set(task_uuid: str, group: str, signing_dir: str,
                     local_dir.rmdir()
             except: pass
             try:
-                if storage_sign.exists(remote_body_path): storage_sign.delete(remote_body_path)
-                if storage_sign.exists(remote_signature_path): storage_sign.delete(remote_signature_path)
+                if not keep_signing_body:
+                    if storage_sign.exists(remote_body_path): storage_sign.delete(remote_body_path)
+                    if storage_sign.exists(remote_signature_path): storage_sign.delete(remote_signature_path)
             except: pass
 
     except Exception as e:
@@ -3388,9 +3957,31 @@ def sign_and_send_aggregation_set(task_uuid: str, group: str, signing_dir: str,
                 submission_storage,
                 submission_lock_path,
             )
+        if isinstance(e, SignaturePending):
+            raise
         logger.error(f"[!] Ошибка в sign_and_send_aggregation_set: {e}")
         raise
 
+# Начиная с этого количества наборов отчет КИН собирается в потоковом режиме
+KIN_STREAM_MIN_KITS = 10000
+
+
+def _generate_kin_report(generator, file_paths, num_kits, config):
+    """
+    Отчет КИН на num_kits наборов: небольшие - в памяти, большие - потоково
+    (порог kin_stream_min_kits). Возвращает (путь к отчету, количество наборов).
+    """
+    if num_kits >= config.get('kin_stream_min_kits', KIN_STREAM_MIN_KITS):
+        report_local_name = generator.generate_kin_report_stream(file_paths, num_kits=num_kits)
+        return report_local_name, getattr(generator, 'generated_kits', 0)
+
+    report_local_name = generator.generate_kin_report(file_paths, num_kits=num_kits)
+    if not report_local_name or not os.path.exists(report_local_name):
+        return report_local_name, 0
+    with open(report_local_name, 'r', encoding='utf-8') as f:
+        return report_local_name, len(json.load(f).get('readyBox', []))
+
+
 def create_equipment_set_report(production_order_id: str):
     """
     Создает виртуальный отчет оборудования об агрегации в наборы SET.
@@ -3534,16 +4125,16 @@ def create_equipment_set_report(production_order_id: str):
         generator = KinReportGenerator()
         file_paths = [str(tf) for tf in temp_files]
 
-        report_local_name = generator.generate_kin_report(file_paths, num_kits=main_codes_count)
+        report_local_name, generated_kits_count = _generate_kin_report(
+            generator, file_paths, main_codes_count, config
+        )
 
         if not report_local_name or not os.path.exists(report_local_name):
              raise ValueError("Failed to generate KIN report")
 
         # Проверка, что сгенерировано нужное количество
-        with open(report_local_name, 'r', encoding='utf-8') as f:
-             report_res_data = json.load(f)
-             if len(report_res_data.get('readyBox', [])) < main_codes_count:
-                  raise ValueError(f"Недостаточно кодов для создания {main_codes_count} наборов")
+        if generated_kits_count < main_codes_count:
+             raise ValueError(f"Недостаточно кодов для создания {main_codes_count} наборов")
 
         # 6. Загружаем в S3
         storage_reports = get_storage(equipment_set_reports_path, s3_config)
@@ -3566,15 +4157,15 @@ def create_equipment_set_report(production_order_id: str):
             try: tf.unlink()
             except: pass
 
-def create_equipment_set_report_from_report(production_order_id: str):
+def create_equipment_set_report_from_report(production_order_id: str, report_context=None):
     """
     Создает отчет об агрегации наборов на основании отчета оборудования об агрегации.
     Извлекает коды наборов из отчета оборудования и собирает наборы из кодов вложений виртуальных заданий.
+    report_context - EquipmentReportContext события, если отчет уже прочитан.
     """
     temp_files = []
     try:
         from .kinGenerator import KinReportGenerator
-        from urllib.parse import urlparse, unquote
 
         config = load_config('suz_worker_config')
         s3_config = config.get('s3_config')
@@ -3589,28 +4180,12 @@ def create_equipment_set_report_from_report(production_order_id: str):
             return None
 
         # 1. Находим и загружаем отчет оборудования
-        storage_tasks = get_storage(equipment_tasks_path, s3_config)
-        task_path = f"{equipment_tasks_path.rstrip('/')}/{production_order_id}.json"
-        if not storage_tasks.exists(task_path):
-            logger.error(f"[!] Задание на оборудование не найдено: {task_path}")
-            return None
-
-        task_data = json.loads(storage_tasks.read_text(task_path))
-        signed_link = task_data.get('task-export-signed-link') or task_data.get('task_export_signed_link')
-        if not signed_link:
-            logger.error(f"[!] В задании {production_order_id} не найден ключ task-export-signed-link")
-            return None
-
-        parsed_url = urlparse(signed_link)
-        report_filename = unquote(os.path.basename(parsed_url.path))
-        storage_reports = get_storage(equipment_reports_path, s3_config)
-        report_path = f"{equipment_reports_path.rstrip('/')}/{report_filename}"
-
-        if not storage_reports.exists(report_path):
-            logger.error(f"[!] Отчет оборудования не найден: {report_path}")
+        report_context = report_context or EquipmentReportContext(production_order_id, config)
+        try:
+            eq_report_data = report_context.report()
+        except (FileNotFoundError, ValueError) as e:
+            logger.error(f"[!] {e}")
             return None
-
-        eq_report_data = json.loads(storage_reports.read_text(report_path))
         # Извлекаем коды наборов (kigu)
         eq_set_codes = extract_and_flatten(eq_report_data)
         if not eq_set_codes:
@@ -3734,17 +4309,16 @@ def create_equipment_set_report_from_report(production_order_id: str):
         generator = KinReportGenerator()
         file_paths = [str(tf) for tf in temp_files]
 
-        report_local_name = generator.generate_kin_report(file_paths, num_kits=set_codes_count)
+        report_local_name, generated_kits_count = _generate_kin_report(
+            generator, file_paths, set_codes_count, config
+        )
 
         if not report_local_name or not os.path.exists(report_local_name):
              raise ValueError("Failed to generate KIN report")
 
         # Проверка, что сгенерировано нужное количество
-        with open(report_local_name, 'r', encoding='utf-8') as f:
-             report_res_data = json.load(f)
-             generated_kits_count = len(report_res_data.get('readyBox', []))
-             if generated_kits_count < set_codes_count:
-                  raise ValueError(f"Недостаточно кодов для создания {set_codes_count} наборов (создано только {generated_kits_count})")
+        if generated_kits_count < set_codes_count:
+             raise ValueError(f"Недостаточно кодов для создания {set_codes_count} наборов (создано только {generated_kits_count})")
 
         # 7. Загружаем в S3
         storage_reports = get_storage(equipment_set_reports_path, s3_config)
@@ -3765,7 +4339,7 @@ def create_equipment_set_report_from_report(production_order_id: str):
             try: tf.unlink()
             except: pass
 
-def _create_pallet_assignment(prod_data, config):
+def _create_pallet_assignment(prod_data, config, reserved_for=None):
     """Build the task pallet assignment and allocate all SSCCs once."""
     raw_boxes_per_pallet = prod_data.get('numBoxesInPallet')
     has_pallet_norm = raw_boxes_per_pallet not in (None, '')
@@ -3828,12 +4402,25 @@ def _create_pallet_assignment(prod_data, config):
             "and sscc_prefix"
         )
 
-    raw_codes = get_sscc_from_service(
-        sscc_service_url,
-        sscc_prefix,
-        sscc_count,
-        sscc_extension,
-    )
+    sscc_pool = get_sscc_pool(config)
+    if sscc_pool is not None:
+        # Коды из заранее полученного запаса, без ожидания сервиса SSCC.
+        # Задание оборудования создается один раз на заказ, поэтому повтор
+        # с тем же заказом продолжает прерванное создание и получает те же коды.
+        raw_codes = sscc_pool.take(
+            sscc_prefix,
+            sscc_count,
+            sscc_extension,
+            reserved_for=f"pallets:{reserved_for}" if reserved_for else None,
+            reuse=bool(reserved_for),
+        )
+    else:
+        raw_codes = get_sscc_from_service(
+            sscc_service_url,
+            sscc_prefix,
+            sscc_count,
+            sscc_extension,
+        )
     if not isinstance(raw_codes, list) or len(raw_codes) != sscc_count:
         actual_count = len(raw_codes) if isinstance(raw_codes, list) else 0
         raise ValueError(
@@ -3897,7 +4484,9 @@ def create_equipment_aggregation_task(production_order_id: str):
 
         prod_data = json.loads(storage_prod.read_text(prod_order_path))
         pasport = prod_data.get('PasportData', {})
-        pallet_assignment = _create_pallet_assignment(prod_data, config)
+        pallet_assignment = _create_pallet_assignment(
+            prod_data, config, reserved_for=prod_filename[:-5]
+        )
 
         # Поле id теперь совпадает с production_order_id (без расширения .json)
         task_uuid = production_order_id
@@ -4012,12 +4601,14 @@ def create_equipment_aggregation_task(production_order_id: str):
         logger.error(f"[!] Ошибка в create_equipment_aggregation_task: {e}")
         return None
 
-def update_aggregation_set_status(task_uuid: str, group: str):
+def update_aggregation_set_status(task_uuid: str, group: str, status_context=None):
     """
     Получает актуальный статус документа агрегации наборов из ЛК ЧЗ.
+    status_context - общий контекст цикла опроса (StatusCheckContext).
     """
     try:
-        config = load_config('suz_worker_config')
+        status_context = status_context or StatusCheckContext()
+        config = status_context.config
         s3_config = config.get('s3_config')
         agg_set_receipts_path = config.get('agg_set_receipts')
         agg_set_tasks_path = config.get('agg_set_tasks')
@@ -4060,20 +4651,13 @@ def update_aggregation_set_status(task_uuid: str, group: str):
             return None
 
         # 3. Инициализация API
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        org_manager = OrganizationManager(os.path.join(base_path, 'my_orgs'))
-        token_processor = TokenProcessor(org_manager=org_manager)
-        token = token_processor.get_token_value_by_inn(inn, token_type='JWT')
-
-        if not token:
-            logger.error(f"[!] JWT токен для ИНН {inn} не найден.")
+        api = status_context.true_api(inn)
+        if api is None:
             return None
 
-        api = HonestSignAPI(token=token)
-
         # 4. Запрос статуса
         logger.info(f"[*] Запрос статуса документа {doc_id} для наборов {task_uuid}...")
-        status_res = api.doc(doc_id, pg=group)
+        status_res = _true_api_document_status(api, receipt_data, group)
 
         if not status_res:
             logger.error("[!] Пустой ответ от API.")
@@ -4110,12 +4694,14 @@ def update_aggregation_set_status(task_uuid: str, group: str):
         logger.error(f"[!] Ошибка в update_aggregation_set_status: {e}")
         return str(e)
 
-def update_introduce_status(order_id: str, group: str):
+def update_introduce_status(order_id: str, group: str, status_context=None):
     """
     Получает актуальный статус документа ввода в оборот из ЛК ЧЗ и сохраняет чек.
+    status_context - общий контекст цикла опроса (StatusCheckContext).
     """
     try:
-        config = load_config('suz_worker_config')
+        status_context = status_context or StatusCheckContext()
+        config = status_context.config
         s3_config = config.get('s3_config')
         introduce_receipts_path = config.get('introduce-receipts')
         introduce_tasks_path = config.get('introduce-tasks')
@@ -4156,20 +4742,13 @@ def update_introduce_status(order_id: str, group: str):
             return None
 
         # 3. Инициализация API
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        org_manager = OrganizationManager(os.path.join(base_path, 'my_orgs'))
-        token_processor = TokenProcessor(org_manager=org_manager)
-        token = token_processor.get_token_value_by_inn(inn, token_type='JWT')
-
-        if not token:
-            logger.error(f"[!] JWT токен для ИНН {inn} не найден.")
+        api = status_context.true_api(inn)
+        if api is None:
             return None
 
-        api = HonestSignAPI(token=token)
-
         # 4. Запрос статуса
         logger.info(f"[*] Запрос статуса документа {doc_id} для заказа {order_id}...")
-        status_res = api.doc(doc_id, pg=group)
+        status_res = _true_api_document_status(api, receipt_data, group)
 
         if not status_res:
             logger.error("[!] Пустой ответ от API.")
@@ -4289,10 +4868,37 @@ def _normalise_cis_information_change_date(value: str, field_name: str) -> str:
     return parsed.isoformat()
 
 
-def _validate_cis_information_change_codes(codes):
+def _validate_cis_information_change_codes(codes, max_codes=CIS_INFORMATION_CHANGE_MAX_CODES):
+    """
+    Нормализует коды (без криптохвоста) и проверяет их списком целиком:
+    пробельные символы ищутся в склеенной строке, дубли - по размеру множества.
+    Позиция ошибки ищется поштучно только после неудачной проверки.
+    """
     if isinstance(codes, (str, bytes)) or not isinstance(codes, (list, tuple)):
         raise ValueError("codes должен быть списком полных кодов маркировки")
 
+    stripped = [code.strip() if isinstance(code, str) else "" for code in codes]
+    clean_codes = None
+    if all(stripped):
+        clean_codes = list(map(datamatrix.cut_crypto_tail, stripped))
+        joined = "".join(clean_codes)
+        if any(char in joined for char in ("\r", "\n", "\t", " ")) or len(set(clean_codes)) != len(clean_codes):
+            clean_codes = None
+    if clean_codes is None:
+        clean_codes = _cis_information_change_codes_one_by_one(codes)
+
+    if not clean_codes:
+        raise ValueError("Не указан ни один код маркировки")
+    if max_codes and len(clean_codes) > max_codes:
+        raise ValueError(
+            f"Количество кодов {len(clean_codes)} превышает лимит "
+            f"{max_codes}"
+        )
+    return clean_codes
+
+
+def _cis_information_change_codes_one_by_one(codes):
+    """Поштучная проверка: находит первый некорректный код и его позицию."""
     clean_codes = []
     seen = set()
     for index, code in enumerate(codes, start=1):
@@ -4305,19 +4911,14 @@ def _validate_cis_information_change_codes(codes):
             raise ValueError(f"Коды в документе должны быть уникальны: {clean_code}")
         seen.add(clean_code)
         clean_codes.append(clean_code)
-
-    if not clean_codes:
-        raise ValueError("Не указан ни один код маркировки")
-    if len(clean_codes) > CIS_INFORMATION_CHANGE_MAX_CODES:
-        raise ValueError(
-            f"Количество кодов {len(clean_codes)} превышает лимит "
-            f"{CIS_INFORMATION_CHANGE_MAX_CODES}"
-        )
     return clean_codes
 
 
-def _validate_cis_information_change_payload(payload):
-    """Не допускает смешивание двух видов дат в одном документе."""
+def _validate_cis_information_change_payload(payload, max_codes=CIS_INFORMATION_CHANGE_MAX_CODES):
+    """
+    Не допускает смешивание двух видов дат в одном документе. max_codes=None -
+    задача, которая будет отправлена частями.
+    """
     if not isinstance(payload, dict):
         raise ValueError("Тело CIS_INFORMATION_CHANGE должно быть JSON-объектом")
 
@@ -4363,7 +4964,7 @@ def _validate_cis_information_change_payload(payload):
             raise ValueError(f"В codes[{index}].code отсутствуют коды")
         all_codes.extend(group_codes)
 
-    normalized_codes = _validate_cis_information_change_codes(all_codes)
+    normalized_codes = _validate_cis_information_change_codes(all_codes, max_codes)
     if normalized_codes != all_codes:
         raise ValueError(
             "В теле CIS_INFORMATION_CHANGE должны быть КИ без "
@@ -4392,7 +4993,10 @@ def create_cis_information_change_task(
     correction_type: str,
     correction_date: str,
 ):
-    """Создаёт отдельный документ на изменение одного вида даты у списка кодов."""
+    """
+    Создаёт отдельный документ на изменение одного вида даты у списка кодов.
+    Задача сверх CIS_INFORMATION_CHANGE_MAX_CODES отправляется частями.
+    """
     config = load_config("suz_worker_config")
     s3_config = config.get("s3_config")
     tasks_path, _, _ = _cis_information_change_paths(config)
@@ -4405,7 +5009,7 @@ def create_cis_information_change_task(
     participant_inn = str(participant_inn or "").strip()
     field_name = _normalise_cis_information_change_type(correction_type)
     correction_date = _normalise_cis_information_change_date(correction_date, field_name)
-    clean_codes = _validate_cis_information_change_codes(codes)
+    clean_codes = _validate_cis_information_change_codes(codes, max_codes=None)
 
     group_args = {"code": clean_codes, field_name: correction_date}
     message = CisInformationChangeMessage(
@@ -4413,7 +5017,7 @@ def create_cis_information_change_task(
         codes=[CisInformationChangeCodeGroup(**group_args)],
     )
     payload = message.to_dict()
-    _validate_cis_information_change_payload(payload)
+    _validate_cis_information_change_payload(payload, max_codes=None)
     body_json = message.to_json()
 
     storage = get_storage(tasks_path, s3_config)
@@ -4461,7 +5065,7 @@ def _read_cis_information_change_codes_source(source_path: str):
             for line in content.split("\n")
             if line.rstrip("\r")
         ]
-        return _validate_cis_information_change_codes(codes)
+        return _validate_cis_information_change_codes(codes, max_codes=None)
 
     if isinstance(data, list):
         codes = data
@@ -4479,7 +5083,7 @@ def _read_cis_information_change_codes_source(source_path: str):
             "Неподдерживаемый источник кодов. Ожидается JSON-массив, "
             "объект с codes/sntins, отчёт оборудования readyBox или TXT"
         )
-    return _validate_cis_information_change_codes(codes)
+    return _validate_cis_information_change_codes(codes, max_codes=None)
 
 
 def create_cis_information_change_from_source(
@@ -4565,7 +5169,7 @@ def _read_emission_codes_for_production_order(production_order_id: str):
         raise RuntimeError(
             f"[!] Полные коды эмиссии для заказа {order_id} не найдены или уже исчерпаны"
         )
-    return _validate_cis_information_change_codes(codes)
+    return _validate_cis_information_change_codes(codes, max_codes=None)
 
 
 def _get_participant_inn_from_production_order(production_order_id: str):
@@ -4619,14 +5223,28 @@ def create_cis_information_change_from_emission(
     )
 
 
+def _cis_information_change_signing_paths(signing_dir, participant_inn, task_id):
+    """Имя тела на подпись и пути тела и подписи в корзине подписи."""
+    unique_id = _signing_unique_id("cis-information-change", task_id)
+    body_filename = f"{participant_inn}_{unique_id}_cis_information_change.json"
+    remote_body_path = f"{signing_dir.rstrip('/')}/{body_filename}"
+    return body_filename, remote_body_path, f"{remote_body_path}.sig"
+
+
 def sign_and_send_cis_information_change(
     task_id: str,
     group: str,
     signing_dir: str,
     timeout: int,
     refresh_token: bool = False,
+    wait_signature: bool = True,
+    receipts_path: str = None,
 ):
-    """Подписывает и отправляет CIS_INFORMATION_CHANGE через True API."""
+    """
+    Подписывает и отправляет CIS_INFORMATION_CHANGE через True API.
+    При wait_signature=False не ждет подпись, а бросает SignaturePending.
+    Задача сверх CIS_INFORMATION_CHANGE_MAX_CODES отправляется частями.
+    """
     submission_storage = None
     submission_lock_path = None
     submission_ambiguous = False
@@ -4634,7 +5252,8 @@ def sign_and_send_cis_information_change(
     try:
         config = load_config("suz_worker_config")
         s3_config = config.get("s3_config")
-        tasks_path, receipts_path, _ = _cis_information_change_paths(config)
+        tasks_path, default_receipts_path, _ = _cis_information_change_paths(config)
+        receipts_path = receipts_path or default_receipts_path
         signing_dir = config.get("sign") or signing_dir
         timeout = config.get("SIGNING_TIMEOUT", timeout)
         if not tasks_path or not receipts_path:
@@ -4664,9 +5283,36 @@ def sign_and_send_cis_information_change(
             raise RuntimeError(f"[!] Задача корректировки не найдена: {task_path}")
         task_content = task_storage.read_text(task_path)
         task_data = json.loads(task_content)
-        _validate_cis_information_change_payload(task_data)
+        _validate_cis_information_change_payload(task_data, max_codes=None)
         participant_inn = str(task_data["participantInn"])
 
+        parts = split_document(
+            "cis-information-change", task_data, document_limits(config, "cis-information-change")
+        )
+        if len(parts) > 1:
+            signing_storage = get_storage(signing_dir, s3_config)
+
+            def stage_part(part_id, part_text):
+                _, part_body_path, part_signature_path = _cis_information_change_signing_paths(
+                    signing_dir, participant_inn, part_id
+                )
+                _stage_signing_body(signing_storage, part_body_path, part_signature_path, part_text)
+
+            part_receipts = _send_document_parts(
+                "cis-information-change", task_id, parts, tasks_path, receipts_path, s3_config,
+                lambda part_id, part_receipts_path: sign_and_send_cis_information_change(
+                    part_id, group, signing_dir, timeout,
+                    wait_signature=wait_signature, receipts_path=part_receipts_path,
+                ),
+                chunking_workers(config),
+                stage_part=stage_part,
+            )
+            result = _parts_receipt(part_receipts, taskId=task_id, productGroup=group)
+            submission_storage.write_text(receipt_path, json.dumps(result, ensure_ascii=False, indent=4))
+            _release_document_submission_lock(submission_storage, submission_lock_path)
+            submission_lock_path = None
+            return result
+
         base_path = os.path.dirname(os.path.abspath(__file__))
         org_manager = OrganizationManager(os.path.join(base_path, "my_orgs"))
         token_processor = TokenProcessor(org_manager=org_manager)
@@ -4680,28 +5326,31 @@ def sign_and_send_cis_information_change(
             )
 
         signing_storage = get_storage(signing_dir, s3_config)
-        unique_id = uuid.uuid4()
-        body_filename = f"{participant_inn}_{unique_id}_cis_information_change.json"
+        body_filename, remote_body_path, remote_signature_path = _cis_information_change_signing_paths(
+            signing_dir, participant_inn, task_id
+        )
         signature_filename = f"{body_filename}.sig"
-        remote_body_path = f"{signing_dir.rstrip('/')}/{body_filename}"
-        remote_signature_path = f"{signing_dir.rstrip('/')}/{signature_filename}"
         local_dir = Path("temp_signing")
         local_dir.mkdir(exist_ok=True)
         local_body_path = local_dir / body_filename
         local_signature_path = local_dir / signature_filename
 
+        keep_signing_body = False
         try:
-            signing_storage.write_text(remote_body_path, task_content)
             body_bytes = task_content.encode("utf-8")
             with open(local_body_path, "wb") as body_file:
                 body_file.write(body_bytes)
 
-            logger.info("[*] Ожидание подписи для %s...", remote_body_path)
-            started_at = time.time()
-            while not signing_storage.exists(remote_signature_path):
-                if time.time() - started_at > timeout:
-                    raise RuntimeError("[!] Таймаут ожидания подписи")
-                time.sleep(2)
+            _await_signature(
+                signing_storage,
+                remote_body_path,
+                remote_signature_path,
+                task_content,
+                timeout,
+                wait_signature,
+                "cis-information-change",
+                task_id,
+            )
 
             signing_storage.download(remote_signature_path, str(local_signature_path))
             with open(local_signature_path, "r", encoding="utf-8") as signature_file:
@@ -4732,6 +5381,9 @@ def sign_and_send_cis_information_change(
             submission_lock_path = None
             logger.info("[+] CIS_INFORMATION_CHANGE отправлен: %s", result)
             return result
+        except SignaturePending:
+            keep_signing_body = True
+            raise
         finally:
             if local_body_path.exists():
                 local_body_path.unlink()
@@ -4743,13 +5395,14 @@ def sign_and_send_cis_information_change(
             except Exception:
                 pass
             try:
-                if signing_storage.exists(remote_body_path):
-                    signing_storage.delete(remote_body_path)
-                if signing_storage.exists(remote_signature_path):
-                    signing_storage.delete(remote_signature_path)
+                if not keep_signing_body:
+                    if signing_storage.exists(remote_body_path):
+                        signing_storage.delete(remote_body_path)
+                    if signing_storage.exists(remote_signature_path):
+                        signing_storage.delete(remote_signature_path)
             except Exception:
                 pass
-    except Exception:
+    except Exception as e:
         if (
             submission_lock_path
             and not submission_ambiguous
@@ -4759,6 +5412,8 @@ def sign_and_send_cis_information_change(
                 submission_storage,
                 submission_lock_path,
             )
+        if isinstance(e, SignaturePending):
+            raise
         logger.exception("[!] Ошибка в sign_and_send_cis_information_change")
         raise
 
@@ -4801,7 +5456,7 @@ def update_cis_information_change_status(task_id: str, group: str = None):
     if not token:
         raise RuntimeError(f"[!] JWT токен для ИНН {participant_inn} не найден")
 
-    status_result = HonestSignAPI(token=token).doc(document_id, pg=group)
+    status_result = _true_api_document_status(HonestSignAPI(token=token), receipt, group)
     if not status_result:
         raise RuntimeError("[!] True API вернул пустой статус")
     if isinstance(status_result, dict) and status_result.get("error"):
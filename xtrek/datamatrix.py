@@ -0,0 +1,145 @@
+from array import array
+from typing import Iterable, NamedTuple, Optional
+
+# ---------------------------------------------------------------------------
+# Разбор кодов маркировки GS1 DataMatrix за один проход.
+#
+# Код КИ: 01 + GTIN(14) + 21 + серийный номер, далее через GS (\u001d)
+# криптохвост: 91 (ключ), 92 (подпись) или 93 (код проверки). SSCC: 00 + 18 цифр.
+# Поля переменной длины заканчиваются на GS или в конце кода. Сканер может
+# добавить в начало идентификатор символики (]d2) или FNC1 в виде GS.
+#
+# Разбор идет по позициям в исходной строке (startswith/find), без split и
+# промежуточных списков; смещения полей возвращаются вместе со значениями.
+# ---------------------------------------------------------------------------
+
+GS = '\u001d'
+
+# Идентификаторы символики, которые сканер передает перед данными
+SYMBOLOGY_PREFIXES = (']d2', ']C1', ']Q3')
+
+# AI с данными фиксированной длины (только цифры)
+FIXED_AIS = {'00': 18, '01': 14}
+# AI криптохвоста: данные до GS или до конца кода
+TAIL_AIS = ('91', '92', '93')
+
+
+class ParsedCode(NamedTuple):
+    """Результат разбора кода. Смещения - позиции в исходной строке."""
+    gtin: Optional[str]
+    serial: Optional[str]
+    sscc: Optional[str]
+    start: int       # начало данных (после идентификатора символики / FNC1)
+    ki_end: int      # конец КИ: первый GS после данных или длина кода
+    tail_start: int  # начало криптохвоста (после GS) или длина кода
+
+
+class ParsedCodes(NamedTuple):
+    """Пакетный результат разбора: столбцы одинаковой длины."""
+    gtins: list
+    serials: list
+    ki_ends: array
+    tail_starts: array
+
+    def __len__(self):
+        return len(self.gtins)
+
+
+def data_start(code: str) -> int:
+    """Позиция начала данных: пропускает идентификатор символики и FNC1 (GS)."""
+    pos = 3 if code.startswith(SYMBOLOGY_PREFIXES) else 0
+    if code.startswith(GS, pos):
+        pos += 1
+    return pos
+
+
+def _scan(code: str):
+    """(gtin, serial, sscc, start, ki_end, tail_start) для строки кода."""
+    n = len(code)
+    start = pos = data_start(code)
+    gtin = serial = sscc = None
+    while pos + 2 <= n:
+        is_gtin = code.startswith('01', pos)
+        if is_gtin or code.startswith('00', pos):
+            end = pos + 2 + (FIXED_AIS['01'] if is_gtin else FIXED_AIS['00'])
+            value = code[pos + 2:end]
+            if end > n or not (value.isascii() and value.isdigit()):
+                break
+            if is_gtin:
+                gtin = value
+            else:
+                sscc = value
+            pos = end
+            continue
+        if code.startswith('21', pos):
+            end = code.find(GS, pos + 2)
+            serial = code[pos + 2:n if end == -1 else end]
+        # После серийного номера идет только криптохвост (TAIL_AIS)
+        break
+
+    ki_end = code.find(GS, start)
+    if ki_end == -1:
+        ki_end = n
+    tail_start = ki_end + 1 if ki_end < n else n
+    return gtin, serial, sscc, start, ki_end, tail_start
+
+
+def parse_code(code) -> Optional[ParsedCode]:
+    """Разбирает один код. Для не-строки возвращает None."""
+    if not isinstance(code, str):
+        return None
+    return ParsedCode(*_scan(code))
+
+
+def parse_codes(codes: Iterable) -> ParsedCodes:
+    """
+    Разбирает список кодов в столбцы: GTIN, серийные номера, конец КИ и
+    начало криптохвоста. Для не-строк - None и смещения -1.
+    """
+    gtins, serials = [], []
+    ki_ends, tail_starts = array('l'), array('l')
+    for code in codes:
+        if isinstance(code, str):
+            gtin, serial, _, _, ki_end, tail_start = _scan(code)
+        else:
+            gtin = serial = None
+            ki_end = tail_start = -1
+        gtins.append(gtin)
+        serials.append(serial)
+        ki_ends.append(ki_end)
+        tail_starts.append(tail_start)
+    return ParsedCodes(gtins, serials, ki_ends, tail_starts)
+
+
+def cut_crypto_tail(code: str) -> str:
+    """Код без криптохвоста: данные до первого GS (без идентификатора символики)."""
+    start = data_start(code)
+    end = code.find(GS, start)
+    return code[start:] if end == -1 else code[start:end]
+
+
+def gtin_of(code) -> Optional[str]:
+    """GTIN из AI (01) в начале кода или None."""
+    if not isinstance(code, str):
+        return None
+    pos = data_start(code)
+    if not code.startswith('01', pos):
+        return None
+    value = code[pos + 2:pos + 16]
+    return value if len(value) == 14 and value.isascii() and value.isdigit() else None
+
+
+def ki_of(code) -> Optional[str]:
+    """КИ в виде 01 + GTIN + 21 + серийный номер или None, если код не разобран."""
+    parsed = parse_code(code)
+    if parsed is None or not parsed.gtin or not parsed.serial:
+        return None
+    return f"01{parsed.gtin}21{parsed.serial}"
+
+
+def short_code(code, length: int = 6) -> Optional[str]:
+    """Первые length символов серийного номера (AI 21) или None."""
+    parsed = parse_code(code)
+    if parsed is None or parsed.serial is None or len(parsed.serial) < length:
+        return None
+    return parsed.serial[:length]
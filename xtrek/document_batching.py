@@ -0,0 +1,411 @@
+import json
+import time
+import uuid
+import hashlib
+import logging
+
+from .config_loader import load_config
+from .storage import get_storage
+from .create_emission_task_sample import (
+    SignaturePending,
+    _claim_document_submission,
+    _release_document_submission_lock,
+    _resolve_utilisation_inn,
+    sign_and_send_introduce,
+    sign_and_send_utilisation,
+)
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Сводные документы по нескольким производственным заказам.
+#
+# Заказ, готовый к отчету о нанесении или вводу в оборот, не отправляется
+# сразу, а ставится в очередь пакета. Пакет объединяет заказы одного участника
+# и товарной группы с совместимыми реквизитами документа. По окну времени или
+# по размеру из задач заказов собирается один документ, который подписывается
+# и отправляется один раз, а чек раскладывается в папку чеков каждого заказа -
+# дальше заказы идут по обычной цепочке проверки статуса.
+#
+# Конфигурация (раздел document_batching, по умолчанию выключено):
+#   "document_batching": {
+#       "path": "s3://<internal_bucket>/documentBatches/",
+#       "utilisation": {"window_seconds": 300, "max_orders": 50, "max_codes": 30000},
+#       "introduce": {"window_seconds": 300, "max_orders": 50, "max_codes": 30000}
+#   }
+# ---------------------------------------------------------------------------
+
+BATCH_ID_PREFIX = "B-"
+
+DEFAULT_WINDOW_SECONDS = 300
+DEFAULT_MAX_ORDERS = 50
+# Ограничения API на количество кодов в одном документе
+DEFAULT_MAX_CODES = {
+    "utilisation": 30000,
+    "introduce": 30000,
+}
+
+# Тип документа -> ключи конфигурации папок задач и чеков
+DOCUMENT_PATHS = {
+    "utilisation": ("utilisation_tasks_path", "utilisation_receipts"),
+    "introduce": ("introduce-tasks", "introduce-receipts"),
+}
+# Поле идентификатора документа в чеке пакета
+RECEIPT_ID_FIELDS = {
+    "utilisation": "reportId",
+    "introduce": "document_id",
+}
+
+
+def batching_settings(config, doc_type):
+    """Настройки пакетирования типа документа или None, если оно выключено."""
+    settings = (config.get('document_batching') or {})
+    doc_settings = settings.get(doc_type)
+    if not doc_settings or not settings.get('path'):
+        return None
+    if doc_settings is True:
+        doc_settings = {}
+    return {
+        "path": settings['path'],
+        "window_seconds": doc_settings.get('window_seconds', DEFAULT_WINDOW_SECONDS),
+        "max_orders": doc_settings.get('max_orders', DEFAULT_MAX_ORDERS),
+        "max_codes": doc_settings.get('max_codes', DEFAULT_MAX_CODES[doc_type]),
+    }
+
+
+def _batch_dir(settings, doc_type, kind):
+    return f"{settings['path'].rstrip('/')}/{doc_type}/{kind}"
+
+
+def _task_path(config, doc_type, task_id):
+    tasks_key, _ = DOCUMENT_PATHS[doc_type]
+    return f"{config.get(tasks_key).rstrip('/')}/{task_id}.json"
+
+
+def _receipt_path(config, doc_type, task_id):
+    _, receipts_key = DOCUMENT_PATHS[doc_type]
+    return f"{config.get(receipts_key).rstrip('/')}/{task_id}.json"
+
+
+def _batch_key(config, doc_type, group, task_data):
+    """
+    Ключ совместимости: заказы с одинаковым ключом можно объединить в один
+    документ. Возвращает (ключ, ИНН участника, количество кодов).
+    """
+    if doc_type == "utilisation":
+        inn = _resolve_utilisation_inn(config, task_data, task_data.get('productionOrderId'))
+        compatible = {
+            "productGroup": task_data.get('productGroup') or group,
+            "usageType": task_data.get('usageType'),
+            "attributes": task_data.get('attributes') or {},
+        }
+        codes = len(task_data.get('sntins') or [])
+    else:
+        inn = task_data.get('participant_inn') or task_data.get('owner_inn')
+        compatible = {
+            key: value for key, value in task_data.items()
+            if key not in ('products', 'productionOrderId')
+        }
+        codes = len(task_data.get('products') or [])
+
+    if not inn:
+        raise RuntimeError(f"[!] Не удалось определить ИНН участника для пакета {doc_type}")
+    fingerprint = json.dumps(
+        {"inn": inn, "group": group, "document": compatible},
+        sort_keys=True, ensure_ascii=False,
+    )
+    digest = hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:16]
+    return f"{inn}_{group}_{digest}", inn, codes
+
+
+def enqueue_document(doc_type, order_id, group):
+    """
+    Ставит готовую задачу заказа (utilisation/introduce) в очередь пакета.
+    Задача должна быть уже создана в папке задач этого типа документа.
+    """
+    config = load_config('suz_worker_config')
+    settings = batching_settings(config, doc_type)
+    if settings is None:
+        raise RuntimeError(f"[!] Пакетирование {doc_type} не настроено (document_batching)")
+    s3_config = config.get('s3_config')
+
+    task_path = _task_path(config, doc_type, order_id)
+    storage_tasks = get_storage(task_path, s3_config)
+    if not storage_tasks.exists(task_path):
+        raise RuntimeError(f"[!] Задача {doc_type} для пакета не найдена: {task_path}")
+    task_data = json.loads(storage_tasks.read_text(task_path))
+
+    batch_key, inn, codes = _batch_key(config, doc_type, group, task_data)
+    entry = {
+        "orderId": str(order_id),
+        "batchKey": batch_key,
+        "group": group,
+        "inn": inn,
+        "codes": codes,
+        "enqueuedAtUnix": time.time(),
+    }
+    pending_dir = _batch_dir(settings, doc_type, "pending")
+    storage = get_storage(pending_dir, s3_config)
+    entry_path = f"{pending_dir}/{order_id}.json"
+    if storage.exists(entry_path):
+        # Повторная постановка не сдвигает окно пакета
+        entry["enqueuedAtUnix"] = json.loads(storage.read_text(entry_path)).get(
+            "enqueuedAtUnix", entry["enqueuedAtUnix"]
+        )
+    storage.write_text(entry_path, json.dumps(entry, ensure_ascii=False, indent=4))
+    logger.info(f"[BATCH] {doc_type} {order_id} добавлен в пакет {batch_key} ({codes} кодов)")
+    return batch_key
+
+
+def _pack_entries(entries, max_orders, max_codes):
+    """Жадная упаковка заказов в пакеты в порядке постановки в очередь."""
+    batches, current, current_codes = [], [], 0
+    for entry in sorted(entries, key=lambda e: e["enqueuedAtUnix"]):
+        if current and (len(current) >= max_orders or current_codes + entry["codes"] > max_codes):
+            batches.append(current)
+            current, current_codes = [], 0
+        current.append(entry)
+        current_codes += entry["codes"]
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _combine_tasks(doc_type, tasks):
+    """Собирает один документ из задач заказов с одинаковым ключом совместимости."""
+    combined = dict(tasks[0])
+    if doc_type == "utilisation":
+        combined["sntins"] = [code for task in tasks for code in task.get("sntins") or []]
+        # По первому заказу sign_and_send_utilisation определит ИНН участника
+        combined["productionOrderId"] = tasks[0].get("productionOrderId")
+    else:
+        combined["products"] = [product for task in tasks for product in task.get("products") or []]
+        combined.pop("productionOrderId", None)
+    return combined
+
+
+def _send(doc_type, task_id, group, config, wait_signature, receipts_path=None):
+    signing_dir = config.get('sign')
+    timeout = config.get('SIGNING_TIMEOUT', 120)
+    if doc_type == "utilisation":
+        if receipts_path is None:
+            return sign_and_send_utilisation(task_id, signing_dir, timeout, wait_signature=wait_signature)
+        return sign_and_send_utilisation(
+            task_id, signing_dir, timeout, wait_signature=wait_signature,
+            receipts_path=receipts_path, send_order_id=False,
+        )
+    return sign_and_send_introduce(
+        task_id, group, signing_dir, timeout,
+        wait_signature=wait_signature, receipts_path=receipts_path,
+    )
+
+
+def _fan_out_receipt(config, doc_type, batch, receipt):
+    """Раскладывает чек сводного документа в папку чеков каждого заказа."""
+    s3_config = config.get('s3_config')
+    for order in batch["orders"]:
+        order_receipt = dict(receipt)
+        order_receipt["productionOrderId"] = order.get("productionOrderId") or order["orderId"]
+        order_receipt["batchId"] = batch["batchId"]
+        if doc_type == "utilisation":
+            order_receipt["orderId"] = order["orderId"]
+        receipt_path = _receipt_path(config, doc_type, order["orderId"])
+        get_storage(receipt_path, s3_config).write_text(
+            receipt_path, json.dumps(order_receipt, ensure_ascii=False, indent=4)
+        )
+
+
+def _send_batch(config, settings, doc_type, batch_path, batch, wait_signature):
+    """
+    Отправляет сводный документ пакета под захватом отправки по id пакета:
+    повторная доставка сброса не отправляет пакет второй раз, а по
+    сохраненному чеку только дорассылает его заказам.
+    """
+    s3_config = config.get('s3_config')
+    batch_receipts = _batch_dir(settings, doc_type, "receipts")
+    existing_receipt, receipts_storage, receipt_path, lock_path = _claim_document_submission(
+        batch_receipts, s3_config, f"{doc_type}-batch", batch["batchId"],
+        id_field=RECEIPT_ID_FIELDS[doc_type],
+    )
+    try:
+        if existing_receipt is None:
+            try:
+                result = _send(doc_type, batch["batchId"], batch["group"], config, wait_signature, batch_receipts)
+            except SignaturePending:
+                logger.info(f"[BATCH] {batch['batchId']} ожидает подпись")
+                return False
+            if not result or (isinstance(result, str) and result.startswith('{')):
+                raise RuntimeError(f"[!] Ошибка отправки пакета {batch['batchId']}: {result}")
+            receipt = json.loads(receipts_storage.read_text(receipt_path))
+        else:
+            receipt = existing_receipt
+        _fan_out_receipt(config, doc_type, batch, receipt)
+
+        batch["status"] = "sent"
+        batch["sentAtUnix"] = time.time()
+        get_storage(batch_path, s3_config).write_text(batch_path, json.dumps(batch, ensure_ascii=False, indent=4))
+    finally:
+        _release_document_submission_lock(receipts_storage, lock_path)
+    logger.info(
+        f"[BATCH] {doc_type} {batch['batchId']} отправлен, чек разослан "
+        f"{len(batch['orders'])} заказам"
+    )
+    return True
+
+
+def _move_entry_to_errors(config, settings, doc_type, entry, error):
+    """
+    Переносит заказ из очереди в errors/ с причиной: заказ, который не удалось
+    отправить, не должен останавливать сброс остальных заказов и пакетов.
+    """
+    s3_config = config.get('s3_config')
+    error_path = f"{_batch_dir(settings, doc_type, 'errors')}/{entry['orderId']}.json"
+    error_entry = {**entry, "error": str(error), "failedAtUnix": time.time()}
+    get_storage(error_path, s3_config).write_text(error_path, json.dumps(error_entry, ensure_ascii=False, indent=4))
+    pending_dir = _batch_dir(settings, doc_type, "pending")
+    get_storage(pending_dir, s3_config).delete(f"{pending_dir}/{entry['orderId']}.json")
+    return error_path
+
+
+def _batch_id(doc_type, entries):
+    # Id определяется составом пакета: повторное формирование после сбоя
+    # пишет те же файлы, а не создает второй пакет
+    members = ",".join(sorted(entry["orderId"] for entry in entries))
+    return f"{BATCH_ID_PREFIX}{uuid.uuid5(uuid.NAMESPACE_URL, f'xtrek-batch/{doc_type}/{members}')}"
+
+
+def _open_batch(config, settings, doc_type, entries):
+    """
+    Создает сводную задачу и запись пакета; снимает заказы с очереди.
+
+    Запись пакета со списком заказов пишется одной записью и последней:
+    пакет существует, только когда его сводная задача уже выложена. Заказы
+    из записи пакета, оставшиеся в очереди после сбоя, повторно не
+    упаковываются (см. flush_document_batches).
+    """
+    s3_config = config.get('s3_config')
+    tasks = []
+    orders = []
+    for entry in entries:
+        task_path = _task_path(config, doc_type, entry["orderId"])
+        task_data = json.loads(get_storage(task_path, s3_config).read_text(task_path))
+        tasks.append(task_data)
+        orders.append({
+            "orderId": entry["orderId"],
+            "productionOrderId": task_data.get("productionOrderId"),
+            "codes": entry["codes"],
+        })
+
+    batch_id = _batch_id(doc_type, entries)
+    combined_path = _task_path(config, doc_type, batch_id)
+    get_storage(combined_path, s3_config).write_text(
+        combined_path, json.dumps(_combine_tasks(doc_type, tasks), ensure_ascii=False)
+    )
+
+    batch = {
+        "batchId": batch_id,
+        "documentType": doc_type,
+        "batchKey": entries[0]["batchKey"],
+        "group": entries[0]["group"],
+        "inn": entries[0]["inn"],
+        "orders": orders,
+        "status": "open",
+        "createdAtUnix": time.time(),
+    }
+    batch_path = f"{_batch_dir(settings, doc_type, 'batches')}/{batch_id}.json"
+    get_storage(batch_path, s3_config).write_text(batch_path, json.dumps(batch, ensure_ascii=False, indent=4))
+
+    pending_dir = _batch_dir(settings, doc_type, "pending")
+    storage_pending = get_storage(pending_dir, s3_config)
+    for entry in entries:
+        storage_pending.delete(f"{pending_dir}/{entry['orderId']}.json")
+    logger.info(f"[BATCH] Сформирован пакет {batch_id}: {len(entries)} заказов {doc_type}")
+    return batch_path, batch
+
+
+def flush_document_batches(doc_type, force=False, wait_signature=False):
+    """
+    Формирует и отправляет пакеты типа документа. Пакет формируется, когда
+    набрано max_orders заказов или max_codes кодов, либо истекло окно
+    window_seconds с постановки первого заказа (force - не ждать окна).
+    Пакеты, ожидающие подпись, дозапускаются при следующем вызове.
+    Заказ, отправленный отдельно с ошибкой, переносится в errors/ и не мешает
+    остальным.
+    """
+    config = load_config('suz_worker_config')
+    settings = batching_settings(config, doc_type)
+    if settings is None:
+        return {"opened": 0, "sent": 0, "single": 0, "failed": 0}
+    s3_config = config.get('s3_config')
+
+    lock_path = f"{settings['path'].rstrip('/')}/{doc_type}/flush.lock"
+    lock_storage = get_storage(lock_path, s3_config)
+    if not lock_storage.acquire_lock(lock_path, json.dumps({"createdAtUnix": time.time()})):
+        logger.info(f"[BATCH] Пакеты {doc_type} уже обрабатываются другим воркером")
+        return {"opened": 0, "sent": 0, "single": 0, "failed": 0}
+
+    stats = {"opened": 0, "sent": 0, "single": 0, "failed": 0}
+    try:
+        # 1. Дозапуск пакетов, ожидающих подпись
+        batches_dir = _batch_dir(settings, doc_type, "batches")
+        storage_batches = get_storage(batches_dir, s3_config)
+        open_batches = []
+        batched_orders = set()
+        for batch_path in storage_batches.list_files(batches_dir, "*.json"):
+            batch = json.loads(storage_batches.read_text(batch_path))
+            batched_orders.update(order["orderId"] for order in batch.get("orders") or [])
+            if batch.get("status") == "open":
+                open_batches.append((batch_path, batch))
+
+        # 2. Новые пакеты из очереди
+        pending_dir = _batch_dir(settings, doc_type, "pending")
+        storage_pending = get_storage(pending_dir, s3_config)
+        groups = {}
+        for entry_path in storage_pending.list_files(pending_dir, "*.json"):
+            entry = json.loads(storage_pending.read_text(entry_path))
+            if entry["orderId"] in batched_orders:
+                # Заказ уже в пакете: снятие с очереди прервал сбой
+                storage_pending.delete(entry_path)
+                continue
+            groups.setdefault(entry["batchKey"], []).append(entry)
+
+        now = time.time()
+        for batch_key, entries in groups.items():
+            due = (
+                force
+                or len(entries) >= settings["max_orders"]
+                or sum(e["codes"] for e in entries) >= settings["max_codes"]
+                or now - min(e["enqueuedAtUnix"] for e in entries) >= settings["window_seconds"]
+            )
+            if not due:
+                continue
+            for packed in _pack_entries(entries, settings["max_orders"], settings["max_codes"]):
+                if len(packed) == 1:
+                    # Один заказ отправляется обычным документом без сводного чека
+                    entry = packed[0]
+                    try:
+                        result = _send(doc_type, entry["orderId"], entry["group"], config, wait_signature)
+                        if not result or (isinstance(result, str) and result.startswith('{')):
+                            raise RuntimeError(f"[!] Ошибка отправки: {result}")
+                    except SignaturePending:
+                        continue
+                    except Exception as e:
+                        error_path = _move_entry_to_errors(config, settings, doc_type, entry, e)
+                        logger.error(f"[BATCH] Заказ {entry['orderId']} не отправлен ({e}), перенесен в {error_path}")
+                        stats["failed"] += 1
+                        continue
+                    storage_pending.delete(f"{pending_dir}/{entry['orderId']}.json")
+                    stats["single"] += 1
+                    continue
+                open_batches.append(_open_batch(config, settings, doc_type, packed))
+                stats["opened"] += 1
+
+        for batch_path, batch in open_batches:
+            try:
+                if _send_batch(config, settings, doc_type, batch_path, batch, wait_signature):
+                    stats["sent"] += 1
+            except Exception as e:
+                logger.error(f"[BATCH] Ошибка отправки пакета {batch['batchId']}: {e}")
+    finally:
+        lock_storage.release_lock(lock_path)
+    return stats
@@ -0,0 +1,197 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Разбиение больших документов на части.
+#
+# СУЗ и ГИС МТ ограничивают количество кодов и размер одного документа.
+# Документ, который не укладывается в ограничения, делится на части: каждая
+# часть - самостоятельный документ со своим id задачи (<id>__partNNN), своей
+# подписью и своим чеком. Родительская задача получает сводный чек со списком
+# частей, а функции статуса сводят статусы частей в один.
+#
+# Ограничения переопределяются разделом конфигурации document_chunking:
+#   "document_chunking": {
+#       "max_workers": 4,
+#       "utilisation": {"max_codes": 30000, "max_bytes": 20971520}
+#   }
+# ---------------------------------------------------------------------------
+
+PART_SEPARATOR = "__part"
+
+DEFAULT_MAX_WORKERS = 4
+# Размер тела одной части с запасом от ограничения на размер документа
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+
+DOCUMENT_LIMITS = {
+    "utilisation": {"max_codes": 30000},
+    "introduce": {"max_codes": 30000},
+    "aggregation": {"max_codes": 30000},
+    "aggregation-set": {"max_codes": 30000},
+    # Совпадает с CIS_INFORMATION_CHANGE_MAX_CODES
+    "cis-information-change": {"max_codes": 35000},
+}
+
+
+def document_limits(config, operation):
+    """Ограничения документа operation с учетом раздела document_chunking."""
+    overrides = ((config or {}).get('document_chunking') or {}).get(operation) or {}
+    limits = {"max_codes": None, "max_bytes": DEFAULT_MAX_BYTES}
+    limits.update(DOCUMENT_LIMITS.get(operation, {}))
+    limits.update(overrides)
+    return limits
+
+
+def chunking_workers(config):
+    return ((config or {}).get('document_chunking') or {}).get('max_workers', DEFAULT_MAX_WORKERS)
+
+
+def part_task_id(task_id, index):
+    return f"{task_id}{PART_SEPARATOR}{index:03d}"
+
+
+def is_part_task_id(task_id):
+    return PART_SEPARATOR in str(task_id)
+
+
+def _item_size(item):
+    return len(json.dumps(item, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def pack_items(items, max_codes=None, max_bytes=None, codes=len, size=_item_size):
+    """
+    Жадно раскладывает неделимые элементы по частям в исходном порядке.
+    codes(item) - количество кодов элемента, size(item) - размер в байтах.
+    Элемент, который сам превышает ограничение, попадает в отдельную часть.
+    """
+    parts, current, current_codes, current_bytes = [], [], 0, 0
+    for item in items:
+        item_codes, item_bytes = codes(item), size(item)
+        overflow = (
+            (max_codes and current_codes + item_codes > max_codes)
+            or (max_bytes and current_bytes + item_bytes > max_bytes)
+        )
+        if current and overflow:
+            parts.append(current)
+            current, current_codes, current_bytes = [], 0, 0
+        current.append(item)
+        current_codes += item_codes
+        current_bytes += item_bytes
+    if current:
+        parts.append(current)
+    return parts
+
+
+def aggregation_clusters(units):
+    """
+    Группирует единицы агрегации, которые нельзя разносить по разным
+    документам: паллета идет вместе со всеми вложенными коробами.
+    Возвращает списки единиц в исходном порядке.
+    """
+    serial_index = {
+        unit.get('unitSerialNumber'): index
+        for index, unit in enumerate(units) if unit.get('unitSerialNumber')
+    }
+    parent = list(range(len(units)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    for index, unit in enumerate(units):
+        children = list(unit.get('sntins') or []) + list(unit.get('unitSerialNumberList') or [])
+        for child in children:
+            child_index = serial_index.get(child)
+            if child_index is not None:
+                parent[find(child_index)] = find(index)
+
+    clusters = {}
+    for index in range(len(units)):
+        clusters.setdefault(find(index), []).append(index)
+    ordered = sorted(clusters.values(), key=lambda members: members[0])
+    return [[units[index] for index in members] for members in ordered]
+
+
+def _unit_codes(unit):
+    return len(unit.get('sntins') or []) + len(unit.get('unitSerialNumberList') or [])
+
+
+def _split_list_field(task_data, field, limits):
+    items = task_data.get(field) or []
+    packed = pack_items(items, limits.get("max_codes"), limits.get("max_bytes"), codes=lambda item: 1)
+    return [{**task_data, field: chunk} for chunk in packed]
+
+
+def _split_aggregation(task_data, limits):
+    clusters = aggregation_clusters(task_data.get('aggregationUnits') or [])
+    packed = pack_items(
+        clusters, limits.get("max_codes"), limits.get("max_bytes"),
+        codes=lambda cluster: sum(_unit_codes(unit) for unit in cluster),
+    )
+    return [
+        {**task_data, 'aggregationUnits': [unit for cluster in chunk for unit in cluster]}
+        for chunk in packed
+    ]
+
+
+def _split_cis_information_change(task_data, limits):
+    # Группа кодов делится на части, каждая часть сохраняет реквизиты группы
+    items = [
+        (group_index, code)
+        for group_index, group in enumerate(task_data.get('codes') or [])
+        for code in group.get('code') or []
+    ]
+    packed = pack_items(
+        items, limits.get("max_codes"), limits.get("max_bytes"),
+        codes=lambda item: 1, size=lambda item: len(item[1]) + 3,
+    )
+    groups = task_data.get('codes') or []
+    parts = []
+    for chunk in packed:
+        part_groups = {}
+        for group_index, code in chunk:
+            part_groups.setdefault(group_index, []).append(code)
+        parts.append({
+            **task_data,
+            'codes': [{**groups[index], 'code': codes} for index, codes in part_groups.items()],
+        })
+    return parts
+
+
+_SPLITTERS = {
+    "utilisation": lambda task, limits: _split_list_field(task, 'sntins', limits),
+    "introduce": lambda task, limits: _split_list_field(task, 'products', limits),
+    "aggregation": _split_aggregation,
+    "aggregation-set": _split_aggregation,
+    "cis-information-change": _split_cis_information_change,
+}
+
+
+def split_document(operation, task_data, limits):
+    """
+    Делит тело документа operation на части в пределах limits. Документ,
+    который укладывается в ограничения, возвращается как есть одной частью.
+    """
+    splitter = _SPLITTERS.get(operation)
+    if splitter is None:
+        return [task_data]
+    parts = splitter(task_data, limits)
+    if len(parts) <= 1:
+        return [task_data]
+    logger.info(f"[CHUNK] Документ {operation} разделен на {len(parts)} частей")
+    return parts
+
+
+def combine_part_states(states, success_state):
+    """
+    Сводный статус частей: success_state, только если он у всех частей,
+    иначе статус первой части, которая его еще не достигла.
+    """
+    for state in states:
+        if state != success_state:
+            return state
+    return success_state
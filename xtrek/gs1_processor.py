@@ -61,37 +61,63 @@ def get_inn_by_gtin(gtin, db_path=None):
         logger.error(f"Ошибка при поиске в базе: {e}")
         return None
 
+def _csv_delimiter(first_line):
+    # Простейшее определение разделителя
+    return ';' if ';' in first_line else ','
+
+def iter_csv_gtins(file_path):
+    """Построчно выдает значения колонки gtin из CSV, не загружая файл целиком."""
+    with open(file_path, mode='r', encoding='utf-8', errors='ignore') as f:
+        first_line = f.readline()
+        if not first_line:
+            return
+        delimiter = _csv_delimiter(first_line)
+
+        # Читаем заголовки и приводим к нижнему регистру
+        headers = [h.strip().lower() for h in first_line.split(delimiter)]
+        if 'gtin' not in headers:
+            return
+        gtin_idx = headers.index('gtin')
+
+        for row in csv.reader(f, delimiter=delimiter):
+            if len(row) > gtin_idx:
+                yield row[gtin_idx]
+
+def iter_xlsx_gtins(file_path):
+    """Построчно выдает значения колонки gtin из XLSX (openpyxl read-only/iter_rows)."""
+    if not HAS_OPENPYXL:
+        return
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = wb.active
+        header_row = next(sheet.iter_rows(max_row=1, values_only=True), None)
+        if not header_row:
+            return
+        headers = [str(value).strip().lower() for value in header_row]
+        if 'gtin' not in headers:
+            return
+        gtin_idx = headers.index('gtin')
+        for row in sheet.iter_rows(min_row=2, values_only=True):
+            if len(row) > gtin_idx:
+                yield row[gtin_idx]
+    finally:
+        wb.close()
+
 def parse_csv(file_path, inn, prefix_map):
     try:
-        with open(file_path, mode='r', encoding='utf-8', errors='ignore') as f:
-            first_line = f.readline()
-            if not first_line:
-                return
-            # Простейшее определение разделителя
-            delimiter = ';' if ';' in first_line else ','
-
-            # Читаем заголовки и приводим к нижнему регистру
-            headers = [h.strip().lower() for h in first_line.split(delimiter)]
-
-            reader = csv.DictReader(f, fieldnames=headers, delimiter=delimiter)
-            for row in reader:
-                prefix = get_gs1_prefix(row.get('gtin'))
-                if prefix:
-                    prefix_map[prefix] = inn
+        for gtin in iter_csv_gtins(file_path):
+            prefix = get_gs1_prefix(gtin)
+            if prefix:
+                prefix_map[prefix] = inn
     except Exception as e:
         logger.error(f"Ошибка в CSV {file_path}: {e}")
 
 def parse_xlsx(file_path, inn, prefix_map):
     if not HAS_OPENPYXL: return
     try:
-        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
-        sheet = wb.active
-        headers = [str(cell.value).strip().lower() for cell in next(sheet.iter_rows(max_row=1))]
-        if 'gtin' in headers:
-            gtin_idx = headers.index('gtin')
-            for row in sheet.iter_rows(min_row=2, values_only=True):
-                prefix = get_gs1_prefix(row[gtin_idx])
-                if prefix: prefix_map[prefix] = inn
+        for gtin in iter_xlsx_gtins(file_path):
+            prefix = get_gs1_prefix(gtin)
+            if prefix: prefix_map[prefix] = inn
     except Exception as e:
         logger.error(f"Ошибка в XLSX {file_path}: {e}")
 
@@ -108,15 +134,113 @@ def build_prefix_inn_dict(masks):
                 parse_csv(file_path, inn, prefix_map)
     return prefix_map
 
+def collect_input_files(masks):
+    """Список входных файлов по маскам без дублей, в стабильном порядке."""
+    files = set()
+    for mask in masks:
+        for file_path in glob.glob(mask):
+            if extract_inn_from_filename(Path(file_path).name) != "unknown":
+                files.add(os.path.abspath(file_path))
+    return sorted(files)
+
+def count_file_prefixes(file_path):
+    """
+    Разбирает один файл реестра потоком и возвращает (inn, {prefix: кол-во GTIN}).
+    Функция верхнего уровня, чтобы ее можно было выполнять в пуле процессов.
+    """
+    inn = extract_inn_from_filename(Path(file_path).name)
+    counts = {}
+    try:
+        if file_path.lower().endswith('.xlsx'):
+            gtins = iter_xlsx_gtins(file_path)
+        else:
+            gtins = iter_csv_gtins(file_path)
+        for gtin in gtins:
+            prefix = get_gs1_prefix(gtin)
+            if prefix:
+                counts[prefix] = counts.get(prefix, 0) + 1
+    except Exception as e:
+        logger.error(f"Ошибка при разборе {file_path}: {e}")
+    return inn, counts
+
+def merge_prefix_counts(file_results):
+    """
+    Детерминированно объединяет результаты разбора файлов.
+
+    Если префикс встречается у нескольких ИНН, побеждает ИНН с наибольшим
+    количеством GTIN под этим префиксом, при равенстве - меньший ИНН.
+    Возвращает (prefix_map, conflicts), где conflicts = {prefix: {inn: кол-во}}.
+    """
+    votes = {}
+    for inn, counts in file_results:
+        for prefix, count in counts.items():
+            by_inn = votes.setdefault(prefix, {})
+            by_inn[inn] = by_inn.get(inn, 0) + count
+
+    prefix_map = {}
+    conflicts = {}
+    for prefix in sorted(votes):
+        by_inn = votes[prefix]
+        prefix_map[prefix] = min(by_inn, key=lambda inn: (-by_inn[inn], inn))
+        if len(by_inn) > 1:
+            conflicts[prefix] = dict(sorted(by_inn.items()))
+    return prefix_map, conflicts
+
+def build_prefix_inn_db(masks, workers=None):
+    """
+    Строит базу префикс -> ИНН, разбирая входные файлы параллельно в пуле процессов.
+    Возвращает (prefix_map, conflicts), см. merge_prefix_counts.
+    """
+    files = collect_input_files(masks)
+    if not files:
+        return {}, {}
+
+    if workers == 1 or len(files) == 1:
+        results = [count_file_prefixes(f) for f in files]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map сохраняет порядок файлов, поэтому слияние детерминировано
+            results = list(executor.map(count_file_prefixes, files))
+
+    for file_path, (inn, counts) in zip(files, results):
+        logger.info(f"{Path(file_path).name}: ИНН {inn}, префиксов {len(counts)}")
+    return merge_prefix_counts(results)
+
+def write_json_mapping(mapping, output_path):
+    """
+    Записывает словарь в JSON построчно через временный файл и атомарно
+    заменяет результат, чтобы читатели get_inn_by_gtin не видели неполную базу.
+    """
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as jf:
+        jf.write('{')
+        for i, (key, value) in enumerate(mapping.items()):
+            jf.write(',\n' if i else '\n')
+            jf.write(f"    {json.dumps(key, ensure_ascii=False)}: "
+                     f"{json.dumps(value, ensure_ascii=False)}")
+        jf.write('\n}' if mapping else '}')
+    os.replace(tmp_path, output_path)
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--masks', nargs='+', default=["owned_gtins*.csv", "linked_gtins*.csv", "owned_gtins*.xlsx"])
     parser.add_argument('--output', default='gs1prefix_inn_db.json')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Количество процессов для разбора файлов (по умолчанию - по числу CPU)')
+    parser.add_argument('--conflicts', default=None,
+                        help='Файл отчета о конфликтах префикс -> несколько ИНН')
     args = parser.parse_args()
-    db = build_prefix_inn_dict(args.masks)
+    db, conflicts = build_prefix_inn_db(args.masks, workers=args.workers)
+    if conflicts:
+        logger.warning(f"Найдено конфликтующих префиксов: {len(conflicts)}")
+        for prefix, by_inn in conflicts.items():
+            logger.warning(f"Префикс {prefix}: {by_inn} -> выбран ИНН {db[prefix]}")
+        if args.conflicts:
+            write_json_mapping(conflicts, args.conflicts)
+            logger.info(f"Отчет о конфликтах сохранен: {args.conflicts}")
     if db:
-        with open(args.output, 'w', encoding='utf-8') as jf:
-            json.dump(db, jf, ensure_ascii=False, indent=4)
+        write_json_mapping(db, args.output)
         logger.info(f"База сохранена: {args.output}")
 
 if __name__ == "__main__":
@@ -1,26 +1,28 @@
 import json
-import re
 import sys
 import xlsxwriter
 from pathlib import Path
 
+try:
+    from .datamatrix import GS, ki_of
+except ImportError:
+    # Запуск файла как скрипта
+    from datamatrix import GS, ki_of
+
 def parse_dm_code(full_code):
     """
     Извлекает из кода КИ (GTIN + Серийный номер), отсекая криптохвост.
     """
     if not isinstance(full_code, str):
         return ""
-    
-    # Регулярное выражение: ищем 01 + 14 цифр и 21 + всё до разделителя GS (\u001d)
-    match = re.search(r"01(\d{14})21([^\u001d]+)", full_code)
-    
-    if match:
-        gtin = match.group(1)
-        serial = match.group(2)
-        return f"01{gtin}21{serial}"
-    
+
+    # 01 + GTIN(14) + 21 + серийный номер до разделителя GS
+    ki = ki_of(full_code.strip())
+    if ki:
+        return ki
+
     # Если формат не стандартный, просто убираем символ GS
-    return full_code.replace('\u001d', '').strip()
+    return full_code.replace(GS, '').strip()
 
 def convert_json_to_xlsx(input_json, output_xlsx=None):
     """
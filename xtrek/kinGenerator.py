@@ -1,10 +1,17 @@
 import json
+from collections import deque
 from datetime import datetime, timedelta
 import uuid
 import random
 import os
 import logging
 
+try:
+    from .datamatrix import gtin_of, parse_code, parse_codes
+except ImportError:
+    # Запуск файла как скрипта
+    from datamatrix import gtin_of, parse_code, parse_codes
+
 # Настройка логгера ДО проверки google.colab
 def setup_logger():
     """Настройка логгера для минимального вывода информации"""
@@ -26,6 +33,13 @@ def setup_logger():
 # Инициализация логгера ПЕРВОЙ
 logger = setup_logger()
 
+# Потоковое чтение больших файлов кодов (необязательная зависимость)
+try:
+    import ijson
+    HAS_IJSON = True
+except ImportError:
+    HAS_IJSON = False
+
 # Теперь проверка наличия google.colab
 try:
     from google.colab import files
@@ -35,48 +49,157 @@ except ImportError:
     IN_COLAB = False
     logger.info("Работаем вне Google Colab")
 
+_UTF8_BOM = b'\xef\xbb\xbf'
+
+_REPORT_TAIL = {
+    "sampleNumbers": [],
+    "sampleNumbersFull": None,
+    "defectiveCodes": None,
+    "defectiveCodesFull": None,
+    "emptyNumbers": None
+}
+
+
+def _make_box(number, box_number, product_numbers, product_numbers_full, start_time):
+    return {
+        "Number": number,
+        "boxNumber": box_number,
+        "boxAgregate": True,
+        "boxTime": (start_time + timedelta(minutes=random.randint(2, 30))).isoformat(),
+        "productNumbers": product_numbers,
+        "productNumbersFull": product_numbers_full
+    }
+
+
+def iter_file_codes(file_path):
+    """
+    Коды из файла {"codes": [...]} по одному. С ijson файл читается потоково,
+    без него - загружается целиком, но только на время перебора.
+    """
+    if HAS_IJSON:
+        with open(file_path, 'rb') as f:
+            if f.read(3) != _UTF8_BOM:
+                f.seek(0)
+            yield from ijson.items(f, 'codes.item')
+        return
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        yield from data.get('codes') or []
+
+
+class KinReportWriter:
+    """
+    Пишет отчет КИН в поток по одной коробке (компактный JSON).
+    stream - любой объект с write(str): файл или поток хранилища.
+    """
+
+    def __init__(self, stream, report_id, start_time):
+        self.stream = stream
+        self.boxes = 0
+        self.products = 0
+        self.stream.write(
+            '{"id":' + json.dumps(report_id, ensure_ascii=False)
+            + ',"startTime":' + json.dumps(start_time.isoformat())
+            + ',"operators":[],"readyBox":['
+        )
+
+    def write_box(self, box):
+        if self.boxes:
+            self.stream.write(',')
+        self.stream.write(json.dumps(box, ensure_ascii=False, separators=(',', ':')))
+        self.boxes += 1
+        self.products += len(box['productNumbers'])
+
+    def close(self, end_time):
+        tail = {"endTime": end_time.isoformat(), **_REPORT_TAIL}
+        self.stream.write('],' + json.dumps(tail, separators=(',', ':'))[1:])
+
+
 class KinReportGenerator:
     def __init__(self):
         self.uploaded_files = {}
+        # Индекс GTIN -> коды, строится один раз после загрузки файлов
+        self._code_index = None
+        self._unindexed_files = None
         logger.info("Инициализация KinReportGenerator")
 
+    @staticmethod
+    def gtin_from_code(full_code):
+        """GTIN из AI (01) в начале кода маркировки или None."""
+        return gtin_of(full_code)
+
+    def _build_code_index(self):
+        """
+        Раскладывает коды всех загруженных файлов по GTIN из AI (01). Коды
+        без AI (01) в начале остаются по файлам и ищутся по вхождению GTIN
+        в первый код файла, как раньше.
+        """
+        index = {}
+        unindexed = []
+        # Сортируем имена файлов для детерминированного порядка
+        for filename in sorted(self.uploaded_files.keys()):
+            data = self.uploaded_files[filename]
+            codes = data.get('codes') if isinstance(data, dict) else None
+            if not codes:
+                continue
+            rest = []
+            for code in codes:
+                gtin = self.gtin_from_code(code)
+                if gtin is None:
+                    rest.append(code)
+                else:
+                    index.setdefault(gtin, []).append(code)
+            if rest:
+                unindexed.append(rest)
+        self._code_index = index
+        self._unindexed_files = unindexed
+
+    def _codes_for_gtin(self, gtin):
+        if self._code_index is None:
+            self._build_code_index()
+        codes = list(self._code_index.get(gtin, ()))
+        for file_codes in self._unindexed_files:
+            if gtin in file_codes[0]:
+                codes.extend(file_codes)
+        return codes
+
     def extract_short_code(self, full_code):
-        """Извлечение короткого кода из полного кода маркировки"""
+        """Извлечение короткого кода (6 символов серийного номера AI 21) из полного кода маркировки"""
         try:
             if not full_code or not isinstance(full_code, str):
                 logger.warning("Передан пустой или некорректный полный код маркировки")
                 return None
 
-            # Разделяем код по разделителю GS (\u001D)
-            parts = full_code.split('\u001D')
-            if not parts:
-                logger.warning("Не удалось разделить полный код по разделителю GS")
-                return None
-
-            # Первая часть содержит GTIN и короткий код
-            main_part = parts[0]
-
-            # Ищем позицию идентификатора 21 (код товара)
-            pos_21 = main_part.find('21')
-            if pos_21 == -1:
+            serial = parse_code(full_code).serial
+            if serial is None:
                 logger.warning("В полной маркировке не найден идентификатор '21'")
                 return None
 
-            # Извлекаем 6 символов после '21'
-            short_code_start = pos_21 + 2
-            short_code_end = short_code_start + 6
-
-            if short_code_end <= len(main_part):
-                short_code = main_part[short_code_start:short_code_end]
-                return short_code
-            else:
-                logger.warning("Не удалось извлечь 6 символов после '21'. Код слишком короткий")
-                return None
+            if len(serial) >= 6:
+                return serial[:6]
+            logger.warning("Не удалось извлечь 6 символов после '21'. Код слишком короткий")
+            return None
 
         except Exception as e:
             logger.error(f"Ошибка при извлечении короткого кода: {e}")
             return None
 
+    def extract_short_codes(self, full_codes):
+        """
+        Пакетный вариант extract_short_code: тот же результат для каждого
+        кода, но без вызова и логирования на каждый успешный код.
+        """
+        full_codes = list(full_codes)
+        short_codes = []
+        for full_code, serial in zip(full_codes, parse_codes(full_codes).serials):
+            if serial is not None and len(serial) >= 6:
+                short_codes.append(serial[:6])
+            else:
+                # Ошибочные коды разбирает одиночная функция - с прежними сообщениями
+                short_codes.append(self.extract_short_code(full_code))
+        return short_codes
+
     def load_json_file(self, file_path):
         """
         Загрузка JSON файла с поддержкой utf-8-sig для обработки BOM
@@ -110,6 +233,7 @@ class KinReportGenerator:
                 data = self.load_json_file(file_name)
                 if data is not None:
                     self.uploaded_files[file_name] = data
+                    self._code_index = None
                     logger.info(f"Загружен файл: {file_name}")
                     successful_loads += 1
                 else:
@@ -131,31 +255,17 @@ class KinReportGenerator:
 
         missing_files = []
 
-        # Проверяем наличие файла для Kigu
-        kigu_found = False
-        for filename, data in self.uploaded_files.items():
-            if 'codes' in data and data.get('codes'):
-                if data['codes'] and kigu_gtin in data['codes'][0]:
-                    kigu_found = True
-                    logger.info(f"Найден файл для Kigu GTIN: {kigu_gtin}")
-                    break
-
-        if not kigu_found:
+        # Проверяем наличие кодов для Kigu
+        if self._codes_for_gtin(kigu_gtin):
+            logger.info(f"Найден файл для Kigu GTIN: {kigu_gtin}")
+        else:
             missing_files.append(f"Kigu GTIN: {kigu_gtin}")
 
-        # Проверяем наличие файлов для всех Kit GTIN
-        found_kit_gtins = []
-        for kit_gtin in kit_gtins:
-            kit_found = False
-            for filename, data in self.uploaded_files.items():
-                if 'codes' in data and data.get('codes'):
-                    if data['codes'] and kit_gtin in data['codes'][0]:
-                        kit_found = True
-                        found_kit_gtins.append(kit_gtin)
-                        logger.info(f"Найден файл для Kit GTIN: {kit_gtin}")
-                        break
-
-            if not kit_found:
+        # Проверяем наличие кодов для всех Kit GTIN
+        for kit_gtin in dict.fromkeys(kit_gtins):
+            if self._codes_for_gtin(kit_gtin):
+                logger.info(f"Найден файл для Kit GTIN: {kit_gtin}")
+            else:
                 missing_files.append(f"Kit GTIN: {kit_gtin}")
 
         # Выводим отчет о проверке
@@ -169,12 +279,8 @@ class KinReportGenerator:
             code_files = [f for f, d in self.uploaded_files.items() if 'codes' in d and d.get('codes')]
             for code_file in code_files:
                 if self.uploaded_files[code_file]['codes']:
-                    first_code = self.uploaded_files[code_file]['codes'][0]
-                    # Извлекаем GTIN из первого кода (01{GTIN}21...)
-                    gtin_start = first_code.find('01') + 2
-                    gtin_end = first_code.find('21', gtin_start)
-                    if gtin_start > 1 and gtin_end > gtin_start:
-                        file_gtin = first_code[gtin_start:gtin_end]
+                    file_gtin = gtin_of(self.uploaded_files[code_file]['codes'][0])
+                    if file_gtin:
                         logger.info(f"   - {code_file} -> GTIN: {file_gtin}")
 
             return False
@@ -199,13 +305,7 @@ class KinReportGenerator:
 
     def get_all_codes_for_gtin(self, gtin):
         """Получение всех кодов для указанного GTIN из всех загруженных файлов"""
-        all_codes = []
-        # Сортируем имена файлов для детерминированного порядка
-        for filename in sorted(self.uploaded_files.keys()):
-            data = self.uploaded_files[filename]
-            if 'codes' in data and data.get('codes'):
-                if data['codes'] and gtin in data['codes'][0]:
-                    all_codes.extend(data['codes'])
+        all_codes = self._codes_for_gtin(gtin)
 
         if not all_codes:
             logger.warning(f"Не найдены коды для GTIN {gtin}")
@@ -308,8 +408,8 @@ class KinReportGenerator:
         if max_kits == 0:
             logger.error("Недостаточно кодов для создания наборов")
             logger.error(f"   Коды Kigu: {len(kigu_codes)}")
-            for i, kit_codes in enumerate(all_kit_codes):
-                logger.error(f"   Коды Kit {kit_gtins[i]}: {len(kit_codes)}")
+            for gtin, kit_codes in kit_codes_by_gtin.items():
+                logger.error(f"   Коды Kit {gtin}: {len(kit_codes)}")
             return None
 
         logger.info("Доступно кодов:")
@@ -356,22 +456,28 @@ class KinReportGenerator:
         logger.info(f"Создание данных отчета для {num_kits} наборов...")
 
         # Группируем коды по GTIN
-        kigu_pool = list(self.get_all_codes_for_gtin(kigu_gtin))
+        kigu_codes = self.get_all_codes_for_gtin(kigu_gtin)
 
-        kit_pools = {}
+        kit_codes = {}
         for gtin in set(kit_gtins):
-            kit_pools[gtin] = list(self.get_all_codes_for_gtin(gtin))
+            kit_codes[gtin] = self.get_all_codes_for_gtin(gtin)
 
         # Проверяем, что достаточно кодов
-        if len(kigu_pool) < num_kits:
-            logger.error(f"Недостаточно кодов Kigu: доступно {len(kigu_pool)}, нужно {num_kits}")
+        if len(kigu_codes) < num_kits:
+            logger.error(f"Недостаточно кодов Kigu: доступно {len(kigu_codes)}, нужно {num_kits}")
             return None
 
+        kit_pools = {}
         for gtin in set(kit_gtins):
             needed = kit_gtins.count(gtin) * num_kits
-            if len(kit_pools[gtin]) < needed:
-                logger.error(f"Недостаточно кодов для Kit GTIN {gtin}: доступно {len(kit_pools[gtin])}, нужно {needed}")
+            if len(kit_codes[gtin]) < needed:
+                logger.error(f"Недостаточно кодов для Kit GTIN {gtin}: доступно {len(kit_codes[gtin])}, нужно {needed}")
                 return None
+            # Короткие коды извлекаются пачкой только для кодов, которые попадут в отчет
+            full_codes = kit_codes[gtin][:needed]
+            kit_pools[gtin] = deque(zip(full_codes, self.extract_short_codes(full_codes)))
+
+        kigu_pool = deque(kigu_codes[:num_kits])
 
         # Поиск ID из основного файла для использования в отчете
         report_id = str(uuid.uuid4())
@@ -390,30 +496,15 @@ class KinReportGenerator:
 
             # Берем коды для каждого компонента набора
             for kit_gtin in kit_gtins:
-                if kit_pools[kit_gtin]:
-                    full_code = kit_pools[kit_gtin].pop(0)
-                    short_code = self.extract_short_code(full_code)
-
-                    if short_code:
-                        product_numbers.append(short_code)
-                        product_numbers_full.append(full_code)
+                full_code, short_code = kit_pools[kit_gtin].popleft()
+                if short_code:
+                    product_numbers.append(short_code)
+                    product_numbers_full.append(full_code)
 
             # Номер коробки из Kigu pool
-            if kigu_pool:
-                box_number = kigu_pool.pop(0)
-            else:
-                break
-
-            box = {
-                "Number": i,
-                "boxNumber": box_number,
-                "boxAgregate": True,
-                "boxTime": (start_time + timedelta(minutes=random.randint(2, 30))).isoformat(),
-                "productNumbers": product_numbers,
-                "productNumbersFull": product_numbers_full
-            }
+            box_number = kigu_pool.popleft()
 
-            ready_boxes.append(box)
+            ready_boxes.append(_make_box(i, box_number, product_numbers, product_numbers_full, start_time))
 
         logger.info(f"Создание данных отчета завершено. Сгенерировано {len(ready_boxes)} наборов")
 
@@ -423,13 +514,134 @@ class KinReportGenerator:
             "endTime": datetime.now().isoformat(),
             "operators": [],
             "readyBox": ready_boxes,
-            "sampleNumbers": [],
-            "sampleNumbersFull": None,
-            "defectiveCodes": None,
-            "defectiveCodesFull": None,
-            "emptyNumbers": None
+            **_REPORT_TAIL
         }
 
+    # --- Потоковый режим ---
+
+    def _scan_code_files(self, file_names):
+        """
+        Первый проход по файлам: основной файл с Hierarchy загружается, для
+        файлов кодов запоминается только количество кодов по GTIN.
+        """
+        self._file_counts = {}
+        self._file_unindexed = {}
+        main_data = None
+        for file_name in file_names:
+            if not os.path.exists(file_name):
+                logger.error(f"Файл не найден: {file_name}")
+                return None
+            counts = {}
+            first_unindexed = None
+            try:
+                for code in iter_file_codes(file_name):
+                    gtin = self.gtin_from_code(code)
+                    if gtin is None:
+                        if first_unindexed is None:
+                            first_unindexed = code
+                    else:
+                        counts[gtin] = counts.get(gtin, 0) + 1
+            except Exception as e:
+                logger.error(f"Ошибка чтения кодов из {file_name}: {e}")
+                return None
+            if counts or first_unindexed is not None:
+                self._file_counts[file_name] = counts
+                if first_unindexed is not None:
+                    self._file_unindexed[file_name] = first_unindexed
+            elif main_data is None:
+                data = self.load_json_file(file_name)
+                if isinstance(data, dict) and 'Hierarchy' in data:
+                    main_data = data
+                    self.uploaded_files = {file_name: data}
+                    self._code_index = None
+                    logger.info(f"Найден основной файл с Hierarchy: {file_name}")
+        return main_data
+
+    def _stream_count(self, gtin):
+        count = sum(counts.get(gtin, 0) for counts in self._file_counts.values())
+        for file_name, first_code in self._file_unindexed.items():
+            if gtin in first_code:
+                count += sum(1 for code in iter_file_codes(file_name) if self.gtin_from_code(code) is None)
+        return count
+
+    def _stream_codes(self, gtin):
+        """Коды GTIN в том же порядке, что и _codes_for_gtin, без загрузки всех файлов."""
+        for file_name in sorted(self._file_counts):
+            if self._file_counts[file_name].get(gtin):
+                for code in iter_file_codes(file_name):
+                    if self.gtin_from_code(code) == gtin:
+                        yield code
+        for file_name in sorted(self._file_unindexed):
+            if gtin in self._file_unindexed[file_name]:
+                for code in iter_file_codes(file_name):
+                    if self.gtin_from_code(code) is None:
+                        yield code
+
+    def generate_kin_report_stream(self, file_names, num_kits=None, output=None):
+        """
+        Потоковый вариант generate_kin_report для больших отчетов: файлы кодов
+        читаются по мере сборки наборов, отчет пишется по одной коробке в
+        компактном JSON. output - путь или объект с write(str); по умолчанию
+        <kigu_gtin>_kin_report.json. Возвращает путь (или output) и
+        количество наборов в self.generated_kits.
+        """
+        logger.info("Запуск потоковой генерации КИН отчета...")
+        self.generated_kits = 0
+
+        main_data = self._scan_code_files(file_names)
+        if not main_data:
+            logger.error("Не найден основной файл с описанием набора")
+            return None
+        _, kigu_gtin, kit_gtins = self.find_main_data_and_gtins()
+        if not kigu_gtin or not kit_gtins:
+            logger.error("В основном файле не найдены GTIN для Kigu или Kit")
+            return None
+
+        available = {gtin: self._stream_count(gtin) for gtin in {kigu_gtin, *kit_gtins}}
+        missing = [gtin for gtin, count in available.items() if not count]
+        if missing:
+            logger.error(f"Отсутствуют файлы для следующих GTIN: {', '.join(sorted(missing))}")
+            return None
+
+        max_kits = available[kigu_gtin]
+        for gtin in set(kit_gtins):
+            max_kits = min(max_kits, available[gtin] // kit_gtins.count(gtin))
+        if max_kits == 0:
+            logger.error("Недостаточно кодов для создания наборов")
+            return None
+        if num_kits is None:
+            num_kits = max_kits
+        elif num_kits > max_kits:
+            logger.warning(f"Запрошено {num_kits} наборов, но доступно только {max_kits}")
+            num_kits = max_kits
+
+        logger.info(f"Генерация {num_kits} наборов (потоковый режим)...")
+        kigu_codes = self._stream_codes(kigu_gtin)
+        kit_codes = {gtin: self._stream_codes(gtin) for gtin in set(kit_gtins)}
+        report_id = main_data.get('id') or str(uuid.uuid4())
+
+        output_name = output if output is not None else f"{kigu_gtin}_kin_report.json"
+        own_stream = not hasattr(output_name, 'write')
+        stream = open(output_name, 'w', encoding='utf-8') if own_stream else output_name
+        try:
+            start_time = datetime.now()
+            writer = KinReportWriter(stream, report_id, start_time)
+            for i in range(num_kits):
+                full_codes = [next(kit_codes[kit_gtin]) for kit_gtin in kit_gtins]
+                short_codes = self.extract_short_codes(full_codes)
+                product_numbers = [short for short in short_codes if short]
+                product_numbers_full = [full for full, short in zip(full_codes, short_codes) if short]
+                writer.write_box(_make_box(i, next(kigu_codes), product_numbers, product_numbers_full, start_time))
+            writer.close(datetime.now())
+        finally:
+            if own_stream:
+                stream.close()
+
+        self.generated_kits = writer.boxes
+        logger.info(f"КИН отчет создан: {output_name if own_stream else 'поток'}")
+        logger.info(f"Сгенерировано наборов: {writer.boxes}, продуктов: {writer.products}")
+        return output_name
+
 # Функция для вызова из внешних модулей
 def generate_kin_report_from_files(file_names, num_kits=None):
     """
@@ -233,6 +233,9 @@ def main():
     parser.add_argument("--suz_worker_config", help="Путь к конфигурационному файлу suz_worker")
     parser.add_argument("--owngtins", action="store_true", help="получить ВЕСЬ список собственных GTIN (постранично)")
     parser.add_argument("--find-token-by-inn", help="Найти токен по ИНН ")
+    parser.add_argument("--workers", type=int, default=4, help="Количество параллельных запросов при выгрузке списков GTIN")
+    parser.add_argument("--rate-limit", type=float, default=2.0, help="Ограничение частоты запросов в секунду при выгрузке списков GTIN")
+    parser.add_argument("--sync-state", help="Файл состояния (локальный или s3://) для инкрементальной выгрузки --owngtins/--linked-gtins")
 
     args = parser.parse_args()
 
@@ -251,7 +254,10 @@ def main():
             logger.info(' '.join([str(token.get(k)) for k in [ 'user_status', 'full_name', 'scope', 'inn', 'pid', 'id', 'exp']]))
         nk = NK(sandbox=args.sandbox,token=token['Токен']if token else None)
         if args.owngtins:
-            goods = nk.get_gtins()
+            if args.sync_state:
+                goods = nk.sync_gtins(args.sync_state, workers=args.workers, rate_limit=args.rate_limit)
+            else:
+                goods = nk.get_gtins(workers=args.workers, rate_limit=args.rate_limit)
 
             if goods:
                 try:
@@ -276,10 +282,25 @@ def main():
         elif args.linked_gtins:
             logger.info("Начало постраничной выгрузки ВСЕХ доступных GTIN для субаккаунта...")
 
-            all_linked_gtins = nk.get_all_linked_gtins(
-                inn=args.linked_inn,
-                page_size=args.linked_limit
-            )
+            if args.sync_state:
+                changes = nk.sync_linked_gtins(
+                    args.sync_state,
+                    inn=args.linked_inn,
+                    page_size=args.linked_limit,
+                    workers=args.workers,
+                    rate_limit=args.rate_limit,
+                )
+                all_linked_gtins = changes["added"] if changes is not None else None
+                if changes is not None:
+                    for gtin in changes["removed"]:
+                        logger.info(f"GTIN {gtin} больше не доступен субаккаунту")
+            else:
+                all_linked_gtins = nk.get_all_linked_gtins(
+                    inn=args.linked_inn,
+                    page_size=args.linked_limit,
+                    workers=args.workers,
+                    rate_limit=args.rate_limit,
+                )
 
             if all_linked_gtins is None:
                 logger.error("Не удалось выгрузить список доступных GTIN")
@@ -328,6 +349,9 @@ def main():
             logger.error("Не указан GTIN или файл (--gtin или --file).")
             sys.exit(1)
 
+        # Разрешительные документы для всех GTIN проверяются одним пакетом
+        permits_by_gtin = nk.get_active_permit_documents_by_gtins(gtin_list) if args.inn else {}
+
         for gtin in gtin_list:
             logger.info("=" * 80)
             logger.info(f"Проверка GTIN: {gtin}")
@@ -353,7 +377,7 @@ def main():
                 logger.warning("Карточка не найдена.")
 
             if args.inn:
-                docs = nk.get_active_permit_documents_by_gtin(gtin)
+                docs = permits_by_gtin.get(gtin)
                 if not docs:
                     logger.warning(f"gtin:{gtin} Разрешительные документы не найдены.")
                 else:
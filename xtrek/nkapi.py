@@ -3,12 +3,40 @@ import json
 import logging
 import re
 import requests
-from datetime import date, datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta
 from typing import Any, Dict, List, Optional
 from .suz_api_models import GtinDocument
+from .cache_store import SqliteCache
+from .rate_limit import NK_PRODUCT_LIST, RateLimiter, note_response, throttle
 
 logger = logging.getLogger(__name__)
 
+_NK_CACHES: Dict[tuple, SqliteCache] = {}
+
+
+def _default_nk_cache(namespace: str) -> Optional[SqliteCache]:
+    """
+    Общий для всех воркеров кеш ответов True API / НК.
+    Включается переменной XTREK_PRODUCT_CACHE_PATH (путь к файлу SQLite).
+    """
+    path = os.getenv("XTREK_PRODUCT_CACHE_PATH")
+    if not path:
+        return None
+    if (path, namespace) not in _NK_CACHES:
+        _NK_CACHES[(path, namespace)] = SqliteCache(path, namespace=namespace)
+    return _NK_CACHES[(path, namespace)]
+
+
+def default_product_cache() -> Optional[SqliteCache]:
+    """Кеш карточек product/info."""
+    return _default_nk_cache("product_info")
+
+
+def default_permit_cache() -> Optional[SqliteCache]:
+    """Кеш статусов разрешительных документов /rd/list."""
+    return _default_nk_cache("rd_list")
+
 
 class NK:
 
@@ -32,24 +60,47 @@ class NK:
     CARD_TRUSTED_PERMIT_TYPES = {
         "STATE_REGISTRATION_CERTIFICATE",
     }
+
+    # Максимальное количество GTIN в одном запросе /product/info
+    PRODUCT_INFO_MAX_GTINS = 100
+    PRODUCT_CACHE_TTL_SECONDS = 24 * 60 * 60
+    # Отрицательный результат (карточка не найдена) живет меньше: карточка
+    # может появиться или стать доступной по субаккаунту.
+    PRODUCT_CACHE_NEGATIVE_TTL_SECONDS = 60 * 60
+
+    # /rd/list принимает не более 25 документов; чанки отправляются параллельно
+    RD_LIST_MAX_DOCS = 25
+    RD_LIST_WORKERS = 4
+    # Статус документа может смениться (приостановка), поэтому даже
+    # действующий документ кешируется не дольше этого срока.
+    PERMIT_CACHE_TTL_SECONDS = 6 * 60 * 60
+
+    # /v4/product-list отдает не более 10000 карточек на окно дат (иначе 413)
+    PRODUCT_LIST_MAX_RESULTS = 10000
+    PRODUCT_LIST_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
     """
     Клиент API Национального Каталога маркированных товаров (Честный Знак).
     Версия API: v5.38
     """
 
     def __init__(self, token: str = None, apikey: str = None, sandbox: bool = False, host: str = None,
-                 token_refresher=None):
+                 token_refresher=None, product_cache: Optional[SqliteCache] = None,
+                 permit_cache: Optional[SqliteCache] = None):
         """
         Инициализация API клиента.
         :param token: Bearer-токен True API
         :param apikey: API Key Национального каталога
         :param sandbox: использовать тестовую среду
         :param host: переопределение базового URL API
+        :param product_cache: кеш карточек product/info (по умолчанию default_product_cache())
+        :param permit_cache: кеш статусов /rd/list (по умолчанию default_permit_cache())
         """
         self.token = token or os.getenv("TRUE_API_TOKEN")
         self.apikey = apikey or os.getenv("API_KEY")
         self.sandbox = sandbox
         self.token_refresher = token_refresher
+        self.product_cache = product_cache if product_cache is not None else default_product_cache()
+        self.permit_cache = permit_cache if permit_cache is not None else default_permit_cache()
 
         if not self.token and not self.apikey:
             raise ValueError("Не найден ни token, ни apikey. "
@@ -66,11 +117,21 @@ class NK:
     def _request(self, method: str, url: str, **kwargs):
         """Один безопасный повтор read-only запроса после обновления токена."""
         requester = requests.get if method.upper() == "GET" else requests.post
+        # Общий для воркеров лимит действует только на выгрузку списка товаров
+        family = NK_PRODUCT_LIST if "/product-list" in url else None
+        if family:
+            throttle(family)
         response = requester(url, **kwargs)
+        if family:
+            note_response(family, response)
         if response.status_code in (401, 403) and self.token_refresher:
             self.token = self.token_refresher()
             kwargs["headers"] = self._true_api_headers()
+            if family:
+                throttle(family)
             response = requester(url, **kwargs)
+            if family:
+                note_response(family, response)
         return response
 
     def _true_api_base_url(self) -> str:
@@ -132,73 +193,163 @@ class NK:
             doc.get("date") or doc.get("dateFrom") or "",
         )
 
+    def _rd_list_payload_item(self, doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        doc_type = doc.get("type")
+        number = doc.get("number")
+        doc_date = doc.get("date") or doc.get("dateFrom")
+
+        if doc_type not in self.TRUE_API_PERMIT_TYPES or not number:
+            return None
+
+        item = {"type": doc_type, "number": number}
+        if doc_type in self.RD_LIST_DATEFROM_REQUIRED:
+            if not doc_date:
+                return None
+            item["dateFrom"] = doc_date
+        elif doc_date:
+            item["dateFrom"] = doc_date
+        return item
+
+    @staticmethod
+    def _permit_cache_key(key: tuple) -> str:
+        return json.dumps(list(key), ensure_ascii=False)
+
+    def _permit_cache_ttl(self, rd_doc: Dict[str, Any]) -> float:
+        """Срок хранения статуса: не дольше PERMIT_CACHE_TTL_SECONDS и не позже окончания действия документа."""
+        ttl = self.PERMIT_CACHE_TTL_SECONDS
+        if rd_doc.get("status") == "Действует":
+            date_to = self._parse_iso_date((rd_doc.get("dateTo") or "")[:10])
+            if date_to:
+                valid_until = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+                ttl = min(ttl, (valid_until - datetime.now()).total_seconds())
+        return ttl
+
+    def _post_rd_list_chunk(self, url: str, chunk: List[Dict[str, Any]]) -> Dict[tuple, Dict[str, Any]]:
+        result = {}
+        logger.info(f"POST {url} (/rd/list docs: {len(chunk)})")
+        try:
+            response = self._request("POST",
+                url,
+                headers=self._true_api_headers(),
+                json={"documents": chunk},
+                timeout=30,
+            )
+            logger.info(f"Status: {response.status_code}")
+
+            if response.status_code != 200:
+                logger.warning(f"/rd/list failed: {response.status_code} {response.text}")
+                return result
+
+            data = response.json()
+            for rd_doc in data.get("result", {}).get("documents", []):
+                key = (
+                    rd_doc.get("type"),
+                    rd_doc.get("number"),
+                    rd_doc.get("dateFrom") or "",
+                )
+                result[key] = rd_doc
+
+            for err in data.get("result", {}).get("errors", []):
+                logger.info(f"/rd/list error for {err.get('number')}: {err.get('message')}")
+        except Exception as e:
+            logger.error(f"Error in _get_rd_list_statuses: {e}")
+        return result
+
     def _get_rd_list_statuses(self, docs: List[Dict[str, Any]]) -> Dict[tuple, Dict[str, Any]]:
+        """
+        Статусы документов в реестре /rd/list. Документы дедуплицируются,
+        уже известные статусы берутся из кеша, остальные отправляются
+        чанками по RD_LIST_MAX_DOCS параллельно.
+        """
         if not docs:
             return {}
 
         result = {}
         url = f"{self._true_api_base_url()}/rd/list"
 
-        payload_docs = []
+        payload_by_key = {}
         for doc in docs:
-            doc_type = doc.get("type")
-            number = doc.get("number")
-            doc_date = doc.get("date") or doc.get("dateFrom")
-
-            if doc_type not in self.TRUE_API_PERMIT_TYPES or not number:
-                continue
+            item = self._rd_list_payload_item(doc)
+            if item:
+                payload_by_key.setdefault(self._rd_list_key(item), item)
 
-            item = {"type": doc_type, "number": number}
-            if doc_type in self.RD_LIST_DATEFROM_REQUIRED:
-                if not doc_date:
-                    continue
-                item["dateFrom"] = doc_date
-            elif doc_date:
-                item["dateFrom"] = doc_date
-
-            payload_docs.append(item)
-
-        # /rd/list accepts max 25 documents.
-        for i in range(0, len(payload_docs), 25):
-            chunk = payload_docs[i:i + 25]
-            logger.info(f"POST {url} (/rd/list docs: {len(chunk)})")
+        if self.permit_cache and payload_by_key:
+            cache_keys = {self._permit_cache_key(key): key for key in payload_by_key}
             try:
-                response = self._request("POST",
-                    url,
-                    headers=self._true_api_headers(),
-                    json={"documents": chunk},
-                    timeout=30,
-                )
-                logger.info(f"Status: {response.status_code}")
+                cached = self.permit_cache.get_many(cache_keys)
+            except Exception as e:
+                logger.warning(f"Кеш /rd/list недоступен: {e}")
+                cached = {}
+            for cache_key, rd_doc in cached.items():
+                key = cache_keys[cache_key]
+                result[key] = rd_doc
+                payload_by_key.pop(key, None)
+
+        payload_docs = list(payload_by_key.values())
+        chunks = [
+            payload_docs[i:i + self.RD_LIST_MAX_DOCS]
+            for i in range(0, len(payload_docs), self.RD_LIST_MAX_DOCS)
+        ]
+        if len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.RD_LIST_WORKERS, len(chunks))) as executor:
+                chunk_results = list(executor.map(lambda chunk: self._post_rd_list_chunk(url, chunk), chunks))
+        else:
+            chunk_results = [self._post_rd_list_chunk(url, chunk) for chunk in chunks]
+
+        for fetched in chunk_results:
+            result.update(fetched)
+            if self.permit_cache:
+                try:
+                    for key, rd_doc in fetched.items():
+                        ttl = self._permit_cache_ttl(rd_doc)
+                        if ttl > 0:
+                            self.permit_cache.set(self._permit_cache_key(key), rd_doc, ttl)
+                except Exception as e:
+                    logger.warning(f"Не удалось сохранить статусы /rd/list в кеш: {e}")
 
-                if response.status_code != 200:
-                    logger.warning(f"/rd/list failed: {response.status_code} {response.text}")
-                    continue
+        return result
 
-                data = response.json()
-                for rd_doc in data.get("result", {}).get("documents", []):
-                    key = (
-                        rd_doc.get("type"),
-                        rd_doc.get("number"),
-                        rd_doc.get("dateFrom") or "",
-                    )
-                    result[key] = rd_doc
+    def _product_cache_key(self, gtin: str, rd_info: bool) -> str:
+        return f"{gtin}:{'rd' if rd_info else 'base'}"
 
-                for err in data.get("result", {}).get("errors", []):
-                    logger.info(f"/rd/list error for {err.get('number')}: {err.get('message')}")
-            except Exception as e:
-                logger.error(f"Error in _get_rd_list_statuses: {e}")
+    def _read_product_cache(self, gtins: List[str], rd_info: bool) -> Dict[str, Optional[Dict[str, Any]]]:
+        if not self.product_cache:
+            return {}
+        keys = {self._product_cache_key(g, True): g for g in gtins}
+        if not rd_info:
+            # Карточка с rdInfo содержит все поля базовой карточки
+            keys.update({self._product_cache_key(g, False): g for g in gtins})
+        try:
+            cached = self.product_cache.get_many(keys)
+        except Exception as e:
+            logger.warning(f"Кеш product/info недоступен: {e}")
+            return {}
 
+        result = {}
+        for key, value in cached.items():
+            gtin = keys[key]
+            if value is not None or gtin not in result:
+                result[gtin] = value
         return result
 
-    def product_info(self, gtin: str, rd_info: bool = False) -> Optional[Dict[str, Any]]:
-        """
-        Метод «/v4/true-api/product/info» возвращает расширенную информацию о товаре.
-        """
+    def _write_product_cache(self, cards: Dict[str, Optional[Dict[str, Any]]], rd_info: bool) -> None:
+        if not self.product_cache or not cards:
+            return
+        found = {self._product_cache_key(g, rd_info): c for g, c in cards.items() if c}
+        missing = {self._product_cache_key(g, rd_info): None for g, c in cards.items() if not c}
+        try:
+            self.product_cache.set_many(found, self.PRODUCT_CACHE_TTL_SECONDS)
+            self.product_cache.set_many(missing, self.PRODUCT_CACHE_NEGATIVE_TTL_SECONDS)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить карточки в кеш product/info: {e}")
+
+    def _fetch_product_info(self, gtins: List[str], rd_info: bool) -> Optional[Dict[str, Optional[Dict[str, Any]]]]:
+        """Один запрос /product/info. None - ошибка запроса (результат не кешируется)."""
         url = f"{self._true_api_base_url()}/product/info"
-        payload = {"gtins": [gtin], "rdInfo": rd_info}
+        payload = {"gtins": gtins, "rdInfo": rd_info}
 
-        logger.info(f"POST {url} (GTIN: {gtin}, rdInfo={rd_info})")
+        gtins_desc = gtins[0] if len(gtins) == 1 else f"{len(gtins)} шт."
+        logger.info(f"POST {url} (GTIN: {gtins_desc}, rdInfo={rd_info})")
         try:
             response = self._request("POST",
                 url,
@@ -214,15 +365,55 @@ class NK:
 
             data = response.json()
             results = data.get("results") or []
-            if not results:
-                logger.info(f"GTIN {gtin}: product/info не вернул карточку")
-                return None
-
-            return results[0]
         except Exception as e:
             logger.error(f"Error calling product/info: {e}")
             return None
 
+        cards = {gtin: None for gtin in gtins}
+        by_gtin = {str(gtin).zfill(14): gtin for gtin in gtins}
+        for card in results:
+            card_gtin = str(card.get("gtin") or "").zfill(14)
+            requested = by_gtin.get(card_gtin)
+            if requested is None and len(gtins) == 1:
+                requested = gtins[0]
+            if requested is not None:
+                cards[requested] = card
+        return cards
+
+    def product_info_many(self, gtins: List[str], rd_info: bool = False) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Пакетный вариант product_info: карточки запрашиваются пачками по
+        PRODUCT_INFO_MAX_GTINS, найденные и отсутствующие карточки сохраняются
+        в общий кеш. Возвращает {gtin: карточка или None}.
+        """
+        gtins = [str(g) for g in dict.fromkeys(gtins) if g]
+        result = self._read_product_cache(gtins, rd_info)
+        missing = [g for g in gtins if g not in result]
+        if result:
+            logger.debug(f"product/info: из кеша {len(result)}, к запросу {len(missing)}")
+
+        for i in range(0, len(missing), self.PRODUCT_INFO_MAX_GTINS):
+            chunk = missing[i:i + self.PRODUCT_INFO_MAX_GTINS]
+            cards = self._fetch_product_info(chunk, rd_info)
+            if cards is None:
+                result.update({gtin: None for gtin in chunk})
+                continue
+            for gtin, card in cards.items():
+                if not card:
+                    logger.info(f"GTIN {gtin}: product/info не вернул карточку")
+            self._write_product_cache(cards, rd_info)
+            result.update(cards)
+
+        return {gtin: result.get(gtin) for gtin in gtins}
+
+    def product_info(self, gtin: str, rd_info: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Метод «/v4/true-api/product/info» возвращает расширенную информацию о товаре.
+        """
+        if not gtin:
+            return None
+        return self.product_info_many([gtin], rd_info=rd_info).get(str(gtin))
+
     def get_active_permit_documents_by_gtin(
         self,
         gtin: str,
@@ -258,14 +449,67 @@ class NK:
 
         registry_by_key = {}
         if verify_registry_status:
-            registry_checked_docs = [
-                doc for doc in cert_docs
-                if doc.get("type") not in self.CARD_TRUSTED_PERMIT_TYPES
-            ]
-            registry_by_key = self._get_rd_list_statuses(registry_checked_docs)
+            registry_by_key = self._get_rd_list_statuses(self._registry_checked_docs(cert_docs))
+
+        return self._active_permit_documents(gtin, product, registry_by_key, on_date)
 
+    def get_active_permit_documents_by_gtins(
+        self,
+        gtins: List[str],
+        on_date: Optional[date] = None,
+        verify_registry_status: bool = True,
+        products: Optional[Dict[str, Dict[str, Any]]] = None,
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Пакетный вариант get_active_permit_documents_by_gtin для многих GTIN
+        (наборы, многотоварные заказы).
+
+        Карточки запрашиваются через product_info_many, документы всех GTIN
+        дедуплицируются и проверяются в /rd/list одним пакетом (чанки
+        отправляются параллельно). Возвращает {gtin: [активные документы]}.
+        """
+        on_date = on_date or date.today()
+        gtins = [str(g) for g in dict.fromkeys(gtins) if g]
+        products = dict(products or {})
+
+        missing = [g for g in gtins if not products.get(g)]
+        if missing:
+            products.update({g: p for g, p in self.product_info_many(missing, rd_info=True).items() if p})
+
+        registry_by_key = {}
+        if verify_registry_status:
+            all_docs = []
+            for gtin in gtins:
+                all_docs.extend(self._registry_checked_docs((products.get(gtin) or {}).get("certDocList") or []))
+            registry_by_key = self._get_rd_list_statuses(all_docs)
+
+        result = {}
+        for gtin in gtins:
+            product = products.get(gtin)
+            if not product:
+                result[gtin] = []
+            elif not product.get("certDocList"):
+                logger.info(f"GTIN {gtin}: certDocList пустой")
+                result[gtin] = []
+            else:
+                result[gtin] = self._active_permit_documents(gtin, product, registry_by_key, on_date)
+        return result
+
+    def _registry_checked_docs(self, cert_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [
+            doc for doc in cert_docs
+            if doc.get("type") not in self.CARD_TRUSTED_PERMIT_TYPES
+        ]
+
+    def _active_permit_documents(
+        self,
+        gtin: str,
+        product: Dict[str, Any],
+        registry_by_key: Dict[tuple, Dict[str, Any]],
+        on_date: date,
+    ) -> List[Dict[str, Any]]:
         active_docs = []
-        for doc in cert_docs:
+        for doc in product.get("certDocList") or []:
             key = self._rd_list_key(doc)
             registry_doc = registry_by_key.get(key)
             is_card_trusted = doc.get("type") in self.CARD_TRUSTED_PERMIT_TYPES
@@ -545,6 +789,15 @@ class NK:
 считается равным 1000, а «offset» («Смещение относительно начала выдачи») равным 0;
 • если в запросе одновременно передаются параметры «from_date» и «to_date», то заданный
 период может быть больше месяца.
+        """
+        status_code, goods = self._product_list_page(from_date, to_date, limit, offset)
+        return goods if status_code == 200 else None
+
+    def _product_list_page(self, from_date: str = None, to_date: str = None, limit: int = None,
+                           offset: int = None):
+        """
+        Одна страница /v4/product-list. Возвращает (HTTP-код, список goods или None).
+        Код 413 означает, что в окне дат больше PRODUCT_LIST_MAX_RESULTS карточек.
         """
         url = f"{self.base_url}/v4/product-list"
         headers = {"Accept": "application/json", "Content-Type": "application/json"}
@@ -565,15 +818,16 @@ class NK:
         elif self.apikey:
             params["apikey"] = self.apikey
 
-        logger.info(f"GET {url} (limit: {limit}, offset: {offset})")
+        logger.info(f"GET {url} ({from_date} - {to_date}, limit: {limit}, offset: {offset})")
         
         try:
             response = self._request("GET", url, headers=headers, params=params, timeout=30)
             logger.info(f"Status: {response.status_code}")
 
             if response.status_code != 200:
-                logger.error(f"Ошибка API: {response.status_code}")
-                return None
+                if response.status_code != 413:
+                    logger.error(f"Ошибка API: {response.status_code}")
+                return response.status_code, None
 
             data = response.json()
             
@@ -587,117 +841,258 @@ class NK:
                 for error in errors:
                     logger.warning(f"Ошибка в ответе: {error.get('message')} (код: {error.get('code')})")
             
-            return goods
+            return 200, goods
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Ошибка сети: {e}")
-            return None
+            return None, None
         except Exception as e:
             logger.error(f"Ошибка обработки ответа: {e}")
+            return None, None
+
+    def _fetch_product_list_window(self, start: datetime, end: datetime, page_size: int,
+                                   limiter: RateLimiter):
+        """
+        Выгружает все карточки окна [start, end] постранично.
+        Возвращает None, если окно нужно разбить (413 или более 10000 карточек).
+        """
+        goods = []
+        offset = 0
+        while True:
+            if offset + page_size > self.PRODUCT_LIST_MAX_RESULTS:
+                return None
+            limiter.acquire()
+            status_code, page = self._product_list_page(
+                from_date=start.strftime(self.PRODUCT_LIST_DATE_FORMAT),
+                to_date=end.strftime(self.PRODUCT_LIST_DATE_FORMAT),
+                limit=page_size,
+                offset=offset,
+            )
+            if status_code == 413:
+                return None
+            if page is None:
+                raise RuntimeError(f"product-list failed for window {start} - {end}: HTTP {status_code}")
+            goods.extend(page)
+            if len(page) < page_size:
+                return goods
+            offset += page_size
+
+    def get_gtins_windowed(self, from_date: Optional[datetime] = None, to_date: Optional[datetime] = None,
+                           page_size: int = 1000, workers: int = 4, rate_limit: Optional[float] = 2.0):
+        """
+        Выгрузка собственных карточек по окнам дат.
+
+        Диапазон делится на workers окон, окна выгружаются параллельно с общим
+        ограничением частоты rate_limit (запросов в секунду). Окно, на которое
+        API отвечает 413 (более 10000 карточек), делится пополам. Карточки из
+        пересекающихся окон объединяются по GTIN.
+
+        :return: Список карточек (по GTIN без дублей) или None в случае ошибки
+        """
+        start = from_date or datetime(2000, 1, 1)
+        end = (to_date or datetime.now()).replace(microsecond=0)
+        page_size = min(page_size, self.PRODUCT_LIST_MAX_RESULTS)
+        workers = max(1, workers)
+        limiter = RateLimiter(rate_limit)
+
+        logger.info(f"Выгрузка карточек {start} - {end} (окон: {workers}, rate_limit: {rate_limit}/с)")
+
+        goods_by_gtin = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {
+                executor.submit(self._fetch_product_list_window, s, e, page_size, limiter): (s, e)
+                for s, e in _split_time_range(start, end, workers)
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    s, e = pending.pop(future)
+                    try:
+                        goods = future.result()
+                    except Exception as exc:
+                        logger.error(f"Ошибка при получении окна {s} - {e}: {exc}")
+                        for other in pending:
+                            other.cancel()
+                        return None
+
+                    if goods is None:
+                        if e - s <= timedelta(seconds=1):
+                            logger.error(f"Окно {s} - {e} содержит более "
+                                         f"{self.PRODUCT_LIST_MAX_RESULTS} карточек и не может быть разбито")
+                            for other in pending:
+                                other.cancel()
+                            return None
+                        logger.info(f"Окно {s} - {e} слишком большое, делим пополам")
+                        for half_start, half_end in _split_time_range(s, e, 2):
+                            future_half = executor.submit(
+                                self._fetch_product_list_window, half_start, half_end, page_size, limiter
+                            )
+                            pending[future_half] = (half_start, half_end)
+                        continue
+
+                    for item in goods:
+                        _merge_by_gtin(goods_by_gtin, item)
+                    logger.info(f"Окно {s} - {e}: {len(goods)} карточек, всего уникальных: {len(goods_by_gtin)}")
+
+        logger.info(f"Выгрузка по окнам завершена. Всего получено GTIN: {len(goods_by_gtin)}")
+        return [goods_by_gtin[gtin] for gtin in sorted(goods_by_gtin)]
+
+    def sync_gtins(self, state_path: str, s3_config: Optional[Dict] = None, overlap_seconds: int = 300, **kwargs):
+        """
+        Инкрементальная выгрузка: только карточки, измененные с прошлой
+        синхронизации. Отметка (high-water mark) хранится в state_path
+        (локальный файл или s3://). Отметка сдвигается только после успешной выгрузки.
+        """
+        storage, state = _load_sync_state(state_path, s3_config)
+        started_at = datetime.now().replace(microsecond=0)
+        from_date = None
+        if state.get("high_water_mark"):
+            from_date = datetime.strptime(state["high_water_mark"], self.PRODUCT_LIST_DATE_FORMAT)
+            from_date -= timedelta(seconds=overlap_seconds)
+            logger.info(f"Инкрементальная выгрузка карточек с {from_date}")
+
+        goods = self.get_gtins_windowed(from_date=from_date, to_date=started_at, **kwargs)
+        if goods is None:
             return None
 
+        state.update({
+            "high_water_mark": started_at.strftime(self.PRODUCT_LIST_DATE_FORMAT),
+            "last_count": len(goods),
+        })
+        _save_sync_state(storage, state_path, state)
+        return goods
+
    # ---------------------------
     # Метод 6: Получить все доступные GTIN с постраничной выгрузкой
     # ---------------------------
-    def get_gtins(self, page_size: int = 1000):
+    def get_gtins(self, page_size: int = 1000, workers: int = 4, rate_limit: Optional[float] = 2.0):
         """
         Получить все доступные GTIN принадлежащие клиенту с постраничной выгрузкой.
+        Выгрузка выполняется параллельно по окнам дат, см. get_gtins_windowed.
         
         :param page_size: Размер страницы (макс. 10000)
+        :param workers: Количество параллельно выгружаемых окон
+        :param rate_limit: Ограничение частоты запросов в секунду
         :return: Список всех доступных GTIN или None в случае ошибки
         """
-        all_gtins = []
-        offset = 0
-        
         logger.info(f"Начало постраничной выгрузки доступных GTIN (page_size: {page_size})")
-        
-        while True:
-            logger.info(f"Запрос страницы с offset: {offset}")
-            
-            page_result = self._get_gtins(
-                from_date='2000-01-01 00:00:00',
-                to_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                limit=page_size,
-                offset=offset
-            )
-            
-            if page_result is None:
-                logger.error("Ошибка при получении страницы, прерывание выгрузки")
-                return None
-                
-            if not page_result:
-                logger.info("Получена пустая страница, завершение выгрузки")
-                break
-                
-            # Добавляем результаты текущей страницы
-            all_gtins.extend(page_result)
-            logger.info(f"Получено {len(page_result)} GTIN на текущей странице, всего: {len(all_gtins)}")
-            
-            # Проверяем, есть ли еще данные
-            if len(page_result) < page_size:
-                logger.info("Получено меньше запрошенного количества, завершение выгрузки")
-                break
-                
-            # Увеличиваем offset для следующей страницы
-            offset += page_size
-            
-            # Пауза между запросами для соблюдения лимитов API
-            logger.info("Пауза 1 секунда перед следующим запросом...")
-            import time
-            time.sleep(1)
-        
-        logger.info(f"Постраничная выгрузка завершена. Всего получено GTIN: {len(all_gtins)}")
-        return all_gtins
+        return self.get_gtins_windowed(
+            from_date=datetime(2000, 1, 1),
+            to_date=datetime.now(),
+            page_size=page_size,
+            workers=workers,
+            rate_limit=rate_limit,
+        )
 
     # ---------------------------
     # Метод 4: Получить все доступные linked GTIN  с постраничной выгрузкой
     # ---------------------------
-    def get_all_linked_gtins(self, inn: str = None, page_size: int = 1000):
+    def get_all_linked_gtins(self, inn: str = None, page_size: int = 1000, workers: int = 4,
+                             rate_limit: Optional[float] = 2.0):
         """
         Получить все доступные GTIN для субаккаунта с постраничной выгрузкой.
+        Страницы запрашиваются параллельно волнами по workers страниц с общим
+        ограничением частоты; выгрузка завершается на первой неполной странице.
         
         :param inn: ИНН владельца товара (опционально)
         :param page_size: Размер страницы (макс. 10000)
+        :param workers: Количество страниц, запрашиваемых параллельно
+        :param rate_limit: Ограничение частоты запросов в секунду
         :return: Список всех доступных GTIN или None в случае ошибки
         """
-        all_linked_gtins = []
+        workers = max(1, workers)
+        limiter = RateLimiter(rate_limit)
+        linked_by_gtin = {}
         offset = 0
-        
-        logger.info(f"Начало постраничной выгрузки доступных GTIN (page_size: {page_size})")
-        
-        while True:
-            logger.info(f"Запрос страницы с offset: {offset}")
-            
-            page_result = self.get_linked_gtins(
-                inn=inn,
-                limit=page_size,
-                offset=offset
-            )
-            
-            if page_result is None:
-                logger.error("Ошибка при получении страницы, прерывание выгрузки")
-                return None
-                
-            if not page_result:
-                logger.info("Получена пустая страница, завершение выгрузки")
-                break
-                
-            # Добавляем результаты текущей страницы
-            all_linked_gtins.extend(page_result)
-            logger.info(f"Получено {len(page_result)} GTIN на текущей странице, всего: {len(all_linked_gtins)}")
-            
-            # Проверяем, есть ли еще данные
-            if len(page_result) < page_size:
-                logger.info("Получено меньше запрошенного количества, завершение выгрузки")
-                break
-                
-            # Увеличиваем offset для следующей страницы
-            offset += page_size
-            
-            # Пауза между запросами для соблюдения лимитов API
-            logger.info("Пауза 1 секунда перед следующим запросом...")
-            import time
-            time.sleep(1)
-        
-        logger.info(f"Постраничная выгрузка завершена. Всего получено GTIN: {len(all_linked_gtins)}")
-        return all_linked_gtins
+
+        def fetch_page(page_offset):
+            limiter.acquire()
+            return self.get_linked_gtins(inn=inn, limit=page_size, offset=page_offset)
+
+        logger.info(f"Начало постраничной выгрузки доступных GTIN (page_size: {page_size}, workers: {workers})")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                offsets = [offset + i * page_size for i in range(workers)]
+                logger.info(f"Запрос страниц с offset: {offsets}")
+                pages = list(executor.map(fetch_page, offsets))
+
+                finished = False
+                for page_result in pages:
+                    if page_result is None:
+                        logger.error("Ошибка при получении страницы, прерывание выгрузки")
+                        return None
+                    for item in page_result:
+                        _merge_by_gtin(linked_by_gtin, item)
+                    if len(page_result) < page_size:
+                        finished = True
+
+                logger.info(f"Получено GTIN всего: {len(linked_by_gtin)}")
+                if finished:
+                    break
+                offset += workers * page_size
+
+        logger.info(f"Постраничная выгрузка завершена. Всего получено GTIN: {len(linked_by_gtin)}")
+        return list(linked_by_gtin.values())
+
+    def sync_linked_gtins(self, state_path: str, s3_config: Optional[Dict] = None, inn: str = None, **kwargs):
+        """
+        Инкрементальный режим для linked-gtins. API не фильтрует по дате,
+        поэтому состояние хранит список GTIN прошлой синхронизации, а
+        результатом являются изменения: {"added": [...], "removed": [...]}.
+        """
+        storage, state = _load_sync_state(state_path, s3_config)
+        linked = self.get_all_linked_gtins(inn=inn, **kwargs)
+        if linked is None:
+            return None
+
+        known = set(state.get("gtins") or [])
+        current = {str(item.get("gtin")): item for item in linked if item.get("gtin")}
+        changes = {
+            "added": [current[gtin] for gtin in sorted(set(current) - known)],
+            "removed": sorted(known - set(current)),
+        }
+
+        state.update({
+            "high_water_mark": datetime.now().strftime(self.PRODUCT_LIST_DATE_FORMAT),
+            "gtins": sorted(current),
+        })
+        _save_sync_state(storage, state_path, state)
+        logger.info(f"linked-gtins: добавлено {len(changes['added'])}, удалено {len(changes['removed'])}")
+        return changes
+
+
+def _split_time_range(start: datetime, end: datetime, parts: int):
+    """Делит [start, end] на parts окон с точностью до секунды; соседние окна пересекаются на границе."""
+    total = int((end - start).total_seconds())
+    parts = max(1, min(parts, total or 1))
+    step = total // parts
+    bounds = [start + timedelta(seconds=step * i) for i in range(parts)] + [end]
+    return [(bounds[i], bounds[i + 1]) for i in range(parts)]
+
+
+def _merge_by_gtin(items_by_gtin: Dict[str, Dict[str, Any]], item: Dict[str, Any]) -> None:
+    gtin = str(item.get("gtin") or "")
+    if not gtin:
+        return
+    existing = items_by_gtin.get(gtin)
+    # При повторе в нескольких окнах оставляем более свежую запись
+    if existing is None or str(item.get("updated_date") or "") >= str(existing.get("updated_date") or ""):
+        items_by_gtin[gtin] = item
+
+
+def _load_sync_state(state_path: str, s3_config: Optional[Dict] = None):
+    from .storage import get_storage
+    storage = get_storage(state_path, s3_config)
+    state = {}
+    if storage.exists(state_path):
+        try:
+            state = json.loads(storage.read_text(state_path)) or {}
+        except Exception as e:
+            logger.warning(f"Состояние синхронизации {state_path} повреждено, выполняем полную выгрузку: {e}")
+            state = {}
+    return storage, state
+
+
+def _save_sync_state(storage, state_path: str, state: Dict[str, Any]) -> None:
+    storage.write_text(state_path, json.dumps(state, ensure_ascii=False, indent=2))
@@ -2,9 +2,9 @@ import os
 import json
 import logging
 import argparse
-import tempfile
-from pathlib import Path
 import shutil
+from dataclasses import dataclass
+from typing import Optional
 from datetime import datetime, timezone
 
 from .storage import get_storage
@@ -13,6 +13,8 @@ from .create_emission_task_sample import _find_production_order_id_by_suz_order_
 import amica.amica_generator as amica_generator
 
 generate_amica_vdf = amica_generator.generate_amica_vdf
+build_data_file = amica_generator.build_data_file
+render_amica_vdf = amica_generator.render_amica_vdf
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -53,10 +55,72 @@ def convert_json_to_raw_csv(input_path, output_path=None):
         logger.error(f"Ошибка при конвертации JSON в CSV: {e}")
         return None
 
-def generate_prn_files(key: str, vdf_template_name: str = "32x32_20x20.VDF", ignore_duplicate: bool = False):
+@dataclass(frozen=True)
+class PrintJob:
+    """Файлы задания на печать, собранные в памяти."""
+    key: str
+    csv_name: str
+    csv_data: bytes
+    vdf_name: str
+    vdf_data: str
+    data_md5: str
+    record_count: int
+
+def build_print_job(key, codes, template_xml, static_data, mapping_list) -> PrintJob:
     """
-    Основная процедура создания файлов задания на печать.
-    key: имя файла эмиссии без расширения .json
+    Собирает CSV и VDF без временных файлов: коды пишутся в CSV за один проход
+    вместе с подсчетом MD5 и числа записей, VDF рендерится один раз.
+    """
+    csv_name = f"{key}.csv"
+    csv_data, data_md5, record_count = build_data_file(codes)
+    vdf_data = render_amica_vdf(template_xml, csv_name, data_md5, record_count, static_data, mapping_list)
+    return PrintJob(key, csv_name, csv_data, f"{key}.vdf", vdf_data, data_md5, record_count)
+
+@dataclass(frozen=True)
+class PrintTemplates:
+    """Шаблон VDF, amica.json и маппинг, общие для всех заданий пакета."""
+    name: str
+    template_xml: str
+    static_data: dict
+    mapping_list: list
+
+def load_print_templates(storage_templates, prn_templates_path, vdf_template_name) -> Optional[PrintTemplates]:
+    """Читает шаблон и конфиги печати в память. Возвращает None, если чего-то не хватает."""
+    vdf_template_s3_path = f"{prn_templates_path.rstrip('/')}/{vdf_template_name}"
+    amica_json_s3_path = f"{prn_templates_path.rstrip('/')}/amica.json"
+    mapping_json_s3_path = f"{prn_templates_path.rstrip('/')}/mapping-empty.json"
+
+    logger.info(f"[*] Чтение шаблона {vdf_template_s3_path}...")
+    if not storage_templates.exists(vdf_template_s3_path):
+        logger.error(f"[!] Шаблон {vdf_template_s3_path} не найден")
+        return None
+    template_xml = storage_templates.read_text(vdf_template_s3_path)
+
+    logger.info(f"[*] Чтение конфигурации {amica_json_s3_path}...")
+    if not storage_templates.exists(amica_json_s3_path):
+        logger.error(f"[!] Файл конфигурации {amica_json_s3_path} не найден")
+        return None
+    static_data = json.loads(storage_templates.read_text(amica_json_s3_path))
+
+    logger.info(f"[*] Чтение маппинга {mapping_json_s3_path}...")
+    if not storage_templates.exists(mapping_json_s3_path):
+        # Если mapping-empty.json не найден, используем пустой маппинг
+        logger.warning(f"[*] Файл маппинга {mapping_json_s3_path} не найден. Используем пустой маппинг.")
+        mapping_list = []
+    else:
+        mapping_list = json.loads(storage_templates.read_text(mapping_json_s3_path))
+
+    return PrintTemplates(vdf_template_name, template_xml, static_data, mapping_list)
+
+# Результаты задания печати, для которых generate_prn_files возвращает ключ
+PRINT_DONE_STATUSES = ("printed", "virtual", "duplicate")
+
+def _generate_print_job(key: str, vdf_template_name: str, ignore_duplicate: bool = False,
+                        templates: Optional[PrintTemplates] = None) -> dict:
+    """
+    Создает задание на печать для одного ключа с учетом .locks/ и тега print-status.
+    Возвращает запись манифеста: {"key", "status", ...}; для status == "printed"
+    также пути csv/vdf, число кодов и MD5.
     """
     lock_path = None
     lock_acquired = False
@@ -71,7 +135,7 @@ def generate_prn_files(key: str, vdf_template_name: str = "32x32_20x20.VDF", ign
 
         if not all([kodes_path, prn_tasks_path, prn_templates_path]):
             logger.error("[!] В конфигурации отсутствуют необходимые пути (kodes, prn_tasks, prn_templates)")
-            return None
+            return {"key": key, "status": "error", "error": "missing config paths"}
 
         # Инициализация хранилищ
         storage_kodes = get_storage(kodes_path, s3_config)
@@ -89,14 +153,14 @@ def generate_prn_files(key: str, vdf_template_name: str = "32x32_20x20.VDF", ign
         lock_acquired = storage_tasks.acquire_lock(lock_path, lock_content)
         if not lock_acquired:
             logger.info(f"[*] Задание печати {key} уже заблокировано другим обработчиком. Пропуск.")
-            return None
+            return {"key": key, "status": "locked"}
 
-        def finish(value):
+        def finish(status, **extra):
             try:
                 storage_tasks.release_lock(lock_path)
             except Exception as release_err:
                 logger.warning(f"[!] Не удалось снять lock печати {lock_path}: {release_err}")
-            return value
+            return {"key": key, "status": status, **extra}
 
         # 0. Проверка тегов управления печатью
         tags = storage_kodes.get_tags(json_s3_path)
@@ -108,7 +172,7 @@ def generate_prn_files(key: str, vdf_template_name: str = "32x32_20x20.VDF", ign
 
         if print_status == 'processing':
             logger.info(f"[*] Файл {key} уже в обработке (print-status:processing). Пропуск.")
-            return finish(None)
+            return finish("processing")
 
         # Проверка на виртуальность
         if not ignore_duplicate and production_order_id:
@@ -131,7 +195,7 @@ def generate_prn_files(key: str, vdf_template_name: str = "32x32_20x20.VDF", ign
                         # Обрабатываем и bool и строку
                         if is_virtual is True or str(is_virtual).lower() == 'true':
                             logger.info(f"Попытка напечатать коды созданные для виртуального заказа {production_order_id}")
-                            return finish(key)
+                            return finish("virtual")
                     else:
                         logger.warning(f"[!] Файл производственного заказа не найден: {prod_path}")
             except Exception as e:
@@ -139,98 +203,48 @@ def generate_prn_files(key: str, vdf_template_name: str = "32x32_20x20.VDF", ign
 
         if not ignore_duplicate and print_status != 'not-printed':
             logger.error(f"Попытка повторной печати. Задание {key} проигнорировано.")
-            return finish(key)
+            return finish("duplicate")
 
         # Устанавливаем статус processing
         logger.info(f"[*] Установка статуса print-status:processing для {key}")
         storage_kodes.set_tags(json_s3_path, {'print-status': 'processing'})
 
-        vdf_template_s3_path = f"{prn_templates_path.rstrip('/')}/{vdf_template_name}"
-        amica_json_s3_path = f"{prn_templates_path.rstrip('/')}/amica.json"
-        mapping_json_s3_path = f"{prn_templates_path.rstrip('/')}/mapping-empty.json"
-
-        # Создаем временную директорию
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_path = Path(temp_dir)
-
-            # 1. Скачиваем исходный JSON
-            logger.info(f"[*] Скачивание {json_s3_path}...")
-            local_json = temp_path / f"{key}.json"
-            if not storage_kodes.exists(json_s3_path):
-                logger.error(f"[!] Файл {json_s3_path} не найден в S3")
-                return finish(None)
-            storage_kodes.download(json_s3_path, str(local_json))
-
-            # 2. Скачиваем шаблоны и конфиги
-            local_template = temp_path / vdf_template_name
-            local_amica_json = temp_path / "amica.json"
-            local_mapping = temp_path / "mapping.json"
-
-            logger.info(f"[*] Скачивание шаблона {vdf_template_s3_path}...")
-            if not storage_templates.exists(vdf_template_s3_path):
-                logger.error(f"[!] Шаблон {vdf_template_s3_path} не найден")
-                return finish(None)
-            storage_templates.download(vdf_template_s3_path, str(local_template))
-
-            logger.info(f"[*] Скачивание конфигурации {amica_json_s3_path}...")
-            if not storage_templates.exists(amica_json_s3_path):
-                logger.error(f"[!] Файл конфигурации {amica_json_s3_path} не найден")
-                return finish(None)
-            storage_templates.download(amica_json_s3_path, str(local_amica_json))
-
-            logger.info(f"[*] Скачивание маппинга {mapping_json_s3_path}...")
-            if not storage_templates.exists(mapping_json_s3_path):
-                # Если mapping-empty.json не найден, создаем пустой маппинг
-                logger.warning(f"[*] Файл маппинга {mapping_json_s3_path} не найден. Используем пустой маппинг.")
-                with open(local_mapping, 'w', encoding='utf-8') as f:
-                    json.dump([], f)
-            else:
-                storage_templates.download(mapping_json_s3_path, str(local_mapping))
-
-            # 3. Конвертируем JSON -> CSV
-            logger.info("[*] Конвертация JSON в CSV...")
-            local_csv = temp_path / f"{key}.csv"
-            if not convert_json_to_raw_csv(str(local_json), str(local_csv)):
-                return finish(None)
-
-            # 4. Генерация VDF
-            logger.info("[*] Генерация VDF файла...")
-            local_vdf = temp_path / f"{key}.vdf"
-            generate_amica_vdf(
-                base_template_path=str(local_template),
-                new_csv_path=str(local_csv),
-                static_json_path=str(local_amica_json),
-                mapping_json_path=str(local_mapping),
-                output_vdf_path=str(local_vdf)
-            )
-
-            # Проверяем, что VDF был создан (имя могло измениться по маске, но по умолчанию оно такое же)
-            # В amica_generator.py по умолчанию output_vdf_path используется как база
-            if not local_vdf.exists():
-                # Пробуем найти любой .vdf во временной папке
-                vdf_files = list(temp_path.glob("*.vdf"))
-                if vdf_files:
-                    local_vdf = vdf_files[0]
-                else:
-                    logger.error("[!] VDF файл не был создан")
-                    return finish(None)
-
-            # 5. Загружаем CSV и VDF в целевой бакет
-            dest_csv_s3 = f"{prn_tasks_path.rstrip('/')}/{key}.csv"
-            dest_vdf_s3 = f"{prn_tasks_path.rstrip('/')}/{local_vdf.name}"
-
-            logger.info(f"[*] Загрузка CSV в {dest_csv_s3}...")
-            storage_tasks.upload(str(local_csv), dest_csv_s3)
-
-            logger.info(f"[*] Загрузка VDF в {dest_vdf_s3}...")
-            storage_tasks.upload(str(local_vdf), dest_vdf_s3)
-
-            # 6. Устанавливаем статус printed
-            logger.info(f"[*] Установка статуса print-status:printed для {key}")
-            storage_kodes.set_tags(json_s3_path, {'print-status': 'printed'})
-
-            logger.info(f"[+++] Процедура успешно завершена для {key}")
-            return finish(key)
+        # 1. Читаем исходный JSON, шаблон и конфиги сразу в память
+        logger.info(f"[*] Чтение {json_s3_path}...")
+        if not storage_kodes.exists(json_s3_path):
+            logger.error(f"[!] Файл {json_s3_path} не найден в S3")
+            return finish("error", error="kodes file not found")
+        codes = json.loads(storage_kodes.read_text(json_s3_path)).get("codes", [])
+        if not codes:
+            logger.warning(f"В файле {json_s3_path} не найдено поле 'codes'.")
+            return finish("error", error="no codes")
+
+        if templates is None:
+            templates = load_print_templates(storage_templates, prn_templates_path, vdf_template_name)
+            if templates is None:
+                return finish("error", error="templates not found")
+
+        # 2. Сборка CSV и VDF в памяти
+        logger.info("[*] Генерация CSV и VDF...")
+        job = build_print_job(key, codes, templates.template_xml, templates.static_data, templates.mapping_list)
+
+        # 3. Загружаем CSV и VDF в целевой бакет
+        dest_csv_s3 = f"{prn_tasks_path.rstrip('/')}/{job.csv_name}"
+        dest_vdf_s3 = f"{prn_tasks_path.rstrip('/')}/{job.vdf_name}"
+
+        logger.info(f"[*] Загрузка CSV в {dest_csv_s3} ({job.record_count} кодов, MD5 {job.data_md5})...")
+        storage_tasks.write_text(dest_csv_s3, job.csv_data)
+
+        logger.info(f"[*] Загрузка VDF в {dest_vdf_s3}...")
+        storage_tasks.write_text(dest_vdf_s3, job.vdf_data)
+
+        # 4. Устанавливаем статус printed
+        logger.info(f"[*] Установка статуса print-status:printed для {key}")
+        storage_kodes.set_tags(json_s3_path, {'print-status': 'printed'})
+
+        logger.info(f"[+++] Процедура успешно завершена для {key}")
+        return finish("printed", csv=dest_csv_s3, vdf=dest_vdf_s3,
+                      records=job.record_count, md5=job.data_md5)
 
     except Exception as e:
         # В случае ошибки сбрасываем статус в not-printed, чтобы можно было попробовать снова
@@ -246,25 +260,117 @@ def generate_prn_files(key: str, vdf_template_name: str = "32x32_20x20.VDF", ign
         logger.error(f"[!] Ошибка в generate_prn_files: {e}")
         import traceback
         logger.error(traceback.format_exc())
-        return None
+        return {"key": key, "status": "error", "error": str(e)}
+
+def generate_prn_files(key: str, vdf_template_name: str = "32x32_20x20.VDF", ignore_duplicate: bool = False):
+    """
+    Основная процедура создания файлов задания на печать.
+    key: имя файла эмиссии без расширения .json
+    """
+    result = _generate_print_job(key, vdf_template_name, ignore_duplicate)
+    return key if result["status"] in PRINT_DONE_STATUSES else None
+
+def _batch_print_worker(args):
+    key, vdf_template_name, ignore_duplicate, templates = args
+    return _generate_print_job(key, vdf_template_name, ignore_duplicate, templates)
+
+def list_kodes_keys(prefix: str = ""):
+    """Ключи файлов кодов (имена без .json) в каталоге kodes, начинающиеся с prefix."""
+    config = load_config('suz_worker_config')
+    kodes_path = config.get('kodes')
+    storage_kodes = get_storage(kodes_path, config.get('s3_config'))
+    files = storage_kodes.list_files(kodes_path, f"{prefix}*.json")
+    return sorted(os.path.basename(f)[:-len('.json')] for f in files)
+
+def generate_prn_batch(keys=None, prefix: str = None, vdf_template_name: str = "32x32_20x20.VDF",
+                       ignore_duplicate: bool = False, workers: int = None, manifest: bool = True):
+    """
+    Пакетное создание заданий на печать (перепечать, догон после простоя принтера).
+    Шаблон и конфиги читаются один раз и передаются в пул процессов; каждый ключ
+    обрабатывается как generate_prn_files (блокировка .locks/, тег print-status).
+    Возвращает манифест {"createdAt", "template", "summary", "jobs"} и, если
+    manifest=True, сохраняет его в <prn_tasks>/.manifests/.
+    """
+    config = load_config('suz_worker_config')
+    s3_config = config.get('s3_config')
+    prn_tasks_path = config.get('prn_tasks')
+    prn_templates_path = config.get('prn_templates')
+    if not all([config.get('kodes'), prn_tasks_path, prn_templates_path]):
+        raise ValueError("В конфигурации отсутствуют необходимые пути (kodes, prn_tasks, prn_templates)")
+
+    keys = list(dict.fromkeys(keys or []))
+    if prefix is not None:
+        keys.extend(k for k in list_kodes_keys(prefix) if k not in keys)
+    created_at = datetime.now(timezone.utc)
+    result = {"createdAt": created_at.isoformat(), "template": vdf_template_name, "summary": {}, "jobs": []}
+    if not keys:
+        logger.info("[*] Пакетная печать: нет ключей для обработки")
+        return result
+
+    templates = load_print_templates(get_storage(prn_templates_path, s3_config), prn_templates_path,
+                                     vdf_template_name)
+    if templates is None:
+        raise FileNotFoundError(f"Шаблоны печати не найдены в {prn_templates_path}")
+
+    tasks = [(key, vdf_template_name, ignore_duplicate, templates) for key in keys]
+    logger.info(f"[*] Пакетная печать: {len(keys)} заданий, шаблон {vdf_template_name}")
+    if workers == 1 or len(tasks) == 1:
+        jobs = [_batch_print_worker(task) for task in tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map сохраняет порядок ключей в манифесте
+            jobs = list(executor.map(_batch_print_worker, tasks))
+
+    summary = {}
+    for job in jobs:
+        summary[job["status"]] = summary.get(job["status"], 0) + 1
+    result["summary"] = summary
+    result["jobs"] = jobs
+    logger.info(f"[*] Пакетная печать завершена: {summary}")
+
+    if manifest:
+        manifest_path = (f"{prn_tasks_path.rstrip('/')}/.manifests/"
+                         f"batch-{created_at.strftime('%Y%m%d-%H%M%S-%f')}.json")
+        get_storage(prn_tasks_path, s3_config).write_text(
+            manifest_path, json.dumps(result, ensure_ascii=False, indent=4)
+        )
+        result["manifest"] = manifest_path
+        logger.info(f"[*] Манифест пакета: {manifest_path}")
+    return result
 
 def main():
     parser = argparse.ArgumentParser(description="Генерация файлов задания на печать (PRN) на основе кодов эмиссии")
-    parser.add_argument("key", help="Ключ объекта эмиссии (имя файла без .json)")
+    parser.add_argument("key", nargs="*", help="Ключ объекта эмиссии (имя файла без .json); несколько ключей - пакетный режим")
+    parser.add_argument("--prefix", help="Пакетный режим: все файлы кодов, имя которых начинается с префикса")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Количество процессов пакетного режима (по умолчанию - по числу CPU)")
     parser.add_argument("--template", default="32x32_20x20.VDF", help="Имя файла шаблона VDF")
     parser.add_argument("--config", help="Путь к файлу конфигурации suz_worker_config")
     parser.add_argument("--ignore-duplicate", action="store_true", help="Игнорировать проверку на повторную печать")
 
     args = parser.parse_args()
+    if not args.key and args.prefix is None:
+        parser.error("укажите ключ эмиссии или --prefix")
 
     if args.config:
         os.environ['suz_worker_config'] = args.config
 
-    result = generate_prn_files(args.key, args.template, ignore_duplicate=args.ignore_duplicate)
-    if result:
-        print(f"Success: {result}")
-    else:
-        print("Failed")
+    if len(args.key) == 1 and args.prefix is None:
+        result = generate_prn_files(args.key[0], args.template, ignore_duplicate=args.ignore_duplicate)
+        if result:
+            print(f"Success: {result}")
+        else:
+            print("Failed")
+            exit(1)
+        return
+
+    batch = generate_prn_batch(args.key, prefix=args.prefix, vdf_template_name=args.template,
+                               ignore_duplicate=args.ignore_duplicate, workers=args.workers)
+    print(json.dumps(batch["summary"], ensure_ascii=False))
+    if batch.get("manifest"):
+        print(f"Manifest: {batch['manifest']}")
+    if batch["summary"].get("error"):
         exit(1)
 
 if __name__ == "__main__":
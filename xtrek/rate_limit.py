@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import logging
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Потокобезопасный ограничитель частоты (token bucket) в пределах процесса.
+    rate - разрешенное количество запросов в секунду, burst - размер корзины.
+    """
+
+    def __init__(self, rate: Optional[float], burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Блокирует поток до получения разрешения. Возвращает время ожидания в секундах."""
+        if not self.rate or self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+# ---------------------------------------------------------------------------
+# Общие для воркеров ограничители частоты запросов к API ЦРПТ.
+#
+# Лимиты ЦРПТ действуют на учетную запись, а не на процесс, поэтому корзина
+# семейства методов хранится вне процесса:
+#   XTREK_RATE_LIMIT_PATH - файл SQLite, общий для процессов одного хоста;
+#   XTREK_RATE_LIMIT_S3   - каталог (s3://... или локальный) с состоянием
+#                           корзин под блокировками storage, для нескольких
+#                           хостов без общего диска.
+# Без этих переменных ограничение не действует. Частоты семейств
+# переопределяются JSON в XTREK_RATE_LIMITS:
+#   {"suz_codes": {"rate": 5, "burst": 5}, "true_api_doc": 10}
+# ---------------------------------------------------------------------------
+
+SUZ_CODES = "suz_codes"
+SUZ_STATUS = "suz_status"
+TRUE_API_CISES = "true_api_cises"
+TRUE_API_DOC = "true_api_doc"
+NK_PRODUCT_LIST = "nk_product_list"
+
+# Запросов в секунду и размер корзины по умолчанию
+API_RATE_LIMITS = {
+    SUZ_CODES: {"rate": 10, "burst": 10},
+    SUZ_STATUS: {"rate": 20, "burst": 20},
+    TRUE_API_CISES: {"rate": 10, "burst": 10},
+    TRUE_API_DOC: {"rate": 20, "burst": 20},
+    NK_PRODUCT_LIST: {"rate": 5, "burst": 5},
+}
+
+
+def _refill(tokens: float, updated_at: float, now: float, rate: float, burst: int) -> float:
+    return min(float(burst), tokens + max(0.0, now - updated_at) * rate)
+
+
+class _SharedBucket:
+    """Общая часть межпроцессных корзин: _take(cost, pause) возвращает ожидание."""
+
+    rate: Optional[float]
+
+    def acquire(self) -> float:
+        """Блокирует поток до получения разрешения. Возвращает время ожидания в секундах."""
+        if not self.rate or self.rate <= 0:
+            return 0.0
+        delay = self._take(1)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def pause(self, seconds: float):
+        """Приостанавливает семейство для всех процессов (например, после 429)."""
+        if self.rate and self.rate > 0 and seconds > 0:
+            self._take(0, pause=seconds)
+
+
+class SqliteRateLimiter(_SharedBucket):
+    """
+    Token bucket, общий для процессов одного хоста (SQLite, WAL).
+
+    Разрешение резервируется в транзакции: счетчик токенов уменьшается сразу и
+    может уйти в минус, а ожидание до возврата долга выполняется уже вне
+    транзакции. Так процессы не держат блокировку базы во время сна и
+    получают разрешения в порядке обращения.
+    """
+
+    def __init__(self, path, family: str, rate: Optional[float], burst: int = 1,
+                 timeout: float = 30.0):
+        self.path = Path(str(path)).expanduser()
+        self.family = family
+        self.rate = rate
+        self.burst = max(1, int(burst))
+        self.timeout = timeout
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " family TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None)
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return conn
+
+    def _take(self, cost: float, pause: float = 0.0) -> float:
+        """Списывает cost токенов (и долг pause секунд) и возвращает необходимое ожидание."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM buckets WHERE family = ?", (self.family,)
+            ).fetchone()
+            tokens = float(self.burst) if row is None else _refill(row[0], row[1], now, self.rate, self.burst)
+            tokens -= cost
+            if pause:
+                tokens = min(tokens, -pause * self.rate)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (family, tokens, updated_at) VALUES (?, ?, ?)",
+                (self.family, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return max(0.0, -tokens / self.rate)
+
+
+class StorageRateLimiter(_SharedBucket):
+    """
+    Token bucket с состоянием в файле storage (s3://... или локальный путь).
+
+    Запасной вариант для воркеров на разных хостах: состояние корзины
+    читается и записывается под блокировкой storage.acquire_lock. Каждое
+    разрешение стоит нескольких запросов к хранилищу, поэтому подходит только
+    для невысоких частот.
+    """
+
+    # Блокировка, оставленная упавшим процессом, снимается через lock_ttl секунд
+    def __init__(self, base_path, family: str, rate: Optional[float], burst: int = 1,
+                 s3_config=None, lock_ttl: float = 10.0, lock_wait: float = 30.0):
+        from .storage import get_storage
+
+        self.base_path = str(base_path).rstrip('/')
+        self.family = family
+        self.rate = rate
+        self.burst = max(1, int(burst))
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.state_path = f"{self.base_path}/{family}.json"
+        self.lock_path = f"{self.base_path}/{family}.lock"
+        self.storage = get_storage(self.base_path, s3_config)
+
+    def _lock(self) -> str:
+        """Берет блокировку и возвращает ее содержимое (метку владельца)."""
+        from .storage import take_over_stale_lock
+
+        token = uuid.uuid4().hex
+        deadline = time.time() + self.lock_wait
+        while True:
+            content = json.dumps({"createdAt": time.time(), "token": token})
+            if self.storage.acquire_lock(self.lock_path, content):
+                return content
+            try:
+                current = self.storage.read_text(self.lock_path)
+                created_at = json.loads(current).get("createdAt", 0)
+            except Exception:
+                created_at = None
+            if created_at is not None and time.time() - created_at > self.lock_ttl:
+                # Перехват только прочитанной блокировки: из процессов, увидевших
+                # ее устаревшей, блокировку получит один
+                if take_over_stale_lock(self.storage, self.lock_path, current, content):
+                    logger.warning(f"[RATE] Перехвачена устаревшая блокировка {self.lock_path}")
+                    return content
+                continue
+            if time.time() > deadline:
+                raise TimeoutError(f"Не удалось получить блокировку {self.lock_path}")
+            time.sleep(0.05)
+
+    def _unlock(self, content: str):
+        # Блокировку, перехваченную после lock_ttl другим процессом, не снимаем
+        try:
+            if self.storage.read_text(self.lock_path) != content:
+                return
+        except Exception:
+            return
+        self.storage.release_lock(self.lock_path)
+
+    def _take(self, cost: float, pause: float = 0.0) -> float:
+        lock_content = self._lock()
+        try:
+            now = time.time()
+            try:
+                state = json.loads(self.storage.read_text(self.state_path))
+                tokens = _refill(state["tokens"], state["updatedAt"], now, self.rate, self.burst)
+            except Exception:
+                tokens = float(self.burst)
+            tokens -= cost
+            if pause:
+                tokens = min(tokens, -pause * self.rate)
+            self.storage.write_text(self.state_path, json.dumps({"tokens": tokens, "updatedAt": now}))
+        finally:
+            self._unlock(lock_content)
+        return max(0.0, -tokens / self.rate)
+
+
+_SHARED_LIMITERS = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def _family_limits(family: str) -> dict:
+    limits = dict(API_RATE_LIMITS.get(family, {"rate": None, "burst": 1}))
+    raw = os.getenv("XTREK_RATE_LIMITS")
+    if raw:
+        try:
+            override = json.loads(raw).get(family)
+        except (ValueError, AttributeError):
+            logger.warning("[RATE] Некорректный JSON в XTREK_RATE_LIMITS, используются значения по умолчанию")
+            override = None
+        if isinstance(override, dict):
+            limits.update(override)
+        elif override is not None:
+            limits["rate"] = override
+    return limits
+
+
+def shared_rate_limiter(family: str):
+    """
+    Общий ограничитель семейства методов или None, если ограничение не
+    включено переменными окружения.
+    """
+    sqlite_path = os.getenv("XTREK_RATE_LIMIT_PATH")
+    storage_path = os.getenv("XTREK_RATE_LIMIT_S3")
+    if not sqlite_path and not storage_path:
+        return None
+    key = (family, sqlite_path, storage_path, os.getenv("XTREK_RATE_LIMITS"))
+    with _SHARED_LOCK:
+        if key not in _SHARED_LIMITERS:
+            limits = _family_limits(family)
+            if sqlite_path:
+                limiter = SqliteRateLimiter(sqlite_path, family, limits.get("rate"), limits.get("burst", 1))
+            else:
+                from .config_loader import load_config
+
+                s3_config = load_config('suz_worker_config').get('s3_config')
+                limiter = StorageRateLimiter(storage_path, family, limits.get("rate"),
+                                             limits.get("burst", 1), s3_config=s3_config)
+            _SHARED_LIMITERS[key] = limiter
+        return _SHARED_LIMITERS[key]
+
+
+def throttle(family: str) -> float:
+    """Ждет разрешения общего ограничителя семейства. Без настройки ничего не делает."""
+    limiter = shared_rate_limiter(family)
+    if limiter is None:
+        return 0.0
+    try:
+        waited = limiter.acquire()
+    except Exception as e:
+        # Недоступное хранилище лимитов не должно останавливать обмен с ЦРПТ
+        logger.warning(f"[RATE] Ограничитель {family} недоступен: {e}")
+        return 0.0
+    if waited:
+        logger.debug(f"[RATE] {family}: ожидание {waited:.2f} с")
+    return waited
+
+
+def note_response(family: str, response) -> None:
+    """При ответе 429 приостанавливает семейство для всех воркеров на Retry-After."""
+    if getattr(response, "status_code", None) != 429:
+        return
+    limiter = shared_rate_limiter(family)
+    if limiter is None:
+        return
+    try:
+        seconds = float((getattr(response, "headers", None) or {}).get("Retry-After") or 1)
+    except (TypeError, ValueError):
+        seconds = 1.0
+    logger.warning(f"[RATE] {family}: 429 от API, пауза {seconds:.1f} с")
+    try:
+        limiter.pause(seconds)
+    except Exception as e:
+        logger.warning(f"[RATE] Ограничитель {family} недоступен: {e}")
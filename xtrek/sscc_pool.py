@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from .SSCC_Utils import get_sscc_from_service, invalid_ssccs, sscc_body
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Запас SSCC, полученных у сервиса заранее.
+#
+# Коды выбираются блоками по префиксу/расширению и хранятся в SQLite, общем
+# для процессов хоста. Выдача атомарна (BEGIN IMMEDIATE), поэтому два воркера
+# никогда не получат один код. Когда свободных кодов становится меньше
+# low_water, запас пополняется в фоне. Полученные блоки и выдачи дублируются
+# в журнал в хранилище (ledger, s3://... или локальный путь), чтобы коды
+# можно было восстановить при потере сервера.
+#
+# Раздел конфигурации:
+#   "sscc_pool": {
+#       "path": "~/.cache/xtrek/sscc_pool.sqlite",
+#       "block_size": 1000,
+#       "low_water": 200,
+#       "ledger": "s3://bucket/ssccLedger/"
+#   }
+# ---------------------------------------------------------------------------
+
+DEFAULT_POOL_PATH = "~/.cache/xtrek/sscc_pool.sqlite"
+DEFAULT_BLOCK_SIZE = 1000
+DEFAULT_LOW_WATER = 200
+
+# Пополнение, начатое другим процессом, считается брошенным через это время
+REFILL_LEASE_SECONDS = 120
+
+# fetch(prefix, count, extension) -> список SSCC
+Fetcher = Callable[[str, int, Optional[str]], List[str]]
+
+
+class SsccPool:
+    """Запас SSCC с атомарной выдачей и фоновым пополнением."""
+
+    def __init__(self, path, fetch: Fetcher, block_size: int = DEFAULT_BLOCK_SIZE,
+                 low_water: int = DEFAULT_LOW_WATER, ledger_path: Optional[str] = None,
+                 s3_config=None, timeout: float = 30.0):
+        self.path = Path(str(path)).expanduser()
+        self.fetch = fetch
+        self.block_size = max(1, int(block_size))
+        self.low_water = max(0, int(low_water))
+        self.ledger_path = ledger_path.rstrip('/') if ledger_path else None
+        self.s3_config = s3_config
+        self.timeout = timeout
+        self._refill_threads = {}
+        self._refill_lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ssccs ("
+                " sscc TEXT PRIMARY KEY,"
+                " pool TEXT NOT NULL,"
+                " fetched_at REAL NOT NULL,"
+                " reserved_at REAL,"
+                " reserved_for TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ssccs_free ON ssccs (pool, reserved_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ssccs_reserved_for ON ssccs (pool, reserved_for)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS refills ("
+                " pool TEXT PRIMARY KEY,"
+                " started_at REAL NOT NULL)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None)
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return conn
+
+    @staticmethod
+    def _pool_key(prefix, extension) -> str:
+        return f"{prefix}:{'' if extension is None else extension}"
+
+    def available(self, prefix: str, extension: Optional[str] = None) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM ssccs WHERE pool = ? AND reserved_at IS NULL",
+                (self._pool_key(prefix, extension),),
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def _write_ledger(self, kind: str, record: dict):
+        if not self.ledger_path:
+            return
+        path = f"{self.ledger_path}/{kind}/{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.json"
+        try:
+            get_storage(self.ledger_path, self.s3_config).write_text(
+                path, json.dumps(record, ensure_ascii=False, indent=4)
+            )
+        except Exception as e:
+            logger.error(f"[SSCC] Не удалось записать журнал {path}: {e}")
+
+    def _claim_refill(self, pool: str) -> bool:
+        """Одно пополнение пула на все процессы хоста."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT started_at FROM refills WHERE pool = ?", (pool,)).fetchone()
+            if row and now - row[0] < REFILL_LEASE_SECONDS:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute("INSERT OR REPLACE INTO refills (pool, started_at) VALUES (?, ?)", (pool, now))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _release_refill(self, pool: str):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM refills WHERE pool = ?", (pool,))
+        finally:
+            conn.close()
+
+    def refill(self, prefix: str, extension: Optional[str] = None, count: Optional[int] = None) -> int:
+        """
+        Запрашивает у сервиса блок кодов и добавляет его в запас. Коды с
+        неверной контрольной цифрой отбрасываются. Возвращает число новых кодов.
+        """
+        pool = self._pool_key(prefix, extension)
+        count = max(int(count or 0), self.block_size)
+        codes = self.fetch(prefix, count, extension) or []
+        invalid = set(invalid_ssccs(codes))
+        if invalid:
+            logger.error(f"[SSCC] Сервис вернул {len(invalid)} кодов с неверной контрольной цифрой, "
+                         f"например {next(iter(invalid))}")
+        bodies = [sscc_body(code) for code in codes if code not in invalid]
+
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO ssccs (sscc, pool, fetched_at) VALUES (?, ?, ?)",
+                [(body, pool, now) for body in bodies],
+            )
+            added = conn.total_changes - before
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        if added < len(bodies):
+            logger.warning(f"[SSCC] {len(bodies) - added} кодов пула {pool} уже были в запасе")
+        logger.info(f"[SSCC] Пул {pool} пополнен на {added} кодов")
+        self._write_ledger("blocks", {
+            "pool": pool, "prefix": prefix, "extension": extension,
+            "fetchedAtUnix": now, "ssccs": bodies, "invalid": sorted(invalid),
+        })
+        return added
+
+    def _reserve(self, pool: str, count: int, reserved_for: Optional[str], reuse: bool = False):
+        """
+        Резервирует count кодов. При reuse коды, уже выданные тому же
+        reserved_for (повтор задачи), возвращаются повторно и дополняются до count.
+        Возвращает (все коды, новые коды) или ([], []), если свободных не хватает.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            existing = []
+            if reuse and reserved_for is not None:
+                existing = [row[0] for row in conn.execute(
+                    "SELECT sscc FROM ssccs WHERE pool = ? AND reserved_for = ? "
+                    "ORDER BY fetched_at, sscc LIMIT ?",
+                    (pool, reserved_for, count),
+                ).fetchall()]
+            needed = count - len(existing)
+            rows = conn.execute(
+                "SELECT sscc FROM ssccs WHERE pool = ? AND reserved_at IS NULL "
+                "ORDER BY fetched_at, sscc LIMIT ?",
+                (pool, needed),
+            ).fetchall() if needed else []
+            if len(rows) < needed:
+                conn.execute("ROLLBACK")
+                return [], []
+            codes = [row[0] for row in rows]
+            conn.executemany(
+                "UPDATE ssccs SET reserved_at = ?, reserved_for = ? WHERE sscc = ?",
+                [(now, reserved_for, code) for code in codes],
+            )
+            conn.execute("COMMIT")
+            return existing + codes, codes
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def take(self, prefix: str, count: int, extension: Optional[str] = None,
+             reserved_for: Optional[str] = None, reuse: bool = False) -> List[str]:
+        """
+        Выдает count кодов SSCC (18 цифр). Запрос к сервису выполняется
+        синхронно только если запас пуст; иначе пополнение идет в фоне.
+        reserved_for - идентификатор задания в журнале. С reuse=True повтор
+        с тем же reserved_for получает уже выданные ему коды, а не расходует
+        новые; включать только если reserved_for однозначно задает задание.
+        """
+        count = int(count)
+        if count <= 0:
+            return []
+        pool = self._pool_key(prefix, extension)
+        codes, new_codes = self._reserve(pool, count, reserved_for, reuse)
+        if not codes:
+            missing = count - self.available(prefix, extension)
+            logger.warning(f"[SSCC] В пуле {pool} не хватает {missing} кодов, синхронный запрос к сервису")
+            self.refill(prefix, extension, count=missing + self.low_water)
+            codes, new_codes = self._reserve(pool, count, reserved_for, reuse)
+            if not codes:
+                raise ValueError(f"Пул SSCC {pool}: не удалось получить {count} кодов")
+
+        if len(new_codes) < len(codes):
+            logger.info(f"[SSCC] {reserved_for}: повторно выданы {len(codes) - len(new_codes)} "
+                        f"ранее зарезервированных кодов пула {pool}")
+        if new_codes:
+            self._write_ledger("reservations", {
+                "pool": pool, "reservedFor": reserved_for, "reservedAtUnix": time.time(), "ssccs": new_codes,
+            })
+        if self.available(prefix, extension) < self.low_water:
+            self.refill_async(prefix, extension)
+        return codes
+
+    def refill_if_low(self, prefix: str, extension: Optional[str] = None) -> int:
+        """Пополняет пул, если свободных кодов меньше low_water и пополнение не идет в другом процессе."""
+        if self.available(prefix, extension) >= self.low_water:
+            return 0
+        pool = self._pool_key(prefix, extension)
+        if not self._claim_refill(pool):
+            return 0
+        try:
+            return self.refill(prefix, extension)
+        finally:
+            self._release_refill(pool)
+
+    def refill_async(self, prefix: str, extension: Optional[str] = None) -> Optional[threading.Thread]:
+        """Запускает пополнение в фоновом потоке (не более одного на пул в процессе)."""
+        pool = self._pool_key(prefix, extension)
+
+        def run():
+            try:
+                self.refill_if_low(prefix, extension)
+            except Exception as e:
+                logger.error(f"[SSCC] Ошибка фонового пополнения пула {pool}: {e}")
+
+        with self._refill_lock:
+            thread = self._refill_threads.get(pool)
+            if thread is not None and thread.is_alive():
+                return None
+            thread = threading.Thread(target=run, name=f"sscc-refill-{pool}", daemon=True)
+            self._refill_threads[pool] = thread
+            thread.start()
+            return thread
+
+
+_POOLS = {}
+
+
+def get_sscc_pool(config) -> Optional[SsccPool]:
+    """Пул из раздела конфигурации sscc_pool или None, если пул не настроен."""
+    settings = (config or {}).get('sscc_pool')
+    service_url = (config or {}).get('sscc_service_url') or (config or {}).get('sscc_url')
+    if not settings or not service_url:
+        return None
+    if settings is True:
+        settings = {}
+    path = os.path.expanduser(settings.get('path', DEFAULT_POOL_PATH))
+    if path not in _POOLS:
+        _POOLS[path] = SsccPool(
+            path,
+            fetch=lambda prefix, count, extension: get_sscc_from_service(service_url, prefix, count, extension),
+            block_size=settings.get('block_size', DEFAULT_BLOCK_SIZE),
+            low_water=settings.get('low_water', DEFAULT_LOW_WATER),
+            ledger_path=settings.get('ledger'),
+            s3_config=config.get('s3_config'),
+        )
+    return _POOLS[path]
@@ -0,0 +1,259 @@
+import time
+import random
+import sqlite3
+import logging
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StatusPending(RuntimeError):
+    """
+    Документ или заказ еще не перешел в конечное состояние на стороне СУЗ/ЧЗ.
+    Это не ошибка: документ передается поллеру вместо повторов задачи Celery.
+    """
+
+    def __init__(self, document_id, state=None, message=None):
+        super().__init__(message or f"Статус {document_id}: {state} (ожидание конечного состояния)")
+        self.document_id = str(document_id)
+        self.state = state
+
+
+# probe(document_id) -> (state, final)
+Probe = Callable[[str], Tuple[Optional[str], bool]]
+# batch_probe(rows) -> {document_id: (state, final)}: один запрос на пачку документов этапа
+BatchProbe = Callable[[List[Dict]], Dict[str, Tuple[Optional[str], bool]]]
+# is_failed(stage, state) -> True для конечного состояния-ошибки (REJECTED, CHECKED_NOT_OK и т.п.)
+FailedCheck = Callable[[str, Optional[str]], bool]
+
+
+class StatusPoller:
+    """
+    Единая таблица документов, ожидающих конечного статуса, с адаптивной
+    задержкой проверки для каждого документа.
+
+    Пока состояние не меняется, интервал удваивается от base_interval до
+    max_interval; смена состояния сбрасывает его. Продолжение цепочки
+    (on_final) вызывается один раз - когда документ достиг конечного
+    состояния; неудачное продолжение повторяется с той же растущей
+    задержкой. Конечное состояние-ошибка снимает документ с опроса без
+    продолжения. Таблица хранится в SQLite и общая для процессов хоста.
+    """
+
+    def __init__(self, path, base_interval: float = 60, max_interval: float = 1800,
+                 max_age: float = 12 * 3600, batch_size: int = 50, timeout: float = 30.0):
+        self.path = Path(str(path)).expanduser()
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending_status ("
+                " stage TEXT NOT NULL,"
+                " document_id TEXT NOT NULL,"
+                " full_key TEXT NOT NULL,"
+                " state TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " registered_at REAL NOT NULL,"
+                " checked_at REAL,"
+                " next_check_at REAL NOT NULL,"
+                " PRIMARY KEY (stage, document_id))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS pending_status_due ON pending_status (next_check_at)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None)
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return conn
+
+    def _interval(self, attempts: int) -> float:
+        interval = min(self.base_interval * (2 ** attempts), self.max_interval)
+        # Небольшой разброс, чтобы документы одной пачки не проверялись синхронно
+        return interval * random.uniform(0.9, 1.1)
+
+    def register(self, stage: str, document_id: str, full_key: str, state: Optional[str] = None,
+                 registered_at: Optional[float] = None) -> None:
+        """Ставит документ на опрос. Повторная регистрация не сбрасывает возраст и задержку."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO pending_status "
+                "(stage, document_id, full_key, state, attempts, registered_at, next_check_at) "
+                "VALUES (?, ?, ?, ?, 0, ?, ?) "
+                "ON CONFLICT (stage, document_id) DO UPDATE SET "
+                " full_key = excluded.full_key,"
+                " state = COALESCE(excluded.state, pending_status.state)",
+                (stage, str(document_id), full_key, state, registered_at or now, now + self._interval(0)),
+            )
+        finally:
+            conn.close()
+
+    def remove(self, stage: str, document_id: str) -> None:
+        conn = self._connect()
+        try:
+            conn.execute(
+                "DELETE FROM pending_status WHERE stage = ? AND document_id = ?",
+                (stage, str(document_id)),
+            )
+        finally:
+            conn.close()
+
+    def pending(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT stage, document_id, full_key, state, attempts, registered_at, next_check_at "
+                "FROM pending_status ORDER BY next_check_at"
+            ).fetchall()
+        finally:
+            conn.close()
+        keys = ("stage", "document_id", "full_key", "state", "attempts", "registered_at", "next_check_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def claim_due(self, limit: Optional[int] = None, lease_seconds: float = 300):
+        """
+        Забирает до limit документов, срок проверки которых наступил. Срок
+        сдвигается на lease_seconds, поэтому параллельный цикл их не возьмет.
+        """
+        now = time.time()
+        limit = limit or self.batch_size
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT stage, document_id, full_key, state, attempts, registered_at "
+                "FROM pending_status WHERE next_check_at <= ? ORDER BY next_check_at LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE pending_status SET next_check_at = ? WHERE stage = ? AND document_id = ?",
+                [(now + lease_seconds, row[0], row[1]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        keys = ("stage", "document_id", "full_key", "state", "attempts", "registered_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def _reschedule(self, row: Dict, state: Optional[str], attempts: int) -> None:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE pending_status SET state = ?, attempts = ?, checked_at = ?, next_check_at = ? "
+                "WHERE stage = ? AND document_id = ?",
+                (state, attempts, now, now + self._interval(attempts), row["stage"], row["document_id"]),
+            )
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _run_batch_probes(rows: List[Dict], batch_probes: Dict[str, BatchProbe]) -> Dict[tuple, Tuple]:
+        """Результаты пакетных проверок по (stage, document_id); ошибка пачки - пустой результат."""
+        results = {}
+        for stage, batch_probe in batch_probes.items():
+            stage_rows = [row for row in rows if row["stage"] == stage]
+            if not stage_rows:
+                continue
+            try:
+                stage_results = batch_probe(stage_rows)
+            except Exception as e:
+                logger.warning(f"[POLL] Ошибка пакетной проверки этапа {stage}: {e}")
+                continue
+            for document_id, result in (stage_results or {}).items():
+                results[(stage, str(document_id))] = result
+        return results
+
+    def run_once(self, probes: Dict[str, Probe], on_final: Callable[[str, str, Optional[str]], None],
+                 on_expired: Optional[Callable[[Dict], None]] = None,
+                 batch_probes: Optional[Dict[str, BatchProbe]] = None,
+                 is_failed: Optional[FailedCheck] = None,
+                 on_failed: Optional[Callable[[Dict, Optional[str]], None]] = None) -> Dict[str, int]:
+        """
+        Один цикл опроса: проверяет наступившие документы пачкой и вызывает
+        on_final(stage, full_key, state) для документов в конечном состоянии.
+        Документы этапов из batch_probes проверяются одним вызовом на этап.
+        Конечные состояния, для которых is_failed(stage, state) истинно,
+        передаются в on_failed(row, state) вместо on_final.
+        """
+        stats = {"checked": 0, "changed": 0, "finished": 0, "failed": 0, "expired": 0}
+        now = time.time()
+        rows = self.claim_due()
+        batch_probes = batch_probes or {}
+        batch_results = self._run_batch_probes(rows, batch_probes)
+        for row in rows:
+            probe = probes.get(row["stage"])
+            if probe is None and row["stage"] not in batch_probes:
+                logger.warning(f"[POLL] Нет проверки статуса для этапа {row['stage']}, запись удалена")
+                self.remove(row["stage"], row["document_id"])
+                continue
+
+            stats["checked"] += 1
+            if row["stage"] in batch_probes:
+                # Документ без результата пачки (ошибка запроса) проверяется в следующий раз
+                state, final = batch_results.get((row["stage"], row["document_id"]), (row["state"], False))
+            else:
+                try:
+                    state, final = probe(row["document_id"])
+                except Exception as e:
+                    logger.warning(f"[POLL] Ошибка проверки {row['stage']}/{row['document_id']}: {e}")
+                    state, final = row["state"], False
+
+            if final and is_failed and is_failed(row["stage"], state):
+                logger.error(f"[POLL] {row['stage']}/{row['document_id']}: статус ошибки {state}, опрос остановлен")
+                self.remove(row["stage"], row["document_id"])
+                if on_failed:
+                    on_failed(row, state)
+                stats["failed"] += 1
+            elif final:
+                logger.info(f"[POLL] {row['stage']}/{row['document_id']}: конечный статус {state}")
+                # Продолжение может снова поставить документ на опрос, поэтому
+                # запись удаляется до вызова и возвращается, если вызов не удался
+                self.remove(row["stage"], row["document_id"])
+                try:
+                    on_final(row["stage"], row["full_key"], state)
+                except Exception as e:
+                    logger.error(f"[POLL] Не удалось продолжить {row['stage']}/{row['document_id']}: {e}")
+                    if now - row["registered_at"] > self.max_age:
+                        logger.error(f"[POLL] {row['stage']}/{row['document_id']}: продолжение не удалось "
+                                     f"за {self.max_age}с, опрос остановлен")
+                        if on_expired:
+                            on_expired(row)
+                        stats["expired"] += 1
+                        continue
+                    # Следующая попытка - с растущей задержкой, а не через base_interval
+                    self.register(row["stage"], row["document_id"], row["full_key"], state,
+                                  registered_at=row["registered_at"])
+                    self._reschedule(row, state, row["attempts"] + 1)
+                    continue
+                stats["finished"] += 1
+            elif now - row["registered_at"] > self.max_age:
+                logger.error(
+                    f"[POLL] {row['stage']}/{row['document_id']} не получил конечный статус "
+                    f"за {self.max_age}с (последний: {state}), опрос остановлен"
+                )
+                self.remove(row["stage"], row["document_id"])
+                if on_expired:
+                    on_expired(row)
+                stats["expired"] += 1
+            elif state != row["state"]:
+                logger.info(f"[POLL] {row['stage']}/{row['document_id']}: {row['state']} -> {state}")
+                self._reschedule(row, state, 0)
+                stats["changed"] += 1
+            else:
+                self._reschedule(row, state, row["attempts"] + 1)
+        return stats
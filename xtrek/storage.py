@@ -2,6 +2,7 @@ import os
 import json
 import boto3
 import fnmatch
+import hashlib
 import logging
 from pathlib import Path
 from urllib.parse import urlparse
@@ -335,3 +336,28 @@ def get_storage(path, s3_config=None):
     if str(path).startswith('s3://'):
         return S3Storage(s3_config or {})
     return LocalStorage()
+
+
+def take_over_stale_lock(storage, lock_path, stale_content, content):
+    """
+    Перехватывает блокировку, оставленную упавшим процессом.
+
+    stale_content - прочитанное содержимое устаревшей блокировки. Перехват
+    именно этого содержимого защищен условной записью маркера, поэтому из
+    процессов, увидевших одну и ту же устаревшую блокировку, ее получает
+    только один; остальные увидят другое содержимое и отступят.
+    Возвращает True, если блокировка перешла к вызывающему.
+    """
+    digest = hashlib.sha1(str(stale_content).encode('utf-8')).hexdigest()[:16]
+    marker_path = f"{lock_path}.takeover-{digest}"
+    if not storage.acquire_lock(marker_path, content):
+        return False
+    try:
+        current = storage.read_text(lock_path) if storage.exists(lock_path) else None
+        if current != stale_content:
+            # Блокировку уже освободили или перехватили
+            return False
+        storage.write_text(lock_path, content)
+        return True
+    finally:
+        storage.release_lock(marker_path)
@@ -22,6 +22,7 @@ from typing import List, Dict, Any, Generator, Union
 from .suz_api_models import EmissionOrderreceipts
 from .org_manager import OrganizationManager
 from .tokens import TokenProcessor
+from .rate_limit import SUZ_CODES, SUZ_STATUS, note_response, throttle
 
 # logging
 logger = logging.getLogger(__name__)
@@ -58,12 +59,18 @@ class SUZ:
         }
 
     def _get(self, url, params=None):
+        # Выгрузка кодов и запросы статусов ограничиваются ЦРПТ раздельно
+        family = SUZ_CODES if "/codes" in url else SUZ_STATUS
         try:
+            throttle(family)
             response = requests.get(url, params=params, headers=self.headers, verify=False)
+            note_response(family, response)
             if response.status_code in (401, 403) and self.token_refresher:
                 self.token = self.token_refresher()
                 self.headers["clientToken"] = self.token
+                throttle(family)
                 response = requests.get(url, params=params, headers=self.headers, verify=False)
+                note_response(family, response)
             if response.status_code != 200:
                 logger.debug(f"GET {url} failed with {response.status_code}: {response.text}")
             response.raise_for_status()
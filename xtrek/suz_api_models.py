@@ -258,3 +258,5 @@ class EmissionOrderStatus(SUZBase):
     templateId: Optional[int] = None
     expiredDate: Optional[str] = None
     productionOrderId: Optional[str] = None
+    # Время проверки статуса воркером (unix), не поле API СУЗ
+    checkedAtUnix: Optional[float] = None
@@ -1,9 +1,12 @@
 import os
 import json
 import re
+import time
+import uuid
+from dataclasses import dataclass, replace
 from celery import Celery
 from celery.signals import task_postrun, task_prerun
-from urllib.parse import quote
+from urllib.parse import quote, urlparse
 
 # 1. Импорт вашей бизнес-логики
 from xtrek.config_loader import load_config
@@ -14,6 +17,9 @@ from xtrek.create_emission_task_sample import (
     create_emission_task, 
     sign_and_send_emission,
     update_emission_order_status,
+    update_emission_order_statuses,
+    StatusCheckContext,
+    EMISSION_PUBLISHED_STATES,
     get_emission_kodes,
     create_virtual_utilisation_task,
     sign_and_send_utilisation,
@@ -32,8 +38,15 @@ from xtrek.create_emission_task_sample import (
     update_aggregation_set_status,
     create_aggregation_report,
     sign_and_send_aggregation,
+    SignaturePending,
+    EquipmentReportContext,
 )
+from xtrek.storage import get_storage, take_over_stale_lock
+from xtrek.cache_store import SqliteCache
+from xtrek.status_poller import StatusPoller, StatusPending
+from xtrek.document_batching import batching_settings, enqueue_document, flush_document_batches
 from xtrek.prn_util import generate_prn_files
+from xtrek.sscc_pool import get_sscc_pool
 from xtrek.utils import (
         check_aggregation_reports,
         set_ready_check,
@@ -83,11 +96,57 @@ CONTACT_PERSON = config.get('contact_person', "scan")
 # Директория для подписи
 signing_dir = config.get('sign', r"Y:\BatchPassToPrint\tst")
 
+# Двухфазная подпись: обработчик выкладывает документ на подпись и завершается,
+# а отправку выполняет событие появления .sig или периодический обход (нужен
+# Celery beat). По умолчанию выключена: воркер ждет подпись, как раньше.
+TWO_PHASE_SIGNING = config.get('two_phase_signing', False)
+WAIT_SIGNATURE = not TWO_PHASE_SIGNING
+SIGNATURE_PENDING_PATH = config.get('signature-pending', f"s3://{INTERNAL_BUCKET}/signaturePending/")
+SIGNATURE_PENDING_TTL_SECONDS = config.get('signature_pending_ttl_seconds', 12 * 3600)
+# Просроченные ожидания переносятся сюда, а не удаляются: остановленный этап виден и разбирается вручную
+SIGNATURE_PENDING_ERRORS_PATH = config.get(
+    'signature-pending-errors', f"s3://{INTERNAL_BUCKET}/errors/signaturePending/"
+)
+SIGNATURE_SWEEP_SECONDS = config.get('signature_sweep_seconds', 60)
+# Захват записи ожидающей подписи, оставленный упавшим воркером, перехватывается через это время
+SIGNATURE_RESUME_CLAIM_TTL_SECONDS = config.get('signature_resume_claim_ttl_seconds', 1800)
+
+# Опрос статусов документов единым поллером вместо повторов задач Celery.
+# По умолчанию выключен: нужен Celery beat на том же хосте, что и воркеры.
+STATUS_POLLER_ENABLED = config.get('status_poller', False)
+STATUS_POLL_SECONDS = config.get('status_poll_seconds', 30)
+# Документы с конечным статусом-ошибкой снимаются с опроса и записываются сюда
+STATUS_POLLER_ERRORS_PATH = config.get('status-poller-errors', f"s3://{INTERNAL_BUCKET}/errors/statusPoller/")
+# Статусы заказов на эмиссию опрашиваются одним запросом /order/list на omsId
+EMISSION_BATCH_POLLING = config.get('emission_batch_polling', True)
+
+# Отсев повторных S3-событий и объединение всплесков событий по одному документу
+EVENT_DEDUP_TTL_SECONDS = config.get('event_dedup_ttl_seconds', 600)
+EVENT_COALESCE_SECONDS = config.get('event_coalesce_seconds', 0)
+
+# Сводные отчеты о нанесении/вводе в оборот по нескольким заказам (по умолчанию выключено)
+DOCUMENT_BATCH_TYPES = [t for t in ('utilisation', 'introduce') if batching_settings(config, t)]
+DOCUMENT_BATCH_FLUSH_SECONDS = (config.get('document_batching') or {}).get('flush_seconds', 30)
+
+# Пополнение запаса SSCC заранее, чтобы создание заданий не ждало сервис SSCC
+SSCC_POOL_ENABLED = bool(config.get('sscc_pool'))
+SSCC_POOL_REFILL_SECONDS = config.get('sscc_pool_refill_seconds', 300)
+
+# Бакет и папка корзины подписи (для маршрутизации событий .sig)
+_sign_url = urlparse(str(signing_dir))
+SIGN_BUCKET = _sign_url.netloc if _sign_url.scheme == 's3' else None
+SIGN_PREFIX = _sign_url.path.lstrip('/') if SIGN_BUCKET else ""
+
+# Очереди этапов: {имя очереди: URL}. Этап, для очереди которого URL не
+# задан, выполняется непосредственно в роутере (прежнее поведение).
+STAGE_QUEUE_URLS = config.get('stage_queue_urls') or {}
+
 app.conf.update(
     broker_transport_options={
         'region': 'ru-central1',
         'predefined_queues': {
-            REAL_QUEUE_NAME: {'url': QUEUE_URL}
+            REAL_QUEUE_NAME: {'url': QUEUE_URL},
+            **{name: {'url': url} for name, url in STAGE_QUEUE_URLS.items()},
         }
     },
     task_default_queue=REAL_QUEUE_NAME,
@@ -100,6 +159,33 @@ app.conf.update(
 )
 
 # --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
+# Промежуточные состояния: документ еще обрабатывается на стороне СУЗ/ЧЗ
+_SUZ_ORDER_PENDING_STATES = {"PENDING"}
+_SUZ_REPORT_PENDING_STATES = {"PENDING", "READY_TO_SEND", "SENT"}
+_TRUE_API_PENDING_STATES = {
+    "IN_PROGRESS",
+    "WAIT_ACCEPTANCE",
+    "WAIT_PARTICIPANT_REGISTRATION",
+    "WAIT_FOR_CONTINUATION",
+}
+
+
+# Конечные состояния, после которых этап продолжает цепочку; остальные конечные - ошибки
+_STATUS_SUCCESS_STATES = {
+    'update_emission': set(EMISSION_PUBLISHED_STATES),
+    'utilisation_receipt': {"SUCCESS"},
+    'update_introduce': {"CHECKED_OK"},
+    'update_agg': {"CHECKED_OK"},
+    'update_agg_set': {"CHECKED_OK"},
+}
+
+
+def _raise_if_true_api_pending(document_id, result):
+    status = result.get('status') if isinstance(result, dict) else None
+    if status in _TRUE_API_PENDING_STATES:
+        raise StatusPending(document_id, status)
+
+
 _EQUIPMENT_REPORT_RETRYABLE_TRUE_API_HTTP_ERRORS = {
     401: "Unauthorized",
     408: "Request Timeout",
@@ -247,7 +333,7 @@ def trigger_set_aggregation_if_ready(parent_id):
             raise RuntimeError(f"create_aggregation_set_report failed for {parent_id}")
 
         # 3. Подписываем и отправляем
-        res3 = sign_and_send_aggregation_set(parent_id, PRODUCT_GROUP, signing_dir, 120)
+        res3 = sign_and_send_aggregation_set(parent_id, PRODUCT_GROUP, signing_dir, 120, wait_signature=WAIT_SIGNATURE)
         if not res3:
             raise RuntimeError(f"sign_and_send_aggregation_set failed for {parent_id}")
 
@@ -282,7 +368,7 @@ def logic_sign_emission(full_key):
     
     print(f"[LOGIC-2] Запуск подписания эмиссии для ID: {production_order_id}")
     
-    resultSEmT = sign_and_send_emission(production_order_id, signing_dir, 120)
+    resultSEmT = sign_and_send_emission(production_order_id, signing_dir, 120, wait_signature=WAIT_SIGNATURE)
     
     if not resultSEmT:
         raise RuntimeError(f"sign_and_send_emission failed for {production_order_id}")
@@ -305,6 +391,8 @@ def logic_update_emission(full_key):
             return f"Emission for {production_order_id} ready for download (ACTIVE)"
         elif result.bufferStatus == "EXHAUSTED":
             return f"Emission for {production_order_id} has been downloaded (EXHAUSTED)"
+        elif result.bufferStatus in _SUZ_ORDER_PENDING_STATES:
+            raise StatusPending(production_order_id, result.bufferStatus)
         else:
             raise RuntimeError(f"Unexpected bufferStatus '{result.bufferStatus}' for {production_order_id}")
     else:
@@ -348,7 +436,7 @@ def logic_kodes(full_key):
         raise RuntimeError(f"create_virtual_utilisation_task failed for {kodes_order_id}")
     if type(result) is ProductionOrder:
         if result.virtual:
-                result = sign_and_send_utilisation(kodes_order_id, signing_dir, 120)
+                result = sign_and_send_utilisation(kodes_order_id, signing_dir, 120, wait_signature=WAIT_SIGNATURE)
                 if not result:
                     raise RuntimeError(f"sign_and_send_utilisation failed for {kodes_order_id}")
 
@@ -370,6 +458,8 @@ def logic_utilisationReceipt(full_key):
     print(f"Virtual utilisation task for {utilisationReceipt_id} status is {result}")
     if type(result) is not UtilisationReportStatus:
         raise RuntimeError(f"logic_utilisationReceipt failed for {utilisationReceipt_id} result:{result}")
+    if result.reportStatus in _SUZ_REPORT_PENDING_STATES:
+        raise StatusPending(utilisationReceipt_id, result.reportStatus)
     if result.reportStatus !="SUCCESS":
         raise RuntimeError(f"logic_utilisationReceipt failed for {utilisationReceipt_id} result staus:{result.reportStatus}")
 
@@ -418,7 +508,10 @@ def logic_utilisationReceipt(full_key):
             res1 = create_introduce_task_from_report(utilisationReceipt_id, PRODUCT_GROUP)
             if not res1:
                 raise RuntimeError(f"create_introduce_task_from_report failed for {utilisationReceipt_id}")
-            res2 = sign_and_send_introduce(utilisationReceipt_id, PRODUCT_GROUP, signing_dir, 120)
+            if 'introduce' in DOCUMENT_BATCH_TYPES:
+                batch_key = enqueue_document('introduce', utilisationReceipt_id, PRODUCT_GROUP)
+                return f"Introduction task for UNIT {utilisationReceipt_id} queued to batch {batch_key}"
+            res2 = sign_and_send_introduce(utilisationReceipt_id, PRODUCT_GROUP, signing_dir, 120, wait_signature=WAIT_SIGNATURE)
             if _is_failed_send_result(res2):
                 raise RuntimeError(f"sign_and_send_introduce failed for {utilisationReceipt_id}")
             return f"Introduction task for UNIT {utilisationReceipt_id} started successfully"
@@ -433,7 +526,7 @@ def logic_utilisationReceipt(full_key):
         raise RuntimeError(f"create_virtual_introduce_task failed for {utilisationReceipt_id}")
     if type(result) is ProductionOrder:
         if result.virtual:
-            result = sign_and_send_introduce(utilisationReceipt_id, PRODUCT_GROUP, signing_dir, 120)
+            result = sign_and_send_introduce(utilisationReceipt_id, PRODUCT_GROUP, signing_dir, 120, wait_signature=WAIT_SIGNATURE)
             if _is_failed_send_result(result):
                 raise RuntimeError(f"sign_and_send_introduce failed for {utilisationReceipt_id}")
 
@@ -460,6 +553,7 @@ def logic_update_introduce(full_key):
         print("Ошибка API при запросе статуса")
         raise RuntimeError(f"update_introduce_status failed for {introduceReceipt_id}  result:{result}")
     result = result[0] if isinstance(result, list) and len(result) > 0 else result
+    _raise_if_true_api_pending(introduceReceipt_id, result)
     if isinstance(result, dict) and result.get('status')== 'CHECKED_OK':
         prod_id = result.get('productionOrderId') or _find_production_order_id_by_suz_order_id(introduceReceipt_id)
         if not prod_id:
@@ -481,7 +575,7 @@ def logic_update_introduce(full_key):
                 res1 = create_aggregation_report(prod_id)
                 if not res1:
                     raise RuntimeError(f"create_aggregation_report failed for {prod_id}")
-                res2 = sign_and_send_aggregation(prod_id, PRODUCT_GROUP, signing_dir, 120)
+                res2 = sign_and_send_aggregation(prod_id, PRODUCT_GROUP, signing_dir, 120, wait_signature=WAIT_SIGNATURE)
                 if _is_failed_send_result(res2):
                     raise RuntimeError(f"sign_and_send_aggregation failed for {prod_id}")
                 return f"Standard aggregation for UNIT {prod_id} started successfully"
@@ -499,8 +593,10 @@ def logic_start_equipment_reports(full_key):
         return f"No production_order_id found for {full_key}"
     # Номер заказа на производство равен номеру отчета оборудования
     production_order_id = report_id
+    # Задание оборудования и отчет читаются один раз на событие и передаются этапам
+    report_context = EquipmentReportContext(production_order_id)
     # Проверяем отчет перед обработкой
-    result = check_aggregation_reports([production_order_id])
+    result = check_aggregation_reports([production_order_id], report_context=report_context)
     
     # Ошибки авторизации (401), таймауты и rate limit (408, 429), ошибки
     # True API/upstream (500, 502, 503, 504), а также сетевые ошибки без
@@ -544,12 +640,16 @@ def logic_start_equipment_reports(full_key):
     
     # Запускаем процедуру создания/подписания/отправки отчета об утилизации по емиссии связаной с заказом на производство
     print(f"Запускаем процедуру создания/подписания/отправки отчета об утилизации по емиссии связаной с заказом на производство")
-    utResult = create_utilisation_task_from_report(report_id, group)
+    utResult = create_utilisation_task_from_report(report_id, group, report_context=report_context)
     if not utResult:
         raise RuntimeError(f"create_utilisation_task_from_report failed for {report_id}")
+    elif 'utilisation' in DOCUMENT_BATCH_TYPES:
+        # Отчет уйдет сводным документом при сбросе пакета
+        batch_key = enqueue_document('utilisation', report_id, group)
+        print(f"Отчет о нанесении {report_id} добавлен в пакет {batch_key}")
     else:
         print("Подписываем/отправляем")
-        sutResult = sign_and_send_utilisation(report_id, signing_dir, 120)
+        sutResult = sign_and_send_utilisation(report_id, signing_dir, 120, wait_signature=WAIT_SIGNATURE)
         if _is_failed_send_result(sutResult):
             raise RuntimeError(f"sign_and_send_utilisation failed for {report_id}")
     
@@ -562,7 +662,7 @@ def logic_start_equipment_reports(full_key):
         print(f"[*] Пропускаем создание виртуальных заданий для UNIT {production_order_id}")
     else:
         # Запускаем поцедуру создания виртуальных наборов для вложений по отчету оборудования
-        vtResult = create_virtual_tasks_from_equipment_report(report_id)
+        vtResult = create_virtual_tasks_from_equipment_report(report_id, report_context=report_context)
 
         # Если при создании ошибки то сообщаем и выходим без ошибки. Дальнейшая обработка в автомате невозможна
         if not vtResult:
@@ -605,6 +705,7 @@ def logic_update_agg_set(full_key):
         raise RuntimeError(f"update_aggregation_set_status failed for {production_order_id} result:{result}")
 
     result = result[0] if isinstance(result, list) and len(result) > 0 else result
+    _raise_if_true_api_pending(production_order_id, result)
     if isinstance(result, dict) and result.get('status') == 'CHECKED_OK':
         print(f"[+++] Агрегация наборов для {production_order_id} успешна. Запуск стандартной агрегации...")
 
@@ -614,7 +715,7 @@ def logic_update_agg_set(full_key):
             raise RuntimeError(f"create_aggregation_report failed for {production_order_id}")
 
         # 2. Подписываем и отправляем
-        res2 = sign_and_send_aggregation(production_order_id, group, signing_dir, 120)
+        res2 = sign_and_send_aggregation(production_order_id, group, signing_dir, 120, wait_signature=WAIT_SIGNATURE)
         if _is_failed_send_result(res2):
             raise RuntimeError(f"sign_and_send_aggregation failed for {production_order_id}")
 
@@ -638,6 +739,7 @@ def logic_update_agg(full_key):
         print("Ошибка API при запросе статуса")
         raise RuntimeError(f"update_aggregation_status failed for {production_order_id}  result:{result}")
     result = result[0] if isinstance(result, list) and len(result) > 0 else result
+    _raise_if_true_api_pending(production_order_id, result)
     if isinstance(result, dict) and result.get('status') == 'CHECKED_OK':
         # Выполняем проверку отчета и установку тега check
         print(f"[+++] Агрегация для {production_order_id} успешна. Проверка отчета...")
@@ -647,6 +749,595 @@ def logic_update_agg(full_key):
         status = result.get('status') if isinstance(result, dict) else 'unknown'
         raise RuntimeError(f"update_aggregation_status failed for {production_order_id} result status:{status}")
 
+# --- ТАБЛИЦА МАРШРУТИЗАЦИИ ---
+@dataclass(frozen=True)
+class StageRoute:
+    """
+    Этап обработки S3-событий: какие ключи он обрабатывает, какой функцией,
+    в какой очереди и с какой политикой повторов.
+
+    kind описывает, во что упирается этап: signing - ожидание подписи,
+    polling - опрос статуса во внешнем API, processing - чтение S3 и расчеты.
+    concurrency - рекомендуемое количество процессов воркера очереди этапа.
+    """
+    stage: str
+    bucket: str   # 'input', 'internal' или 'sign'
+    prefix: str
+    handler: str  # имя функции logic_* этого модуля
+    kind: str
+    priority: int = 5
+    concurrency: int = 2
+    max_retries: int = 200
+    retry_backoff: int = 60
+    retry_backoff_max: int = 300
+    suffix: str = ""
+
+    @property
+    def queue(self):
+        return f"xtrek_{self.stage}"
+
+    @property
+    def task_name(self):
+        return f"tasks.stage.{self.stage}"
+
+    def matches(self, bucket, key):
+        expected_bucket = {
+            'input': INPUT_BUCKET,
+            'internal': INTERNAL_BUCKET,
+            'sign': SIGN_BUCKET,
+        }.get(self.bucket)
+        return (
+            expected_bucket is not None
+            and bucket == expected_bucket
+            and key.startswith(self.prefix)
+            and key.endswith(self.suffix)
+        )
+
+
+# Порядок важен: используется первый подходящий маршрут.
+_DEFAULT_S3_ROUTES = [
+    # Условие №1: Создание заказа
+    StageRoute('create_order', 'input', 'Задания/', 'logic_create_order', 'processing',
+               priority=7, concurrency=2),
+    # Условие №2: Подписание эмиссии
+    StageRoute('sign_emission', 'internal', 'emissionOrders/', 'logic_sign_emission', 'signing',
+               priority=6, concurrency=4),
+    # Условие №3: Обновление статуса эмиссии
+    StageRoute('update_emission', 'internal', 'emissionReceipts/', 'logic_update_emission', 'polling',
+               priority=3, concurrency=8),
+    # Условие №4: Получение кодов эмиссии
+    StageRoute('emission_kodes', 'internal', 'emissions/', 'logic_get_emission_kodes', 'polling',
+               priority=5, concurrency=4),
+    # Условие №5: Печать и отчет о нанесении для виртуальных заданий
+    StageRoute('kodes', 'internal', 'kodes/', 'logic_kodes', 'signing',
+               priority=5, concurrency=4),
+    # Условие №6: Статус отчёта о нанесении и запуск ввода в оборот
+    StageRoute('utilisation_receipt', 'internal', 'utilisationReceipts/', 'logic_utilisationReceipt', 'signing',
+               priority=4, concurrency=4),
+    # Условие №7: Статус ввода в оборот и запуск агрегации
+    StageRoute('update_introduce', 'internal', 'introduceReceipts/', 'logic_update_introduce', 'polling',
+               priority=3, concurrency=8),
+    # Условие №20: Обработка отчета оборудования
+    StageRoute('equipment_reports', 'internal', 'equipment-reports/', 'logic_start_equipment_reports', 'processing',
+               priority=6, concurrency=2),
+    # Условие №21: Обработка виртуального заказа на производство
+    StageRoute('production_orders', 'internal', 'productionOrders/', 'logic_start_virtualProdTask_emission', 'processing',
+               priority=5, concurrency=2),
+    # Условие №92: Обработка чека об агрегации
+    StageRoute('update_agg', 'internal', 'aggReceipts/', 'logic_update_agg', 'polling',
+               priority=3, concurrency=8),
+    # Условие №93: Обработка чека об агрегации наборов
+    StageRoute('update_agg_set', 'internal', 'aggSetReceipts/', 'logic_update_agg_set', 'polling',
+               priority=3, concurrency=8),
+    # Вторая фаза подписи: в корзине подписи появился файл .sig
+    StageRoute('signature_ready', 'sign', SIGN_PREFIX, 'logic_signature_ready', 'signing',
+               priority=6, concurrency=4, suffix='.sig'),
+]
+
+
+def _load_s3_routes():
+    """Маршруты с переопределениями из конфигурации stage_routes: {stage: {поле: значение}}."""
+    overrides = config.get('stage_routes') or {}
+    routes = []
+    for route in _DEFAULT_S3_ROUTES:
+        route_overrides = overrides.get(route.stage) or {}
+        routes.append(replace(route, **route_overrides) if route_overrides else route)
+    return routes
+
+
+S3_ROUTES = _load_s3_routes()
+
+
+def resolve_route(bucket, key):
+    for route in S3_ROUTES:
+        if route.matches(bucket, key):
+            return route
+    return None
+
+
+def stage_worker_command(route):
+    """Команда запуска воркера, обслуживающего очередь этапа с его лимитом параллельности."""
+    return (
+        f"python -m celery -A xtrek.tasks worker -Q {route.queue} "
+        f"--concurrency={route.concurrency} --loglevel=info"
+    )
+
+
+def _execute_stage(route, full_key):
+    """
+    Вызывает обработчик этапа. Ожидание подписи - не ошибка: обработчик
+    регистрируется в реестре ожидающих подписей и завершается без retry.
+    Ожидание статуса передается поллеру.
+    Возвращает (результат, SignaturePending/StatusPending или None).
+    """
+    # Функция ищется по имени в момент вызова, чтобы ее можно было подменить
+    handler = globals()[route.handler]
+    try:
+        return handler(full_key), None
+    except SignaturePending as pending:
+        _register_pending_signature(route, full_key, pending)
+        print(f"[PENDING] {pending}")
+        return f"Pending signature: {pending.signature_path}", pending
+    except StatusPending as pending:
+        if not STATUS_POLLER_ENABLED:
+            raise
+        get_status_poller().register(route.stage, pending.document_id, full_key, pending.state)
+        print(f"[POLL] Этап {route.stage} отложен до смены статуса: {pending}")
+        return f"Pending status: {pending.state}", pending
+
+
+def _run_stage(route, full_key):
+    result, pending = _execute_stage(route, full_key)
+    if pending is None:
+        print(f"[OK] {result}")
+    return result
+
+
+def _dispatch_stage(route, full_key):
+    # Этап с собственной очередью выполняется отдельной задачей: долгие
+    # подписания не занимают слоты дешевых опросов статуса.
+    if route.queue in STAGE_QUEUE_URLS:
+        STAGE_TASKS[route.stage].apply_async(
+            args=[full_key],
+            queue=route.queue,
+            priority=route.priority,
+        )
+        print(f"[DISPATCH] {full_key} -> {route.queue}")
+        return f"Dispatched to {route.queue}"
+
+    return _run_stage(route, full_key)
+
+
+# --- ОТСЕВ И ОБЪЕДИНЕНИЕ S3-СОБЫТИЙ ---
+_event_store = None
+
+
+def get_event_store():
+    global _event_store
+    if _event_store is None:
+        _event_store = SqliteCache(
+            config.get('event_dedup_db', "~/.cache/xtrek/s3_events.sqlite"),
+            namespace="s3_events",
+            max_entries=config.get('event_dedup_max_entries', 100_000),
+        )
+    return _event_store
+
+
+def _event_fingerprint(data):
+    """
+    Отпечаток события: (bucket, key, ETag). Запись тегов и повторная доставка
+    SQS приходят с тем же ETag. Без ETag используется sequencer события.
+    """
+    version = data.get('etag') or data.get('eTag') or data.get('sequencer')
+    if not version:
+        return None
+    return f"{data['bucket']}/{data['key']}#{str(version).strip(chr(34))}"
+
+
+def _coalesce_key(route, key):
+    document_id = key.split('/')[-1].replace('.json', '')
+    return f"coalesce:{route.stage}:{document_id}"
+
+
+def _coalesce_event(route, data, full_key):
+    """
+    Первое событие по документу откладывает запуск этапа на
+    EVENT_COALESCE_SECONDS; события, пришедшие за это время, поглощаются
+    и будут учтены отложенным запуском.
+    """
+    coalesce_key = _coalesce_key(route, data['key'])
+    # Запас сверх окна на задержку доставки отложенного сообщения
+    if not get_event_store().add(coalesce_key, full_key, EVENT_COALESCE_SECONDS * 4 + 60):
+        print(f"[SKIP] {full_key} объединено с уже запланированным запуском {route.stage}")
+        return "Skipped: Coalesced"
+
+    process_s3_event.apply_async(
+        args=[{**data, 'coalesced': True}],
+        countdown=EVENT_COALESCE_SECONDS,
+    )
+    print(f"[COALESCE] {full_key}: запуск {route.stage} через {EVENT_COALESCE_SECONDS}с")
+    return f"Coalescing {route.stage} for {EVENT_COALESCE_SECONDS}s"
+
+
+# --- ОПРОС СТАТУСОВ ---
+_status_poller = None
+
+
+def get_status_poller():
+    global _status_poller
+    if _status_poller is None:
+        _status_poller = StatusPoller(
+            config.get('status_poller_db', "~/.cache/xtrek/status_poller.sqlite"),
+            base_interval=config.get('status_poll_base_seconds', 60),
+            max_interval=config.get('status_poll_max_seconds', 1800),
+            max_age=config.get('status_poll_max_age_seconds', 12 * 3600),
+            batch_size=config.get('status_poll_batch_size', 50),
+        )
+    return _status_poller
+
+
+def _status_state(result):
+    """Состояние из ответа update_*_status: объект СУЗ или ответ True API."""
+    if isinstance(result, EmissionOrderStatus):
+        return result.bufferStatus
+    if isinstance(result, UtilisationReportStatus):
+        return result.reportStatus
+    if isinstance(result, list) and result:
+        result = result[0]
+    if isinstance(result, dict):
+        return result.get('status')
+    return None
+
+
+def _status_probe(fetch, pending_states):
+    def probe(document_id):
+        state = _status_state(fetch(document_id))
+        # Ошибка запроса (state None) - не конечное состояние, опрос продолжается
+        return state, state is not None and state not in pending_states
+    return probe
+
+
+def _status_probes(context):
+    """
+    Проверки статуса по этапам: один запрос к СУЗ/ЧЗ без продолжения цепочки.
+    Все проверки цикла используют общий StatusCheckContext.
+    """
+    return {
+        'update_emission': _status_probe(
+            lambda document_id: update_emission_order_status(document_id, status_context=context),
+            _SUZ_ORDER_PENDING_STATES),
+        'utilisation_receipt': _status_probe(
+            lambda document_id: update_utilisation_report_status(document_id, status_context=context),
+            _SUZ_REPORT_PENDING_STATES),
+        'update_introduce': _status_probe(
+            lambda document_id: update_introduce_status(document_id, PRODUCT_GROUP, status_context=context),
+            _TRUE_API_PENDING_STATES),
+        'update_agg': _status_probe(
+            lambda document_id: update_aggregation_status(document_id, PRODUCT_GROUP, status_context=context),
+            _TRUE_API_PENDING_STATES),
+        'update_agg_set': _status_probe(
+            lambda document_id: update_aggregation_set_status(document_id, PRODUCT_GROUP, status_context=context),
+            _TRUE_API_PENDING_STATES),
+    }
+
+
+def _emission_batch_probe(context):
+    def probe(rows):
+        """Пакетная проверка заказов на эмиссию по последним известным состояниям поллера."""
+        results = update_emission_order_statuses(
+            [row['document_id'] for row in rows],
+            known_states={row['document_id']: row['state'] for row in rows},
+            status_context=context,
+        )
+        probe_results = {}
+        for document_id, result in results.items():
+            state = _status_state(result)
+            if state is not None:
+                probe_results[document_id] = (state, state not in _SUZ_ORDER_PENDING_STATES)
+        return probe_results
+    return probe
+
+
+def _status_batch_probes(context):
+    return {'update_emission': _emission_batch_probe(context)} if EMISSION_BATCH_POLLING else {}
+
+
+def _is_failed_status(stage, state):
+    success_states = _STATUS_SUCCESS_STATES.get(stage)
+    return success_states is not None and state not in success_states
+
+
+def _record_failed_status(row, state):
+    """Записывает документ со статусом-ошибкой в папку ошибок поллера для ручного разбора."""
+    error_path = f"{STATUS_POLLER_ERRORS_PATH.rstrip('/')}/{row['stage']}/{row['document_id']}.json"
+    error_record = {
+        "stage": row['stage'],
+        "documentId": row['document_id'],
+        "fullKey": row['full_key'],
+        "status": state,
+        "registeredAtUnix": row['registered_at'],
+        "failedAtUnix": time.time(),
+    }
+    try:
+        get_storage(error_path, config.get('s3_config')).write_text(
+            error_path, json.dumps(error_record, ensure_ascii=False, indent=4)
+        )
+    except Exception as e:
+        print(f"[ERROR] Не удалось записать {error_path}: {e}")
+        return
+    print(f"[ERROR] {row['full_key']}: статус {state}, этап {row['stage']} остановлен: {error_path}")
+
+
+def _continue_after_status(stage, full_key, state):
+    if stage == 'update_emission' and EMISSION_BATCH_POLLING and state in EMISSION_PUBLISHED_STATES:
+        # Пакетная проверка уже записала статус в emissions/, дальше цепочку ведет S3-событие
+        print(f"[POLL] {full_key}: статус {state} передан в emissions/")
+        return
+    route = next(r for r in S3_ROUTES if r.stage == stage)
+    print(f"[POLL] {full_key}: статус {state}, продолжение этапа {stage}")
+    _dispatch_stage(route, full_key)
+
+
+def poll_document_statuses():
+    """Цикл поллера: проверяет наступившие документы и продолжает цепочку при конечном статусе."""
+    # Конфигурация и токены загружаются один раз на цикл, а не для каждого документа
+    context = StatusCheckContext()
+    return get_status_poller().run_once(_status_probes(context), _continue_after_status,
+                                        batch_probes=_status_batch_probes(context),
+                                        is_failed=_is_failed_status, on_failed=_record_failed_status)
+
+
+# --- РЕЕСТР ОЖИДАЮЩИХ ПОДПИСЕЙ ---
+def _pending_signature_record_path(signature_path):
+    signature_filename = str(signature_path).replace('\\', '/').split('/')[-1]
+    return f"{SIGNATURE_PENDING_PATH.rstrip('/')}/{signature_filename}.json"
+
+
+def _register_pending_signature(route, full_key, pending):
+    record_path = _pending_signature_record_path(pending.signature_path)
+    record = {
+        "stage": route.stage,
+        "fullKey": full_key,
+        "operation": pending.operation,
+        "taskId": pending.task_id,
+        "bodyPath": pending.body_path,
+        "signaturePath": pending.signature_path,
+        "createdAtUnix": time.time(),
+    }
+    storage = get_storage(SIGNATURE_PENDING_PATH, config.get('s3_config'))
+    if storage.exists(record_path):
+        # Повторная регистрация не сдвигает момент начала ожидания
+        try:
+            record["createdAtUnix"] = json.loads(storage.read_text(record_path)).get(
+                "createdAtUnix", record["createdAtUnix"]
+            )
+        except Exception:
+            pass
+    storage.write_text(record_path, json.dumps(record, ensure_ascii=False, indent=4))
+
+
+def _load_pending_signature(record_path):
+    storage = get_storage(SIGNATURE_PENDING_PATH, config.get('s3_config'))
+    if not storage.exists(record_path):
+        return None
+    return json.loads(storage.read_text(record_path))
+
+
+def _delete_pending_signature(record_path):
+    storage = get_storage(SIGNATURE_PENDING_PATH, config.get('s3_config'))
+    if storage.exists(record_path):
+        storage.delete(record_path)
+
+
+def _expire_pending_signature(record_path, record):
+    """Переносит просроченную запись в папку ошибок с причиной остановки этапа."""
+    s3_config = config.get('s3_config')
+    record_filename = str(record_path).replace('\\', '/').split('/')[-1]
+    error_path = f"{SIGNATURE_PENDING_ERRORS_PATH.rstrip('/')}/{record_filename}"
+    error_record = {
+        **record,
+        "error": f"Подпись не получена за {SIGNATURE_PENDING_TTL_SECONDS}с",
+        "expiredAtUnix": time.time(),
+    }
+    get_storage(error_path, s3_config).write_text(
+        error_path, json.dumps(error_record, ensure_ascii=False, indent=4)
+    )
+    _delete_pending_signature(record_path)
+    return error_path
+
+
+def _pending_signature_claim_path(record_path):
+    # Суффикс вне маски *.json: обход реестра не принимает захват за запись
+    return f"{record_path[:-len('.json')]}.resuming"
+
+
+def _claim_pending_signature(record_path):
+    """
+    Атомарно захватывает запись ожидающей подписи перед продолжением этапа.
+    Событие .sig и обход реестра (или два обхода) продолжают этап только
+    один раз. Возвращает путь захвата или None, если запись уже продолжается.
+    """
+    storage = get_storage(SIGNATURE_PENDING_PATH, config.get('s3_config'))
+    claim_path = _pending_signature_claim_path(record_path)
+    claim = json.dumps({"claimedAtUnix": time.time(), "pid": os.getpid(), "token": uuid.uuid4().hex})
+    if storage.acquire_lock(claim_path, claim):
+        return claim_path
+    try:
+        current = storage.read_text(claim_path)
+        claimed_at = json.loads(current).get("claimedAtUnix", 0)
+    except Exception:
+        return None
+    if time.time() - claimed_at > SIGNATURE_RESUME_CLAIM_TTL_SECONDS and \
+            take_over_stale_lock(storage, claim_path, current, claim):
+        print(f"[!] Перехвачен устаревший захват {claim_path}")
+        return claim_path
+    return None
+
+
+def _release_pending_signature_claim(claim_path):
+    get_storage(SIGNATURE_PENDING_PATH, config.get('s3_config')).release_lock(claim_path)
+
+
+def _resume_pending_signature(record_path, record):
+    """Повторяет исходный этап: теперь sign_and_send_* найдет готовую подпись и отправит документ."""
+    route = next((r for r in S3_ROUTES if r.stage == record.get("stage")), None)
+    if route is None:
+        print(f"[!] Неизвестный этап {record.get('stage')} в {record_path}, запись удалена")
+        _delete_pending_signature(record_path)
+        return f"Unknown stage {record.get('stage')}"
+
+    claim_path = _claim_pending_signature(record_path)
+    if claim_path is None:
+        print(f"[SKIP] Этап {route.stage} для {record['fullKey']} уже продолжается")
+        return f"Already resuming {record['fullKey']}"
+    try:
+        # Пока шел захват, другой воркер мог завершить этап и удалить запись
+        if _load_pending_signature(record_path) is None:
+            print(f"[SKIP] Этап {route.stage} для {record['fullKey']} уже продолжен")
+            return f"Already resumed {record['fullKey']}"
+
+        print(f"[SIGN] Продолжение этапа {route.stage} для {record['fullKey']}")
+        result, pending = _execute_stage(route, record["fullKey"])
+        # Этап мог снова уйти в ожидание той же подписи - тогда запись остается
+        if not isinstance(pending, SignaturePending) or \
+                _pending_signature_record_path(pending.signature_path) != record_path:
+            _delete_pending_signature(record_path)
+        return result
+    finally:
+        _release_pending_signature_claim(claim_path)
+
+
+def logic_signature_ready(full_key):
+    record_path = _pending_signature_record_path(full_key)
+    record = _load_pending_signature(record_path)
+    if record is None:
+        print(f"[SKIP] Для подписи {full_key} нет ожидающего документа")
+        return f"No pending document for {full_key}"
+    return _resume_pending_signature(record_path, record)
+
+
+def sweep_pending_signatures():
+    """
+    Обход реестра ожидающих подписей: подстраховка на случай потерянного
+    события .sig. Готовые документы отправляются дальше, просроченные записи
+    переносятся в SIGNATURE_PENDING_ERRORS_PATH.
+    """
+    s3_config = config.get('s3_config')
+    storage = get_storage(SIGNATURE_PENDING_PATH, s3_config)
+    sign_route = next(r for r in S3_ROUTES if r.stage == 'signature_ready')
+    resumed, expired = 0, 0
+    for record_path in storage.list_files(SIGNATURE_PENDING_PATH, "*.json"):
+        try:
+            record = json.loads(storage.read_text(record_path))
+            signature_path = record["signaturePath"]
+            if get_storage(signature_path, s3_config).exists(signature_path):
+                if storage.exists(_pending_signature_claim_path(record_path)):
+                    # Этап уже продолжает событие .sig или предыдущий обход
+                    continue
+                _dispatch_stage(sign_route, signature_path)
+                resumed += 1
+            elif time.time() - record.get("createdAtUnix", 0) > SIGNATURE_PENDING_TTL_SECONDS:
+                error_path = _expire_pending_signature(record_path, record)
+                print(f"[ERROR] Подпись {signature_path} не получена за "
+                      f"{SIGNATURE_PENDING_TTL_SECONDS}с, этап {record.get('stage')} "
+                      f"для {record.get('fullKey')} остановлен: {error_path}")
+                expired += 1
+        except Exception as e:
+            print(f"[!] Ошибка обработки {record_path}: {e}")
+    return {"resumed": resumed, "expired": expired}
+
+
+def _make_stage_task(route):
+    @app.task(
+        name=route.task_name,
+        bind=True,
+        acks_late=True,
+        autoretry_for=(Exception,),
+        retry_kwargs={'max_retries': route.max_retries},
+        retry_backoff=route.retry_backoff,
+        retry_backoff_max=route.retry_backoff_max,
+        retry_jitter=True
+    )
+    def process_stage_event(self, full_key):
+        print(f"\n[STAGE:{route.stage}] Событие S3: {full_key}")
+        try:
+            return _run_stage(route, full_key)
+        except Exception as e:
+            print(f"[ERROR] Критическая ошибка этапа {route.stage}: {e}")
+            raise
+
+    return process_stage_event
+
+
+STAGE_TASKS = {route.stage: _make_stage_task(route) for route in S3_ROUTES}
+
+@app.task(name='tasks.sweep_pending_signatures')
+def sweep_pending_signatures_task():
+    return sweep_pending_signatures()
+
+
+@app.task(name='tasks.poll_document_statuses')
+def poll_document_statuses_task():
+    return poll_document_statuses()
+
+
+def flush_all_document_batches(force=False):
+    """Сброс пакетов всех включенных типов документов."""
+    return {
+        doc_type: flush_document_batches(doc_type, force=force, wait_signature=WAIT_SIGNATURE)
+        for doc_type in DOCUMENT_BATCH_TYPES
+    }
+
+
+@app.task(name='tasks.flush_document_batches')
+def flush_document_batches_task(force=False):
+    return flush_all_document_batches(force=force)
+
+
+def refill_sscc_pool():
+    """Пополняет запас SSCC настроенного префикса, если он ниже low_water."""
+    sscc_pool = get_sscc_pool(config)
+    if sscc_pool is None:
+        return None
+    return sscc_pool.refill_if_low(config.get('sscc_prefix'), config.get('sscc_extension'))
+
+
+@app.task(name='tasks.refill_sscc_pool')
+def refill_sscc_pool_task():
+    return refill_sscc_pool()
+
+
+app.conf.update(
+    task_routes={route.task_name: {'queue': route.queue} for route in S3_ROUTES},
+    beat_schedule={
+        **({
+            'sweep-pending-signatures': {
+                'task': 'tasks.sweep_pending_signatures',
+                'schedule': SIGNATURE_SWEEP_SECONDS,
+            },
+        } if TWO_PHASE_SIGNING else {}),
+        **({
+            'poll-document-statuses': {
+                'task': 'tasks.poll_document_statuses',
+                'schedule': STATUS_POLL_SECONDS,
+            },
+        } if STATUS_POLLER_ENABLED else {}),
+        **({
+            'flush-document-batches': {
+                'task': 'tasks.flush_document_batches',
+                'schedule': DOCUMENT_BATCH_FLUSH_SECONDS,
+            },
+        } if DOCUMENT_BATCH_TYPES else {}),
+        **({
+            'refill-sscc-pool': {
+                'task': 'tasks.refill_sscc_pool',
+                'schedule': SSCC_POOL_REFILL_SECONDS,
+            },
+        } if SSCC_POOL_ENABLED else {}),
+    },
+)
+
+
 # --- ГЛАВНЫЙ ВОРКЕР (РОУТЕР) ---
 #@app.task(name='tasks.process_s3_event', bind=True)
 @app.task(
@@ -669,58 +1360,36 @@ def process_s3_event(self, data):
     full_key = f"{bucket}/{key}"
     print(f"\n[ROUTER] Новое событие S3: {full_key}")
 
-    try:
-        # Условие №1: Создание заказа
-        if bucket == INPUT_BUCKET and key.startswith("Задания/"):
-            result = logic_create_order(full_key)
-            print(f"[OK] {result}")
-
-        # Условие №2: Подписание эмиссии
-        elif bucket == INTERNAL_BUCKET and key.startswith("emissionOrders/"):
-            result = logic_sign_emission(full_key)
-            print(f"[OK] {result}")
-        # Условие №3: Обновление статуса эмиссии
-        elif bucket == INTERNAL_BUCKET and key.startswith("emissionReceipts/"):
-            result = logic_update_emission(full_key)
-            print(f"[OK] {result}")
-        # Условие №4: Получение кодов эмиссии
-        elif bucket == INTERNAL_BUCKET and key.startswith("emissions/"):
-            result = logic_get_emission_kodes(full_key)
-            print(f"[OK] {result}")
-        # Условие №5: Создание отчёта о нанесении
-        elif bucket == INTERNAL_BUCKET and key.startswith("kodes/"):
-            result = logic_kodes(full_key)
-            print(f"[OK] {result}")
-        # Условие №6: Создание отчёта о нанесении
-        elif bucket == INTERNAL_BUCKET and key.startswith("utilisationReceipts/"):
-            result = logic_utilisationReceipt(full_key)
-            print(f"[OK] {result}")
-        # Условие №7: Обновление статуса отчёта о нанесении
-        elif bucket == INTERNAL_BUCKET and key.startswith("introduceReceipts/"):
-            result = logic_update_introduce(full_key)
-            print(f"[OK] {result}")
-        # Условие №20: Обработка отчета оборудования 
-        elif bucket == INTERNAL_BUCKET and key.startswith("equipment-reports/"):
-            result = logic_start_equipment_reports(full_key)
-            print(f"[OK] {result}")
-        # Условие №21: Обработка виртуального заказа на производство
-        elif bucket == INTERNAL_BUCKET and key.startswith("productionOrders/"):
-            result = logic_start_virtualProdTask_emission(full_key)
-            print(f"[OK] {result}")
-        # Условие №92: Обработка чека об агрегации
-        elif bucket == INTERNAL_BUCKET and key.startswith("aggReceipts/"):
-            result = logic_update_agg(full_key)
-            print(f"[OK] {result}")
-        # Условие №93: Обработка чека об агрегации наборов
-        elif bucket == INTERNAL_BUCKET and key.startswith("aggSetReceipts/"):
-            result = logic_update_agg_set(full_key)
-            print(f"[OK] {result}")
+    route = resolve_route(bucket, key)
+    if route is None:
+        print(f"[SKIP] Бакет или папка не соответствуют фильтрам. Игнорирую.")
+        return "Skipped: No match"
 
-        else:
-            print(f"[SKIP] Бакет или папка не соответствуют фильтрам. Игнорирую.")
-            return "Skipped: No match"
+    # Повтор задачи после ошибки - не новое событие, фильтры к нему не применяются
+    request = getattr(self, 'request', None)
+    is_retry = bool(getattr(request, 'retries', 0))
+
+    fingerprint = None
+    if not is_retry and not data.get('coalesced'):
+        fingerprint = _event_fingerprint(data)
+        if fingerprint and not get_event_store().add(fingerprint, full_key, EVENT_DEDUP_TTL_SECONDS):
+            print(f"[SKIP] Повторное событие {fingerprint}")
+            return "Skipped: Duplicate event"
+
+        if EVENT_COALESCE_SECONDS > 0:
+            return _coalesce_event(route, data, full_key)
+
+    if data.get('coalesced'):
+        # Событие, пришедшее после этой точки, запланирует новый запуск
+        get_event_store().delete(_coalesce_key(route, key))
+
+    try:
+        return _dispatch_stage(route, full_key)
 
     except Exception as e:
         print(f"[ERROR] Критическая ошибка: {e}")
+        if fingerprint:
+            # Следующая доставка того же события снова будет обработана
+            get_event_store().delete(fingerprint)
         # Celery перехватит это и сделает retry (если настроено) или залогирует
         raise e
@@ -14,6 +14,18 @@ try:
 except (ImportError, ValueError):
     TokenProcessor = None
 
+try:
+    from .rate_limit import TRUE_API_CISES, TRUE_API_DOC, note_response, throttle
+except (ImportError, ValueError):
+    # Запуск файла как скрипта: без общего ограничителя
+    TRUE_API_CISES, TRUE_API_DOC = "true_api_cises", "true_api_doc"
+
+    def throttle(family):
+        return 0.0
+
+    def note_response(family, response):
+        return None
+
 # Отключаем предупреждения SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -89,7 +101,9 @@ class HonestSignAPI:
     def get_single_cis_info(self, code: str) -> Dict[str, Any]:
         url = f"{self.host}/api/v3/true-api/cises/info"
         try:
+            throttle(TRUE_API_CISES)
             response = requests.post(url, json=[code], headers=self.headers, verify=False)
+            note_response(TRUE_API_CISES, response)
             logger.debug(f"RAW POST | Status: {response.status_code} | Body: {response.text}")
             response.raise_for_status()
             return response.json()
@@ -101,7 +115,9 @@ class HonestSignAPI:
         url = f"{self.host}/api/v3/true-api/cises/info"
         try:
             logger.debug(f'get_list_cis_info code:{code}')
+            throttle(TRUE_API_CISES)
             response = requests.post(url, json=code, headers=self.headers, verify=False)
+            note_response(TRUE_API_CISES, response)
             logger.debug(f"RAW POST | Status: {response.status_code} | Body: {response.text}")
 
             if response.status_code == 404:
@@ -159,7 +175,9 @@ class HonestSignAPI:
 
         try:
             logger.info(f"Запрос информации о документе {doc_id}...")
+            throttle(TRUE_API_DOC)
             response = requests.get(url, params=params, headers=self.headers, verify=False)
+            note_response(TRUE_API_DOC, response)
             logger.debug(f"RAW GET | Status: {response.status_code} | Body: {response.text}")
 
             if response.status_code >= 400:
@@ -1,5 +1,7 @@
 import os
 import json
+import time
+import hashlib
 import logging
 import argparse
 import tempfile
@@ -12,6 +14,7 @@ from .nkapi import NK
 from .tokens import TokenProcessor
 from .gs1_processor import get_inn_by_gtin
 from .config_loader import load_config
+from .datamatrix import cut_crypto_tail, gtin_of
 from .aggregation_builder import (
     AggregationBuildError,
     iter_equipment_report_boxes,
@@ -27,10 +30,6 @@ if not logger.handlers:
     logger.addHandler(handler)
     logger.setLevel(logging.INFO)
 
-def cut_crypto_tail(code: str) -> str:
-    """Обрезает криптохвост кода (разделитель \u001d)."""
-    return code.split('\u001d')[0]
-
 def normalize_sscc(code: str) -> str:
     """Добавляет префикс 00 к 18-значным SSCC кодам."""
     if len(code) == 18 and code.isdigit():
@@ -39,13 +38,19 @@ def normalize_sscc(code: str) -> str:
 
 def get_gtin_from_code(code: str) -> Optional[str]:
     """Извлекает GTIN из кода (01 + 14 цифр)."""
-    if code.startswith('01') and len(code) >= 16:
-        return code[2:16]
-    return None
+    return gtin_of(code)
+
+def report_etag(content: str) -> str:
+    """ETag версии отчета - MD5 содержимого (как ETag S3 для обычной загрузки)."""
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
 
 MIN_SSCC_IN_AGG_REP_DEFAULT = 0
+# Сколько подтвержденные статусы кодов отчета считаются актуальными
+CHECK_STATE_TTL_SECONDS_DEFAULT = 3600
 
 class AggregationAnalyzer:
+    status_batch_size = 1000
+
     def __init__(self, api: HonestSignAPI, nk: NK, config: Optional[Dict] = None):
         self.api = api
         self.nk = nk
@@ -53,21 +58,42 @@ class AggregationAnalyzer:
         self.gtin_cache = {}
         self.min_sscc = self.config.get('MIN_SSCC_IN_AGG_REP', MIN_SSCC_IN_AGG_REP_DEFAULT)
 
+    @staticmethod
+    def _card_is_set(product: Optional[Dict[str, Any]]) -> Optional[bool]:
+        if not product:
+            return None
+        is_set = product.get('isSet')
+        if is_set is None:
+            is_set = product.get('isKit')
+        return bool(is_set) if is_set is not None else None
+
+    def prefetch_gtins(self, gtins) -> None:
+        """Одним пакетным запросом product/info заполняет gtin_cache для списка GTIN."""
+        pending = [g for g in dict.fromkeys(gtins) if g and g not in self.gtin_cache]
+        if not pending:
+            return
+        try:
+            cards = self.nk.product_info_many(pending)
+        except Exception as e:
+            logger.warning(f"Пакетный запрос product/info не выполнен: {e}")
+            return
+        if not isinstance(cards, dict):
+            return
+        for gtin, product in cards.items():
+            is_set = self._card_is_set(product)
+            if is_set is not None:
+                self.gtin_cache[gtin] = is_set
+
     def is_set(self, gtin: str) -> Optional[bool]:
         if gtin in self.gtin_cache:
             return self.gtin_cache[gtin]
 
         # Пытаемся получить через product_info (True API)
         product = self.nk.product_info(gtin)
-        if product:
-            is_set = product.get('isSet')
-            if is_set is None:
-                is_set = product.get('isKit')
-
-            if is_set is not None:
-                is_set = bool(is_set)
-                self.gtin_cache[gtin] = is_set
-                return is_set
+        is_set = self._card_is_set(product)
+        if is_set is not None:
+            self.gtin_cache[gtin] = is_set
+            return is_set
 
         # Fallback to feedProduct (National Catalog)
         res = self.nk.feedProduct(gtin)
@@ -89,8 +115,8 @@ class AggregationAnalyzer:
     def check_statuses(self, codes: List[str]) -> List[Dict[str, Any]]:
         """Проверка статусов кодов пачками по 1000. Возвращает список результатов или словарь с ошибкой."""
         results = []
-        for i in range(0, len(codes), 1000):
-            batch = codes[i:i+1000]
+        for i in range(0, len(codes), self.status_batch_size):
+            batch = codes[i:i+self.status_batch_size]
             try:
                 batch_results = self.api.get_list_cis_info(batch)
                 if isinstance(batch_results, list):
@@ -103,14 +129,30 @@ class AggregationAnalyzer:
                 return {"error": str(e)}
         return results
 
-    def check_report(self, path: str, s3_config: Optional[Dict] = None) -> Optional[Dict[str, List[str]]]:
-        """Проверяет один отчет об агрегации и устанавливает тег check."""
+    def check_report(self, path: str, s3_config: Optional[Dict] = None, report_context=None) -> Optional[Dict[str, List[str]]]:
+        """
+        Проверяет один отчет об агрегации и устанавливает тег check.
+        report_context - контекст отчета оборудования события (read_json),
+        через который отчет читается один раз для всех этапов.
+
+        Проверка инкрементальная: пока отчет не прошел проверку, коды, уже
+        подтвержденные для этой версии отчета (ETag), повторно в ГИС МТ не
+        запрашиваются - см. _load_check_state. После успешной проверки
+        состояние удаляется: по отчету отправляется нанесение, и повтор задачи
+        должен увидеть новые статусы кодов, а не прошлые подтверждения.
+        """
         errors = defaultdict(list)
-        storage = get_storage(path, s3_config or self.config.get('s3_config'))
+        s3_config = s3_config or self.config.get('s3_config')
+        storage = get_storage(path, s3_config)
 
         try:
-            content = storage.read_text(path)
-            data = json.loads(content)
+            if report_context is not None:
+                data = report_context.read_json(path)
+                etag = report_context.etag(path)
+            else:
+                content = storage.read_text(path)
+                data = json.loads(content)
+                etag = report_etag(content)
         except Exception as e:
             logger.error(f"Ошибка чтения файла {path}: {e}")
             return {'filereaderror': [str(e)]}
@@ -131,42 +173,49 @@ class AggregationAnalyzer:
         aggregate_codes = []
         child_codes = []
 
-        aggregate_counter = Counter()
-        child_counter = Counter()
-
         for pallet in ready_pallets:
             pallet_code = pallet.get('palletNumber')
             if pallet_code:
-                clean_pallet = normalize_sscc(cut_crypto_tail(pallet_code))
-                aggregate_codes.append(clean_pallet)
-                aggregate_counter[clean_pallet] += 1
+                aggregate_codes.append(normalize_sscc(cut_crypto_tail(pallet_code)))
 
         for box in ready_boxes:
             box_code = box.get('boxNumber')
             if box_code:
-                clean_box = normalize_sscc(cut_crypto_tail(box_code))
-                aggregate_codes.append(clean_box)
-                aggregate_counter[clean_box] += 1
+                aggregate_codes.append(normalize_sscc(cut_crypto_tail(box_code)))
 
             children = box.get('productNumbersFull') or []
-            for child in children:
-                clean_child = cut_crypto_tail(child)
-                child_codes.append(clean_child)
-                child_counter[clean_child] += 1
-
-        for code, count in aggregate_counter.items():
-            if count > 1: errors['duplicateaggregation'].append(code)
-        for code, count in child_counter.items():
-            if count > 1: errors['duplicateattachment'].append(code)
-
-        # 3. Запрос статусов в ГИС МТ
-        all_codes = list(set(aggregate_codes + child_codes))
-        status_map = {}
-
-        if all_codes:
-            status_results = self.check_statuses(all_codes)
+            child_codes.extend(cut_crypto_tail(child) for child in children)
+
+        aggregate_set = set(aggregate_codes)
+        child_set = set(child_codes)
+        # Counter строится, только если дубли есть
+        if len(aggregate_set) != len(aggregate_codes):
+            errors['duplicateaggregation'].extend(
+                code for code, count in Counter(aggregate_codes).items() if count > 1
+            )
+        if len(child_set) != len(child_codes):
+            errors['duplicateattachment'].extend(
+                code for code, count in Counter(child_codes).items() if count > 1
+            )
+
+        # 3. Запрос статусов в ГИС МТ только для кодов, не подтвержденных
+        # прошлой проверкой этой версии отчета
+        state_path = self._check_state_path(path)
+        state = self._load_check_state(state_path, etag, s3_config)
+        verified_children = set(state['verifiedChildren']) & child_set
+        verified_aggregates = set(state['verifiedAggregates']) & aggregate_set
+        for gtin, is_set_flag in state['gtins'].items():
+            self.gtin_cache.setdefault(gtin, is_set_flag)
+
+        status_map = {code: {'status': 'EMITTED'} for code in verified_children}
+        to_check = list((aggregate_set - verified_aggregates) | (child_set - verified_children))
+
+        for i in range(0, len(to_check), self.status_batch_size):
+            status_results = self.check_statuses(to_check[i:i + self.status_batch_size])
             if isinstance(status_results, dict) and "error" in status_results:
                 logger.error(f"Ошибка API при проверке статусов: {status_results['error']}")
+                # Проверенные до ошибки коды сохраняются для повтора
+                self._save_check_state(state_path, state, status_map, child_set, aggregate_set, s3_config)
                 return {"api_error": [status_results["error"]]}
 
             for res in status_results:
@@ -174,17 +223,15 @@ class AggregationAnalyzer:
                 code = cis_info.get('cis') or res.get('requestedCis')
                 if code:
                     status_map[code] = cis_info
+            # Коды без ответа в пачке считаются не найденными
+            for code in to_check[i:i + self.status_batch_size]:
+                status_map.setdefault(code, {})
 
         # 4. Проверка на финальное состояние (все товары INTRODUCED)
         # Мы проверяем только товары (child_codes), так как SSCC не всегда переходят в INTRODUCED
-        all_introduced = False
-        if child_codes:
-            all_introduced = True
-            for code in set(child_codes):
-                info = status_map.get(code)
-                if not info or info.get('status') != 'INTRODUCED':
-                    all_introduced = False
-                    break
+        all_introduced = bool(child_set) and all(
+            (status_map.get(code) or {}).get('status') == 'INTRODUCED' for code in child_set
+        )
 
         if all_introduced:
             result = {'finished': ['All codes are INTRODUCED']}
@@ -192,7 +239,7 @@ class AggregationAnalyzer:
             # 5. Проверка начального состояния (эквивалентно готовности к агрегации)
 
             # Проверка кодов агрегации (SSCC должны отсутствовать в системе)
-            for aggregate_code in set(aggregate_codes):
+            for aggregate_code in aggregate_set:
                 info = status_map.get(aggregate_code)
                 # Если info пустой или в нем нет статуса - это значит "не найден" (ОК)
                 if info and info.get('status') and info.get('status') != 'NOT_FOUND':
@@ -200,27 +247,36 @@ class AggregationAnalyzer:
                         f"{aggregate_code} (Статус: {info.get('status')})"
                     )
 
-            # Проверка кодов товаров (должны быть в статусе EMITTED)
-            for child in set(child_codes):
-                info = status_map.get(child)
-                status = info.get('status') if info else None
-
+            # Проверка кодов товаров (должны быть в статусе EMITTED).
+            # Признак набора определяется один раз на GTIN, а не на каждый код.
+            children_by_gtin = defaultdict(list)
+            for child in child_set:
                 gtin = get_gtin_from_code(child)
-                if not gtin:
-                    continue
+                if gtin:
+                    children_by_gtin[gtin].append(child)
 
+            self.prefetch_gtins(children_by_gtin)
+            for gtin, children in children_by_gtin.items():
                 is_set_flag = self.is_set(gtin)
                 if is_set_flag is None:
                     errors['gtinnotfound'].append(gtin)
                     continue
 
-                if status != 'EMITTED':
-                    err_key = 'wrongsetstatus' if is_set_flag else 'wrongunitstatus'
-                    status_desc = status or "Не найден"
-                    errors[err_key].append(f"{child} (Статус: {status_desc})")
+                err_key = 'wrongsetstatus' if is_set_flag else 'wrongunitstatus'
+                for child in children:
+                    info = status_map.get(child)
+                    status = info.get('status') if info else None
+                    if status != 'EMITTED':
+                        status_desc = status or "Не найден"
+                        errors[err_key].append(f"{child} (Статус: {status_desc})")
 
             result = dict(errors) if errors else None
 
+        if result is None:
+            self._drop_check_state(state_path, s3_config)
+        else:
+            self._save_check_state(state_path, state, status_map, child_set, aggregate_set, s3_config, result)
+
         # 6. Установка тега check
         tag_value = ""
         if result:
@@ -233,6 +289,89 @@ class AggregationAnalyzer:
 
         return result
 
+    def _check_state_path(self, path: str) -> str:
+        """
+        Файл состояния проверки отчета. По умолчанию - вне маршрутов S3-событий
+        (equipmentReportChecks/ в корне бакета) или в подпапке .checks рядом
+        с локальным отчетом.
+        """
+        name = os.path.basename(path.rstrip('/'))
+        checks_path = self.config.get('equipment-report-checks')
+        if checks_path:
+            return f"{checks_path.rstrip('/')}/{name}"
+        if path.startswith('s3://'):
+            bucket = path[len('s3://'):].split('/', 1)[0]
+            return f"s3://{bucket}/equipmentReportChecks/{name}"
+        return os.path.join(os.path.dirname(path), '.checks', name)
+
+    def _load_check_state(self, state_path: str, etag: str, s3_config: Optional[Dict]) -> Dict[str, Any]:
+        """
+        Состояние прошлой проверки: подтвержденные коды (товары в EMITTED,
+        коды агрегации не зарегистрированы) и признаки наборов по GTIN.
+        Используется, только если ETag отчета не изменился и с первой
+        проверки прошло меньше equipment_report_check_ttl_seconds: после этого
+        подтвержденные статусы считаются устаревшими и проверяются заново.
+        """
+        now = time.time()
+        empty = {'etag': etag, 'verifiedAtUnix': now, 'verifiedChildren': [], 'verifiedAggregates': [], 'gtins': {}}
+        ttl = self.config.get('equipment_report_check_ttl_seconds', CHECK_STATE_TTL_SECONDS_DEFAULT)
+        try:
+            storage = get_storage(state_path, s3_config)
+            if not storage.exists(state_path):
+                return empty
+            state = json.loads(storage.read_text(state_path))
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать состояние проверки {state_path}: {e}")
+            return empty
+
+        if not isinstance(state, dict) or state.get('etag') != etag:
+            return empty
+        if now - float(state.get('verifiedAtUnix') or 0) > ttl:
+            return empty
+        return {
+            **empty,
+            'verifiedAtUnix': state['verifiedAtUnix'],
+            'verifiedChildren': state.get('verifiedChildren') or [],
+            'verifiedAggregates': state.get('verifiedAggregates') or [],
+            'gtins': state.get('gtins') or {},
+        }
+
+    def _save_check_state(self, state_path, state, status_map, child_set, aggregate_set, s3_config, result=None):
+        verified_children = sorted(
+            code for code in child_set if (status_map.get(code) or {}).get('status') == 'EMITTED'
+        )
+        verified_aggregates = sorted(
+            code for code in aggregate_set
+            if code in status_map and (status_map[code] or {}).get('status') in (None, '', 'NOT_FOUND')
+        )
+        gtins = {
+            gtin: self.gtin_cache[gtin]
+            for gtin in {get_gtin_from_code(code) for code in child_set}
+            if gtin in self.gtin_cache
+        }
+        new_state = {
+            'etag': state['etag'],
+            'verifiedAtUnix': state['verifiedAtUnix'],
+            'checkedAtUnix': time.time(),
+            'result': result,
+            'verifiedChildren': verified_children,
+            'verifiedAggregates': verified_aggregates,
+            'gtins': gtins,
+        }
+        try:
+            storage = get_storage(state_path, s3_config)
+            storage.write_text(state_path, json.dumps(new_state, ensure_ascii=False))
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить состояние проверки {state_path}: {e}")
+
+    def _drop_check_state(self, state_path, s3_config):
+        try:
+            storage = get_storage(state_path, s3_config)
+            if storage.exists(state_path):
+                storage.delete(state_path)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить состояние проверки {state_path}: {e}")
+
 # Глобальный кеш для ресурсов
 _RESOURCES_CACHE = {
     'config': None,
@@ -241,14 +380,20 @@ _RESOURCES_CACHE = {
     'last_token': None,
 }
 
-def _ensure_resources(path: str, api: Optional[HonestSignAPI] = None, nk: Optional[NK] = None, config: Optional[Dict] = None):
+def _ensure_resources(path: str, api: Optional[HonestSignAPI] = None, nk: Optional[NK] = None, config: Optional[Dict] = None,
+                      report_context=None):
     """Обеспечивает наличие API, NK и конфига, выполняя автодетекцию если нужно."""
     if config is None:
         if _RESOURCES_CACHE['config'] is None:
             _RESOURCES_CACHE['config'] = load_config('suz_worker_config')
         config = _RESOURCES_CACHE['config']
 
-    resolved_path = resolve_file_path(path, config)
+    if report_context is not None:
+        # Отчет события проверяется по тому же пути, по которому его читают
+        # следующие этапы: кеш контекста ведется по пути, и отчет читается один раз
+        resolved_path = report_context.report_path
+    else:
+        resolved_path = resolve_file_path(path, config)
 
     # Если переданы и API и NK, просто возвращаем их
     if api and nk:
@@ -272,12 +417,14 @@ def _ensure_resources(path: str, api: Optional[HonestSignAPI] = None, nk: Option
         # Автодетекция ИНН по файлу
         s3_config = config.get('s3_config')
         try:
-            storage = get_storage(resolved_path, s3_config)
+            storage = report_context or get_storage(resolved_path, s3_config)
             if not storage.exists(resolved_path):
                  logger.warning(f"Файл {resolved_path} не найден для автодетекции ИНН")
             else:
-                content = storage.read_text(resolved_path)
-                data = json.loads(content)
+                if report_context is not None:
+                    data = report_context.read_json(resolved_path)
+                else:
+                    data = json.loads(storage.read_text(resolved_path))
                 ready_boxes = iter_equipment_report_boxes(data)
                 detected_inn = None
                 for box in ready_boxes:
@@ -496,14 +643,21 @@ def set_ready_check(path: str, api: Optional[HonestSignAPI] = None, nk: Optional
         logger.error(f"Не удалось установить тег check для {resolved_path}: {e}")
         return None
 
-def check_aggregation_reports(paths: List[str], api: Optional[HonestSignAPI] = None, nk: Optional[NK] = None, config: Optional[Dict] = None) -> Dict[str, Optional[Dict[str, List[str]]]]:
-    """Функция-обертка для проверки списка отчетов."""
+def check_aggregation_reports(paths: List[str], api: Optional[HonestSignAPI] = None, nk: Optional[NK] = None, config: Optional[Dict] = None,
+                              report_context=None) -> Dict[str, Optional[Dict[str, List[str]]]]:
+    """
+    Функция-обертка для проверки списка отчетов. report_context - контекст
+    отчета оборудования события: отчет проверяется по его report_path, и
+    прочитанный отчет используют следующие этапы.
+    """
     results = {}
     for path in paths:
         try:
-            resolved_path, current_api, current_nk, current_config = _ensure_resources(path, api, nk, config)
+            resolved_path, current_api, current_nk, current_config = _ensure_resources(
+                path, api, nk, config, report_context=report_context
+            )
             analyzer = AggregationAnalyzer(current_api, current_nk, current_config)
-            results[resolved_path] = analyzer.check_report(resolved_path)
+            results[resolved_path] = analyzer.check_report(resolved_path, report_context=report_context)
         except Exception as e:
             logger.error(f"Ошибка при проверке {path}: {e}")
             results[path] = {'error': [str(e)]}
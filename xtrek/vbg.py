@@ -2,17 +2,22 @@ import argparse
 import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional
 
 import requests
 
+from .cache_store import SqliteCache
+
 
 DEFAULT_BASE_URL = "https://be-rich.gs1ru.org/vbg-api/v3.2.4"
 DEFAULT_TOKEN_PATH = "~/.gs1rus-7733154124"
-DEFAULT_CACHE_PATH = "~/.cache/xtrek/vbg_gtin_cache.json"
+DEFAULT_CACHE_PATH = "~/.cache/xtrek/vbg_gtin_cache.sqlite"
 DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
 DEFAULT_BATCH_SIZE = 50
+DEFAULT_CACHE_MAX_ENTRIES = 200_000
+DEFAULT_FETCH_WORKERS = 4
 
 
 class VbgAPIError(RuntimeError):
@@ -99,23 +104,43 @@ def default_cache_path() -> Path:
     return Path(os.getenv("GS1_VBG_CACHE_PATH", DEFAULT_CACHE_PATH)).expanduser()
 
 
-def load_cache(cache_path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
-    path = Path(cache_path).expanduser() if cache_path else default_cache_path()
-    if not path.exists():
-        return {}
+def _migrate_json_cache(json_path: Path, store: SqliteCache, ttl_seconds: int) -> None:
+    # Однократный перенос записей из старого JSON-кеша
     try:
-        payload = json.loads(path.read_text(encoding="utf-8"))
+        payload = json.loads(json_path.read_text(encoding="utf-8"))
     except (OSError, json.JSONDecodeError):
-        return {}
+        return
     if not isinstance(payload, dict):
-        return {}
-    return payload
-
-
-def save_cache(cache: Dict[str, Dict[str, Any]], cache_path: Optional[str] = None) -> None:
+        return
+    now = time.time()
+    fresh = {}
+    for gtin, entry in payload.items():
+        if isinstance(entry, dict) and _is_fresh(entry, ttl_seconds):
+            fresh[gtin] = entry
+    for gtin, entry in fresh.items():
+        store.set(gtin, entry, ttl_seconds - (now - entry["checked_at"]))
+
+
+def open_cache(cache_path: Optional[str] = None, max_entries: Optional[int] = None) -> SqliteCache:
+    """
+    Кеш VbG: SQLite (WAL) с отдельной строкой на GTIN, сроком жизни записи
+    и ограничением размера. Безопасен при одновременной работе нескольких
+    процессов. Путь со старым расширением .json заменяется на .sqlite,
+    существующие записи JSON-кеша переносятся при первом открытии.
+    """
     path = Path(cache_path).expanduser() if cache_path else default_cache_path()
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(cache, ensure_ascii=False, indent=2), encoding="utf-8")
+    legacy_json = None
+    if path.suffix.lower() == ".json":
+        legacy_json = path
+        path = path.with_suffix(".sqlite")
+
+    is_new = not path.exists()
+    if max_entries is None:
+        max_entries = int(os.getenv("GS1_VBG_CACHE_MAX_ENTRIES", DEFAULT_CACHE_MAX_ENTRIES))
+    store = SqliteCache(path, namespace="vbg_gtin", max_entries=max_entries)
+    if is_new and legacy_json is not None and legacy_json.exists():
+        _migrate_json_cache(legacy_json, store, DEFAULT_TTL_SECONDS)
+    return store
 
 
 def _chunks(items: List[str], size: int) -> Iterable[List[str]]:
@@ -168,33 +193,45 @@ def get_gtin_info(
     base_url: str = DEFAULT_BASE_URL,
     batch_size: int = DEFAULT_BATCH_SIZE,
     session: Optional[requests.Session] = None,
+    fetch_workers: int = DEFAULT_FETCH_WORKERS,
 ) -> Dict[str, Dict[str, Any]]:
-    normalized = []
-    for gtin in gtins:
-        item = normalize_gtin(gtin)
-        if item not in normalized:
-            normalized.append(item)
+    normalized = list(dict.fromkeys(normalize_gtin(gtin) for gtin in gtins))
 
-    cache = load_cache(cache_path)
+    cache = open_cache(cache_path)
     result: Dict[str, Dict[str, Any]] = {}
     missing: List[str] = []
 
+    cached = {} if force_refresh else cache.get_many(normalized)
     for gtin in normalized:
-        entry = cache.get(gtin)
-        if not force_refresh and isinstance(entry, dict) and _is_fresh(entry, ttl_seconds):
+        entry = cached.get(gtin)
+        if isinstance(entry, dict) and _is_fresh(entry, ttl_seconds):
             result[gtin] = entry.get("data", {})
         else:
             missing.append(gtin)
 
     if missing:
         api_token = read_token(token=token, token_path=token_path)
-        now = time.time()
-        for batch in _chunks(missing, batch_size):
-            for item in _fetch_gtins(batch, api_token, base_url, timeout, session=session):
+        http = session or requests.Session()
+
+        def fetch_batch(batch: List[str]) -> Dict[str, Dict[str, Any]]:
+            fetched = {}
+            now = time.time()
+            for item in _fetch_gtins(batch, api_token, base_url, timeout, session=http):
                 key = normalize_gtin(item.get("gtin") or item.get("gtinCode") or batch[0])
-                cache[key] = {"checked_at": now, "data": item}
-                result[key] = item
-        save_cache(cache, cache_path)
+                fetched[key] = item
+            # Сохраняем каждую пачку сразу: результат не теряется при ошибке в соседней
+            cache.set_many({key: {"checked_at": now, "data": item} for key, item in fetched.items()}, ttl_seconds)
+            return fetched
+
+        batches = list(_chunks(missing, batch_size))
+        workers = max(1, min(fetch_workers, len(batches)))
+        if workers == 1:
+            fetched_batches = [fetch_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                fetched_batches = list(executor.map(fetch_batch, batches))
+        for fetched in fetched_batches:
+            result.update(fetched)
 
     return {gtin: result.get(gtin, {}) for gtin in normalized}
 
@@ -257,6 +294,7 @@ def main() -> None:
     parser.add_argument("--token-file", default=None, help=f"Token file path, default {DEFAULT_TOKEN_PATH}")
     parser.add_argument("--cache-path", default=None, help=f"Cache path, default {DEFAULT_CACHE_PATH}")
     parser.add_argument("--force-refresh", action="store_true", help="Ignore cached values")
+    parser.add_argument("--workers", type=int, default=DEFAULT_FETCH_WORKERS, help="Concurrent /gtin batch requests")
     parser.add_argument("--json", action="store_true", help="Print JSON summaries")
     parser.add_argument("--upload-token-to-s3", help="Upload local VbG token file to this s3:// path")
     parser.add_argument("--local-token-file", default=DEFAULT_TOKEN_PATH, help="Local token file for --upload-token-to-s3")
@@ -273,6 +311,7 @@ def main() -> None:
         token_path=args.token_file,
         cache_path=args.cache_path,
         force_refresh=args.force_refresh,
+        fetch_workers=args.workers,
     )
 
     if args.json: